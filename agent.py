@@ -1,68 +1,271 @@
 # agent.py
 
 import asyncio
+import json
 import logging
+from typing import AsyncGenerator, Literal
 
-from autogen_agentchat.agents import AssistantAgent
-from autogen_agentchat.conditions import TextMentionTermination, FunctionCallTermination
-from autogen_agentchat.teams import RoundRobinGroupChat
-from autogen_agentchat.ui import Console
 from autogen_core import CancellationToken
-from autogen_ext.models.openai import OpenAIChatCompletionClient
-from autogen_ext.tools.mcp import SseServerParams, mcp_server_tools
+from autogen_core.models import LLMMessage, SystemMessage, UserMessage
 
+from config import FAST_PATH_SUMMARY_PROMPT
+from logger.app_logger import log_message
+from model_clients import with_role
+from query_planner import QueryPlan, plan_query
+from runtime import get_runtime
 from settings import settings
-from config import EMAIL_RETRIEVER_AGENT_SYSTEM_PROMPT, EMAIL_CRITIC_AGENT_SYSTEM_PROMPT, response_dispatcher
+from summariser import MapReduceSummariser, summarise_emails
+from tracing import span, start_trace
 
-logging.debug("MCP Server Configuration:")
-logging.debug(f"  URL: {settings.MCP_SERVER_URL}")
-mcp_server_params = SseServerParams(
-    url=settings.MCP_SERVER_URL,
-    headers={"Content-Type": "application/json"},
-    timeout=30
-)
+SEARCH_TOOL_NAME = "get_top_mails_for_query"
+WARMUP_TOOL_NAME = "warm_up_session"
+INTERNAL_TOOL_NAMES = {WARMUP_TOOL_NAME}  # Called by the app itself, never offered to the model
+SUMMARISER_SOURCE = "summariser"
+SummaryMode = Literal["auto", "team", "map_reduce"]
 
-mcp_tools = mcp_server_tools(mcp_server_params)
 
-tools = asyncio.run(mcp_tools)
+def team_tools(tools: list) -> list:
+    """The tools the agent team may call."""
+    return [tool for tool in tools if tool.name not in INTERNAL_TOOL_NAMES]
 
-openai_client =  OpenAIChatCompletionClient(
-    model="gpt-4o",
-    api_key=settings.OPENAI_API_KEY
-)
 
+def extract_summaries(messages) -> list[str]:
+    """
+    Collects the responses the critic agent handed to `response_dispatcher`, or the answer of
+    the map-reduce summariser.
+    """
+    summaries: list[str] = []
+    for msg in messages:
+        if msg.source == SUMMARISER_SOURCE and msg.type == "TextMessage":
+            summaries.append(msg.content)
+        elif msg.source == "critic_agent" and msg.type == "ToolCallSummaryMessage":
+            args = json.loads(msg.tool_calls[0].arguments)
+            if resp := args.get("response"):
+                summaries.append(resp)
+    return summaries
 
-function_call_termination = FunctionCallTermination(function_name="response_dispatcher")
 
+def parse_tool_result(content: str) -> dict | None:
+    """
+    Decodes the JSON payload of an MCP tool result, which arrives as a list of text contents.
+    """
+    try:
+        items = json.loads(content)
+        for item in items if isinstance(items, list) else [items]:
+            if isinstance(item, dict) and item.get("type") == "text":
+                return json.loads(item["text"])
+    except (TypeError, ValueError):
+        pass
+    return None
 
-async def get_emails_using_mcp(access_token: str, query: str) -> str:
 
+def email_headers(emails: list[dict]) -> list[dict]:
+    return [
+        {key: email.get(key) for key in ("id", "subject", "from", "date", "snippet")}
+        for email in emails
+    ]
 
-    email_retriever_agent = AssistantAgent(
-        name="email_retriever",
-        model_client=openai_client,
-        tools=tools,
-        system_message=EMAIL_RETRIEVER_AGENT_SYSTEM_PROMPT.format(access_token=access_token)
-    )
 
-    critic_agent = AssistantAgent(
-        name="critic_agent",
-        description="A critic agent that evaluates the response of the email retriever agent.",
-        model_client=openai_client,
-        tools=[response_dispatcher],
-        system_message=EMAIL_CRITIC_AGENT_SYSTEM_PROMPT,
+# ──────── Planning ──────────────────────────────────────────────────────────────
+def plan_request(access_token: str, query: str) -> QueryPlan | None:
+    """
+    Plans the Gmail search for a request, None when the planner is disabled.
+    """
+    if not settings.QUERY_PLANNER_ENABLED:
+        return None
+    plan = plan_query(query)
+    log_message(
+        f"[{access_token}]: Planned {plan.gmail_query!r} (confidence {plan.confidence}, rules {plan.matched_rules})",
+        level="info",
     )
+    return plan
+
+
+def choose_summary_mode(plan: QueryPlan | None, mode: SummaryMode | None = None) -> SummaryMode:
+    """
+    Resolves "auto": map-reduce when a confidently planned request asks for more emails than one
+    summarisation call handles well, the team (or its fast path) otherwise.
+    """
+    mode = mode or settings.SUMMARY_MODE
+    if mode != "auto":
+        return mode
+    if plan is not None and plan.is_confident and plan.max_results > settings.SUMMARY_MAP_REDUCE_MIN_EMAILS:
+        return "map_reduce"
+    return "team"
+
+
+async def search_emails(
+    access_token: str,
+    tools: list,
+    query: str,
+    max_results: int,
+    max_tokens: int | None = None,
+    resource: str = "messages",
+) -> list[dict] | None:
+    """
+    Calls the MCP search tool directly, without a model turn. Returns None if the call failed.
+    With `resource="threads"` every result is one conversation (see `gmail_search.parse_thread`).
+    """
+    tool = next((tool for tool in tools if tool.name == SEARCH_TOOL_NAME), None)
+    if tool is None:
+        return None
+    arguments = {"session_id": access_token, "query": query, "top_n_mails": max_results}
+    if max_tokens:
+        arguments["max_tokens"] = max_tokens
+    if resource != "messages":
+        arguments["resource"] = resource
+    try:
+        result = await tool.run_json(arguments, CancellationToken())
+    except Exception as e:
+        log_message(f"[{access_token}]: Direct search failed: {e}", level="warning")
+        return None
+    payload = parse_tool_result(tool.return_value_as_string(result))
+    if not payload or not payload.get("success"):
+        return None
+    return payload.get("emails", [])
 
-    # Create a console for interaction
-    agents = [email_retriever_agent, critic_agent]
 
-    research_helper_team = RoundRobinGroupChat(
-        agents,
-        max_turns=10,
-        termination_condition=TextMentionTermination("TERMINATE") | function_call_termination
+async def search_for_map_reduce(access_token: str, query: str, plan: QueryPlan | None, tools: list) -> list[dict] | None:
+    """
+    Fetches the emails to summarise: the requested count, or up to SUMMARY_MAP_REDUCE_MAX_EMAILS.
+    Bodies are only limited per email, the summariser batches them.
+    """
+    plan = plan or plan_query(query)
+    max_results = plan.max_results if "count" in plan.matched_rules else settings.SUMMARY_MAP_REDUCE_MAX_EMAILS
+    return await search_emails(
+        access_token,
+        tools,
+        plan.gmail_query or query,
+        max_results,
+        max_tokens=max_results * settings.EMAIL_MAX_TOKENS_PER_EMAIL,
     )
 
-    response = await research_helper_team.run(task=query)
+
+# ──────── Fast path ─────────────────────────────────────────────────────────────
+def build_summary_messages(query: str, plan: QueryPlan, emails: list[dict]) -> list[LLMMessage]:
+    documents = [
+        {
+            "subject": email.get("subject"),
+            "from": email.get("from"),
+            "date": email.get("date"),
+            "body": email.get("body") or email.get("snippet") or "",
+        }
+        # Thread records: the body is a transcript of the whole conversation.
+        | ({"participants": email["participants"], "messages": email["message_count"]} if "message_count" in email else {})
+        for email in emails
+    ]
+    return [
+        SystemMessage(content=FAST_PATH_SUMMARY_PROMPT),
+        UserMessage(
+            content=f"Request: {query}\nGmail search: {plan.gmail_query}\n\nEmails:\n{json.dumps(documents, indent=1)}",
+            source="user",
+        ),
+    ]
+
+
+async def answer_query(
+    access_token: str,
+    query: str,
+    mode: SummaryMode | None = None,
+    trace_id: str | None = None,
+) -> list[str]:
+    """
+    Summaries for a query. Large requests are map-reduced (see `choose_summary_mode`); simple ones
+    take the planned search plus one summarisation call; everything else, and planned searches
+    that find nothing, go to the retriever/critic team. Must run on the agent runtime's loop.
+
+    The query is recorded as one trace (`trace_id`, or a new one), see `tracing.get_trace`.
+    """
+    runtime = get_runtime()
+    with start_trace("query", trace_id=trace_id, query=query) as root:
+        plan = plan_request(access_token, query)
+        mode = choose_summary_mode(plan, mode)
+        root.set(mode=mode)
+        if mode == "team" and plan is not None and plan.is_confident:
+            emails = await search_emails(
+                access_token, await runtime.get_tools(), plan.gmail_query, plan.max_results, resource=plan.resource
+            )
+            if emails:
+                root.set(path="fast_path")
+                result = await with_role(runtime.model_client, "fast_path").create(build_summary_messages(query, plan, emails))
+                return [result.content]
+            log_message(f"[{access_token}]: Fast path found nothing, escalating to the agent team", level="info")
+        return extract_summaries(await get_emails_using_mcp(access_token, query, mode=mode, plan=plan))
+
+
+# ──────── Warm-up ───────────────────────────────────────────────────────────────
+async def warm_up_session(access_token: str) -> dict | None:
+    """
+    Runs after login, in the background on the agent runtime's loop: opens the MCP session, has
+    the server build the Gmail client and start the mailbox index (`warm_up_session` tool), and
+    summarises the most recent inbox emails into the per-message summary cache, so the first
+    query finds warm connections, an index and cached summaries. Returns the tool's payload.
+    """
+    if not settings.WARMUP_ENABLED:
+        return None
+    runtime = get_runtime()
+    with start_trace("warm up", session=access_token[:8]) as root:
+        try:
+            tools = await runtime.get_tools()
+            tool = next((tool for tool in tools if tool.name == WARMUP_TOOL_NAME), None)
+            if tool is None:
+                return None
+            max_results = settings.WARMUP_SUMMARY_MESSAGES
+            result = await tool.run_json(
+                {"session_id": access_token, "top_n_mails": max_results,
+                 "max_tokens": max_results * settings.EMAIL_MAX_TOKENS_PER_EMAIL},
+                CancellationToken(),
+            )
+            payload = parse_tool_result(tool.return_value_as_string(result))
+            if not payload or not payload.get("success"):
+                log_message(f"[{access_token}]: Warm-up did not run: {payload}", level="warning")
+                return payload
+            emails = payload.get("emails", [])
+            if emails and settings.SUMMARY_CACHE_ENABLED:
+                # Same message dicts (and cache keys) a map-reduce summary of the inbox will use.
+                summariser = MapReduceSummariser(runtime.model_client)
+                await summariser.summarise_messages(emails)
+                root.set(map_calls=summariser.stats.map_calls, cached=summariser.stats.cached_summaries)
+            root.set(index=payload.get("index"), skipped=payload.get("skipped", False), emails=len(emails))
+            log_message(f"[{access_token}]: Session warm-up done ({len(emails)} recent emails)", level="info")
+            return payload
+        except Exception as e:
+            log_message(f"[{access_token}]: Session warm-up failed: {e}", level="warning")
+            return None
+
+
+# ──────── Agent team ────────────────────────────────────────────────────────────
+# autogen_agentchat (agent_team.py) is imported when a request first reaches the team, so the
+# planner fast path and map-reduce never pay for it.
+async def get_emails_using_mcp(
+    access_token: str,
+    query: str,
+    mode: SummaryMode = "team",
+    plan: QueryPlan | None = None,
+) -> list:
+    """
+    Runs the retriever/critic team for a query, or with ``mode="map_reduce"`` searches directly and
+    summarises the results with `summariser.summarise_emails` (falling back to the team when the
+    search finds nothing). Must run on the agent runtime's loop,
+    e.g. ``get_runtime().run(get_emails_using_mcp(...))``.
+    """
+    runtime = get_runtime()
+    tools = await runtime.get_tools()
+    if mode == "map_reduce":
+        emails = await search_for_map_reduce(access_token, query, plan, tools)
+        if emails:
+            summary = await summarise_emails(runtime.model_client, query, emails)
+            from autogen_agentchat.messages import TextMessage
+
+            return [TextMessage(source=SUMMARISER_SOURCE, content=summary)]
+        log_message(f"[{access_token}]: Nothing to map-reduce, escalating to the agent team", level="info")
+
+    from agent_team import build_research_team
+
+    research_helper_team = build_research_team(access_token, team_tools(tools), runtime.model_client)
+
+    with span("agent team", "agent"):
+        response = await research_helper_team.run(task=query)
     logging.debug("Response from research helper team:")
 
     messages = response.messages
@@ -73,6 +276,121 @@ async def get_emails_using_mcp(access_token: str, query: str) -> str:
     return messages
 
 
+async def stream_emails_using_mcp(
+    access_token: str,
+    query: str,
+    mode: SummaryMode | None = None,
+    trace_id: str | None = None,
+) -> AsyncGenerator[dict, None]:
+    """
+    Streaming variant of `get_emails_using_mcp` built on `run_stream`.
+
+    Simple requests take the planner's fast path (one search, one streamed summarisation call),
+    large ones are map-reduced as in `answer_query`.
+    Yields partial results as soon as they are available:
+
+    * ``{"type": "emails", "query": ..., "emails": [...]}`` headers of the emails a search returned
+    * ``{"type": "token", "source": ..., "content": ...}`` model output as it is generated
+    * ``{"type": "summary", "content": ...}`` a response handed to `response_dispatcher`
+    * ``{"type": "done", "summaries": [...]}`` once the team has finished
+
+    Like `get_emails_using_mcp` it must be consumed on the agent runtime's loop,
+    e.g. ``get_runtime().iterate(stream_emails_using_mcp(...))``.
+
+    The events are produced by a separate task holding the query's trace (`trace_id`, or a new
+    one): `iterate` resumes this generator from a new task each time, which would lose it.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            with start_trace("query", trace_id=trace_id, query=query, streamed=True):
+                async for event in _stream_events(access_token, query, mode):
+                    await events.put(event)
+        except Exception as e:
+            await events.put(e)
+        finally:
+            await events.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (event := await events.get()) is not None:
+            if isinstance(event, Exception):
+                raise event
+            yield event
+    finally:
+        producer.cancel()
+
+
+async def _stream_events(access_token: str, query: str, mode: SummaryMode | None) -> AsyncGenerator[dict, None]:
+    runtime = get_runtime()
+    tools = await runtime.get_tools()
+    plan = plan_request(access_token, query)
+    mode = choose_summary_mode(plan, mode)
+
+    if mode == "map_reduce":
+        emails = await search_for_map_reduce(access_token, query, plan, tools)
+        if emails:
+            yield {"type": "emails", "query": plan.gmail_query if plan else query, "emails": email_headers(emails)}
+            summary = await summarise_emails(runtime.model_client, query, emails)
+            yield {"type": "summary", "content": summary}
+            yield {"type": "done", "summaries": [summary]}
+            return
+
+    elif plan is not None and plan.is_confident:
+        emails = await search_emails(access_token, tools, plan.gmail_query, plan.max_results, resource=plan.resource)
+        if emails:
+            yield {"type": "emails", "query": plan.gmail_query, "emails": email_headers(emails)}
+            fast_path_client = with_role(runtime.model_client, "fast_path")
+            async for item in fast_path_client.create_stream(build_summary_messages(query, plan, emails)):
+                if isinstance(item, str):
+                    yield {"type": "token", "source": "fast_path", "content": item}
+                else:
+                    yield {"type": "summary", "content": item.content}
+                    yield {"type": "done", "summaries": [item.content]}
+            return
+        log_message(f"[{access_token}]: Fast path found nothing, escalating to the agent team", level="info")
+
+    from autogen_agentchat.base import TaskResult
+    from autogen_agentchat.messages import ModelClientStreamingChunkEvent, ToolCallExecutionEvent, ToolCallRequestEvent
+
+    from agent_team import build_research_team
+
+    research_helper_team = build_research_team(access_token, team_tools(tools), runtime.model_client, stream=True)
+    tool_queries: dict[str, str] = {}
+
+    with span("agent team", "agent"):
+        async for event in research_helper_team.run_stream(task=query):
+            if isinstance(event, TaskResult):
+                yield {"type": "done", "summaries": extract_summaries(event.messages)}
+
+            elif isinstance(event, ModelClientStreamingChunkEvent):
+                yield {"type": "token", "source": event.source, "content": event.content}
+
+            elif isinstance(event, ToolCallRequestEvent):
+                for call in event.content:
+                    try:
+                        arguments = json.loads(call.arguments)
+                    except ValueError:
+                        continue
+                    if call.name == "response_dispatcher" and arguments.get("response"):
+                        yield {"type": "summary", "content": arguments["response"]}
+                    elif "query" in arguments:
+                        tool_queries[call.id] = arguments["query"]
+                    elif isinstance(arguments.get("queries"), list):
+                        tool_queries[call.id] = " | ".join(map(str, arguments["queries"]))
+
+            elif isinstance(event, ToolCallExecutionEvent) and event.source == "email_retriever":
+                for result in event.content:
+                    payload = parse_tool_result(result.content)
+                    if payload and payload.get("success"):
+                        yield {
+                            "type": "emails",
+                            "query": tool_queries.get(result.call_id, ""),
+                            "emails": email_headers(payload.get("emails", [])),
+                        }
+
+
 
 
 
@@ -85,8 +403,7 @@ if __name__ == '__main__':
     query = "Get my"
     print(f"Using access token: {access_token}")
     print(f"Querying emails with query: {query}")
-    import asyncio
-    result = asyncio.run(get_emails_using_mcp(access_token, query))
+    result = get_runtime().run(get_emails_using_mcp(access_token, query))
     print("Email retrieval completed.")
     print("Result:", result)
 
@@ -0,0 +1,62 @@
+from typing import AsyncGenerator, Sequence
+
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.base import Response
+from autogen_agentchat.conditions import TextMentionTermination, FunctionCallTermination
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage
+from autogen_agentchat.teams import RoundRobinGroupChat
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient
+
+from config import EMAIL_CRITIC_AGENT_SYSTEM_PROMPT, EMAIL_RETRIEVER_AGENT_SYSTEM_PROMPT, response_dispatcher
+from model_clients import with_role
+from tracing import span
+
+
+class TracedAssistantAgent(AssistantAgent):
+    """`AssistantAgent` whose turns are recorded as `agent` spans of the active trace."""
+
+    async def on_messages_stream(
+        self, messages: Sequence[BaseChatMessage], cancellation_token: CancellationToken
+    ) -> AsyncGenerator[BaseAgentEvent | BaseChatMessage | Response, None]:
+        # The team consumes a turn within one task, so the span can stay active across yields.
+        with span(f"agent {self.name}", "agent", agent=self.name, messages=len(messages)) as turn:
+            async for item in super().on_messages_stream(messages, cancellation_token):
+                if isinstance(item, Response):
+                    # `on_messages` stops reading at the response; do not wait for the generator to close.
+                    turn.end()
+                yield item
+
+
+def build_research_team(
+    access_token: str,
+    tools: list,
+    model_client: ChatCompletionClient,
+    stream: bool = False,
+) -> RoundRobinGroupChat:
+    email_retriever_agent = TracedAssistantAgent(
+        name="email_retriever",
+        model_client=with_role(model_client, "email_retriever"),
+        tools=tools,
+        system_message=EMAIL_RETRIEVER_AGENT_SYSTEM_PROMPT.format(access_token=access_token),
+        model_client_stream=stream,
+    )
+
+    critic_agent = TracedAssistantAgent(
+        name="critic_agent",
+        description="A critic agent that evaluates the response of the email retriever agent.",
+        model_client=with_role(model_client, "critic_agent"),
+        tools=[response_dispatcher],
+        system_message=EMAIL_CRITIC_AGENT_SYSTEM_PROMPT,
+        model_client_stream=stream,
+    )
+
+    # Create a console for interaction
+    agents = [email_retriever_agent, critic_agent]
+
+    return RoundRobinGroupChat(
+        agents,
+        max_turns=10,
+        # Termination conditions are stateful, every team gets its own.
+        termination_condition=TextMentionTermination("TERMINATE") | FunctionCallTermination(function_name="response_dispatcher")
+    )
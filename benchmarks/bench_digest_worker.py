@@ -0,0 +1,172 @@
+"""
+Background digests for hundreds of users: throughput and fairness of `digest_worker.DigestWorker`.
+
+    python -m benchmarks.bench_digest_worker --users 200 --workers 2 --concurrency 20
+    python -m benchmarks.bench_digest_worker --modes per_user_quotas --users 500 --heavy-users 20
+
+On the offline stack of `bench_end_to_end` (Gmail stub, Redis shared over TCP, MCP server process)
+with the simulated model (`benchmarks.simulated_model`, scaled by `--time-scale`). Each of
+`--users` sessions (its own access token, so its own Gmail client) has the default digest,
+`DIGEST_DEFAULT_QUERY`; `--heavy-users` of them also saved `--heavy-digests` queries from
+`bench_end_to_end.QUERIES`, scheduled first, as if they had logged in before everyone else.
+`--workers` workers share the queue, each running `--concurrency` digests at once:
+
+* `unlimited`: no per-user limits; digests run in queue order.
+* `per_user_quotas`: at most `--user-concurrency` digests per user at once and
+  `--user-jobs-per-hour` per user; the rest are deferred.
+
+Reports per mode: digests/s, when the light users' digests were ready (p50/p95/max seconds after
+scheduling), per-worker counters, Gmail HTTP requests and API calls, and model calls. Then the
+latency of showing a finished digest (`cache.get_digest_results`, what `main.py` does) next to
+answering the same query interactively.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.bench_end_to_end import QUERIES, offline_stack, start_runtime
+from benchmarks.environment import summarise_latencies
+from benchmarks.simulated_model import SimulatedChatCompletionClient
+
+MODES = ["unlimited", "per_user_quotas"]
+HEAVY_QUERIES = [query for query in QUERIES if "60" not in query]  # map-reduce over 60 emails is its own benchmark
+
+
+def session_id(user: int) -> str:
+    return f"bench-digest-{user:04d}"
+
+
+def digest_jobs(args) -> list[dict]:
+    from settings import settings
+
+    heavy = [
+        {"session_id": session_id(user), "name": f"saved {index}", "query": HEAVY_QUERIES[index % len(HEAVY_QUERIES)]}
+        for user in range(args.heavy_users)
+        for index in range(args.heavy_digests)
+    ]
+    daily = [
+        {"session_id": session_id(user), "name": settings.DIGEST_DEFAULT_NAME, "query": settings.DIGEST_DEFAULT_QUERY,
+         "interval_seconds": settings.DIGEST_DEFAULT_INTERVAL_SECONDS}
+        for user in range(args.users)
+    ]
+    return heavy + daily
+
+
+async def run_mode(args, mode: str, gmail, model: SimulatedChatCompletionClient) -> dict:
+    import cache
+    from digest_worker import DigestWorker
+
+    await cache.async_redis_client.flushdb()
+    await cache.asave_sessions(
+        {session_id(user): {"access_token": f"offline-token-{user}", "scope": []} for user in range(args.users)}, 3600
+    )
+    limited = mode == "per_user_quotas"
+    workers = [
+        DigestWorker(
+            concurrency=args.concurrency,
+            user_concurrency=args.user_concurrency if limited else args.concurrency,
+            user_jobs_per_hour=args.user_jobs_per_hour if limited else 0,
+            busy_defer_seconds=args.busy_defer_seconds,
+            poll_seconds=0.05,
+            retry_seconds=1,
+        )
+        for _ in range(args.workers)
+    ]
+    jobs = await cache.aschedule_digests(digest_jobs(args))
+    scheduled_at = time.time()
+    http_requests, api_calls, model_calls = gmail.http_requests, sum(gmail.request_counts.values()), model.calls
+
+    stop = asyncio.Event()
+    started = time.perf_counter()
+    running = [asyncio.create_task(worker.run(stop)) for worker in workers]
+    deadline = time.monotonic() + args.timeout
+    # Done when every digest ran, failed or was deferred to the next hour.
+    while time.monotonic() < deadline and sum(
+        worker.completed + worker.failed + worker.deferred_quota for worker in workers
+    ) < len(jobs):
+        await asyncio.sleep(0.1)
+    wall_seconds = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*running)
+
+    heavy_sessions = {session_id(user) for user in range(args.heavy_users)}
+    ready = []
+    for user in range(args.users):
+        if session_id(user) in heavy_sessions:
+            continue
+        results = await asyncio.to_thread(cache.get_digest_results, session_id(user))
+        ready.extend(result["finished_at"] - scheduled_at for result in results.values() if not result["error"])
+    ready.sort()
+    completed = sum(worker.completed for worker in workers)
+    return {
+        "digests": len(jobs),
+        "completed": completed,
+        "wall_seconds": round(wall_seconds, 2),
+        "digests_per_second": round(completed / wall_seconds, 2),
+        "light_users_ready": len(ready),
+        "light_users_ready_seconds": {
+            "p50": round(ready[len(ready) // 2], 2) if ready else None,
+            "p95": round(ready[min(len(ready) - 1, int(len(ready) * 0.95))], 2) if ready else None,
+            "max": round(ready[-1], 2) if ready else None,
+        },
+        "gmail_http_requests": gmail.http_requests - http_requests,
+        "gmail_api_calls": sum(gmail.request_counts.values()) - api_calls,
+        "model_calls": model.calls - model_calls,
+        "queue": await cache.adigest_queue_stats(),
+        "workers": [worker.stats() for worker in workers],
+    }
+
+
+async def compare_display(args) -> dict:
+    """Reading a finished digest vs answering its query while the user waits."""
+    import cache
+    from agent import answer_query
+    from settings import settings
+    from tracing import new_trace_id
+
+    session = session_id(args.users - 1)
+    reads, answers = [], []
+    for _ in range(args.samples):
+        started = time.perf_counter()
+        await asyncio.to_thread(cache.get_digest_results, session)
+        reads.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        await answer_query(session, settings.DIGEST_DEFAULT_QUERY, trace_id=new_trace_id())
+        answers.append((time.perf_counter() - started) * 1000)
+    return {"cached_digest": summarise_latencies(reads), "interactive": summarise_latencies(answers)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--heavy-users", type=int, default=10)
+    parser.add_argument("--heavy-digests", type=int, default=8, help="Saved queries of each heavy user.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=20, help="Digests in flight per worker.")
+    parser.add_argument("--user-concurrency", type=int, default=2)
+    parser.add_argument("--user-jobs-per-hour", type=int, default=5)
+    parser.add_argument("--busy-defer-seconds", type=float, default=0.5)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--gmail-latency-ms", type=float, default=30.0)
+    parser.add_argument("--redis-url", default=None, help="Redis for the queue; an in-memory one is started if omitted.")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Scales the simulated model latency.")
+    parser.add_argument("--samples", type=int, default=5, help="Reads and interactive answers to compare.")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds before a mode is cut short.")
+    args = parser.parse_args()
+    args.warm_caches = False  # every digest pays for its model and Gmail calls
+
+    report = {"config": vars(args), "modes": {}}
+    with offline_stack(args) as (gmail, _):
+        model = SimulatedChatCompletionClient(time_scale=args.time_scale)
+        runtime = start_runtime(lambda name: model)
+        runtime.start()
+        for mode in args.modes:
+            report["modes"][mode] = runtime.run(run_mode(args, mode, gmail, model))
+        report["display"] = runtime.run(compare_display(args))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Token savings and cost of compacting search tool results, over the synthetic mailbox.
+
+    python -m benchmarks.bench_email_compaction --top-n 50 --budgets 6000 2000 1000
+
+For each response budget reports the tokens the tool would return before and after compaction
+(JSON payload, as the model sees it) and the time `compact_emails` takes. Token counts are exact
+when tiktoken's encoding is available locally and estimated otherwise (`exact_token_counts`).
+"""
+import argparse
+import json
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+
+def run(args) -> dict:
+    configure_offline_environment()
+    from email_compactor import compact_emails
+    from gmail_search import parse_message
+
+    mailbox = generate_mailbox(args.messages)
+    emails = [parse_message(message.to_resource("full"), "full") for message in mailbox[:args.top_n]]
+
+    report = {"config": vars(args), "budgets": {}}
+    results = {}
+    for budget in args.budgets:
+        samples = []
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            results[budget], stats = compact_emails(emails, max_tokens=budget)
+            samples.append((time.perf_counter() - started) * 1000)
+        report["budgets"][budget] = {
+            **stats.as_dict(),
+            "compaction_p50_ms": summarise_latencies(samples)["p50_ms"],
+        }
+    if args.show_example:
+        reply = next(email for email in emails if email["subject"].startswith("Re: "))
+        report["example"] = {
+            "before": reply["body"],
+            "after": next(email for email in results[max(args.budgets)] if email["id"] == reply["id"]).get("body"),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[6000, 2000, 1000])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--show-example", action="store_true", help="Print one reply before and after compaction.")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+End-to-end latency and cost of user queries, fully offline: `agent.answer_query` on the agent
+runtime (what `main.fetch_and_summarize` runs) against an MCP server process, a Gmail stub and Redis.
+
+    python -m benchmarks.bench_end_to_end --iterations 5 --output end_to_end.json
+    python -m benchmarks.bench_end_to_end --record simulated          # re-record the model
+    python -m benchmarks.bench_end_to_end --baseline benchmarks/end_to_end_baseline.json --check
+
+The parts:
+
+* `benchmarks.synthetic_mailbox` (`--messages`) served by `benchmarks.fake_gmail.FakeGmailServer`,
+  `--gmail-latency-ms` per request;
+* `python mcp_server.py --transport http` in a child process; the runtime connects to it over
+  streamable HTTP as a deployed app does;
+* Redis at `--redis-url`, or an in-memory one (`benchmarks.redis_server`), holding the session;
+* the model, replayed from `--recording` (`benchmarks.replay_model`). `--record simulated`
+  records it first from `benchmarks.simulated_model`, which also plays the agent team's tool
+  calls; `--record openai` from `OPENAI_MODEL` (needs `OPENAI_API_KEY` and a network).
+
+Every query in `QUERIES` (planner fast path, map-reduce and agent team requests) runs once
+unmeasured, which is also the recording run, then `--iterations` times. The LLM cache, the
+per-message summary cache and search result reuse are off unless `--warm-caches`, so every run
+pays for its model and Gmail calls.
+
+Reports per query and per path (`fast_path`, `map_reduce`, `team`): end-to-end latency
+percentiles, model turns, prompt and completion tokens, Gmail HTTP requests and API calls (a
+batch counts every call in it), and memory: the app's and the MCP server's resident set and peak,
+and with `--tracemalloc` the peak Python allocation during a query.
+
+`--baseline` compares the paths with an earlier `--output` report: more model turns, tokens or
+Gmail calls per query, or a p95 latency or peak memory more than `--tolerance` higher, is listed
+under `regressions` (latency and memory only against a baseline run with the same
+`TIMING_OPTIONS`). `--check` exits non-zero on regressions, errors or replay misses.
+"""
+import argparse
+import contextlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from benchmarks.environment import REPO_ROOT, configure_offline_environment, summarise_latencies
+from benchmarks.redis_server import FakeRedisServer, free_port
+
+DEFAULT_RECORDING = "benchmarks/end_to_end_recording.json"  # relative to the repository
+SESSION_ID = "bench-end-to-end"
+QUERIES = [
+    "summarise my latest 5 emails",
+    "unread emails from bob@example.com",
+    "my conversation with amit",
+    "summarise my last 60 emails",
+    "what is the status of the invoice",
+    "any news about the release",
+]
+# Per query; any increase is a regression.
+COUNTERS = ["model_turns", "prompt_tokens", "completion_tokens", "gmail_http_requests", "gmail_api_calls"]
+# Latency and memory are only compared with a baseline that ran with the same values.
+TIMING_OPTIONS = ["messages", "gmail_latency_ms", "warm_caches", "tracemalloc"]
+
+
+def read_memory(pid: int | str = "self") -> dict:
+    """Resident set and its peak in MB, from /proc (empty where there is none)."""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name = "rss_mb" if line.startswith("VmRSS") else "peak_rss_mb"
+                    memory[name] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+def build_model(args):
+    from benchmarks.replay_model import ReplayChatCompletionClient
+
+    source = None
+    if args.record == "simulated":
+        from benchmarks.simulated_model import SimulatedChatCompletionClient
+
+        source = SimulatedChatCompletionClient(time_scale=args.time_scale)
+    elif args.record == "openai":
+        from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+        from settings import settings
+
+        source = OpenAIChatCompletionClient(model=settings.OPENAI_MODEL, api_key=settings.OPENAI_API_KEY)
+    return ReplayChatCompletionClient(os.path.join(REPO_ROOT, args.recording), record_from=source)
+
+
+def _wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 60):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"MCP server exited with {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/readyz", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("MCP server did not become ready")
+
+
+def run_query(args, query: str, model, gmail) -> dict:
+    from agent import answer_query
+    from runtime import get_runtime
+    from tracing import get_trace, new_trace_id
+
+    trace_id = new_trace_id()
+    turns, usage = model.calls, model.total_usage()
+    http_requests, api_calls = gmail.http_requests, sum(gmail.request_counts.values())
+    if args.tracemalloc:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    error = None
+    try:
+        summaries = get_runtime().run(answer_query(SESSION_ID, query, trace_id=trace_id), timeout=args.timeout)
+        if not summaries:
+            error = "no summaries"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"[:200]
+    latency_ms = (time.perf_counter() - started) * 1000
+    root = next((item for item in get_trace(trace_id) if item.parent_id is None), None)
+    attributes = root.attributes if root is not None else {}
+    run = {
+        "path": attributes.get("path") or attributes.get("mode") or "unknown",
+        "latency_ms": latency_ms,
+        "model_turns": model.calls - turns,
+        "prompt_tokens": model.total_usage().prompt_tokens - usage.prompt_tokens,
+        "completion_tokens": model.total_usage().completion_tokens - usage.completion_tokens,
+        "gmail_http_requests": gmail.http_requests - http_requests,
+        "gmail_api_calls": sum(gmail.request_counts.values()) - api_calls,
+        "error": error,
+    }
+    if args.tracemalloc:
+        run["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+    return run
+
+
+def summarise_runs(runs: list[dict]) -> dict:
+    ok = [run for run in runs if run["error"] is None] or runs
+    summary = {
+        "runs": len(runs),
+        "errors": sum(run["error"] is not None for run in runs),
+        "latency": summarise_latencies([run["latency_ms"] for run in ok]),
+    }
+    for counter in COUNTERS:
+        summary[counter] = round(sum(run[counter] for run in ok) / len(ok), 1)
+    if "peak_traced_mb" in runs[0]:
+        summary["peak_traced_mb"] = max(run["peak_traced_mb"] for run in runs)
+    return summary
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    timings = all(report["config"].get(option) == baseline.get("config", {}).get(option) for option in TIMING_OPTIONS)
+    for path, current in report["paths"].items():
+        previous = baseline.get("paths", {}).get(path)
+        if previous is None:
+            continue
+        for counter in COUNTERS:
+            if current[counter] > previous.get(counter, current[counter]):
+                regressions.append(f"{path}: {counter} {previous[counter]} -> {current[counter]} per query")
+        before, after = previous["latency"]["p95_ms"], current["latency"]["p95_ms"]
+        if timings and after > before * (1 + tolerance):
+            regressions.append(f"{path}: p95 latency {before} -> {after} ms")
+    for process, current in report["memory"].items():
+        before = baseline.get("memory", {}).get(process, {}).get("peak_rss_mb")
+        after = current.get("peak_rss_mb")
+        if timings and before and after and after > before * (1 + tolerance):
+            regressions.append(f"{process}: peak resident set {before} -> {after} MB")
+    return regressions
+
+
+def start_runtime(model_factory):
+    """A new agent runtime (after stopping the current one) whose models come from `model_factory`."""
+    import runtime
+
+    if runtime._runtime is not None:
+        runtime._runtime.shutdown()
+    runtime._runtime = runtime.AgentRuntime(model_factory=model_factory)
+    return runtime._runtime
+
+
+@contextlib.contextmanager
+def offline_stack(args, **environment):
+    """
+    The Gmail stub, Redis with the session and a ready MCP server process, configured with
+    `environment` on top of the benchmark settings; yields `(gmail stub, MCP server process)`.
+    Start the agent runtime inside with `start_runtime`; it is stopped on the way out.
+    """
+    from benchmarks.fake_gmail import FakeGmailServer
+    from benchmarks.synthetic_mailbox import generate_mailbox
+
+    redis_server = None if args.redis_url else FakeRedisServer()
+    redis_url = args.redis_url or redis_server.start()
+    gmail = FakeGmailServer(generate_mailbox(args.messages), args.gmail_latency_ms)
+    port = free_port()
+    caches = "true" if args.warm_caches else "false"
+    configure_offline_environment(**{
+        "GMAIL_API_ENDPOINT": gmail.start(),
+        "REDIS_HOST": redis_url,
+        "MCP_TRANSPORT": "http",
+        "MCP_SERVER_URL": f"http://127.0.0.1:{port}/mcp",
+        # A background index build would make a query's Gmail calls depend on timing.
+        "MAILBOX_INDEX_ENABLED": "false",
+        "WARMUP_ENABLED": "false",
+        "LLM_CACHE_ENABLED": caches,
+        "SUMMARY_CACHE_ENABLED": caches,
+        "SEARCH_COALESCING_ENABLED": caches,
+        "LOG_LEVEL": "ERROR",
+        **environment,
+    })
+    from cache import save_encrypted_cache
+    import runtime
+
+    save_encrypted_cache(SESSION_ID, {"access_token": "offline-token", "scope": []}, 3600)
+    server = subprocess.Popen(
+        [sys.executable, "mcp_server.py", "--transport", "http", "--port", str(port)],
+        cwd=REPO_ROOT, env=dict(os.environ),
+    )
+    try:
+        _wait_ready(f"http://127.0.0.1:{port}", server)
+        yield gmail, server
+    finally:
+        if runtime._runtime is not None:
+            runtime._runtime.shutdown()
+            runtime._runtime = None
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        gmail.stop()
+        if redis_server is not None:
+            redis_server.stop()
+
+
+def run(args) -> dict:
+    report = {"config": vars(args) | {"python": sys.version.split()[0]}, "queries": {}, "paths": {}}
+    with offline_stack(args) as (gmail, server):
+        model = build_model(args)
+        start_runtime(lambda name: model)
+        if args.tracemalloc:
+            tracemalloc.start()
+
+        for query in QUERIES:
+            warm_up = run_query(args, query, model, gmail)  # connections, session LRU; the recording run
+            if warm_up["error"]:
+                print(json.dumps({query: warm_up["error"]}), file=sys.stderr)
+        if model.recording:
+            model.save()
+            model.record_from = None  # the measured runs replay what was just recorded
+
+        by_path: dict[str, list[dict]] = defaultdict(list)
+        for query in QUERIES:
+            runs = [run_query(args, query, model, gmail) for _ in range(args.iterations)]
+            report["queries"][query] = {"path": runs[0]["path"], **summarise_runs(runs)}
+            report["queries"][query]["sample_errors"] = sorted({run["error"] for run in runs if run["error"]})[:3]
+            by_path[runs[0]["path"]].extend(runs)
+        report["paths"] = {path: summarise_runs(runs) for path, runs in sorted(by_path.items())}
+        report["memory"] = {"app": read_memory(), "mcp_server": read_memory(server.pid)}
+        report["replay_misses"] = model.misses
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            report["regressions"] = compare(report, json.load(file), args.tolerance)
+        failures += report["regressions"]
+    if report["replay_misses"]:
+        failures.append(f"{report['replay_misses']} model requests not in {args.recording}; re-record with --record")
+    failures += [f"{query}: {result['errors']} errors" for query, result in report["queries"].items() if result["errors"]]
+    report["failures"] = failures
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--gmail-latency-ms", type=float, default=30.0)
+    parser.add_argument("--redis-url", default=None, help="Redis for the session; an in-memory one is started if omitted.")
+    parser.add_argument("--recording", default=DEFAULT_RECORDING)
+    parser.add_argument("--record", choices=["simulated", "openai"], help="Record the model first, overwriting --recording.")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Scales the simulated model latency when recording.")
+    parser.add_argument("--warm-caches", action="store_true", help="Keep the LLM, summary and search result caches on.")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace Python allocations (slows queries down).")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds before a query counts as failed.")
+    parser.add_argument("--baseline", help="Earlier --output report to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative growth of p95 latency and memory.")
+    parser.add_argument("--check", action="store_true", help="Exit 1 on regressions, errors or replay misses.")
+    parser.add_argument("--output", help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.check and report["failures"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Cold vs warm Gmail tool-call latency against a local Gmail stub.
+
+    python -m benchmarks.bench_gmail_client_pool --iterations 50 --connect-latency-ms 40
+
+* legacy: `googleapiclient.discovery.build()` + new transport on every call (the old tool behaviour)
+* cold:   a fresh pooled client on every call (static discovery document already parsed)
+* warm:   the per-session client handed out by `gmail_client_pool`
+"""
+import argparse
+import json
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.fake_gmail import FakeGmailServer
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated server time per request.")
+    parser.add_argument("--connect-latency-ms", type=float, default=40.0, help="Simulated TCP/TLS setup per connection.")
+    args = parser.parse_args()
+
+    server = FakeGmailServer(generate_mailbox(args.messages), args.latency_ms, args.connect_latency_ms)
+    endpoint = server.start()
+    configure_offline_environment(GMAIL_API_ENDPOINT=endpoint)
+
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
+    from gmail_client import GmailClient, GmailClientPool, get_token_fingerprint
+
+    session_id = "benchmark-session"
+    session_data = {"access_token": "offline-token", "refresh_token": "offline-refresh", "scope": []}
+
+    def legacy_call():
+        credentials = Credentials(token=session_data["access_token"], refresh_token=session_data["refresh_token"])
+        service = build("gmail", "v1", credentials=credentials, client_options={"api_endpoint": endpoint})
+        service.users().messages().list(userId="me", q="budget", maxResults=10).execute()
+
+    def cold_call():
+        client = GmailClient(session_id, Credentials(token=session_data["access_token"]),
+                             get_token_fingerprint(session_data["access_token"]))
+        client.execute(client.service.users().messages().list(userId="me", q="budget", maxResults=10))
+
+    pool = GmailClientPool(max_size=16, ttl_seconds=3600)
+
+    def warm_call():
+        client = pool.get(session_id, session_data)
+        client.execute(client.service.users().messages().list(userId="me", q="budget", maxResults=10))
+
+    report = {"config": vars(args)}
+    try:
+        for name, call in (("legacy", legacy_call), ("cold", cold_call), ("warm", warm_call)):
+            call()  # first call pays the one-off imports and discovery parsing
+            connections_before = server.connections
+            samples = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                call()
+                samples.append((time.perf_counter() - started) * 1000)
+            report[name] = summarise_latencies(samples)
+            report[name]["connections_opened"] = server.connections - connections_before
+        report["pool"] = pool.stats()
+    finally:
+        server.stop()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Sustained searches for one Gmail user against a per-user quota, with and without the limiter.
+
+    python -m benchmarks.bench_gmail_quota --concurrency 8 --duration 10 --quota 100
+
+The Gmail stub enforces `--quota` units per second per user and answers 429 rateLimitExceeded
+with Retry-After beyond it. `--concurrency` searches (several agent turns and browser tabs of the
+same user, each on its own session) run back to back for `--duration` seconds; each costs one
+`messages.list` plus `--top-n` `messages.get` (5 units each).
+
+* `no_limiter`: no quota accounting and no retries, as before. A rate-limited search fails and
+  the tool returns `{"success": False}`.
+* `retry_only`: jittered exponential backoff honouring Retry-After, no shared bucket.
+* `limiter`: the per-user token bucket (in fakeredis, shared by all sessions) plus the retries.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.fake_gmail import FakeGmailServer
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+# The ID token's `sub` is what ties several sessions to one Gmail user.
+ID_TOKEN = "e30.eyJzdWIiOiAiYmVuY2htYXJrLXVzZXIifQ.c2ln"  # {"sub": "benchmark-user"}
+QUERIES = ["budget", "invoice", "meeting", "release", "travel", "in:inbox"]
+
+
+async def run_mode(args, server: FakeGmailServer, mode: str) -> dict:
+    import fakeredis
+
+    import cache
+    import gmail_quota
+    from gmail_client import GmailClientPool
+    from gmail_search import search_messages
+    from settings import settings
+
+    cache.async_redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    limiter = gmail_quota.quota_limiter
+    limiter.__init__(args.quota, args.quota, settings.GMAIL_QUOTA_MAX_WAIT_SECONDS, enabled=mode == "limiter")
+    settings.GMAIL_MAX_RETRIES = 0 if mode == "no_limiter" else args.retries
+    server.quota_buckets.clear()
+    server.rate_limited = 0
+
+    pool = GmailClientPool(max_size=args.concurrency, ttl_seconds=3600)
+    # Gmail charges the account, whichever token the session holds.
+    clients = [pool.get(f"tab-{index}", {"access_token": "offline-token", "id_token": ID_TOKEN})
+               for index in range(args.concurrency)]
+    latencies: list[float] = []
+    failures = 0
+    deadline = time.perf_counter() + args.duration
+
+    async def session(index: int):
+        nonlocal failures
+        count = 0
+        while time.perf_counter() < deadline:
+            count += 1
+            started = time.perf_counter()
+            try:
+                await search_messages(clients[index], QUERIES[(index + count) % len(QUERIES)], args.top_n, "metadata")
+                latencies.append((time.perf_counter() - started) * 1000)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(index) for index in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    pool.clear()
+    return {
+        "successful_searches_per_second": round(len(latencies) / elapsed, 2),
+        "failed_searches": failures,
+        "failure_rate": round(failures / max(1, failures + len(latencies)), 3),
+        "gmail_429s": server.rate_limited,
+        "latency": summarise_latencies(latencies),
+        "limiter": limiter.stats(),
+    }
+
+
+async def run(args) -> dict:
+    server = FakeGmailServer(generate_mailbox(args.messages), args.latency_ms, quota_units_per_second=args.quota)
+    configure_offline_environment(GMAIL_API_ENDPOINT=server.start(), LOG_LEVEL="ERROR")
+    units = 5 + 5 * args.top_n
+    report = {"config": vars(args) | {"units_per_search": units,
+                                      "quota_bound_searches_per_second": round(args.quota / units, 2)}}
+    try:
+        for mode in ("no_limiter", "retry_only", "limiter"):
+            report[mode] = await run_mode(args, server, mode)
+    finally:
+        server.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--quota", type=float, default=100.0, help="Gmail quota units per second per user.")
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
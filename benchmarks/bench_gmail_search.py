@@ -0,0 +1,72 @@
+"""
+Sequential vs batched message hydration for the MCP search tool, against a local Gmail stub.
+
+    python -m benchmarks.bench_gmail_search --top-n 50 --latency-ms 30 --iterations 20
+
+* sequential: one `messages.get` round trip per result, as LangChain's GmailSearch does
+* batched:    `gmail_search.search_messages` (one list call + batched hydration)
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.fake_gmail import FakeGmailServer
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+
+async def run(args) -> dict:
+    server = FakeGmailServer(generate_mailbox(args.messages), latency_ms=args.latency_ms)
+    endpoint = server.start()
+    configure_offline_environment(GMAIL_API_ENDPOINT=endpoint)
+
+    from gmail_client import GmailClientPool
+    from gmail_search import list_message_refs, parse_message, search_messages
+
+    pool = GmailClientPool(max_size=4, ttl_seconds=3600)
+    client = pool.get("benchmark-session", {"access_token": "offline-token"})
+    query = "in:inbox"
+
+    async def sequential():
+        refs = await list_message_refs(client, query, args.top_n)
+        results = []
+        for ref in refs:
+            request = client.service.users().messages().get(userId="me", id=ref["id"], format=args.format)
+            results.append(parse_message(await client.aexecute(request), args.format))
+        return results
+
+    async def batched():
+        return await search_messages(client, query, args.top_n, args.format)
+
+    report = {"config": vars(args)}
+    try:
+        for name, call in (("sequential", sequential), ("batched", batched)):
+            assert len(await call()) == args.top_n
+            requests_before = server.http_requests
+            samples = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                await call()
+                samples.append((time.perf_counter() - started) * 1000)
+            report[name] = summarise_latencies(samples)
+            report[name]["http_round_trips_per_call"] = (server.http_requests - requests_before) / args.iterations
+        report["p99_speedup"] = round(report["sequential"]["p99_ms"] / report["batched"]["p99_ms"], 1)
+    finally:
+        server.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--format", choices=["full", "metadata", "raw"], default="full")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="Simulated server time per HTTP request.")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
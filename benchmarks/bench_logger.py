@@ -0,0 +1,107 @@
+"""
+Per-call cost of `log_message` at a disabled and an enabled level, before and after the rewrite.
+
+    python -m benchmarks.bench_logger --calls 20000
+
+`legacy` is the previous front end (frame inspection, path and regex work and a level table built
+on every call, filtering left to loguru), reproduced below. `current` is `logger.app_logger`.
+Both write to a null text sink; `current` also writes JSON lines to a temporary file.
+`caller_us` is the time the logging call takes in the caller, `drained_us` includes waiting for
+the background writer to finish, i.e. the total CPU spent per record.
+"""
+import argparse
+import inspect
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+from benchmarks.environment import configure_offline_environment
+
+HTML_TAGS_REGEX = re.compile(r"<.*?>")
+HTML_TAGS_ESCAPE_REGEX = re.compile(r"(<[^>]*>)")
+
+
+def make_legacy_log_message(custom_logger, format_to_str, colorize_filename):
+    def log_message(message, *args, **kwargs):
+        message = repr(message)[1:-1]
+        level = kwargs.pop("level", "info")
+        if isinstance(level, str):
+            level = level.lower()
+        frame = inspect.currentframe().f_back
+        filename = os.path.relpath(inspect.getfile(frame.f_code), start=os.getcwd())
+        func_name = frame.f_code.co_name
+        line_no = frame.f_lineno
+        message = re.sub(HTML_TAGS_REGEX, "", message)
+        message = re.sub(HTML_TAGS_ESCAPE_REGEX, r"\\\1", message)
+        func_name = re.sub(HTML_TAGS_ESCAPE_REGEX, r"\\\1", func_name)
+        args = re.sub(HTML_TAGS_ESCAPE_REGEX, r"\\\1", " ".join(map(format_to_str, args)))
+        message = f"{colorize_filename(filename)}::<b><e>{func_name}</e></b> (<y>{line_no}</y>) - {message} {args}"
+        level_mapping = {
+            "debug": custom_logger.debug, logging.DEBUG: custom_logger.debug,
+            "info": custom_logger.info, logging.INFO: custom_logger.info,
+            "warn": custom_logger.warning, "warning": custom_logger.warning, logging.WARNING: custom_logger.warning,
+            "error": custom_logger.error, logging.ERROR: custom_logger.error,
+            "critical": custom_logger.critical, logging.CRITICAL: custom_logger.critical,
+            "fatal": custom_logger.critical, logging.FATAL: custom_logger.critical,
+        }
+        level_mapping[level](message, **kwargs)
+    return log_message
+
+
+def measure(log, flush, level: str, calls: int) -> dict:
+    session_id = "3f2a9c1e"
+    started = time.perf_counter()
+    for index in range(calls):
+        log(f"[{session_id}]: Fetched {index} emails for query: from:alice newer_than:7d", level=level)
+    caller = time.perf_counter() - started
+    flush()
+    drained = time.perf_counter() - started
+    return {
+        "caller_us": round(caller / calls * 1e6, 3),
+        "drained_us": round(drained / calls * 1e6, 3),
+    }
+
+
+def run(args) -> dict:
+    configure_offline_environment(LOG_LEVEL="INFO")
+    from logger import app_logger
+    from loguru import logger
+
+    report = {"config": vars(args), "legacy": {}, "current": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        # Legacy: loguru sink with enqueue=True, as before; the caller still formats every record.
+        app_logger.flush_logs()
+        logger.remove()
+        logger.add(lambda message: None, format=app_logger.logger_format, enqueue=True, level="INFO")
+        legacy = make_legacy_log_message(
+            logger.bind(logger_context={}).opt(colors=True), app_logger.format_to_str, app_logger.colorize_filename
+        )
+        for level in ("debug", "info"):
+            report["legacy"][level] = measure(legacy, logger.complete, level, args.calls)
+
+        app_logger.configure_sinks(console=False, log_file=None, json_path=os.path.join(directory, "log.jsonl"))
+        logger.add(lambda message: None, format=app_logger.logger_format, level="INFO")
+        for level in ("debug", "info"):
+            report["current"][level] = measure(app_logger.log_message, app_logger.flush_logs, level, args.calls)
+        app_logger.configure_sinks(console=False, log_file=None)
+
+    for level, name in (("debug", "disabled"), ("info", "enabled")):
+        report[f"{name}_caller_speedup"] = round(
+            report["legacy"][level]["caller_us"] / report["current"][level]["caller_us"], 1
+        )
+    report["dropped_records"] = app_logger.dropped_records
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
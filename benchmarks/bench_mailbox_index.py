@@ -0,0 +1,101 @@
+"""
+Local mailbox index vs live Gmail search, against a local Gmail stub.
+
+    python -m benchmarks.bench_mailbox_index --messages 2000 --latency-ms 30
+
+Reports the bulk sync time, per-query latency for the live path and the index, whether both
+return the same message ids, and the cost of an incremental (history) sync after new mail.
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.fake_gmail import FakeGmailServer
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+QUERIES = [
+    "from:amit",
+    "from:alice subject:budget",
+    "subject:invoice",
+    "label:finance",
+    "is:unread offsite",
+    "after:2025/12/01 before:2026/01/01 Phoenix",
+    "customer timeouts",
+    "to:grace in:inbox",
+]
+
+
+async def run(args) -> dict:
+    mailbox = generate_mailbox(args.messages + 20)
+    server = FakeGmailServer(mailbox[20:], latency_ms=args.latency_ms)
+    endpoint = server.start()
+    configure_offline_environment(
+        GMAIL_API_ENDPOINT=endpoint,
+        MAILBOX_INDEX_DIR=tempfile.mkdtemp(prefix="mailbox-index-"),
+        MAILBOX_INDEX_MAX_MESSAGES=str(args.messages),
+    )
+
+    from gmail_client import GmailClientPool
+    from gmail_search import search_messages
+    from mailbox_index import bulk_sync, get_mailbox_index, incremental_sync
+
+    client = GmailClientPool(max_size=4, ttl_seconds=3600).get("benchmark-session", {"access_token": "offline-token"})
+    report = {"config": vars(args), "queries": {}}
+    try:
+        index = await get_mailbox_index(client)
+        started = time.perf_counter()
+        await bulk_sync(index, client)
+        report["bulk_sync_seconds"] = round(time.perf_counter() - started, 2)
+
+        live_all, local_all, agreement = [], [], 0
+        for query in QUERIES:
+            live_samples, local_samples = [], []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                live = await search_messages(client, query, args.top_n, "full")
+                live_samples.append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                local = index.search(query, args.top_n, "full")
+                local_samples.append((time.perf_counter() - started) * 1000)
+
+            same = [email["id"] for email in live] == [email["id"] for email in local]
+            agreement += same
+            live_all += live_samples
+            local_all += local_samples
+            report["queries"][query] = {
+                "live_p50_ms": summarise_latencies(live_samples)["p50_ms"],
+                "index_p50_ms": summarise_latencies(local_samples)["p50_ms"],
+                "results": len(local),
+                "same_results": same,
+            }
+        report["live"] = summarise_latencies(live_all)
+        report["index"] = summarise_latencies(local_all)
+        report["result_agreement"] = f"{agreement}/{len(QUERIES)}"
+
+        for message in reversed(mailbox[:20]):
+            server.add_message(message)
+        started = time.perf_counter()
+        await incremental_sync(index, client)
+        report["incremental_sync_20_new_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        report["incremental_sync_found_new"] = index.search(f"from:{mailbox[0].sender.split('<')[1][:-1]}", 1)[0]["id"] == mailbox[0].id
+    finally:
+        server.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Single-call vs map-reduce summarisation as the result set grows, with a simulated model.
+
+    python -m benchmarks.bench_map_reduce --sizes 10 50 200 400 --time-scale 0.1
+
+The model is `benchmarks.simulated_model.SimulatedChatCompletionClient`: latency follows input
+and output token counts, so a single call over N emails grows linearly with N while map-reduce
+grows with the number of map waves and reduce levels. `one_batch_seconds` is the latency of a
+single map call over SUMMARY_BATCH_SIZE emails, the floor map-reduce can approach. Times are in
+simulated seconds (wall time divided by --time-scale).
+
+`summary_cache` runs two overlapping 200-email queries against an in-memory Redis (fakeredis) to
+show the per-message summary cache: the second query only maps the emails the first did not see.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.environment import configure_offline_environment
+from benchmarks.simulated_model import SimulatedChatCompletionClient
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+
+async def run(args) -> dict:
+    configure_offline_environment()
+    from autogen_core.models import SystemMessage, UserMessage
+
+    from config import FAST_PATH_SUMMARY_PROMPT
+    from email_compactor import compact_emails
+    from gmail_search import parse_message
+    from settings import settings
+    from summariser import MapReduceSummariser
+
+    mailbox = generate_mailbox(max(args.sizes + [300]))
+    all_emails, _ = compact_emails(
+        [parse_message(message.to_resource("full"), "full") for message in mailbox],
+        max_tokens=10 ** 7,
+    )
+    request = "Summarise these emails"
+
+    def model():
+        return SimulatedChatCompletionClient(time_scale=args.time_scale)
+
+    report = {"config": vars(args) | {"batch_size": settings.SUMMARY_BATCH_SIZE,
+                                      "max_concurrency": settings.SUMMARY_MAX_CONCURRENCY,
+                                      "fan_in": settings.SUMMARY_REDUCE_FAN_IN}, "sizes": {}}
+
+    client = model()
+    started = time.perf_counter()
+    await MapReduceSummariser(client, use_cache=False).summarise_batch(all_emails[:settings.SUMMARY_BATCH_SIZE])
+    report["one_batch_seconds"] = round((time.perf_counter() - started) / args.time_scale, 2)
+
+    for size in args.sizes:
+        emails = all_emails[:size]
+
+        client = model()
+        started = time.perf_counter()
+        await client.create([
+            SystemMessage(content=FAST_PATH_SUMMARY_PROMPT),
+            UserMessage(content=f"Request: {request}\n\nEmails:\n{json.dumps(emails)}", source="user"),
+        ])
+        single_seconds = (time.perf_counter() - started) / args.time_scale
+
+        client = model()
+        summariser = MapReduceSummariser(client, use_cache=False)
+        started = time.perf_counter()
+        await summariser.summarise(request, emails)
+        map_reduce_seconds = (time.perf_counter() - started) / args.time_scale
+
+        report["sizes"][size] = {
+            "single_call_seconds": round(single_seconds, 2),
+            "map_reduce_seconds": round(map_reduce_seconds, 2),
+            "speedup": round(single_seconds / map_reduce_seconds, 2),
+            "vs_one_batch": round(map_reduce_seconds / report["one_batch_seconds"], 2),
+            "model_calls": client.calls,
+            "max_concurrent_calls": client.max_in_flight,
+            "reduce_levels": summariser.stats.reduce_levels,
+        }
+
+    import fakeredis
+    import cache
+    cache.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    report["summary_cache"] = {}
+    for name, window in (("cold", all_emails[:200]), ("overlapping", all_emails[100:300])):
+        client = model()
+        summariser = MapReduceSummariser(client, use_cache=True)
+        started = time.perf_counter()
+        await summariser.summarise(request, window)
+        report["summary_cache"][name] = {
+            "seconds": round((time.perf_counter() - started) / args.time_scale, 2),
+            "cache_hit_rate": summariser.stats.as_dict()["cache_hit_rate"],
+            "model_calls": client.calls,
+            "completion_tokens": client.total_usage().completion_tokens,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200, 400])
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Fraction of simulated latency actually slept.")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+MCP server throughput and tail latency as uvicorn workers are added, against a local Gmail stub.
+
+    python -m benchmarks.bench_mcp_workers --workers 1 2 4 --concurrency 64 --duration 15
+
+For each worker count the harness starts `python mcp_server.py --transport http --workers N`
+(stateless streamable HTTP), waits for `/readyz`, and drives `get_top_mails_for_query` tool calls
+from `--load-processes` client processes for `--duration` seconds. Sessions are seeded in a
+Redis shared by all workers: `--redis-url`, or an in-memory one (`benchmarks.redis_server`).
+Gmail is `benchmarks.fake_gmail.FakeGmailServer` with `--gmail-latency-ms` per request.
+
+Reports calls/s, latency percentiles and errors per worker count, and how long the server took
+to exit after SIGTERM. Each worker needs its own CPU core to add throughput; on a machine with
+fewer cores than workers the numbers stay flat (`cpu_count` is in the report).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.environment import REPO_ROOT, configure_offline_environment, summarise_latencies
+from benchmarks.redis_server import FakeRedisServer, free_port
+
+QUERIES = ["budget", "invoice", "meeting", "release", "travel", "is:unread", "newer_than:30d", "project update"]
+MCP_HEADERS = {"Accept": "application/json, text/event-stream", "Content-Type": "application/json"}
+
+
+def _tool_call(request_id: int, session_id: str, query: str, top_n: int) -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "tools/call",
+        "params": {
+            "name": "get_top_mails_for_query",
+            "arguments": {"session_id": session_id, "query": query, "top_n_mails": top_n, "message_format": "metadata"},
+        },
+    }
+
+
+def _parse_response(response) -> dict:
+    """JSON-RPC reply from a JSON body or the `data:` line of an SSE body."""
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        for line in response.text.splitlines():
+            if line.startswith("data:"):
+                return json.loads(line[5:])
+        raise ValueError("no data in event stream")
+    return response.json()
+
+
+def _drive(url: str, session_ids: list[str], concurrency: int, duration: float, top_n: int, seed: int):
+    """One load process: `concurrency` callers in a loop until the deadline. Returns (latencies ms, errors)."""
+    import httpx
+
+    async def run():
+        latencies: list[float] = []
+        errors: list[str] = []
+        rng = random.Random(seed)
+        deadline = time.perf_counter() + duration
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(headers=MCP_HEADERS, limits=limits, timeout=60) as client:
+            async def caller(index: int):
+                request_id = index * 1_000_000
+                while time.perf_counter() < deadline:
+                    request_id += 1
+                    body = _tool_call(request_id, rng.choice(session_ids), rng.choice(QUERIES), top_n)
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post(url, json=body)
+                        response.raise_for_status()
+                        result = _parse_response(response)["result"]
+                        if result.get("isError") or not result.get("structuredContent", {}).get("success", True):
+                            raise ValueError(json.dumps(result)[:200])
+                        latencies.append((time.perf_counter() - started) * 1000)
+                    except Exception as e:
+                        errors.append(f"{type(e).__name__}: {e}"[:200])
+
+            await asyncio.gather(*(caller(index) for index in range(concurrency)))
+        return latencies, errors
+
+    return asyncio.run(run())
+
+
+def _wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 60) -> dict:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"MCP server exited with {process.returncode}")
+        try:
+            response = httpx.get(f"{base_url}/readyz", timeout=2)
+            if response.status_code == 200:
+                return response.json()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("MCP server did not become ready")
+
+
+def run_workers(args, workers: int, env: dict, session_ids: list[str]) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "mcp_server.py", "--transport", "http", "--workers", str(workers), "--port", str(port)],
+        cwd=REPO_ROOT, env=env,
+    )
+    try:
+        ready = _wait_ready(base_url, process)
+        per_process = max(1, args.concurrency // args.load_processes)
+        with ProcessPoolExecutor(args.load_processes, mp_context=get_context("spawn")) as executor:
+            # Warm every worker's Gmail clients and session LRU before measuring.
+            list(executor.map(_drive, *zip(*[(f"{base_url}/mcp", session_ids, per_process, args.warmup, args.top_n, seed)
+                                             for seed in range(args.load_processes)])))
+            started = time.perf_counter()
+            results = list(executor.map(_drive, *zip(*[(f"{base_url}/mcp", session_ids, per_process, args.duration,
+                                                        args.top_n, 1000 + seed)
+                                                       for seed in range(args.load_processes)])))
+            elapsed = time.perf_counter() - started
+        latencies = [sample for samples, _ in results for sample in samples]
+        errors = [error for _, process_errors in results for error in process_errors]
+    finally:
+        stopping = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        shutdown_seconds = time.perf_counter() - stopping
+
+    return {
+        "calls_per_second": round(len(latencies) / elapsed, 1),
+        "latency": summarise_latencies(latencies),
+        "errors": len(errors),
+        "sample_errors": sorted(set(errors))[:3],
+        "shutdown_seconds": round(shutdown_seconds, 2),
+        "exit_code": process.returncode,
+        "ready_pid": ready.get("pid"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent tool calls across all load processes.")
+    parser.add_argument("--load-processes", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--gmail-latency-ms", type=float, default=20.0)
+    parser.add_argument("--redis-url", default=None, help="Shared Redis; an in-memory one is started if omitted.")
+    args = parser.parse_args()
+
+    from benchmarks.fake_gmail import FakeGmailServer
+    from benchmarks.synthetic_mailbox import generate_mailbox
+
+    redis_server = None if args.redis_url else FakeRedisServer()
+    redis_url = args.redis_url or redis_server.start()
+    gmail = FakeGmailServer(generate_mailbox(args.messages), args.gmail_latency_ms)
+    try:
+        configure_offline_environment(
+            GMAIL_API_ENDPOINT=gmail.start(),
+            REDIS_HOST=redis_url,
+            MCP_TRANSPORT="http",
+            MAILBOX_INDEX_ENABLED="false",
+            LOG_LEVEL="WARNING",
+        )
+        # Seed the sessions the tool calls will use; workers inherit the environment (and Fernet key).
+        from cache import save_encrypted_cache
+
+        session_ids = [f"bench-session-{index}" for index in range(args.sessions)]
+        for session_id in session_ids:
+            save_encrypted_cache(session_id, {"access_token": f"offline-token-{session_id}",
+                                              "refresh_token": "offline-refresh", "scope": []}, 3600)
+
+        env = dict(os.environ)
+        report = {"config": vars(args) | {"cpu_count": os.cpu_count()}, "workers": {}}
+        for workers in args.workers:
+            report["workers"][workers] = run_workers(args, workers, env, session_ids)
+            print(json.dumps({workers: report["workers"][workers]}), file=sys.stderr)
+        baseline = report["workers"][args.workers[0]]["calls_per_second"]
+        for result in report["workers"].values():
+            result["scaling"] = round(result["calls_per_second"] / baseline, 2) if baseline else 0.0
+        print(json.dumps(report, indent=2))
+    finally:
+        gmail.stop()
+        if redis_server is not None:
+            redis_server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Model routing policies compared on the end-to-end queries: latency, spend and answers.
+
+    python -m benchmarks.bench_model_routing --iterations 3
+    python -m benchmarks.bench_model_routing --policies single default --small-failure-rate 0.2
+
+Runs `bench_end_to_end.QUERIES` through `agent.answer_query` on the offline stack of
+`bench_end_to_end` (Gmail stub, Redis, MCP server process) with `MODEL_ROUTING_ENABLED`, once per
+policy in `POLICIES` (a list of `MODEL_ROUTING_RULES`). Every model is simulated
+(`benchmarks.simulated_model`, scaled by `--time-scale`) with its own latency profile in `MODELS`:
+the small model is faster and cheaper, but only reliable up to `--small-reliable-tokens` of prompt
+and fails `--small-failure-rate` of its calls (retried on the rule's fallback).
+
+* `single`: every call on `OPENAI_MODEL`, the reference.
+* `default`: the shipped `MODEL_ROUTING_RULES`, the retriever's first turn and size-limited map
+  calls on the small model.
+* `small_summaries`: every summariser call up to 4000 prompt tokens on the small model.
+* `small_everywhere`: every call on the small model.
+
+Reports per policy: end-to-end latency percentiles overall and per path, model calls, failures and
+fallbacks, tokens and spend (`MODEL_PRICES`) per `role -> model` route, and how many answers
+match the `single` policy's for the same query (the simulated answers count the emails they
+cover, so an answer that missed emails differs).
+"""
+import argparse
+import json
+import time
+from collections import defaultdict
+
+from benchmarks.bench_end_to_end import QUERIES, SESSION_ID, offline_stack, start_runtime
+from benchmarks.environment import summarise_latencies
+from benchmarks.simulated_model import SimulatedChatCompletionClient
+
+SMALL_MODEL = "gpt-4o-mini"
+MODELS = {  # Simulated latency profile per model
+    "gpt-4o": {"first_token_seconds": 0.5, "prefill_tokens_per_second": 20000, "decode_tokens_per_second": 80},
+    SMALL_MODEL: {"first_token_seconds": 0.3, "prefill_tokens_per_second": 40000, "decode_tokens_per_second": 160},
+}
+POLICIES = {
+    "single": [],
+    "default": None,  # settings.MODEL_ROUTING_RULES as shipped
+    "small_summaries": [
+        {"model": SMALL_MODEL, "roles": ["summary_map", "summary_reduce", "summary_final"], "max_prompt_tokens": 4000},
+    ],
+    "small_everywhere": [{"model": SMALL_MODEL}],
+}
+
+
+def build_models(args) -> dict[str, SimulatedChatCompletionClient]:
+    return {
+        model: SimulatedChatCompletionClient(
+            **profile,
+            time_scale=args.time_scale,
+            **({"reliable_prompt_tokens": args.small_reliable_tokens, "failure_rate": args.small_failure_rate,
+                "seed": args.seed} if model == SMALL_MODEL else {}),
+        )
+        for model, profile in MODELS.items()
+    }
+
+
+def run_policy(args, rules: list[dict]) -> tuple[dict, dict[str, list[str]]]:
+    from agent import answer_query
+    from settings import settings
+    from tracing import get_trace, new_trace_id
+
+    settings.MODEL_ROUTING_RULES = rules
+    models = build_models(args)
+    runtime = start_runtime(lambda model: models[model])
+    runtime.start()
+    router = runtime.model_client
+
+    def ask(query: str) -> tuple[str, float, str | None]:
+        trace_id = new_trace_id()
+        started = time.perf_counter()
+        try:
+            answer = " ".join(runtime.run(answer_query(SESSION_ID, query, trace_id=trace_id), timeout=args.timeout))
+        except Exception as e:
+            answer = f"error: {type(e).__name__}: {e}"[:200]
+        latency_ms = (time.perf_counter() - started) * 1000
+        root = next((item for item in get_trace(trace_id) if item.parent_id is None), None)
+        attributes = root.attributes if root is not None else {}
+        return attributes.get("path") or attributes.get("mode") or "unknown", latency_ms, answer
+
+    for query in QUERIES:
+        ask(query)  # connections, session LRU
+    router.routes.clear()
+    calls = {model: client.calls for model, client in models.items()}
+
+    latencies: list[float] = []
+    by_path: dict[str, list[float]] = defaultdict(list)
+    answers: dict[str, list[str]] = {}
+    for query in QUERIES:
+        for _ in range(args.iterations):
+            path, latency_ms, answer = ask(query)
+            latencies.append(latency_ms)
+            by_path[path].append(latency_ms)
+            answers.setdefault(query, []).append(answer)
+    stats = router.stats()
+    queries = len(QUERIES) * args.iterations
+    return {
+        "latency": summarise_latencies(latencies),
+        "paths": {path: summarise_latencies(samples) for path, samples in sorted(by_path.items())},
+        "model_calls": {model: client.calls - calls[model] for model, client in models.items()},
+        "failures": stats["failures"],
+        "fallbacks": sum(route["fallbacks"] for route in stats["routes"].values()),
+        "cost_usd": stats["cost_usd"],
+        "cost_usd_per_query": round(stats["cost_usd"] / queries, 6),
+        "routes": stats["routes"],
+    }, answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policies", nargs="+", choices=list(POLICIES), default=list(POLICIES))
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--gmail-latency-ms", type=float, default=30.0)
+    parser.add_argument("--redis-url", default=None, help="Redis for the session; an in-memory one is started if omitted.")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Scales the simulated model latency.")
+    parser.add_argument("--small-reliable-tokens", type=int, default=1500,
+                        help="Prompt size beyond which the small model's answers miss emails.")
+    parser.add_argument("--small-failure-rate", type=float, default=0.1, help="Share of small model calls that fail.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds before a query counts as failed.")
+    args = parser.parse_args()
+    args.warm_caches = False  # every run pays for its model calls
+
+    report = {"config": vars(args), "policies": {}}
+    answers = {}
+    with offline_stack(args, MODEL_ROUTING_ENABLED="true"):
+        from settings import settings
+
+        shipped = list(settings.MODEL_ROUTING_RULES)
+        for policy in ["single"] + [policy for policy in args.policies if policy != "single"]:
+            rules = shipped if POLICIES[policy] is None else POLICIES[policy]
+            report["policies"][policy], answers[policy] = run_policy(args, rules)
+
+    reference = report["policies"]["single"]
+    for policy, result in report["policies"].items():
+        result["answers_matching_single"] = sum(
+            answer == expected
+            for query, expected_answers in answers["single"].items()
+            for answer, expected in zip(answers[policy][query], expected_answers)
+        )
+        result["answers"] = len(QUERIES) * args.iterations
+        result["p50_vs_single"] = round(result["latency"]["p50_ms"] / max(0.001, reference["latency"]["p50_ms"]), 2)
+        result["cost_vs_single"] = round(result["cost_usd"] / max(1e-9, reference["cost_usd"]), 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
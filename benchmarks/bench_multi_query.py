@@ -0,0 +1,138 @@
+"""
+Exploring several formulations of a search: one refinement per agent turn vs one fan-out call.
+
+    python -m benchmarks.bench_multi_query --messages 2000 --top-n 10 --iterations 3
+
+Each question in `QUESTIONS` comes with the candidate Gmail queries a retriever would try. Against
+a local Gmail stub (`--latency-ms` per request) and fakeredis, with the model simulated
+(`benchmarks.simulated_model`, scaled by `--time-scale`):
+
+* `sequential`: the retriever spends a model turn on each query and calls
+  `get_top_mails_for_query` with it, the tool results piling up in its context, then answers.
+* `fan_out`: one model turn, one `get_top_mails_for_queries` call with every query (merged and
+  deduplicated, `--max-tokens` per query of budget in total), then the answer.
+
+Reports per question: wall time, model turns and prompt tokens, Gmail HTTP requests and API
+calls, emails returned vs distinct emails, and the tokens of the tool results.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.fake_gmail import FakeGmailServer
+from benchmarks.simulated_model import SimulatedChatCompletionClient
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+SESSION_ID = "bench-multi-query"
+QUESTIONS = {
+    "What's happening with the budget?": ["budget", "subject:budget", "finance budget numbers", "board meeting"],
+    "Did anyone chase an unpaid invoice?": ["invoice", "subject:invoice", "overdue payment", "invoice 4471"],
+    "Where are we on the 2.4 release?": ["release", "subject:release", "blockers", "login crash"],
+    "Anything new about the offsite?": ["offsite", "subject:offsite", "venue", "dietary needs"],
+}
+
+
+async def ask(args, question: str, queries: list[str], mode: str, model: SimulatedChatCompletionClient) -> dict:
+    from autogen_core.models import SystemMessage, UserMessage
+
+    from config import EMAIL_RETRIEVER_AGENT_SYSTEM_PROMPT
+    from mcp_server import _get_top_mails_for_queries, _get_top_mails_for_query
+
+    # Offered the search tool, the simulated model answers a turn with a (short) tool call.
+    tools = [{"name": "get_top_mails_for_query"}]
+    messages = [
+        SystemMessage(content=EMAIL_RETRIEVER_AGENT_SYSTEM_PROMPT.format(access_token=SESSION_ID)),
+        UserMessage(content=question, source="user"),
+    ]
+    if mode == "sequential":
+        responses = []
+        for query in queries:
+            await model.create(messages, tools=tools)  # the turn that chooses the next formulation
+            response = await _get_top_mails_for_query(SESSION_ID, query, args.top_n, "full", args.max_tokens)
+            messages.append(UserMessage(content=json.dumps(response), source="email_retriever"))
+            responses.append(response)
+    else:
+        await model.create(messages, tools=tools)
+        response = await _get_top_mails_for_queries(
+            SESSION_ID, queries, args.top_n, "full", args.max_tokens * len(queries)
+        )
+        messages.append(UserMessage(content=json.dumps(response), source="email_retriever"))
+        responses = [response]
+    await model.create(messages)  # the answer
+    assert all(response["success"] for response in responses), responses
+
+    emails = [email for response in responses for email in response["emails"]]
+    return {
+        "emails_returned": len(emails),
+        "distinct_emails": len({email["id"] for email in emails}),
+        "result_tokens": sum(response.get("token_stats", {}).get("compacted_tokens", 0) for response in responses),
+    }
+
+
+async def run_mode(args, server: FakeGmailServer, mode: str) -> dict:
+    latencies = []
+    totals = dict.fromkeys(["model_turns", "prompt_tokens", "gmail_http_requests", "gmail_api_calls",
+                            "emails_returned", "distinct_emails", "result_tokens"], 0)
+    for _ in range(args.iterations):
+        for question, queries in QUESTIONS.items():
+            model = SimulatedChatCompletionClient(time_scale=args.time_scale)
+            http_requests, api_calls = server.http_requests, sum(server.request_counts.values())
+            started = time.perf_counter()
+            result = await ask(args, question, queries, mode, model)
+            latencies.append((time.perf_counter() - started) * 1000)
+            totals["model_turns"] += model.calls
+            totals["prompt_tokens"] += model.total_usage().prompt_tokens
+            totals["gmail_http_requests"] += server.http_requests - http_requests
+            totals["gmail_api_calls"] += sum(server.request_counts.values()) - api_calls
+            for key, value in result.items():
+                totals[key] += value
+    questions = len(QUESTIONS) * args.iterations
+    return {"latency": summarise_latencies(latencies)} | {
+        f"{key}_per_question": round(value / questions, 1) for key, value in totals.items()
+    }
+
+
+async def run(args) -> dict:
+    server = FakeGmailServer(generate_mailbox(args.messages), args.latency_ms)
+    configure_offline_environment(
+        GMAIL_API_ENDPOINT=server.start(),
+        MAILBOX_INDEX_ENABLED="false",
+        SEARCH_COALESCING_ENABLED="false",
+        LOG_LEVEL="ERROR",
+    )
+    import fakeredis
+
+    import cache
+
+    cache.async_redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    cache.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    await cache.asave_sessions({SESSION_ID: {"access_token": "offline-token", "scope": []}}, 3600)
+
+    report = {"config": vars(args)}
+    try:
+        for mode in ("sequential", "fan_out"):
+            report[mode] = await run_mode(args, server, mode)
+    finally:
+        server.stop()
+    report["speedup"] = round(
+        report["sequential"]["latency"]["mean_ms"] / max(0.001, report["fan_out"]["latency"]["mean_ms"]), 2
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--max-tokens", type=int, default=3000, help="Tool result budget per query.")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Scales the simulated model latency.")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Latency and accuracy of the rule-based query planner over a fixture set of requests.
+
+    python -m benchmarks.bench_query_planner --iterations 200 --verbose
+
+* query accuracy:   planned Gmail query (and result count) matches the fixture, for requests
+                    that should take the fast path
+* routing accuracy: fast path vs agent team decision matches the fixture
+* llm_calls_saved:  estimated model calls avoided, assuming the team needs at least 3 calls
+                    (retriever search, retriever answer, critic dispatch) and the fast path 1
+"""
+import argparse
+import json
+import shlex
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+
+FIXTURES = Path(__file__).with_name("query_planner_fixtures.json")
+TEAM_MIN_LLM_CALLS = 3
+
+
+def normalise(query: str) -> set[str]:
+    return set(shlex.split(query.lower(), posix=False))
+
+
+def run(args) -> dict:
+    configure_offline_environment()
+    from query_planner import plan_query
+
+    fixtures = json.loads(FIXTURES.read_text())
+    now = datetime.fromisoformat(fixtures["now"])
+    cases = fixtures["queries"]
+
+    samples, failures = [], []
+    query_correct = query_total = routing_correct = fast_paths = 0
+    for case in cases:
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            plan = plan_query(case["prompt"], now=now)
+            samples.append((time.perf_counter() - started) * 1000)
+
+        fast_paths += plan.is_confident
+        routed_ok = plan.is_confident == case["fast_path"]
+        routing_correct += routed_ok
+        query_ok = True
+        if case["fast_path"]:
+            query_total += 1
+            query_ok = (normalise(plan.gmail_query) == normalise(case["gmail_query"])
+                        and plan.max_results == case.get("max_results", 10))
+            query_correct += query_ok
+        if not (routed_ok and query_ok):
+            failures.append({
+                "prompt": case["prompt"],
+                "expected": case["gmail_query"],
+                "planned": plan.gmail_query,
+                "confidence": plan.confidence,
+                "rules": plan.matched_rules,
+            })
+
+    report = {
+        "fixtures": len(cases),
+        "latency_us": {key.replace("_ms", ""): round(value * 1000, 1) for key, value in summarise_latencies(samples).items() if key != "count"},
+        "query_accuracy": round(query_correct / query_total, 3),
+        "routing_accuracy": round(routing_correct / len(cases), 3),
+        "fast_path_share": round(fast_paths / len(cases), 3),
+        "llm_calls_saved": f">= {fast_paths * (TEAM_MIN_LLM_CALLS - 1)} of {len(cases) * TEAM_MIN_LLM_CALLS}",
+    }
+    if args.verbose:
+        report["failures"] = failures
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--verbose", action="store_true", help="List every fixture the planner got wrong.")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
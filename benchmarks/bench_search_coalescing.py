@@ -0,0 +1,96 @@
+"""
+Gmail requests and latency for bursts of identical searches, with and without coalescing.
+
+    python -m benchmarks.bench_search_coalescing --bursts 20 --duplicates 6 --workers 2
+
+Each burst issues `--duplicates` identical `get_top_mails_for_query` searches at once, spread
+over `--workers` simulated MCP workers (separate `SearchCoalescer`s sharing one fakeredis), then
+one agent re-query of the same search `--requery-ms` later. Every burst uses a new query.
+
+* `off`: coalescing disabled, every call searches Gmail.
+* `in_process`: one worker, so duplicates join the in-flight search.
+* `across_workers`: duplicates on other workers wait on the Redis lock and read the stored result.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.fake_gmail import FakeGmailServer
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+QUERIES = ["budget", "invoice", "meeting", "release", "travel", "project", "report", "review"]
+
+
+async def run_mode(args, server: FakeGmailServer, mode: str) -> dict:
+    import fakeredis
+
+    import cache
+    from mcp_server import _get_top_mails_for_query
+    from search_coalescer import SearchCoalescer
+
+    cache.async_redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    await cache.asave_sessions({"bench-session": {"access_token": "offline-token", "scope": []}}, 3600)
+    workers = [
+        SearchCoalescer(result_ttl_seconds=10, lock_ttl_seconds=30, wait_seconds=15, enabled=mode != "off")
+        for _ in range(1 if mode == "in_process" else args.workers)
+    ]
+    requests_before = server.http_requests
+    latencies: list[float] = []
+
+    async def call(coalescer, query: str):
+        started = time.perf_counter()
+        response = await coalescer.run(
+            ("bench-session", query, args.top_n, "metadata", None),
+            lambda: _get_top_mails_for_query("bench-session", query, args.top_n, "metadata", None),
+        )
+        assert response["success"], response
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    for burst in range(args.bursts):
+        query = f"{QUERIES[burst % len(QUERIES)]} newer_than:{burst + 1}y"
+        await asyncio.gather(*(call(workers[index % len(workers)], query) for index in range(args.duplicates)))
+        await asyncio.sleep(args.requery_ms / 1000)
+        await call(workers[burst % len(workers)], query)
+
+    calls = args.bursts * (args.duplicates + 1)
+    stats = {key: sum(worker.stats()[key] for worker in workers) for key in workers[0].stats()}
+    return {
+        "calls": calls,
+        "gmail_http_requests": server.http_requests - requests_before,
+        "gmail_searches": stats["searches"] if mode != "off" else calls,
+        "latency": summarise_latencies(latencies),
+        "coalescing": stats,
+    }
+
+
+async def run(args) -> dict:
+    server = FakeGmailServer(generate_mailbox(args.messages), args.latency_ms)
+    configure_offline_environment(
+        GMAIL_API_ENDPOINT=server.start(), MAILBOX_INDEX_ENABLED="false", LOG_LEVEL="ERROR",
+    )
+    report = {"config": vars(args)}
+    try:
+        for mode in ("off", "in_process", "across_workers"):
+            report[mode] = await run_mode(args, server, mode)
+    finally:
+        server.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bursts", type=int, default=20)
+    parser.add_argument("--duplicates", type=int, default=6, help="Identical concurrent searches per burst.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--requery-ms", type=float, default=200.0)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
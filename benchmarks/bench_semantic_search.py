@@ -0,0 +1,133 @@
+"""
+Recall and latency of semantic retrieval over the local mailbox index, offline.
+
+    python -m benchmarks.bench_semantic_search --messages 2000 --top-n 10
+
+Builds the index from the synthetic mailbox, embeds its chunks with the offline hashing
+embedder, then runs one descriptive query per topic, worded differently from the emails. A
+message is relevant when its subject is the topic (including replies and newsletters).
+
+* `gmail_and`: the index's Gmail-compatible search (every word must match), what
+  `get_top_mails_for_query` does with the same text.
+* `keyword`: BM25 over any of the words.
+* `vector`: cosine similarity of the best chunk.
+* `hybrid`: both fused with reciprocal rank fusion, the `semantic_search_mails` default.
+
+Reports precision@top-n, recall@recall-k and latency per mode, the build time, and the cost of
+indexing and embedding a handful of new messages. The hashing embedder only matches words; an
+embeddings API (`EMBEDDING_PROVIDER=openai`) also matches synonyms, so treat the vector numbers as
+a lower bound.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.synthetic_mailbox import TOPICS, generate_mailbox
+
+# One description per topic, avoiding the subject's own words where the language allows.
+QUERIES = {
+    "Project Phoenix status": "how is the database migration going",
+    "Quarterly budget review": "revised finance numbers needed for the board",
+    "Offsite planning": "team retreat venue and dietary preferences",
+    "Invoice overdue": "unpaid bill that is late, payment reminder",
+    "Hiring loop feedback": "interview feedback about the candidate",
+    "Release 2.4 blockers": "what is blocking the next version, login crash",
+    "Security incident follow-up": "was the leaked key rotated, any misuse in the audit",
+    "Customer escalation": "client complaining about timeouts exporting reports",
+}
+
+
+def topic_of(subject: str) -> str | None:
+    subject = subject.removeprefix("Re: ")
+    for topic, _ in TOPICS:
+        if subject == topic or subject.endswith(f": {topic}"):
+            return topic
+    return None
+
+
+async def run(args) -> dict:
+    configure_offline_environment(
+        MAILBOX_INDEX_DIR=tempfile.mkdtemp(prefix="semantic-index-"),
+        EMBEDDING_PROVIDER="hashing",
+        EMBEDDING_DIMENSIONS=str(args.dimensions),
+        LOG_LEVEL="ERROR",
+    )
+    from mailbox_index import MailboxIndex
+    from semantic_search import embed_pending, get_embedder, semantic_search
+    from settings import settings
+
+    mailbox = generate_mailbox(args.messages + args.new_messages)
+    new, existing = mailbox[:args.new_messages], mailbox[args.new_messages:]
+    relevant: dict[str, set[str]] = {topic: set() for topic in QUERIES}
+    for message in mailbox:
+        if (topic := topic_of(message.subject)) is not None:
+            relevant[topic].add(message.id)
+
+    index = MailboxIndex(os.path.join(settings.MAILBOX_INDEX_DIR, "benchmark.sqlite3"))
+    embedder = get_embedder()
+    report = {"config": vars(args)}
+
+    started = time.perf_counter()
+    index.upsert_messages([message.to_resource("full") for message in existing])
+    indexed = time.perf_counter()
+    chunks = await embed_pending(index, embedder)
+    embedded = time.perf_counter()
+    report["build"] = {
+        "messages": len(existing),
+        "chunks": chunks,
+        "index_seconds": round(indexed - started, 3),
+        "embed_seconds": round(embedded - indexed, 3),
+    }
+
+    recall_k = max(args.recall_k, args.top_n)
+    for mode in ("gmail_and", "keyword", "vector", "hybrid"):
+        precision, recall, latencies = [], [], []
+        for topic, query in QUERIES.items():
+            for iteration in range(args.iterations):
+                started = time.perf_counter()
+                if mode == "gmail_and":
+                    results = index.search(query.replace(",", ""), recall_k, "metadata")
+                else:
+                    results = await semantic_search(index, query, recall_k, mode, "metadata", embedder)
+                latencies.append((time.perf_counter() - started) * 1000)
+            ids = [email["id"] for email in results]
+            precision.append(len(relevant[topic] & set(ids[:args.top_n])) / args.top_n)
+            recall.append(len(relevant[topic] & set(ids)) / min(recall_k, len(relevant[topic])))
+        report[mode] = {
+            f"precision@{args.top_n}": round(sum(precision) / len(precision), 3),
+            f"recall@{recall_k}": round(sum(recall) / len(recall), 3),
+            "latency": summarise_latencies(latencies),
+        }
+
+    # New mail: the next search re-chunks and embeds it inline, then reloads the matrix.
+    started = time.perf_counter()
+    index.upsert_messages([message.to_resource("full") for message in new])
+    new_chunks = await embed_pending(index, embedder)
+    await semantic_search(index, QUERIES["Invoice overdue"], args.top_n, "hybrid", "metadata", embedder)
+    report["incremental"] = {
+        "messages": len(new),
+        "chunks": new_chunks,
+        "index_embed_and_first_search_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    index.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--new-messages", type=int, default=20)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--recall-k", type=int, default=50)
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Concurrent tool-call throughput with the blocking session lookup vs the async, pooled and cached one.
+
+    python -m benchmarks.bench_session_cache --calls 2000 --concurrency 100 --redis-latency-ms 1
+
+Every simulated tool call loads its session from Redis and then awaits a Gmail round trip
+(`--gmail-latency-ms`). Redis is a local server given with `--redis-url`, or fakeredis where each
+command costs `--redis-latency-ms`, so the lookups pay a network round trip either way.
+
+* `sync`: `get_session_details_from_cache` on the blocking client, as the tool did before. Each
+  lookup stalls the event loop, so concurrent calls queue behind one another.
+* `async`: `aget_session_details_from_cache` on the pooled `redis.asyncio` client, LRU disabled.
+* `async_lru`: the same with the in-process decrypted-session LRU.
+* `batch`: one `aget_sessions` MGET for all sessions vs one GET each.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+
+
+class _LatencyPipeline:
+    def __init__(self, pipeline, delay):
+        self._pipeline = pipeline
+        self._delay = delay
+
+    def __getattr__(self, name):
+        attribute = getattr(self._pipeline, name)
+        if name != "execute":
+            return attribute
+        return lambda *args, **kwargs: self._delay(lambda: attribute(*args, **kwargs))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class LatencyRedis:
+    """
+    fakeredis client where every command (a pipeline counts once) costs one network round trip,
+    and at most `max_connections` commands are in flight, like a pooled client on a real network.
+    """
+
+    def __init__(self, client, latency_seconds: float, max_connections: int):
+        self._client = client
+        self._latency = latency_seconds
+        self._is_async = isinstance(client, __import__("fakeredis").FakeAsyncRedis)
+        self._slots = asyncio.Semaphore(max_connections) if self._is_async else threading.Semaphore(max_connections)
+
+    def _delay(self, call):
+        if not self._is_async:
+            with self._slots:
+                time.sleep(self._latency)
+                return call()
+
+        async def delayed():
+            async with self._slots:
+                await asyncio.sleep(self._latency)
+                return await call()
+        return delayed()
+
+    def pipeline(self, *args, **kwargs):
+        return _LatencyPipeline(self._client.pipeline(*args, **kwargs), self._delay)
+
+    def pubsub(self, *args, **kwargs):
+        return self._client.pubsub(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        return lambda *args, **kwargs: self._delay(lambda: attribute(*args, **kwargs))
+
+
+def connect_redis(cache, args):
+    """Points the cache module at `--redis-url`, or at fakeredis with `--redis-latency-ms` per command."""
+    if args.redis_url:
+        return
+    import fakeredis
+
+    server = fakeredis.FakeServer()
+    latency, connections = args.redis_latency_ms / 1000, cache.settings.REDIS_MAX_CONNECTIONS
+    cache.redis_client = LatencyRedis(fakeredis.FakeRedis(server=server, decode_responses=True), latency, connections)
+    cache.async_redis_client = LatencyRedis(
+        fakeredis.FakeAsyncRedis(server=server, decode_responses=True), latency, connections
+    )
+
+
+async def run_calls(lookup, session_ids: list[str], calls: int, concurrency: int, gmail_latency: float) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def tool_call(session_id):
+        async with semaphore:
+            started = time.perf_counter()
+            session = await lookup(session_id)
+            assert session, session_id
+            await asyncio.sleep(gmail_latency)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    rng = random.Random(7)
+    started = time.perf_counter()
+    await asyncio.gather(*(tool_call(rng.choice(session_ids)) for _ in range(calls)))
+    elapsed = time.perf_counter() - started
+    return {"calls_per_second": round(calls / elapsed, 1), **summarise_latencies(latencies)}
+
+
+async def run(args) -> dict:
+    configure_offline_environment(**({"REDIS_HOST": args.redis_url} if args.redis_url else {}))
+    import cache
+
+    connect_redis(cache, args)
+
+    session_ids = [f"session-{index}" for index in range(args.sessions)]
+    await cache.asave_sessions({session_id: {"access_token": f"token-{session_id}"} for session_id in session_ids})
+    gmail_latency = args.gmail_latency_ms / 1000
+    report = {"config": vars(args), "modes": {}}
+
+    async def sync_lookup(session_id):
+        return cache.get_session_details_from_cache(session_id)
+
+    cache_size = cache.session_cache.max_size
+    for mode, lookup, lru_size in (
+        ("sync", sync_lookup, 0),
+        ("async", cache.aget_session_details_from_cache, 0),
+        ("async_lru", cache.aget_session_details_from_cache, cache_size),
+    ):
+        cache.session_cache.clear()
+        cache.session_cache.max_size = lru_size
+        cache.session_cache.hits = cache.session_cache.misses = 0
+        report["modes"][mode] = await run_calls(lookup, session_ids, args.calls, args.concurrency, gmail_latency)
+    report["modes"]["async_lru"]["lru"] = cache.session_cache.stats()
+    baseline = report["modes"]["sync"]["calls_per_second"]
+    for mode in ("async", "async_lru"):
+        report["modes"][mode]["speedup"] = round(report["modes"][mode]["calls_per_second"] / baseline, 2)
+
+    cache.session_cache.clear()
+    cache.session_cache.max_size = 0
+    started = time.perf_counter()
+    for session_id in session_ids:
+        await cache.aget_session_details_from_cache(session_id)
+    one_by_one = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    sessions = await cache.aget_sessions(session_ids)
+    report["batch"] = {
+        "sessions": len(sessions),
+        "get_each_ms": round(one_by_one, 2),
+        "mget_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+    # A save elsewhere must evict this process' copy.
+    cache.session_cache.max_size = cache_size
+    await cache.aget_session_details_from_cache(session_ids[0])
+    await asyncio.sleep(0.2)  # Let the invalidation listener subscribe
+    await asyncio.to_thread(cache.save_encrypted_cache, session_ids[0], {"access_token": "refreshed"})
+    for _ in range(50):
+        if cache.session_cache.get(session_ids[0]) is None:
+            break
+        await asyncio.sleep(0.01)
+    report["invalidation"] = {
+        "evicted": cache.session_cache.get(session_ids[0]) is None,
+        "reloaded_token": (await cache.aget_session_details_from_cache(session_ids[0]))["access_token"],
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--redis-url", help="Benchmark against this Redis instead of fakeredis.")
+    parser.add_argument("--redis-latency-ms", type=float, default=1.0, help="Simulated round trip for fakeredis.")
+    parser.add_argument("--gmail-latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Cold-import time of the application's entry points, measured with `python -X importtime`.
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --check --budget agent=1500 --output startup.json   # CI
+
+Each module is imported `--runs` times, every time in a new interpreter (after one unmeasured run
+that writes the bytecode caches), which is what a Streamlit server, an MCP worker or a digest
+worker pays when it starts. Reports per module the median wall time of the interpreter, the
+module's cumulative import time from `-X importtime`, the number of modules loaded and the slowest
+direct imports.
+
+`--check` exits non-zero when a module exceeds its `--budget` (milliseconds of import time), or
+when a dependency listed in `LAZY_DEPENDENCIES` for it is imported at module load: those are only
+needed later (the agent team, the OpenAI SDK and MCP client on the runtime's first use, Streamlit
+for sign-in) and loading them eagerly is a startup regression.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.environment import REPO_ROOT, configure_offline_environment
+
+MODULES = ["settings", "config", "agent", "mcp_server", "main", "digest_worker"]
+LAZY_DEPENDENCIES = {
+    "settings": ["pprint"],
+    "config": ["streamlit", "requests_oauthlib"],
+    "agent": ["autogen_agentchat", "autogen_ext", "openai", "mcp", "streamlit"],
+    "mcp_server": ["tiktoken", "langchain_community", "langchain_google_community"],
+    "digest_worker": ["autogen_agentchat", "autogen_ext", "openai", "mcp", "streamlit"],
+}
+TOP_IMPORTS = 8
+
+
+def parse_importtime(stderr: str) -> list[tuple[int, int, int, str]]:
+    """`(depth, self us, cumulative us, module)` for every line `-X importtime` wrote."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2  # the imported module itself is depth 0
+        entries.append((depth, int(self_us), int(cumulative_us), name.strip()))
+    return entries
+
+
+def import_once(module: str) -> tuple[float, list[tuple[int, int, int, str]]]:
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=os.environ.copy(), capture_output=True, text=True,
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    return wall_ms, parse_importtime(completed.stderr)
+
+
+def measure(module: str, runs: int) -> dict:
+    import_once(module)  # bytecode caches
+    walls, imports, entries = [], [], []
+    for _ in range(runs):
+        wall_ms, entries = import_once(module)
+        walls.append(wall_ms)
+        imports.append(next((cumulative for depth, _, cumulative, name in entries if name == module and depth == 0), 0) / 1000)
+    loaded = {name for _, _, _, name in entries}
+    # Direct imports of the module: the entries one level below it, listed before it.
+    position = max(index for index, entry in enumerate(entries) if entry[3] == module and entry[0] == 0)
+    children = []
+    for depth, _, cumulative, name in reversed(entries[:position]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children.append((name, round(cumulative / 1000, 1)))
+    return {
+        "wall_ms": round(statistics.median(walls), 1),
+        "import_ms": round(statistics.median(imports), 1),
+        "import_ms_min": round(min(imports), 1),
+        "modules_loaded": len(loaded),
+        "slowest_imports": dict(sorted(children, key=lambda child: child[1], reverse=True)[:TOP_IMPORTS]),
+        "eager_dependencies": sorted(
+            dependency for dependency in LAZY_DEPENDENCIES.get(module, [])
+            if dependency in loaded and dependency != module
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", action="append", default=[], metavar="MODULE=MS",
+                        help="Import time budget of a module in milliseconds (repeatable).")
+    parser.add_argument("--check", action="store_true", help="Exit 1 on budget overruns or eager dependencies.")
+    parser.add_argument("--output", help="Also write the report to this JSON file.")
+    args = parser.parse_args()
+
+    configure_offline_environment(LOG_LEVEL="ERROR")
+    budgets = {module: float(ms) for module, ms in (budget.split("=", 1) for budget in args.budget)}
+    report = {"config": {**vars(args), "python": sys.version.split()[0]}, "modules": {}}
+    failures = []
+    for module in args.modules:
+        result = report["modules"][module] = measure(module, args.runs)
+        if module in budgets and result["import_ms"] > budgets[module]:
+            failures.append(f"{module}: {result['import_ms']} ms import time, budget {budgets[module]} ms")
+        if result["eager_dependencies"]:
+            failures.append(f"{module}: imports {', '.join(result['eager_dependencies'])} at module load")
+    report["failures"] = failures
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.check and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
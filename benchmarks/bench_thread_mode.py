@@ -0,0 +1,115 @@
+"""
+Conversation queries in message mode vs thread mode, against a local Gmail stub.
+
+    python -m benchmarks.bench_thread_mode --top-n 10 --messages 2000 --reply-rate 0.6 --active-threads 15
+
+Each query runs through `get_top_mails_for_query` twice, compaction on:
+
+* `messages`: `top_n` messages, so replies of one thread come back (and are summarised) separately.
+* `threads`: `top_n` threads from `threads.list`, hydrated in batches of `threads.get`, every
+  conversation collapsed into one record with quoted text removed.
+* `messages_same_coverage`: message mode asked for as many messages as thread mode covered.
+
+The synthetic mailbox is generated with `--reply-rate` of its messages replying to one of the
+`--active-threads` most recent threads, so conversations run several messages deep.
+
+Reports, per mode, the records, distinct conversations and messages returned, Gmail HTTP
+requests and quota units, response tokens (per conversation and per message covered) and latency.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.fake_gmail import FakeGmailServer
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+QUERIES = [
+    "{from:amit to:amit}",
+    "{from:alice to:alice}",
+    "Phoenix",
+    "budget",
+    "subject:invoice",
+    "release blockers",
+    "offsite",
+    "escalation",
+]
+UNITS = {"messages.list": 5, "messages.get": 5, "threads.list": 10, "threads.get": 10}
+
+
+async def run_mode(args, server: FakeGmailServer, resource: str, top_n: int) -> dict:
+    from mcp_server import _get_top_mails_for_query
+
+    latencies: list[float] = []
+    records = conversations = messages = tokens = 0
+    requests_before = server.http_requests
+    counts_before = dict(server.request_counts)
+    for _ in range(args.iterations):
+        for query in QUERIES:
+            started = time.perf_counter()
+            response = await _get_top_mails_for_query(
+                "bench-session", query, top_n, "full", args.max_tokens, resource
+            )
+            latencies.append((time.perf_counter() - started) * 1000)
+            assert response["success"], response
+            records += response["count"]
+            conversations += len({email["threadId"] for email in response["emails"]})
+            messages += sum(email.get("message_count", 1) for email in response["emails"])
+            tokens += response.get("token_stats", {}).get("compacted_tokens", 0)
+
+    calls = args.iterations * len(QUERIES)
+    units = sum(UNITS.get(name, 0) * (count - counts_before.get(name, 0)) for name, count in server.request_counts.items())
+    return {
+        "top_n": top_n,
+        "records_per_query": round(records / calls, 1),
+        "conversations_per_query": round(conversations / calls, 1),
+        "messages_covered_per_query": round(messages / calls, 1),
+        "gmail_http_requests_per_query": round((server.http_requests - requests_before) / calls, 1),
+        "quota_units_per_query": round(units / calls, 1),
+        "response_tokens_per_query": round(tokens / calls),
+        "tokens_per_conversation": round(tokens / max(1, conversations)),
+        "tokens_per_message_covered": round(tokens / max(1, messages)),
+        "quota_units_per_conversation": round(units / max(1, conversations), 1),
+        "latency": summarise_latencies(latencies),
+    }
+
+
+async def run(args) -> dict:
+    mailbox = generate_mailbox(args.messages, reply_rate=args.reply_rate, active_threads=args.active_threads)
+    server = FakeGmailServer(mailbox, args.latency_ms)
+    configure_offline_environment(
+        GMAIL_API_ENDPOINT=server.start(), MAILBOX_INDEX_ENABLED="false", LOG_LEVEL="ERROR",
+    )
+    import fakeredis
+
+    import cache
+
+    cache.async_redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    await cache.asave_sessions({"bench-session": {"access_token": "offline-token", "scope": []}}, 3600)
+    report = {"config": vars(args)}
+    try:
+        report["messages"] = await run_mode(args, server, "messages", args.top_n)
+        report["threads"] = await run_mode(args, server, "threads", args.top_n)
+        covered = round(report["threads"]["messages_covered_per_query"])
+        report["messages_same_coverage"] = await run_mode(args, server, "messages", covered)
+    finally:
+        server.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--max-tokens", type=int, default=None, help="Response budget; EMAIL_MAX_TOKENS_PER_RESPONSE if unset.")
+    parser.add_argument("--reply-rate", type=float, default=0.6)
+    parser.add_argument("--active-threads", type=int, default=15)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
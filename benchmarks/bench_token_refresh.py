@@ -0,0 +1,167 @@
+"""
+Tool calls around OAuth token expiry: no refresh, refresh on expiry, and refresh ahead of expiry.
+
+    python -m benchmarks.bench_token_refresh --sessions 20 --workers 2 --seconds 12 --token-lifetime 4
+
+`--sessions` sessions each make a tool call every `--interval-ms` (jittered) for `--seconds`,
+spread over `--workers` simulated MCP workers (separate `TokenManager`s sharing one fakeredis).
+Access tokens from the local token endpoint live `--token-lifetime` seconds and cost
+`--token-latency-ms` to obtain; sessions start with staggered expiries.
+
+* `off`: tokens are never refreshed; calls past expiry would be answered 401 by Gmail.
+* `on_expiry`: a call that finds its token expired refreshes it inline (the synchronous refresh
+  google-auth would do inside the Gmail request).
+* `ahead`: `token_manager` as deployed, refreshing `--refresh-ahead` seconds before expiry in
+  the background.
+
+Reports, per mode, session lookup latency of the tool calls, calls handed an expired token,
+calls that waited on a refresh, and token endpoint requests (one per expiry when refreshes are
+deduplicated across workers).
+"""
+import argparse
+import asyncio
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+
+
+class FakeTokenServer:
+    """Answers refresh_token grants with a new access token after `latency_ms`."""
+
+    def __init__(self, lifetime_seconds: float, latency_ms: float):
+        self.lifetime_seconds = lifetime_seconds
+        self.latency = latency_ms / 1000
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.requests += 1
+                time.sleep(server.latency)
+                body = json.dumps({"access_token": secrets.token_hex(16), "expires_in": server.lifetime_seconds,
+                                   "token_type": "Bearer"}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+
+    def start(self) -> str:
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/token"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+async def run_mode(args, token_server: FakeTokenServer, token_url: str, mode: str) -> dict:
+    import fakeredis
+
+    import cache
+    from token_manager import TokenManager
+
+    cache.async_redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    cache.session_cache.clear()
+    now = time.time()
+    await cache.asave_sessions({
+        f"session-{index}": {
+            "access_token": secrets.token_hex(16),
+            "refresh_token": f"refresh-{index}",
+            "expires_at": now + args.token_lifetime * (index + 1) / args.sessions,
+        }
+        for index in range(args.sessions)
+    }, 3600)
+
+    workers = [
+        TokenManager(
+            refresh_ahead_seconds=args.refresh_ahead if mode == "ahead" else 0,
+            idle_seconds=60 if mode == "ahead" else 0,
+            lock_ttl_seconds=10,
+            wait_seconds=5,
+            token_url=token_url,
+            poll_seconds=0.01,
+            expiry_margin_seconds=args.expiry_margin,
+            enabled=mode != "off",
+        )
+        for _ in range(args.workers)
+    ]
+    requests_before = token_server.requests
+    latencies: list[float] = []
+    expired = waited = 0
+    deadline = time.monotonic() + args.seconds
+
+    async def session_calls(index: int):
+        nonlocal expired, waited
+        session_id = f"session-{index}"
+        call = 0
+        await asyncio.sleep(random.uniform(0, args.interval_ms / 1000))
+        while time.monotonic() < deadline:
+            worker = workers[(index + call) % len(workers)]
+            inline_before = worker.inline_refreshes
+            started = time.perf_counter()
+            session_data = await worker.get_session(session_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+            expired += float(session_data["expires_at"]) <= time.time()
+            waited += worker.inline_refreshes > inline_before
+            call += 1
+            await asyncio.sleep(random.uniform(0.5, 1.5) * args.interval_ms / 1000)
+
+    await asyncio.gather(*(session_calls(index) for index in range(args.sessions)))
+    stats = {key: sum(worker.stats()[key] for worker in workers) for key in workers[0].stats()}
+    for worker in workers:
+        await worker.aclose()
+    return {
+        "calls": len(latencies),
+        "latency": summarise_latencies(latencies),
+        "calls_with_expired_token": expired,
+        "calls_waiting_on_refresh": waited,
+        "token_endpoint_requests": token_server.requests - requests_before,
+        "token_manager": stats,
+    }
+
+
+async def run(args) -> dict:
+    token_server = FakeTokenServer(args.token_lifetime, args.token_latency_ms)
+    token_url = token_server.start()
+    configure_offline_environment(LOG_LEVEL="ERROR")
+    report = {"config": vars(args)}
+    try:
+        for mode in ("off", "on_expiry", "ahead"):
+            report[mode] = await run_mode(args, token_server, token_url, mode)
+    finally:
+        token_server.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=12)
+    parser.add_argument("--interval-ms", type=float, default=200)
+    parser.add_argument("--token-lifetime", type=float, default=4, help="Seconds an access token is valid.")
+    parser.add_argument("--token-latency-ms", type=float, default=150)
+    parser.add_argument("--refresh-ahead", type=float, default=1.5)
+    parser.add_argument("--expiry-margin", type=float, default=0.2)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
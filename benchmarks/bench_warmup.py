@@ -0,0 +1,141 @@
+"""
+Latency of the first query after login, with and without the background session warm-up.
+
+    python -m benchmarks.bench_warmup --messages 2000 --top-n 20 --iterations 3
+
+The first query is "summarise my inbox": `get_top_mails_for_query("in:inbox")` followed by a
+map-reduce summary (`benchmarks.simulated_model`, scaled by `--time-scale`), against a local Gmail
+stub and fakeredis. Every iteration starts from a new user: empty Redis, a new mailbox index
+directory and no pooled Gmail client.
+
+* `cold`: the query runs straight after login, so it builds the Gmail client, searches Gmail (the
+  index is still empty) and maps every email through the model.
+* `warm`: `warm_up_session` runs at login and its emails are pre-summarised, as `agent.warm_up_session`
+  does; the query runs once the warm-up is done (the user is still typing), so it reads the local
+  index and finds every per-message summary cached.
+
+Reports the first query's latency, model calls and Gmail HTTP requests per mode, and the time
+and Gmail requests the warm-up itself spent in the background.
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from benchmarks.environment import configure_offline_environment, summarise_latencies
+from benchmarks.fake_gmail import FakeGmailServer
+from benchmarks.simulated_model import SimulatedChatCompletionClient
+from benchmarks.synthetic_mailbox import generate_mailbox
+
+REQUEST = "Summarise my inbox"
+
+
+async def new_user(session_id: str):
+    import fakeredis
+
+    import cache
+    import mailbox_index
+    from gmail_client import gmail_client_pool
+    from settings import settings
+
+    cache.async_redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    cache.redis_client = fakeredis.FakeRedis(decode_responses=True)
+    settings.MAILBOX_INDEX_DIR = tempfile.mkdtemp(prefix="warmup-index-")
+    mailbox_index._indexes.clear()
+    gmail_client_pool.invalidate(session_id)
+    await cache.asave_sessions({session_id: {"access_token": "offline-token", "scope": []}}, 3600)
+
+
+async def background_work():
+    """Waits for the index build and embedding the warm-up left running."""
+    import semantic_search
+    import warmup
+
+    while pending := [task for task in (*warmup._background_tasks, *semantic_search._background_embeddings.values())
+                      if not task.done()]:
+        await asyncio.gather(*pending)
+
+
+async def first_query(args, session_id: str, model: SimulatedChatCompletionClient) -> None:
+    from mcp_server import _get_top_mails_for_query
+    from summariser import MapReduceSummariser
+
+    response = await _get_top_mails_for_query(session_id, "in:inbox", args.top_n, "full", None)
+    assert response["success"] and response["count"], response
+    await MapReduceSummariser(model).summarise(REQUEST, response["emails"])
+
+
+async def run_mode(args, server: FakeGmailServer, mode: str) -> dict:
+    from mcp_server import _warm_up_session
+    from summariser import MapReduceSummariser
+
+    latencies, warm_up_seconds = [], []
+    model_calls = query_requests = warm_up_requests = 0
+    for iteration in range(args.iterations):
+        session_id = f"bench-{mode}-{iteration}"
+        await new_user(session_id)
+        if mode == "warm":
+            started = time.perf_counter()
+            requests_before = server.http_requests
+            warm_up_model = SimulatedChatCompletionClient(time_scale=args.time_scale)
+            response = await _warm_up_session(session_id, args.top_n, None)
+            assert response["success"] and not response.get("skipped"), response
+            await MapReduceSummariser(warm_up_model).summarise_messages(response["emails"])
+            await background_work()
+            warm_up_seconds.append(time.perf_counter() - started)
+            warm_up_requests += server.http_requests - requests_before
+
+        model = SimulatedChatCompletionClient(time_scale=args.time_scale)
+        requests_before = server.http_requests
+        started = time.perf_counter()
+        await first_query(args, session_id, model)
+        latencies.append((time.perf_counter() - started) * 1000)
+        model_calls += model.calls
+        query_requests += server.http_requests - requests_before
+        await background_work()  # the cold path's own index build, before the next user
+
+    report = {
+        "first_query_latency": summarise_latencies(latencies),
+        "first_query_model_calls": round(model_calls / args.iterations, 1),
+        "first_query_gmail_http_requests": round(query_requests / args.iterations, 1),
+    }
+    if warm_up_seconds:
+        report["warm_up_seconds"] = round(sum(warm_up_seconds) / len(warm_up_seconds), 3)
+        report["warm_up_gmail_http_requests"] = round(warm_up_requests / args.iterations, 1)
+    return report
+
+
+async def run(args) -> dict:
+    server = FakeGmailServer(generate_mailbox(args.messages), args.latency_ms)
+    configure_offline_environment(
+        GMAIL_API_ENDPOINT=server.start(),
+        EMBEDDING_PROVIDER="hashing",
+        MAILBOX_INDEX_MAX_MESSAGES=str(args.messages),
+        LOG_LEVEL="ERROR",
+    )
+    report = {"config": vars(args)}
+    try:
+        for mode in ("cold", "warm"):
+            report[mode] = await run_mode(args, server, mode)
+    finally:
+        server.stop()
+    report["first_query_speedup"] = round(
+        report["cold"]["first_query_latency"]["mean_ms"] / max(0.001, report["warm"]["first_query_latency"]["mean_ms"]), 1
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--top-n", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--time-scale", type=float, default=0.1, help="Scales the simulated model latency.")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
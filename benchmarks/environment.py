@@ -0,0 +1,55 @@
+"""
+Offline environment for the benchmark scripts.
+
+`settings.py` requires the OAuth / OpenAI / Fernet values to be present at import time, so every
+benchmark calls `configure_offline_environment` before importing any application module.
+"""
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure_offline_environment(**overrides: str):
+    from cryptography.fernet import Fernet
+
+    defaults = {
+        # The logger writes to a file named after the app, keep it out of the working tree.
+        "APP_NAME": os.path.join(tempfile.gettempdir(), "gmail-insighter-benchmark.log"),
+        "COOKIE_NAME": "benchmark",
+        "COOKIE_SECRET": "benchmark",
+        "OPENAI_API_KEY": "sk-offline",
+        "GOOGLE_CLIENT_ID": "offline-client-id",
+        "GOOGLE_CLIENT_SECRET": "offline-client-secret",
+        "MCP_SERVER_URL": "http://127.0.0.1:8000/sse",
+        "FERNET_KEY": Fernet.generate_key().decode(),
+        # The Gmail stub has no quota unless asked to; bench_gmail_quota turns the limiter on.
+        "GMAIL_QUOTA_ENABLED": "false",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    for key, value in overrides.items():
+        os.environ[key] = value
+
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarise_latencies(samples_ms: list[float]) -> dict:
+    return {
+        "count": len(samples_ms),
+        "mean_ms": round(sum(samples_ms) / len(samples_ms), 3) if samples_ms else 0.0,
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+        "max_ms": round(max(samples_ms), 3) if samples_ms else 0.0,
+    }
@@ -0,0 +1,367 @@
+"""
+A local stand-in for the Gmail REST API, good enough to drive googleapiclient in benchmarks.
+
+It serves the subset of `gmail/v1/users/me/...` that the application uses, keeps HTTP/1.1
+connections alive, and can simulate per-request and per-connection latency so that connection
+reuse and request counts show up in the measurements. With `quota_units_per_second` it enforces a
+per-user (per access token) quota like Gmail's, answering 429 rateLimitExceeded with Retry-After.
+"""
+import json
+import re
+import shlex
+import uuid
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from email.parser import Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic_mailbox import SyntheticMessage
+
+USER_PREFIX = "/gmail/v1/users/me"
+RETRY_AFTER_SECONDS = 1
+RATE_LIMITED = {"error": {"code": 429, "message": "User-rate limit exceeded.",
+                          "errors": [{"reason": "rateLimitExceeded", "domain": "usageLimits"}]}}
+# Gmail quota units of the endpoints served, by (method, path with ids replaced).
+QUOTA_UNITS = {
+    ("GET", f"{USER_PREFIX}/profile"): 1,
+    ("GET", f"{USER_PREFIX}/labels"): 1,
+    ("GET", f"{USER_PREFIX}/history"): 2,
+    ("GET", f"{USER_PREFIX}/messages"): 5,
+    ("GET", f"{USER_PREFIX}/messages/{{id}}"): 5,
+    ("GET", f"{USER_PREFIX}/threads"): 10,
+    ("GET", f"{USER_PREFIX}/threads/{{id}}"): 10,
+    ("POST", "/batch"): 0,
+}
+
+
+def _parse_date(value: str) -> float:
+    return datetime.strptime(value.replace("-", "/"), "%Y/%m/%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def _parse_relative(value: str) -> float:
+    amount, unit = int(value[:-1]), value[-1]
+    seconds = {"d": 86400, "m": 30 * 86400, "y": 365 * 86400}[unit]
+    return amount * seconds
+
+
+def message_matches(message: SyntheticMessage, query: str, now: float) -> bool:
+    """
+    Evaluates a (simplified) Gmail search query against a synthetic message.
+    """
+    try:
+        terms = shlex.split(query or "")
+    except ValueError:
+        terms = (query or "").split()
+
+    # `{a b}` matches either term.
+    groups, group = [], None
+    for term in terms:
+        if group is None and term.startswith("{"):
+            group, term = [], term[1:]
+        if group is not None:
+            closed = term.endswith("}")
+            group.append(term.rstrip("}"))
+            if closed:
+                groups.append(group)
+                group = None
+        else:
+            groups.append([term])
+    if group:
+        groups.append(group)
+    return all(any(_term_matches(message, term, now) for term in group if term) for group in groups)
+
+
+def _term_matches(message: SyntheticMessage, term: str, now: float) -> bool:
+    timestamp = message.internal_date / 1000
+    key, separator, value = term.partition(":")
+    value = value.lower()
+    if not separator and term.upper() == "OR":
+        return True
+    if separator and key == "from":
+        return value in message.sender.lower()
+    if separator and key == "to":
+        return value in message.to.lower() or value in message.cc.lower()
+    if separator and key == "subject":
+        return value in message.subject.lower()
+    if separator and key in ("label", "in", "is"):
+        wanted = {"unread": "UNREAD", "inbox": "INBOX", "important": "IMPORTANT"}.get(value, value)
+        return any(label.lower() in (wanted.lower(), f"label_{wanted.lower()}") for label in message.label_ids)
+    if separator and key == "after":
+        return timestamp >= _parse_date(value)
+    if separator and key == "before":
+        return timestamp < _parse_date(value)
+    if separator and key == "newer_than":
+        return timestamp >= now - _parse_relative(value)
+    if separator and key == "older_than":
+        return timestamp < now - _parse_relative(value)
+    text = f"{message.subject}\n{message.body_text}\n{message.sender}\n{message.to}".lower()
+    return term.lower() in text
+
+
+class FakeGmailServer:
+    def __init__(
+        self,
+        messages: list[SyntheticMessage],
+        latency_ms: float = 0.0,
+        connect_latency_ms: float = 0.0,
+        batch_item_latency_ms: float = 0.2,
+        quota_units_per_second: float | None = None,
+        now: float | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.messages = list(messages)
+        self.by_id = {message.id: message for message in self.messages}
+        self.latency = latency_ms / 1000
+        self.connect_latency = connect_latency_ms / 1000
+        self.batch_item_latency = batch_item_latency_ms / 1000
+        self.now = now if now is not None else max((m.internal_date for m in self.messages), default=0) / 1000
+        self.history_id = max((message.history_id for message in self.messages), default=1)
+        self.history: list[dict] = []
+        self.request_counts: Counter = Counter()
+        self.connections = 0
+        self.http_requests = 0
+        self.quota_units_per_second = quota_units_per_second
+        self.quota_buckets: dict[str, tuple[float, float]] = {}
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, name: str):
+        with self._lock:
+            self.request_counts[name] += 1
+
+    # ──────── Mailbox changes ────────────────────────────────────────────────────
+    def add_message(self, message: SyntheticMessage):
+        """Delivers a new message and records it in the history feed."""
+        with self._lock:
+            self.history_id += 1
+            message.history_id = self.history_id
+            self.messages.insert(0, message)
+            self.by_id[message.id] = message
+            self.history.append({
+                "id": str(self.history_id),
+                "messagesAdded": [{"message": {"id": message.id, "threadId": message.thread_id, "labelIds": message.label_ids}}],
+            })
+
+    def delete_message(self, message_id: str):
+        with self._lock:
+            message = self.by_id.pop(message_id)
+            self.messages.remove(message)
+            self.history_id += 1
+            self.history.append({
+                "id": str(self.history_id),
+                "messagesDeleted": [{"message": {"id": message.id, "threadId": message.thread_id}}],
+            })
+
+    # ──────── Per-user quota ─────────────────────────────────────────────────────
+    def charge(self, user: str, method: str, path: str) -> bool:
+        """
+        Spends the request's quota units from the user's one-second bucket (when a quota is set);
+        False means Gmail would answer 429 rateLimitExceeded.
+        """
+        if not self.quota_units_per_second:
+            return True
+        units = QUOTA_UNITS.get((method, re.sub(r"/(messages|threads)/[^/]+$", r"/\1/{id}", path)), 5)
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self.quota_buckets.get(user, (self.quota_units_per_second, now))
+            tokens = min(self.quota_units_per_second, tokens + (now - last) * self.quota_units_per_second)
+            allowed = tokens >= units
+            self.quota_buckets[user] = (tokens - units if allowed else tokens, now)
+            if not allowed:
+                self.rate_limited += 1
+            return allowed
+
+    # ──────── API handlers ───────────────────────────────────────────────────────
+    def search(self, query: str) -> list[SyntheticMessage]:
+        return [message for message in self.messages if message_matches(message, query, self.now)]
+
+    def list_messages(self, params: dict) -> dict:
+        self.count("messages.list")
+        matches = self.search(params.get("q", ""))
+        return self._page([{"id": m.id, "threadId": m.thread_id} for m in matches], params, "messages")
+
+    def get_message(self, message_id: str, params: dict) -> tuple[int, dict]:
+        self.count("messages.get")
+        message = self.by_id.get(message_id)
+        if message is None:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        return 200, message.to_resource(params.get("format", "full"), params.get("metadataHeaders"))
+
+    def list_threads(self, params: dict) -> dict:
+        self.count("threads.list")
+        seen, threads = set(), []
+        for message in self.search(params.get("q", "")):
+            if message.thread_id not in seen:
+                seen.add(message.thread_id)
+                threads.append({"id": message.thread_id, "snippet": message.snippet})
+        return self._page(threads, params, "threads")
+
+    def get_thread(self, thread_id: str, params: dict) -> tuple[int, dict]:
+        self.count("threads.get")
+        members = sorted(
+            (message for message in self.messages if message.thread_id == thread_id),
+            key=lambda message: message.internal_date,
+        )
+        if not members:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        return 200, {
+            "id": thread_id,
+            "historyId": str(max(message.history_id for message in members)),
+            "messages": [m.to_resource(params.get("format", "full"), params.get("metadataHeaders")) for m in members],
+        }
+
+    def profile(self) -> dict:
+        self.count("profile")
+        return {
+            "emailAddress": "me@example.com",
+            "messagesTotal": len(self.messages),
+            "threadsTotal": len({message.thread_id for message in self.messages}),
+            "historyId": str(self.history_id),
+        }
+
+    def list_history(self, params: dict) -> tuple[int, dict]:
+        self.count("history.list")
+        start = int(params.get("startHistoryId", 0))
+        records = [record for record in self.history if int(record["id"]) > start]
+        return 200, {"history": records, "historyId": str(self.history_id)}
+
+    def labels(self) -> dict:
+        self.count("labels.list")
+        names = sorted({label for message in self.messages for label in message.label_ids})
+        return {"labels": [{"id": name, "name": name.removeprefix("Label_"), "type": "user" if name.startswith("Label_") else "system"} for name in names]}
+
+    @staticmethod
+    def _page(items: list[dict], params: dict, key: str) -> dict:
+        max_results = int(params.get("maxResults", 100))
+        offset = int(params.get("pageToken", 0) or 0)
+        page = items[offset:offset + max_results]
+        response = {key: page, "resultSizeEstimate": len(items)}
+        if offset + max_results < len(items):
+            response["nextPageToken"] = str(offset + max_results)
+        return response
+
+    def batch(self, body: bytes, content_type: str, user: str = "") -> tuple[int, bytes, str]:
+        """
+        Serves a multipart/mixed batch: every part is an application/http request routed like a
+        standalone call (and charged to the caller's quota), answered in one multipart/mixed response.
+        """
+        self.count("batch")
+        envelope = Parser().parsestr(f"Content-Type: {content_type}\r\n\r\n{body.decode()}")
+        boundary = f"batch_{uuid.uuid4().hex}"
+        chunks = []
+        for part in envelope.get_payload():
+            request_line, _, rest = part.get_payload().partition("\n")
+            method, target, _ = request_line.strip().split(" ", 2)
+            parsed = urlparse(target)
+            params = {key: values if key == "metadataHeaders" else values[-1]
+                      for key, values in parse_qs(parsed.query).items()}
+            if self.batch_item_latency:
+                time.sleep(self.batch_item_latency)
+            status, payload, _ = self.route(method, parsed.path, params, b"", {"Authorization": user})
+            content_id = part["Content-ID"].strip("<>")
+            retry_after = f"Retry-After: {RETRY_AFTER_SECONDS}\r\n" if status == 429 else ""
+            chunks.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                f"{retry_after}\r\n{json.dumps(payload)}\r\n"
+            )
+        chunks.append(f"--{boundary}--\r\n")
+        return 200, "".join(chunks).encode(), f"multipart/mixed; boundary={boundary}"
+
+    def route(self, method: str, path: str, params: dict, body: bytes, headers) -> tuple[int, dict | bytes, str]:
+        if method == "POST" and path == "/batch":
+            return self.batch(body, headers.get("Content-Type", ""), headers.get("Authorization", ""))
+        if not self.charge(headers.get("Authorization", ""), method, path):
+            return 429, RATE_LIMITED, "application/json"
+        if method == "GET" and path == f"{USER_PREFIX}/profile":
+            return 200, self.profile(), "application/json"
+        if method == "GET" and path == f"{USER_PREFIX}/history":
+            status, payload = self.list_history(params)
+            return status, payload, "application/json"
+        if method == "GET" and path == f"{USER_PREFIX}/labels":
+            return 200, self.labels(), "application/json"
+        if method == "GET" and path == f"{USER_PREFIX}/messages":
+            return 200, self.list_messages(params), "application/json"
+        if method == "GET" and path == f"{USER_PREFIX}/threads":
+            return 200, self.list_threads(params), "application/json"
+        if method == "GET" and (match := re.fullmatch(rf"{USER_PREFIX}/messages/([^/]+)", path)):
+            status, payload = self.get_message(match.group(1), params)
+            return status, payload, "application/json"
+        if method == "GET" and (match := re.fullmatch(rf"{USER_PREFIX}/threads/([^/]+)", path)):
+            status, payload = self.get_thread(match.group(1), params)
+            return status, payload, "application/json"
+        return 404, {"error": {"code": 404, "message": f"Unknown endpoint {method} {path}"}}, "application/json"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes, avoid Nagle + delayed ACK stalls.
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+                if server.connect_latency:
+                    # Stands in for DNS + TCP + TLS setup on a fresh connection.
+                    time.sleep(server.connect_latency)
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self, method: str):
+                parsed = urlparse(self.path)
+                params = {key: values if key == "metadataHeaders" else values[-1]
+                          for key, values in parse_qs(parsed.query).items()}
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with server._lock:
+                    server.http_requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                status, payload, content_type = server.route(method, parsed.path, params, body, self.headers)
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if status == 429:
+                    self.send_header("Retry-After", str(RETRY_AFTER_SECONDS))
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+        return Handler
@@ -0,0 +1,68 @@
+"""
+In-memory Redis (fakeredis) served over TCP from a child process, for benchmarks whose
+application processes must share one Redis.
+
+fakeredis' TCP server answers in RESP3 whatever the client speaks, so clients connect with
+`protocol=3` (in the URL `start()` returns). Its request handler polls the socket in a tight loop;
+the one here replaces only that loop, waiting on `select`, so idle connections cost no CPU.
+"""
+import multiprocessing
+import select
+import socket
+
+
+def _serve(port: int):
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer(("127.0.0.1", port))
+
+    class Handler(server.RequestHandlerClass):
+        def handle(self):
+            while not self.shutdown_request:
+                try:
+                    if self.current_client.can_read():
+                        self.writer.dump(self.current_client.read_response())
+                        continue
+                    data = self.rfile.readline()
+                    if data:
+                        self.current_client.get_socket().sendall(data)
+                        continue
+                    readable, _, _ = select.select([self.rfile], [], [], 0.01)
+                    if readable and not self.rfile.peek(1):
+                        break  # closed by the client
+                except Exception as e:
+                    self.writer.dump(e)
+                    break
+
+    server.RequestHandlerClass = Handler
+    server.serve_forever()
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class FakeRedisServer:
+    """`start()` returns a `redis://` URL; `stop()` kills the server process."""
+
+    def __init__(self, port: int | None = None):
+        self.port = port or free_port()
+        self._process: multiprocessing.Process | None = None
+
+    def start(self) -> str:
+        self._process = multiprocessing.get_context("spawn").Process(target=_serve, args=(self.port,), daemon=True)
+        self._process.start()
+        for _ in range(500):
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=0.1).close()
+                break
+            except OSError:
+                self._process.join(0.01)
+        return f"redis://127.0.0.1:{self.port}/0?protocol=3"
+
+    def stop(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join()
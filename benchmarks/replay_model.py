@@ -0,0 +1,152 @@
+"""
+Chat completion client that records a model's responses and replays them deterministically.
+
+Recording wraps any client (the simulated model offline, or `OpenAIChatCompletionClient` with a
+key) and stores every response with its latency, keyed by a sha256 of the request: the messages,
+tool schemas, tool choice and output mode, as `model_clients.CachedChatCompletionClient` keys
+its cache. Replaying answers each request from the recording after the recorded latency (times
+`time_scale`), so a benchmark sees the same turns, tokens and timings on every run without a
+network. A request that is not in the recording (a prompt, tool schema or tool result changed
+since it was made) raises `ReplayMissError`: re-record, and the new tokens show in the report.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, AsyncGenerator, Mapping, Optional, Sequence, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelFamily,
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool
+from pydantic import BaseModel
+
+RECORDING_VERSION = 1
+
+
+class ReplayMissError(KeyError):
+    """The request is not in the recording."""
+
+
+def request_key(messages: Sequence[LLMMessage], tools=(), tool_choice="auto", json_output=None) -> str:
+    if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+        json_output = json_output.model_json_schema()
+    payload = {
+        "messages": [message.model_dump(mode="json") for message in messages],
+        "tools": [tool.schema if isinstance(tool, Tool) else tool for tool in tools],
+        "tool_choice": tool_choice.name if isinstance(tool_choice, Tool) else tool_choice,
+        "json_output": json_output,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ReplayChatCompletionClient(ChatCompletionClient):
+    """
+    Replays `path`; with `record_from`, calls that client instead and records its responses
+    (`save()` writes them). Counts calls and token usage either way.
+    """
+
+    def __init__(self, path: str, record_from: ChatCompletionClient | None = None, time_scale: float = 1.0):
+        self.path = path
+        self.record_from = record_from
+        self.time_scale = time_scale
+        self.responses: dict[str, dict] = {}
+        if record_from is None:
+            with open(path) as file:
+                recording = json.load(file)
+            if recording.get("version") != RECORDING_VERSION:
+                raise ValueError(f"{path} is a version {recording.get('version')} recording, expected {RECORDING_VERSION}")
+            self.responses = recording["responses"]
+        self.calls = 0
+        self.misses = 0
+        self._usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    @property
+    def recording(self) -> bool:
+        return self.record_from is not None
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w") as file:
+            json.dump({"version": RECORDING_VERSION, "responses": self.responses}, file, indent=1, sort_keys=True)
+            file.write("\n")
+
+    def _count(self, result: CreateResult):
+        self.calls += 1
+        self._usage = RequestUsage(
+            prompt_tokens=self._usage.prompt_tokens + result.usage.prompt_tokens,
+            completion_tokens=self._usage.completion_tokens + result.usage.completion_tokens,
+        )
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools=[],
+        tool_choice="auto",
+        json_output: Optional[Any] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        key = request_key(messages, tools, tool_choice, json_output)
+        if self.recording:
+            started = time.perf_counter()
+            result = await self.record_from.create(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token,
+            )
+            self.responses[key] = {
+                "result": result.model_dump(mode="json"),
+                "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+        else:
+            recorded = self.responses.get(key)
+            if recorded is None:
+                self.misses += 1
+                raise ReplayMissError(f"request {key[:12]} is not in {self.path}")
+            await asyncio.sleep(recorded["latency_ms"] / 1000 * self.time_scale)
+            result = CreateResult.model_validate(recorded["result"])
+        self._count(result)
+        return result
+
+    async def create_stream(self, messages: Sequence[LLMMessage], **kwargs) -> AsyncGenerator[Union[str, CreateResult], None]:
+        # Replayed in one chunk: time to first token is the whole call.
+        result = await self.create(messages, **kwargs)
+        if isinstance(result.content, str):
+            yield result.content
+        yield result
+
+    async def close(self) -> None:
+        if self.record_from is not None:
+            await self.record_from.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._usage
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools=[]) -> int:
+        if self.record_from is not None:
+            return self.record_from.count_tokens(messages, tools=tools)
+        return sum(len(str(message.content)) for message in messages) // 4
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools=[]) -> int:
+        return 128000 - self.count_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self):  # type: ignore[override]
+        return self.model_info
+
+    @property
+    def model_info(self) -> ModelInfo:
+        if self.record_from is not None:
+            return self.record_from.model_info
+        return ModelInfo(vision=False, function_calling=True, json_output=True, family=ModelFamily.GPT_4O, structured_output=True)
@@ -0,0 +1,189 @@
+"""
+Chat completion client that answers offline with a latency model of a hosted LLM.
+
+Latency per call = first-token latency + input tokens / prefill rate + output tokens / decode rate,
+scaled by `time_scale` so benchmarks finish quickly while keeping the ratios between strategies.
+Responses are shaped for the prompts in `config.py`: JSON `{"summaries": [...]}` for map calls
+(one entry per email id in the request). A text answer written straight from emails covers every
+email, so its length grows with them; digests of notes (reduce calls) are at most `digest_tokens`.
+
+Offered the agent team's tools, it plays the team: the email retriever searches Gmail for the last
+word of the request (`get_top_mails_for_query`, `search_results` emails), and the critic hands a
+summary of the emails it was shown to `response_dispatcher`. Tool call ids are derived from the
+conversation, so the same conversation always gets the same response.
+
+To stand in for a smaller model, `reliable_prompt_tokens` caps the prompt it handles well: beyond
+it, summaries and answers only cover the emails in that share of the prompt. `failure_rate` makes
+that share of calls raise (seeded by `seed`, so runs repeat).
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+from typing import Any, AsyncGenerator, Mapping, Optional, Sequence, Union
+
+from autogen_core import CancellationToken, FunctionCall
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    FunctionExecutionResultMessage,
+    LLMMessage,
+    ModelFamily,
+    ModelInfo,
+    RequestUsage,
+)
+
+# Also matches ids in tool results, where the emails are JSON inside a JSON string.
+ID_PATTERN = re.compile(r'\\?"id\\?": \\?"([^"\\]+)')
+SESSION_PATTERN = re.compile(r"session_id : (\S+)")
+CHARS_PER_TOKEN = 4
+SEARCH_TOOL = "get_top_mails_for_query"
+DISPATCH_TOOL = "response_dispatcher"
+
+
+class SimulatedChatCompletionClient(ChatCompletionClient):
+    def __init__(
+        self,
+        first_token_seconds: float = 0.5,
+        prefill_tokens_per_second: float = 20000,
+        decode_tokens_per_second: float = 80,
+        summary_tokens_per_email: int = 40,
+        digest_tokens: int = 800,
+        max_output_tokens: int = 16384,
+        search_results: int = 10,
+        reliable_prompt_tokens: int | None = None,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+        time_scale: float = 1.0,
+    ):
+        self.first_token_seconds = first_token_seconds
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.decode_tokens_per_second = decode_tokens_per_second
+        self.summary_tokens_per_email = summary_tokens_per_email
+        self.digest_tokens = digest_tokens
+        self.max_output_tokens = max_output_tokens
+        self.search_results = search_results
+        self.reliable_prompt_tokens = reliable_prompt_tokens
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.time_scale = time_scale
+        self.calls = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    def _respond(self, messages: Sequence[LLMMessage], json_output, tools=()) -> tuple[str | list[FunctionCall], int, int]:
+        text = "\n".join(str(message.content) for message in messages)
+        prompt_tokens = len(text) // CHARS_PER_TOKEN
+        if calls := self._tool_calls(messages, text, tools, prompt_tokens):
+            return calls, prompt_tokens, sum(len(call.arguments) for call in calls) // CHARS_PER_TOKEN
+        coverage = self.coverage(prompt_tokens)
+        if json_output:
+            ids = ID_PATTERN.findall(text)
+            ids = ids[:max(1, int(len(ids) * coverage))]
+            summaries = [{"id": message_id, "summary": f"Summary of {message_id}."} for message_id in ids]
+            completion_tokens = self.summary_tokens_per_email * len(ids)
+            return json.dumps({"summaries": summaries}), prompt_tokens, min(completion_tokens, self.max_output_tokens)
+        if "Notes:" in text:
+            items = max(1, int((text.count("\n- ") + 1) * coverage))
+            return f"- Digest of {items} notes.", prompt_tokens, min(self.summary_tokens_per_email * items, self.digest_tokens)
+        items = max(1, int(len(set(ID_PATTERN.findall(text))) * coverage))
+        completion_tokens = min(self.summary_tokens_per_email * items, self.max_output_tokens)
+        return f"- Summary of {items} emails.", prompt_tokens, completion_tokens
+
+    def coverage(self, prompt_tokens: int) -> float:
+        """Share of the prompt's emails a response covers."""
+        if self.reliable_prompt_tokens and prompt_tokens > self.reliable_prompt_tokens:
+            return self.reliable_prompt_tokens / prompt_tokens
+        return 1.0
+
+    def _tool_calls(self, messages: Sequence[LLMMessage], text: str, tools, prompt_tokens: int) -> list[FunctionCall] | None:
+        names = {tool["name"] if isinstance(tool, dict) else tool.name for tool in tools}
+        if not names or isinstance(messages[-1], FunctionExecutionResultMessage):
+            return None  # answers in text once its tool call has run
+        call_id = "call_" + hashlib.sha256(text.encode()).hexdigest()[:16]
+        if DISPATCH_TOOL in names:
+            items = max(1, int(len(set(ID_PATTERN.findall(text))) * self.coverage(prompt_tokens)))
+            arguments = {"response": f"- Summary of {items} emails.", "is_final": True}
+            return [FunctionCall(id=call_id, name=DISPATCH_TOOL, arguments=json.dumps(arguments))]
+        if SEARCH_TOOL in names:
+            session = SESSION_PATTERN.search(text)
+            request = next((str(message.content) for message in reversed(messages)
+                            if getattr(message, "source", None) == "user"), "")
+            words = re.findall(r"[\w@.:-]+", request)
+            arguments = {
+                "session_id": session.group(1) if session else "",
+                "query": words[-1].strip(".") if words else "",
+                "top_n_mails": self.search_results,
+            }
+            return [FunctionCall(id=call_id, name=SEARCH_TOOL, arguments=json.dumps(arguments))]
+        return None
+
+    def latency(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return self.time_scale * (
+            self.first_token_seconds
+            + prompt_tokens / self.prefill_tokens_per_second
+            + completion_tokens / self.decode_tokens_per_second
+        )
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools=[],
+        tool_choice="auto",
+        json_output: Optional[Any] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        content, prompt_tokens, completion_tokens = self._respond(messages, json_output, tools)
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        failed = self._random.random() < self.failure_rate
+        try:
+            # A failed call costs its time to first token.
+            await asyncio.sleep(self.time_scale * self.first_token_seconds if failed else self.latency(prompt_tokens, completion_tokens))
+        finally:
+            self.in_flight -= 1
+        if failed:
+            self.failures += 1
+            raise RuntimeError("Simulated model error")
+        usage = RequestUsage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        self._usage = RequestUsage(
+            prompt_tokens=self._usage.prompt_tokens + prompt_tokens,
+            completion_tokens=self._usage.completion_tokens + completion_tokens,
+        )
+        finish_reason = "stop" if isinstance(content, str) else "function_calls"
+        return CreateResult(finish_reason=finish_reason, content=content, usage=usage, cached=False)
+
+    async def create_stream(self, messages: Sequence[LLMMessage], **kwargs) -> AsyncGenerator[Union[str, CreateResult], None]:
+        result = await self.create(messages, **kwargs)
+        if isinstance(result.content, str):
+            yield result.content
+        yield result
+
+    async def close(self) -> None:
+        pass
+
+    def actual_usage(self) -> RequestUsage:
+        return self._usage
+
+    def total_usage(self) -> RequestUsage:
+        return self._usage
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools=[]) -> int:
+        return sum(len(str(message.content)) for message in messages) // CHARS_PER_TOKEN
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools=[]) -> int:
+        return 128000 - self.count_tokens(messages)
+
+    @property
+    def capabilities(self):  # type: ignore[override]
+        return self.model_info
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return ModelInfo(vision=False, function_calling=True, json_output=True, family=ModelFamily.GPT_4O, structured_output=True)
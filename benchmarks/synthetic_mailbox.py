@@ -0,0 +1,224 @@
+"""
+Deterministic synthetic mailbox used by the offline benchmarks and the fake Gmail server.
+"""
+import base64
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+PEOPLE = [
+    ("Amit Sharma", "amit@example.com"),
+    ("Alice Johnson", "alice@example.com"),
+    ("Bob Lee", "bob@example.com"),
+    ("Carol Diaz", "carol@example.org"),
+    ("Deepa Rao", "deepa@example.in"),
+    ("Eve Martin", "eve@example.net"),
+    ("Frank Ito", "frank@example.co.jp"),
+    ("Grace Kim", "grace@example.com"),
+]
+NEWSLETTERS = [
+    ("Product Weekly", "news@productweekly.example"),
+    ("Cloud Billing", "billing@cloud.example"),
+]
+OWNER = ("Mailbox Owner", "me@example.com")
+
+TOPICS = [
+    ("Project Phoenix status", "the Phoenix migration is on track, the database cutover moves to Thursday"),
+    ("Quarterly budget review", "finance needs the revised budget numbers before the board meeting"),
+    ("Offsite planning", "we booked the venue for the team offsite, please confirm dietary needs"),
+    ("Invoice overdue", "invoice 4471 is now 30 days overdue, please arrange the payment"),
+    ("Hiring loop feedback", "the candidate did well in the system design round, mixed signals on coding"),
+    ("Release 2.4 blockers", "two blockers remain for the 2.4 release, the login crash and the sync timeout"),
+    ("Security incident follow-up", "the leaked API key was rotated and the audit log shows no misuse"),
+    ("Customer escalation", "the customer reports repeated timeouts when exporting large reports"),
+]
+LABELS = ["INBOX", "UNREAD", "IMPORTANT", "CATEGORY_UPDATES", "Label_work", "Label_finance"]
+SIGNATURE = "\n\n--\n{name}\nSent from my phone"
+
+
+@dataclass
+class SyntheticMessage:
+    id: str
+    thread_id: str
+    history_id: int
+    internal_date: int  # epoch milliseconds, as returned by Gmail
+    sender: str
+    to: str
+    cc: str
+    subject: str
+    body_text: str
+    body_html: str | None
+    label_ids: list[str] = field(default_factory=list)
+
+    @property
+    def snippet(self) -> str:
+        return " ".join(self.body_text.split())[:120]
+
+    @property
+    def date_header(self) -> str:
+        return format_datetime(datetime.fromtimestamp(self.internal_date / 1000, tz=timezone.utc))
+
+    def headers(self) -> list[dict]:
+        headers = [
+            {"name": "From", "value": self.sender},
+            {"name": "To", "value": self.to},
+            {"name": "Subject", "value": self.subject},
+            {"name": "Date", "value": self.date_header},
+            {"name": "Message-ID", "value": f"<{self.id}@synthetic.example>"},
+        ]
+        if self.cc:
+            headers.append({"name": "Cc", "value": self.cc})
+        return headers
+
+    def to_rfc822(self) -> bytes:
+        message = EmailMessage()
+        for header in self.headers():
+            message[header["name"]] = header["value"]
+        message.set_content(self.body_text)
+        if self.body_html:
+            message.add_alternative(self.body_html, subtype="html")
+        return message.as_bytes()
+
+    def to_resource(self, format: str = "full", metadata_headers: list[str] | None = None) -> dict:
+        resource = {
+            "id": self.id,
+            "threadId": self.thread_id,
+            "labelIds": list(self.label_ids),
+            "snippet": self.snippet,
+            "historyId": str(self.history_id),
+            "internalDate": str(self.internal_date),
+            "sizeEstimate": len(self.body_text) + len(self.body_html or ""),
+        }
+        if format == "minimal":
+            return resource
+        if format == "raw":
+            resource["raw"] = base64.urlsafe_b64encode(self.to_rfc822()).decode()
+            return resource
+
+        headers = self.headers()
+        if format == "metadata":
+            if metadata_headers:
+                wanted = {name.lower() for name in metadata_headers}
+                headers = [header for header in headers if header["name"].lower() in wanted]
+            resource["payload"] = {"mimeType": "multipart/alternative", "headers": headers}
+            return resource
+
+        parts = [_body_part("text/plain", self.body_text)]
+        if self.body_html:
+            parts.append(_body_part("text/html", self.body_html))
+        resource["payload"] = {
+            "partId": "",
+            "mimeType": "multipart/alternative",
+            "headers": headers,
+            "body": {"size": 0},
+            "parts": parts,
+        }
+        return resource
+
+
+def _body_part(mime_type: str, content: str) -> dict:
+    data = base64.urlsafe_b64encode(content.encode()).decode()
+    return {
+        "mimeType": mime_type,
+        "headers": [{"name": "Content-Type", "value": f"{mime_type}; charset=utf-8"}],
+        "body": {"size": len(content), "data": data},
+    }
+
+
+def _format_address(person: tuple[str, str]) -> str:
+    return f"{person[0]} <{person[1]}>"
+
+
+def generate_mailbox(
+    n_messages: int = 500,
+    seed: int = 7,
+    now: datetime | None = None,
+    reply_rate: float = 0.35,
+    active_threads: int | None = None,
+) -> list[SyntheticMessage]:
+    """
+    Generates `n_messages` messages spread over the last 90 days, newest first.
+
+    Roughly a third (`reply_rate`) of the messages are replies inside an existing thread (one of
+    the `active_threads` most recently started, when set, for longer conversations) and quote the
+    previous message, and newsletters carry an HTML alternative, so compaction and thread grouping
+    have realistic input.
+    """
+    rng = random.Random(seed)
+    now = now or datetime(2026, 1, 15, 12, 0, tzinfo=timezone.utc)
+    start = now - timedelta(days=90)
+
+    messages: list[SyntheticMessage] = []
+    threads: list[SyntheticMessage] = []
+    timestamps = sorted(rng.uniform(start.timestamp(), now.timestamp()) for _ in range(n_messages))
+
+    for index, timestamp in enumerate(timestamps):
+        message_id = f"{index + 1:016x}"
+        candidates = threads[-active_threads:] if active_threads else threads
+        parent = rng.choice(candidates) if threads and rng.random() < reply_rate else None
+
+        if parent is not None:
+            sender = rng.choice(PEOPLE + [OWNER])
+            subject = parent.subject if parent.subject.startswith("Re: ") else f"Re: {parent.subject}"
+            quoted = "\n".join(f"> {line}" for line in parent.body_text.splitlines())
+            reply = rng.choice(
+                ["Thanks, that works for me.", "Can we discuss this tomorrow?", "Adding the team for visibility.",
+                 "I have a few concerns, details below.", "Looks good, approved."]
+            )
+            body_text = f"{reply}{SIGNATURE.format(name=sender[0])}\n\nOn {parent.date_header}, {parent.sender} wrote:\n{quoted}"
+            body_html = None
+            thread_id = parent.thread_id
+            labels = ["INBOX"]
+        elif rng.random() < 0.15:
+            sender = rng.choice(NEWSLETTERS)
+            topic, detail = rng.choice(TOPICS)
+            subject = f"{sender[0]}: {topic}"
+            body_text = f"{detail}.\n\nRead more on our website.\nUnsubscribe at any time."
+            body_html = (
+                f"<html><body><h1>{topic}</h1><p>{detail}.</p>"
+                f"<p><a href='https://example.com'>Read more</a></p>"
+                f"<div style='font-size:10px'>Unsubscribe at any time.</div></body></html>"
+            )
+            thread_id = message_id
+            labels = ["INBOX", "CATEGORY_UPDATES"]
+        else:
+            sender = rng.choice(PEOPLE)
+            topic, detail = rng.choice(TOPICS)
+            subject = topic
+            body_text = f"Hi,\n\n{detail}. Let me know if you have questions.{SIGNATURE.format(name=sender[0])}"
+            body_html = None
+            thread_id = message_id
+            labels = ["INBOX"]
+
+        if rng.random() < 0.3:
+            labels.append("UNREAD")
+        if "budget" in subject.lower() or "invoice" in subject.lower():
+            labels.append("Label_finance")
+        elif parent is None and sender in PEOPLE:
+            labels.append("Label_work")
+
+        recipients = rng.sample([person for person in PEOPLE if person != sender], k=2)
+        message = SyntheticMessage(
+            id=message_id,
+            thread_id=thread_id,
+            history_id=1000 + index,
+            internal_date=int(timestamp * 1000),
+            sender=_format_address(sender),
+            to=_format_address(OWNER if sender != OWNER else recipients[0]),
+            cc=_format_address(recipients[1]) if rng.random() < 0.4 else "",
+            subject=subject,
+            body_text=body_text,
+            body_html=body_html,
+            label_ids=labels,
+        )
+        messages.append(message)
+        if parent is None:
+            threads.append(message)
+        else:
+            # Later replies quote the latest message of the thread.
+            threads[threads.index(parent)] = message
+
+    messages.reverse()
+    return messages
@@ -1,53 +1,652 @@
+import asyncio
+import hashlib
 import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
 
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, InvalidToken
 
 from settings import settings
 import traceback
 
 import redis
+import redis.asyncio as redis_asyncio
 
 from logger.app_logger import log_message
 from settings import settings
+from tracing import span
 
 
 try:
-    redis_client = redis.from_url(settings.REDIS_HOST,decode_responses=True)
+    # Blocking pools make callers wait for a free connection instead of failing past the limit.
+    redis_pool = redis.BlockingConnectionPool.from_url(
+        settings.REDIS_HOST, decode_responses=True, max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT_SECONDS,
+    )
+    redis_client = redis.Redis(connection_pool=redis_pool)
+    # Connections are opened lazily on the event loop that first uses them (the MCP server's).
+    async_redis_pool = redis_asyncio.BlockingConnectionPool.from_url(
+        settings.REDIS_HOST, decode_responses=True, max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT_SECONDS,
+    )
+    async_redis_client = redis_asyncio.Redis(connection_pool=async_redis_pool)
 except Exception as e:
     log_message(f"Error connecting to Redis: {traceback.format_exc()}")
     redis_client = None
+    async_redis_client = None
 
 
 GLOBAL_USER_DATA_CACHE_PREFIX = "gmail_summariser"
+SESSION_INVALIDATION_CHANNEL = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_session_invalidations"
 
 FERNET_KEY = settings.FERNET_KEY  # Should be a 32 url-safe base64-encoded bytes
 
 fernet = Fernet(FERNET_KEY)
 
 
+# ──────── Decrypted session LRU ─────────────────────────────────────────────────
+class SessionCache:
+    """
+    Small in-process LRU of decrypted session details, so repeated tool calls for a session skip
+    the Redis round trip, Fernet decrypt and JSON parse.
+
+    Entries live for `ttl_seconds` at most. Writes through this module publish the session id on
+    `SESSION_INVALIDATION_CHANNEL`, and every process listening there drops its copy, so a
+    refreshed token is picked up immediately rather than after the TTL.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(session_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def set(self, session_id: str, data: dict):
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[session_id] = (time.monotonic() + self.ttl_seconds, dict(data))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+session_cache = SessionCache(settings.SESSION_CACHE_SIZE, settings.SESSION_CACHE_TTL_SECONDS)
+_invalidation_listener: asyncio.Task | None = None
+
+
+async def _listen_for_session_invalidations():
+    backoff = 1.0
+    while True:
+        pubsub = async_redis_client.pubsub()
+        try:
+            await pubsub.subscribe(SESSION_INVALIDATION_CHANNEL)
+            backoff = 1.0
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    session_cache.invalidate(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log_message(f"Session invalidation listener error: {traceback.format_exc()}", level="warning")
+        finally:
+            await pubsub.aclose()
+        # Invalidations may have been missed while disconnected.
+        session_cache.clear()
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+
+def start_session_invalidation_listener():
+    """
+    Subscribes the running event loop to session invalidations (once per process).
+    Without a listener, cached sessions are only bounded by SESSION_CACHE_TTL_SECONDS.
+    """
+    global _invalidation_listener
+    if async_redis_client is None or (_invalidation_listener is not None and not _invalidation_listener.done()):
+        return
+    _invalidation_listener = asyncio.get_running_loop().create_task(_listen_for_session_invalidations())
+
+
+async def aclose():
+    """Stops the invalidation listener and closes the async pool's connections (worker shutdown)."""
+    global _invalidation_listener
+    if _invalidation_listener is not None:
+        _invalidation_listener.cancel()
+        _invalidation_listener = None
+    if async_redis_client is not None:
+        await async_redis_pool.disconnect()
+
+
+# ──────── Session details ───────────────────────────────────────────────────────
+def _session_key(session_id: str) -> str:
+    return f"{GLOBAL_USER_DATA_CACHE_PREFIX}_{session_id}"
+
+
+def _decrypt_session(session_id: str, encrypted_data: str | None) -> dict | None:
+    if not encrypted_data:
+        return None
+    try:
+        return json.loads(fernet.decrypt(encrypted_data).decode())
+    except (InvalidToken, ValueError):
+        log_message(f"[{session_id}]: Could not decrypt session details", level="warning")
+        return None
+
+
 def save_encrypted_cache(session_id: str, data: dict, expire_in: int| None = None):
     json_data = json.dumps(data)
     encrypted_data = fernet.encrypt(json_data.encode())
 
-    redis_key = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_{session_id}"
-    redis_client.set(redis_key, encrypted_data, ex=expire_in)
+    redis_key = _session_key(session_id)
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.set(redis_key, encrypted_data, ex=expire_in)
+        pipe.publish(SESSION_INVALIDATION_CHANNEL, session_id)
+        pipe.execute()
+    session_cache.invalidate(session_id)
 
 
 def get_session_details_from_cache(session_id: str):
     """
     Retrieves session details from the cache using the session ID.
     """
+    if (data_loaded := session_cache.get(session_id)) is not None:
+        return data_loaded
 
-    redis_key = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_{session_id}"
+    redis_key = _session_key(session_id)
 
     encrypted_data = redis_client.get(redis_key)
 
-    if encrypted_data:
-        decrypted_data = fernet.decrypt(encrypted_data).decode()
-        data_loaded = json.loads(decrypted_data)
-        print(f"[{session_id}]: Loaded the data {data_loaded}")
+    if data_loaded := _decrypt_session(session_id, encrypted_data):
+        session_cache.set(session_id, data_loaded)
+        log_message(f"[{session_id}]: Loaded session details", level="debug")
         return data_loaded
 
     else:
         log_message(message=f"Session details not found for session_id: {session_id}", level="warning")
         return {}
+
+
+async def asave_encrypted_cache(session_id: str, data: dict, expire_in: int | None = None):
+    """Async variant of `save_encrypted_cache`."""
+    await asave_sessions({session_id: data}, expire_in)
+
+
+async def aget_session_details_from_cache(session_id: str) -> dict:
+    """
+    Async variant of `get_session_details_from_cache`, for the MCP tools: served from the
+    in-process LRU when possible, otherwise one non-blocking GET on the pooled async client.
+    """
+    start_session_invalidation_listener()
+    with span("cache session", "cache") as lookup_span:
+        if (data_loaded := session_cache.get(session_id)) is not None:
+            lookup_span.set(source="local")
+            return data_loaded
+
+        encrypted_data = await async_redis_client.get(_session_key(session_id))
+        if data_loaded := _decrypt_session(session_id, encrypted_data):
+            lookup_span.set(source="redis")
+            session_cache.set(session_id, data_loaded)
+            log_message(f"[{session_id}]: Loaded session details", level="debug")
+            return data_loaded
+
+        lookup_span.set(source="missing")
+    log_message(message=f"Session details not found for session_id: {session_id}", level="warning")
+    return {}
+
+
+async def aget_sessions(session_ids: list[str]) -> dict[str, dict]:
+    """
+    Session details for several sessions: LRU hits first, the rest in one MGET.
+    Sessions that do not exist are left out.
+    """
+    sessions: dict[str, dict] = {}
+    missing = []
+    for session_id in dict.fromkeys(session_ids):
+        if (data := session_cache.get(session_id)) is not None:
+            sessions[session_id] = data
+        else:
+            missing.append(session_id)
+    if missing:
+        values = await async_redis_client.mget([_session_key(session_id) for session_id in missing])
+        for session_id, encrypted_data in zip(missing, values):
+            if data := _decrypt_session(session_id, encrypted_data):
+                session_cache.set(session_id, data)
+                sessions[session_id] = data
+    return sessions
+
+
+async def asave_sessions(sessions: dict[str, dict], expire_in: int | None = None):
+    """
+    Stores several sessions in one pipeline and publishes their invalidations.
+    """
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for session_id, data in sessions.items():
+            pipe.set(_session_key(session_id), fernet.encrypt(json.dumps(data).encode()), ex=expire_in)
+            pipe.publish(SESSION_INVALIDATION_CHANNEL, session_id)
+        await pipe.execute()
+    for session_id in sessions:
+        session_cache.invalidate(session_id)
+
+
+# ──────── Per-message summaries ─────────────────────────────────────────────────
+SUMMARY_CACHE_PREFIX = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_summary"
+
+
+def summary_cache_key(message: dict, model: str, prompt_version: int | str) -> str:
+    """
+    Gmail message ids are only unique within a mailbox, so the key also carries a fingerprint of
+    the message headers; a different message with the same id never reads another's summary.
+    """
+    headers = "|".join(str(message.get(key) or "") for key in ("threadId", "from", "date", "subject"))
+    fingerprint = hashlib.sha256(headers.encode()).hexdigest()[:16]
+    return f"{SUMMARY_CACHE_PREFIX}_{model}_v{prompt_version}_{message['id']}_{fingerprint}"
+
+
+def get_cached_summaries(messages: list[dict], model: str, prompt_version: int | str) -> dict[str, str]:
+    """
+    Returns `{message id: summary}` for the messages that have a cached summary, in one MGET.
+    """
+    if not messages or redis_client is None:
+        return {}
+    try:
+        values = redis_client.mget([summary_cache_key(message, model, prompt_version) for message in messages])
+    except Exception:
+        log_message(f"Error reading cached summaries: {traceback.format_exc()}", level="warning")
+        return {}
+
+    summaries = {}
+    for message, encrypted_data in zip(messages, values):
+        if encrypted_data:
+            try:
+                summaries[message["id"]] = fernet.decrypt(encrypted_data).decode()
+            except InvalidToken:
+                log_message(f"Discarding unreadable cached summary for message {message['id']}", level="warning")
+    return summaries
+
+
+def save_cached_summaries(
+    messages: list[dict],
+    summaries: dict[str, str],
+    model: str,
+    prompt_version: int | str,
+    expire_in: int | None = None,
+):
+    """
+    Stores the summaries of `messages` that appear in `summaries`, encrypted, in one pipeline.
+    """
+    if redis_client is None:
+        return
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            for message in messages:
+                if summary := summaries.get(message["id"]):
+                    pipe.set(
+                        summary_cache_key(message, model, prompt_version),
+                        fernet.encrypt(summary.encode()),
+                        ex=expire_in,
+                    )
+            pipe.execute()
+    except Exception:
+        log_message(f"Error saving summaries: {traceback.format_exc()}", level="warning")
+
+
+# ──────── Coalesced search results ──────────────────────────────────────────────
+SEARCH_RESULT_PREFIX = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_search_result"
+SEARCH_LOCK_PREFIX = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_search_lock"
+
+# Deletes the lock only if this worker still holds it (it may have expired and been taken over).
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+async def aget_search_result(key: str) -> tuple[dict | None, bool]:
+    """
+    The stored result of a search (decrypted), and whether a worker still holds its lock,
+    in one round trip.
+    """
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(f"{SEARCH_RESULT_PREFIX}_{key}")
+        pipe.exists(f"{SEARCH_LOCK_PREFIX}_{key}")
+        encrypted_data, locked = await pipe.execute()
+    if encrypted_data:
+        try:
+            return json.loads(fernet.decrypt(encrypted_data).decode()), bool(locked)
+        except (InvalidToken, ValueError):
+            log_message(f"Discarding unreadable search result {key}", level="warning")
+    return None, bool(locked)
+
+
+async def asave_search_result(key: str, result: dict, expire_in: int):
+    await async_redis_client.set(
+        f"{SEARCH_RESULT_PREFIX}_{key}", fernet.encrypt(json.dumps(result).encode()), ex=expire_in
+    )
+
+
+async def aacquire_search_lock(key: str, expire_in: int) -> str | None:
+    """Claims a search for this worker; returns the lock token, or None when another worker has it."""
+    token = secrets.token_hex(8)
+    acquired = await async_redis_client.set(f"{SEARCH_LOCK_PREFIX}_{key}", token, nx=True, ex=expire_in)
+    return token if acquired else None
+
+
+async def arelease_search_lock(key: str, token: str):
+    await async_redis_client.eval(RELEASE_LOCK_SCRIPT, 1, f"{SEARCH_LOCK_PREFIX}_{key}", token)
+
+
+# ──────── Mailbox index sync ────────────────────────────────────────────────────
+INDEX_SYNC_LOCK_PREFIX = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_index_sync_lock"
+
+
+async def aacquire_index_sync_lock(index_key: str, expire_in: int) -> str | None:
+    """Claims syncing a mailbox index for this worker; None when another worker is syncing it."""
+    token = secrets.token_hex(8)
+    acquired = await async_redis_client.set(f"{INDEX_SYNC_LOCK_PREFIX}_{index_key}", token, nx=True, ex=expire_in)
+    return token if acquired else None
+
+
+async def arelease_index_sync_lock(index_key: str, token: str):
+    await async_redis_client.eval(RELEASE_LOCK_SCRIPT, 1, f"{INDEX_SYNC_LOCK_PREFIX}_{index_key}", token)
+
+
+# ──────── Session warm-up ───────────────────────────────────────────────────────
+WARMUP_PREFIX = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_warmup"
+
+
+async def aclaim_warm_up(user: str, expire_in: int) -> bool:
+    """
+    True for the first caller per Gmail user within `expire_in` seconds, across workers, so logins
+    from several tabs or devices do not each spend quota warming the same mailbox.
+    """
+    return bool(await async_redis_client.set(f"{WARMUP_PREFIX}_{user}", "1", nx=True, ex=expire_in))
+
+
+# ──────── OAuth token refresh ───────────────────────────────────────────────────
+REFRESH_LOCK_PREFIX = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_token_refresh_lock"
+
+# Writes a refreshed session only while this worker holds the refresh lock and the session still
+# exists (a logout or expiry is not undone), keeping the entry's TTL, and publishes the invalidation.
+SAVE_REFRESHED_SESSION_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= ARGV[2] or redis.call('EXISTS', KEYS[1]) == 0 then
+  return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'KEEPTTL')
+redis.call('PUBLISH', ARGV[3], ARGV[4])
+return 1
+"""
+
+
+async def aload_session(session_id: str) -> dict | None:
+    """Session details straight from Redis, bypassing the in-process LRU."""
+    return _decrypt_session(session_id, await async_redis_client.get(_session_key(session_id)))
+
+
+async def aacquire_refresh_lock(session_id: str, expire_in: int) -> str | None:
+    """Claims a session's token refresh for this worker; None when another worker has it."""
+    token = secrets.token_hex(8)
+    acquired = await async_redis_client.set(f"{REFRESH_LOCK_PREFIX}_{session_id}", token, nx=True, ex=expire_in)
+    return token if acquired else None
+
+
+async def arelease_refresh_lock(session_id: str, token: str):
+    await async_redis_client.eval(RELEASE_LOCK_SCRIPT, 1, f"{REFRESH_LOCK_PREFIX}_{session_id}", token)
+
+
+async def asave_refreshed_session(session_id: str, data: dict, lock_token: str) -> bool:
+    """
+    Replaces a session's details with a refreshed token in one atomic step; False when the lock
+    was lost or the session is gone, in which case nothing is written.
+    """
+    saved = await async_redis_client.eval(
+        SAVE_REFRESHED_SESSION_SCRIPT, 2,
+        _session_key(session_id), f"{REFRESH_LOCK_PREFIX}_{session_id}",
+        fernet.encrypt(json.dumps(data).encode()), lock_token, SESSION_INVALIDATION_CHANNEL, session_id,
+    )
+    session_cache.invalidate(session_id)
+    if saved:
+        session_cache.set(session_id, data)
+    return bool(saved)
+
+
+# ──────── Digest jobs ───────────────────────────────────────────────────────────
+# Jobs live in a hash by id; their ids move between a sorted set of scheduled runs (score: when),
+# a list of runs that are due, and a sorted set of leases held by workers (score: lease expiry).
+DIGEST_JOBS_KEY = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_digest_jobs"
+DIGEST_SCHEDULED_KEY = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_digest_scheduled"
+DIGEST_QUEUE_KEY = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_digest_queue"
+DIGEST_LEASES_KEY = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_digest_leases"
+DIGEST_RESULTS_PREFIX = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_digest_results"
+DIGEST_QUOTA_PREFIX = f"{GLOBAL_USER_DATA_CACHE_PREFIX}_digest_quota"
+
+# Queues the scheduled runs that are due, and the runs whose worker let its lease expire (at the
+# head of the queue, they waited longest), at most ARGV[2] of each.
+PROMOTE_DIGEST_JOBS_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(due) do
+  redis.call('ZREM', KEYS[1], id)
+  redis.call('LPUSH', KEYS[2], id)
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(expired) do
+  redis.call('ZREM', KEYS[3], id)
+  redis.call('RPUSH', KEYS[2], id)
+end
+return {#due, #expired}
+"""
+
+# Takes the oldest due run and leases it until ARGV[1]; returns the job, or nil when the queue is
+# empty. Ids of jobs deleted while they were queued are dropped.
+CLAIM_DIGEST_JOB_SCRIPT = """
+while true do
+  local id = redis.call('RPOP', KEYS[1])
+  if not id then
+    return nil
+  end
+  local job = redis.call('HGET', KEYS[3], id)
+  if job then
+    redis.call('ZADD', KEYS[2], ARGV[1], id)
+    return job
+  end
+end
+"""
+
+# Ends a run if this worker still holds its lease: schedules the stored job again at ARGV[2] with
+# ARGV[3] attempts or, when ARGV[2] is empty, deletes it. A job saved again while it ran (another
+# version than ARGV[4]) is left as saved, it is scheduled already. Returns 0 when the lease was lost.
+FINISH_DIGEST_JOB_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+  return 0
+end
+local stored = redis.call('HGET', KEYS[3], ARGV[1])
+if not stored then
+  return 1
+end
+local job = cjson.decode(stored)
+if (job['version'] or '') ~= ARGV[4] then
+  return 1
+end
+if ARGV[2] == '' then
+  redis.call('HDEL', KEYS[3], ARGV[1])
+else
+  job['run_at'] = tonumber(ARGV[2])
+  job['attempts'] = tonumber(ARGV[3])
+  redis.call('HSET', KEYS[3], ARGV[1], cjson.encode(job))
+  redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+end
+return 1
+"""
+
+# Counts a digest against the user's budget for the current window; returns the window's count.
+CONSUME_DIGEST_QUOTA_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+  redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+
+def digest_job_id(owner: str, name: str) -> str:
+    return hashlib.sha256(f"{owner}\0{name}".encode()).hexdigest()[:24]
+
+
+def _digest_job(session_id: str, name: str, query: str, interval_seconds: int, run_at: float,
+                user: str | None = None) -> dict:
+    return {
+        "id": digest_job_id(user or session_id, name),
+        "session_id": session_id,
+        "user": user,
+        "name": name,
+        "query": query,
+        "interval_seconds": interval_seconds,  # 0 runs once
+        "run_at": run_at,
+        "attempts": 0,
+        "version": secrets.token_hex(8),  # A run only reschedules the version it claimed
+    }
+
+
+def schedule_digest(
+    session_id: str, name: str, query: str, interval_seconds: int = 0, delay_seconds: float = 0, user: str | None = None,
+) -> dict:
+    """
+    Schedules the digest `name` (replacing one of the same name) to run for a session in
+    `delay_seconds`, then every `interval_seconds` if set. Digests are the session's own, or with
+    `user` (`gmail_quota.quota_user`) the Gmail user's: saved again from a new session, the one
+    job moves to it. Returns the job.
+    """
+    job = _digest_job(session_id, name, query, interval_seconds, time.time() + delay_seconds, user)
+    with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(DIGEST_JOBS_KEY, job["id"], json.dumps(job))
+        pipe.zadd(DIGEST_SCHEDULED_KEY, {job["id"]: job["run_at"]})
+        pipe.execute()
+    return job
+
+
+async def aschedule_digests(jobs: list[dict]) -> list[dict]:
+    """
+    Async variant of `schedule_digest` for many digests in one pipeline; each item has the
+    `session_id`, `name` and `query` and optionally `interval_seconds`, `delay_seconds` and `user`.
+    """
+    now = time.time()
+    scheduled = [
+        _digest_job(item["session_id"], item["name"], item["query"], item.get("interval_seconds", 0),
+                    now + item.get("delay_seconds", 0), item.get("user"))
+        for item in jobs
+    ]
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        for job in scheduled:
+            pipe.hset(DIGEST_JOBS_KEY, job["id"], json.dumps(job))
+            pipe.zadd(DIGEST_SCHEDULED_KEY, {job["id"]: job["run_at"]})
+        await pipe.execute()
+    return scheduled
+
+
+async def apromote_digest_jobs(limit: int = 1000) -> tuple[int, int]:
+    """Queues due runs and runs with expired leases; returns how many of each."""
+    due, expired = await async_redis_client.eval(
+        PROMOTE_DIGEST_JOBS_SCRIPT, 3, DIGEST_SCHEDULED_KEY, DIGEST_QUEUE_KEY, DIGEST_LEASES_KEY, time.time(), limit,
+    )
+    return int(due), int(expired)
+
+
+async def aclaim_digest_job(lease_seconds: float) -> dict | None:
+    """The oldest due digest, leased to this worker for `lease_seconds`; None when nothing is due."""
+    job = await async_redis_client.eval(
+        CLAIM_DIGEST_JOB_SCRIPT, 3, DIGEST_QUEUE_KEY, DIGEST_LEASES_KEY, DIGEST_JOBS_KEY, time.time() + lease_seconds,
+    )
+    return json.loads(job) if job else None
+
+
+async def aextend_digest_leases(job_ids: list[str], lease_seconds: float):
+    """Keeps the leases of running digests (only those this worker still holds)."""
+    if job_ids:
+        await async_redis_client.zadd(DIGEST_LEASES_KEY, dict.fromkeys(job_ids, time.time() + lease_seconds), xx=True)
+
+
+async def afinish_digest_job(job: dict, run_again_in: float | None) -> bool:
+    """
+    Releases a claimed digest: scheduled again in `run_again_in` seconds (a retry, a deferral or
+    the next interval) with `job["attempts"]`, or deleted when None. Only the run time and attempts
+    change: a job saved again while it ran keeps its new query, session and schedule. False when
+    the lease had expired and the job was handed to another worker, in which case nothing is changed.
+    """
+    run_at = "" if run_again_in is None else time.time() + run_again_in
+    return bool(await async_redis_client.eval(
+        FINISH_DIGEST_JOB_SCRIPT, 3, DIGEST_LEASES_KEY, DIGEST_SCHEDULED_KEY, DIGEST_JOBS_KEY,
+        job["id"], run_at, job["attempts"], job.get("version", ""),
+    ))
+
+
+async def aconsume_digest_quota(user: str, window_seconds: int) -> int:
+    """Counts one digest for the user in the current window; returns the window's count so far."""
+    window = int(time.time() // window_seconds)
+    return int(await async_redis_client.eval(
+        CONSUME_DIGEST_QUOTA_SCRIPT, 1, f"{DIGEST_QUOTA_PREFIX}_{user}_{window}", window_seconds,
+    ))
+
+
+async def adigest_queue_stats() -> dict:
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        pipe.hlen(DIGEST_JOBS_KEY)
+        pipe.zcard(DIGEST_SCHEDULED_KEY)
+        pipe.llen(DIGEST_QUEUE_KEY)
+        pipe.zcard(DIGEST_LEASES_KEY)
+        jobs, scheduled, queued, leased = await pipe.execute()
+    return {"jobs": jobs, "scheduled": scheduled, "queued": queued, "leased": leased}
+
+
+async def asave_digest_result(session_id: str, name: str, result: dict, expire_in: int):
+    """Stores a finished digest for the session, encrypted, next to its other digests."""
+    key = f"{DIGEST_RESULTS_PREFIX}_{session_id}"
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        pipe.hset(key, name, fernet.encrypt(json.dumps(result).encode()))
+        pipe.expire(key, expire_in)
+        await pipe.execute()
+
+
+def get_digest_results(session_id: str) -> dict[str, dict]:
+    """`{digest name: result}` of the session's finished digests, in one HGETALL."""
+    if redis_client is None:
+        return {}
+    try:
+        values = redis_client.hgetall(f"{DIGEST_RESULTS_PREFIX}_{session_id}")
+    except Exception:
+        log_message(f"[{session_id}]: Error reading digests: {traceback.format_exc()}", level="warning")
+        return {}
+    results = {}
+    for name, encrypted_data in values.items():
+        try:
+            results[name] = json.loads(fernet.decrypt(encrypted_data).decode())
+        except (InvalidToken, ValueError):
+            log_message(f"[{session_id}]: Discarding unreadable digest {name}", level="warning")
+    return results
@@ -2,14 +2,10 @@
 import logging
 import os
 
-
-from requests_oauthlib import OAuth2Session
-import streamlit as st
-
 from settings import settings
 
 AUTHORIZATION_BASE_URL = "https://accounts.google.com/o/oauth2/v2/auth"
-TOKEN_URL             = "https://oauth2.googleapis.com/token"
+TOKEN_URL             = settings.OAUTH_TOKEN_URL
 SCOPE = [
     "openid",
     "https://www.googleapis.com/auth/userinfo.email",
@@ -25,6 +21,12 @@ EMAIL_RETRIEVER_AGENT_SYSTEM_PROMPT = """
 You are an email retriever agent. Your task is to retrieve emails based on user queries.
 You will be provide with the tools and authenticated session_id : {access_token} to interact with the users mails.Think step by step and formulate a better query to retrieve the emails.
 You are allowed to use the same tools multiple times to refine your query and get the best results.
+When the user describes what the emails are about rather than exact words, senders or dates, prefer one
+semantic_search_mails call with the description over several keyword searches; use get_top_mails_for_query
+for precise Gmail searches. For conversations ("my conversation with amit") pass resource="threads" to
+get_top_mails_for_query to get one record per thread instead of every message in it.
+When you are unsure how to phrase a search, do not refine it over several turns: pass all the candidate
+queries to get_top_mails_for_queries in one call and use the merged, deduplicated results.
 Once You are confident about the retrieved emails, You can respond the user with the structured response.
 Generalise the query to retrieve the emails, but do not use any personal information of the user.
 """
@@ -37,6 +39,34 @@ If the response is not satisfactory, you can ask the email retriever agent to re
 and get better results. You can also ask the user for more information if needed.
 """
 
+FAST_PATH_SUMMARY_PROMPT = """
+You summarise emails for the user. You are given the user's request, the Gmail search that was run for it
+and the emails it returned, newest first.
+Answer the request using only these emails. Summarise each relevant email in one or two sentences with its
+sender and date, group related emails together, and say plainly if none of the emails answer the request.
+"""
+
+# Map summaries are cached per message (see cache.get_cached_summaries), so they must not depend
+# on the request. Bump the version whenever the prompt changes to stop reusing old summaries.
+MAP_SUMMARY_PROMPT_VERSION = 1
+MAP_SUMMARY_PROMPT = """
+You summarise a batch of emails. For every email write one or two sentences with what matters:
+decisions, asks, dates, amounts and who is involved.
+Respond with JSON only: {"summaries": [{"id": "<email id>", "summary": "<summary>"}]}, one entry per email.
+"""
+
+REDUCE_SUMMARY_PROMPT = """
+You merge notes about emails into a shorter set of notes for the user's request. Group related emails and
+threads, keep senders, dates and concrete facts, and drop what is irrelevant to the request.
+Respond with the merged notes as a bullet list.
+"""
+
+FINAL_SUMMARY_PROMPT = """
+You answer the user's request from notes about their emails. Write a concise, well organised summary:
+group related emails together, mention senders and dates, and call out anything that needs action.
+Say plainly if the notes do not answer the request.
+"""
+
 
 def response_dispatcher(response: str, is_final: bool = False) -> str:
    """
@@ -50,8 +80,12 @@ def response_dispatcher(response: str, is_final: bool = False) -> str:
 
 
 # ──────── OAuth Client ─────────────────────────────────────────────────────
+# Only the Streamlit app signs users in; the agent, summariser and workers import this module for
+# its prompts alone, so Streamlit and requests_oauthlib are imported by the methods that use them.
 class GoogleOAuth:
     def __init__(self):
+        from requests_oauthlib import OAuth2Session
+
         self.oauth = OAuth2Session(
             CLIENT_ID,
             redirect_uri=REDIRECT_URI,
@@ -64,10 +98,15 @@ class GoogleOAuth:
             access_type="offline",
             prompt="consent"
         )
+        import streamlit as st
+
         st.session_state["oauth_state"] = state
         return auth_url
 
     def fetch_token(self, code: str) -> dict:
+        import streamlit as st
+        from requests_oauthlib import OAuth2Session
+
         oauth = OAuth2Session(
             CLIENT_ID,
             redirect_uri=REDIRECT_URI,
@@ -82,7 +121,11 @@ class GoogleOAuth:
         )
 
     def save_token(self, token: dict):
+        import streamlit as st
+
         st.session_state["token_data"] = token
 
     def get_saved_token(self) -> dict:
+        import streamlit as st
+
         return st.session_state.get("token_data")
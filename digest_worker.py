@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import signal
+import time
+import traceback
+from collections import deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Awaitable, Callable
+
+import cache
+from agent import answer_query
+from gmail_quota import quota_user
+from logger.app_logger import flush_logs, log_message
+from runtime import get_runtime
+from settings import settings
+from tracing import configure_tracing, new_trace_id
+
+QUOTA_WINDOW_SECONDS = 3600  # DIGEST_USER_JOBS_PER_HOUR
+
+DigestRunner = Callable[[str, str, str], Awaitable[list[str]]]
+
+
+async def run_digest_query(session_id: str, query: str, trace_id: str) -> list[str]:
+    """A digest is the answer to its query, as the chat would give it (fast path, map-reduce or team)."""
+    return await answer_query(session_id, query, trace_id=trace_id)
+
+
+def _percentiles(samples) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50_ms": 0.0, "p95_ms": 0.0}
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2], 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+    }
+
+
+class DigestWorker:
+    """
+    Runs scheduled digests for every user in the background, so their summaries are ready before
+    anyone asks.
+
+    Digests are jobs in Redis (`cache.schedule_digest`): a saved query of a session stored by
+    `cache.save_encrypted_cache`, run once or every `interval_seconds`. Any number of workers share
+    the queue. A worker claims due jobs under a lease it renews while they run; the lease of a
+    worker that dies expires and its jobs are queued again. Up to `concurrency` digests run at once,
+    each one `run_query` call on the agent runtime (the chat's own pipeline: MCP tools, Gmail quota
+    limiter, caches).
+
+    Per Gmail user (`gmail_quota.quota_user`), at most `user_concurrency` digests run at once in a
+    worker and `user_jobs_per_hour` start per hour across workers; jobs over either limit are
+    deferred, not dropped, so one user with many saved queries cannot hold up everyone else.
+    Failed runs are retried `max_attempts` times with exponential backoff. Finished digests are
+    stored per session (`cache.asave_digest_result`) for `main.py` to show without waiting.
+    """
+
+    def __init__(
+        self,
+        run_query: DigestRunner = run_digest_query,
+        concurrency: int = settings.DIGEST_WORKER_CONCURRENCY,
+        user_concurrency: int = settings.DIGEST_USER_CONCURRENCY,
+        user_jobs_per_hour: int = settings.DIGEST_USER_JOBS_PER_HOUR,
+        busy_defer_seconds: float = settings.DIGEST_USER_BUSY_DEFER_SECONDS,
+        lease_seconds: float = settings.DIGEST_LEASE_SECONDS,
+        poll_seconds: float = settings.DIGEST_POLL_SECONDS,
+        max_attempts: int = settings.DIGEST_MAX_ATTEMPTS,
+        retry_seconds: float = settings.DIGEST_RETRY_SECONDS,
+        result_ttl_seconds: int = settings.DIGEST_RESULT_TTL_SECONDS,
+        shutdown_timeout_seconds: float = settings.DIGEST_SHUTDOWN_TIMEOUT_SECONDS,
+    ):
+        self.run_query = run_query
+        self.concurrency = concurrency
+        self.user_concurrency = user_concurrency
+        self.user_jobs_per_hour = user_jobs_per_hour
+        self.busy_defer_seconds = busy_defer_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.shutdown_timeout_seconds = shutdown_timeout_seconds
+        self._running: dict[str, asyncio.Task] = {}
+        self._user_running: dict[str, int] = {}
+        self._last_promoted = 0.0
+        self._started = None
+        self.queue_wait_ms: deque = deque(maxlen=10000)
+        self.run_ms: deque = deque(maxlen=10000)
+        self.claimed = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.deferred_busy = 0
+        self.deferred_quota = 0
+        self.dropped = 0
+        self.lost_leases = 0
+
+    # ──────── Queue ───────────────────────────────────────────────────────────────
+    async def run(self, stop: asyncio.Event):
+        """Claims and runs digests until `stop` is set, then lets the running ones finish."""
+        self._started = time.monotonic()
+        slots = asyncio.Semaphore(self.concurrency)
+        renewer = asyncio.create_task(self._renew_leases())
+        log_message(f"Digest worker started ({self.concurrency} slots)", level="info")
+        try:
+            while not stop.is_set():
+                await slots.acquire()
+                job = await self._next_job(stop)
+                if job is None:
+                    slots.release()
+                    break
+                task = asyncio.create_task(self._process(job))
+                self._running[job["id"]] = task
+                task.add_done_callback(lambda _, job_id=job["id"]: (self._running.pop(job_id, None), slots.release()))
+        finally:
+            await self._drain()
+            renewer.cancel()
+            log_message(f"Digest worker stopped: {self.stats()}", level="info")
+
+    async def _next_job(self, stop: asyncio.Event) -> dict | None:
+        """The next due job, waiting for one; None once `stop` is set."""
+        while not stop.is_set():
+            try:
+                if time.monotonic() - self._last_promoted >= self.poll_seconds:
+                    self._last_promoted = time.monotonic()
+                    await cache.apromote_digest_jobs()
+                job = await cache.aclaim_digest_job(self.lease_seconds)
+                if job is not None:
+                    self.claimed += 1
+                    return job
+            except Exception:
+                log_message(f"Digest queue unavailable: {traceback.format_exc()}", level="warning")
+            try:
+                await asyncio.wait_for(stop.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    async def _renew_leases(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await cache.aextend_digest_leases(list(self._running), self.lease_seconds)
+            except Exception:
+                log_message(f"Could not renew digest leases: {traceback.format_exc()}", level="warning")
+
+    async def _drain(self):
+        """Waits for running digests; those still running after the timeout are queued again."""
+        if not self._running:
+            return
+        running = list(self._running.values())
+        log_message(f"Waiting for {len(running)} running digests", level="info")
+        _, pending = await asyncio.wait(running, timeout=self.shutdown_timeout_seconds)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _finish(self, job: dict, run_again_in: float | None):
+        if not await cache.afinish_digest_job(job, run_again_in):
+            self.lost_leases += 1
+            log_message(f"[{job['session_id']}]: Lease of digest {job['name']!r} expired while it ran", level="warning")
+
+    # ──────── Digests ─────────────────────────────────────────────────────────────
+    async def _process(self, job: dict):
+        session_id = job["session_id"]
+        self.queue_wait_ms.append(max(0.0, time.time() - job["run_at"]) * 1000)
+        try:
+            session = await cache.aload_session(session_id)
+            if not session:
+                # Logged out or expired: the schedule goes with the session.
+                self.dropped += 1
+                await self._finish(job, None)
+                return
+            user = quota_user(session_id, session)
+            if self._user_running.get(user, 0) >= self.user_concurrency:
+                self.deferred_busy += 1
+                await self._finish(job, self.busy_defer_seconds)
+                return
+            if self.user_jobs_per_hour and await cache.aconsume_digest_quota(user, QUOTA_WINDOW_SECONDS) > self.user_jobs_per_hour:
+                self.deferred_quota += 1
+                await self._finish(job, QUOTA_WINDOW_SECONDS - time.time() % QUOTA_WINDOW_SECONDS)
+                return
+
+            self._user_running[user] = self._user_running.get(user, 0) + 1
+            try:
+                await self._run(job)
+            finally:
+                self._user_running[user] -= 1
+                if not self._user_running[user]:
+                    del self._user_running[user]
+        except asyncio.CancelledError:
+            # Shutting down: someone else runs it now rather than after the lease expires.
+            await self._finish(job, 0)
+            raise
+        except Exception:
+            # The lease expires and the job is queued again.
+            log_message(f"[{session_id}]: Digest {job['name']!r} could not be processed: {traceback.format_exc()}",
+                        level="warning")
+
+    async def _run(self, job: dict):
+        session_id = job["session_id"]
+        trace_id = new_trace_id()
+        started = time.perf_counter()
+        try:
+            summaries = await self.run_query(session_id, job["query"], trace_id)
+            error = None
+        except Exception as e:
+            attempts = job["attempts"] + 1
+            if attempts < self.max_attempts:
+                self.retried += 1
+                log_message(f"[{session_id}]: Digest {job['name']!r} failed (attempt {attempts}), retrying: {e}",
+                            level="warning")
+                await self._finish({**job, "attempts": attempts}, self.retry_seconds * 2 ** (attempts - 1))
+                return
+            self.failed += 1
+            log_message(f"[{session_id}]: Digest {job['name']!r} failed after {attempts} attempts: {e}", level="error")
+            summaries, error = [], str(e)
+        duration_ms = (time.perf_counter() - started) * 1000
+        self.run_ms.append(duration_ms)
+        await cache.asave_digest_result(session_id, job["name"], {
+            "name": job["name"],
+            "query": job["query"],
+            "summaries": summaries,
+            "error": error,
+            "finished_at": time.time(),
+            "duration_ms": round(duration_ms, 1),
+            "trace_id": trace_id,
+        }, self.result_ttl_seconds)
+        if error is None:
+            self.completed += 1
+        await self._finish({**job, "attempts": 0}, job["interval_seconds"] or None)
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started if self._started is not None else 0.0
+        return {
+            "in_flight": len(self._running),
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "deferred_busy": self.deferred_busy,
+            "deferred_quota": self.deferred_quota,
+            "dropped": self.dropped,
+            "lost_leases": self.lost_leases,
+            "digests_per_second": round(self.completed / elapsed, 2) if elapsed else 0.0,
+            "queue_wait": _percentiles(self.queue_wait_ms),
+            "run": _percentiles(self.run_ms),
+        }
+
+
+async def _set(event: asyncio.Event):
+    event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run scheduled Gmail digests in the background.")
+    parser.add_argument("--concurrency", type=int, default=settings.DIGEST_WORKER_CONCURRENCY)
+    parser.add_argument("--user-concurrency", type=int, default=settings.DIGEST_USER_CONCURRENCY)
+    args = parser.parse_args()
+
+    configure_tracing(f"{settings.TRACE_SERVICE_NAME}-digest")
+    worker = DigestWorker(concurrency=args.concurrency, user_concurrency=args.user_concurrency)
+    # Digests run on the agent runtime's loop, next to the MCP session and model client they use.
+    runtime = get_runtime()
+    stop = asyncio.Event()
+    signal.signal(signal.SIGTERM, lambda *_: runtime.submit(_set(stop)))
+    signal.signal(signal.SIGINT, lambda *_: runtime.submit(_set(stop)))
+    done = runtime.submit(worker.run(stop))
+    try:
+        while True:
+            try:
+                done.result(timeout=1)
+                break
+            except FutureTimeoutError:
+                pass
+    finally:
+        runtime.shutdown()
+        flush_logs()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import json
+import re
+from dataclasses import dataclass
+from email.utils import parseaddr
+from functools import lru_cache
+
+from gmail_search import html_to_text
+from logger.app_logger import log_message
+from settings import settings
+
+HTML_PATTERN = re.compile(r"<(?:html|body|div|p|br|table|span|td)\b", re.IGNORECASE)
+INVISIBLE_PATTERN = re.compile("[\u200b-\u200f\u00ad\u034f\ufeff]")
+LONG_URL_PATTERN = re.compile(r"https?://([^/\s>]+)[^\s>)\]]{40,}")
+
+# A reply header ends the new content of a message; everything after it is quoted history.
+REPLY_HEADER_PATTERNS = [
+    re.compile(r"^[ \t]*On [^\n]{4,200}\bwrote:[ \t]*$", re.IGNORECASE | re.MULTILINE),
+    re.compile(r"^[ \t]*On [^\n]{4,200}\n[^\n]{0,120}\bwrote:[ \t]*$", re.IGNORECASE | re.MULTILINE),
+    re.compile(r"^[ \t]*-{2,}[ \t]*Original Message[ \t]*-{2,}[ \t]*$", re.IGNORECASE | re.MULTILINE),
+    re.compile(r"^[ \t]*_{10,}[ \t]*$", re.MULTILINE),
+    re.compile(r"^[ \t]*From:[^\n]+\n[ \t]*(?:Sent|Date):[^\n]+$", re.IGNORECASE | re.MULTILINE),
+]
+SIGNATURE_DELIMITER = re.compile(r"^--\s*$")
+# The whole line must be the sign-off: "Thanks for the update." or "Best option is B." are content.
+SIGN_OFF_PATTERN = re.compile(
+    r"^\s*(?:(?:best|kind|warm)\s+)?(?:regards|thanks|thank you|many thanks|cheers|best|best wishes|sincerely|br|thx)"
+    r"[,!.]?\s*$"
+    r"|^\s*sent from my \w+",
+    re.IGNORECASE,
+)
+SIGNATURE_MAX_LINES = 8  # A signature (after "--" or a sign-off) is at most this many lines long
+SIGNATURE_MAX_LINE_CHARS = 60  # Names, titles, phone numbers and addresses are short
+# A line that reads as a sentence ("The client is waiting.", "Can you call me?") is content, not a signature.
+# "Acme Inc." is not: a sentence ends in a lowercase word.
+SENTENCE_PATTERN = re.compile(r"\S+(?:\s+\S+){2,}\s+[a-z]+[.!]\s*$|\?\s*$")
+
+TRUNCATION_MARKER = " …[truncated]"
+MIN_BODY_TOKENS = 32  # An email is only worth returning with at least this much of its body
+
+
+# ──────── Token counting ────────────────────────────────────────────────────────
+class TokenCounter:
+    """
+    tiktoken encoder for the summarisation model. When the encoding cannot be loaded (tiktoken
+    downloads it on first use), counts fall back to an estimate of four characters per token.
+    """
+
+    CHARS_PER_TOKEN = 4
+
+    def __init__(self, model: str):
+        self.model = model
+        try:
+            import tiktoken  # loaded with the first counter, not when the MCP server starts
+
+            self.encoding = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            log_message(f"tiktoken encoding for {model} unavailable, estimating token counts: {e}", level="warning")
+            self.encoding = None
+
+    @property
+    def is_exact(self) -> bool:
+        return self.encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is None:
+            return -(-len(text) // self.CHARS_PER_TOKEN)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is None:
+            limit = max_tokens * self.CHARS_PER_TOKEN
+            return text if len(text) <= limit else text[:limit].rstrip() + TRUNCATION_MARKER
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens]).rstrip() + TRUNCATION_MARKER
+
+
+@lru_cache(maxsize=4)
+def get_token_counter(model: str | None = None) -> TokenCounter:
+    return TokenCounter(model or settings.EMAIL_TOKENIZER_MODEL)
+
+
+# ──────── Body cleanup ──────────────────────────────────────────────────────────
+def normalise_body(body: str) -> str:
+    """Plain text with invisible characters, long tracking URLs and blank line runs removed."""
+    if HTML_PATTERN.search(body):
+        body = html_to_text(body)
+    body = INVISIBLE_PATTERN.sub("", body.replace("\r\n", "\n"))
+    body = LONG_URL_PATTERN.sub(lambda match: f"<{match.group(1)} link>", body)
+    lines = [line.rstrip() for line in body.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def strip_quoted_reply(body: str) -> str:
+    """Drops `>` quoted lines and everything after a reply / inline-forward header."""
+    cut = len(body)
+    for pattern in REPLY_HEADER_PATTERNS:
+        for match in pattern.finditer(body):
+            # A header on the first line is a forwarded message, which is the content itself.
+            if match.start() > 0:
+                cut = min(cut, match.start())
+                break
+    kept = [line for line in body[:cut].split("\n") if not line.lstrip().startswith(">")]
+    return "\n".join(kept).strip()
+
+
+def strip_signature(body: str) -> str:
+    """
+    Drops the signature at the end of a body: a `-- ` delimiter or a line that is only a sign-off
+    ("Thanks,", "Best regards"), with at most `SIGNATURE_MAX_LINES` lines after it. After a
+    sign-off those lines must look like a signature block (`_is_signature_block`): "Thanks!"
+    followed by the actual request is content.
+    """
+    lines = body.split("\n")
+    for index in range(max(1, len(lines) - SIGNATURE_MAX_LINES - 1), len(lines)):
+        if SIGNATURE_DELIMITER.match(lines[index]) or (
+            SIGN_OFF_PATTERN.match(lines[index]) and _is_signature_block(lines[index + 1:])
+        ):
+            return "\n".join(lines[:index]).strip()
+    return body
+
+
+def _is_signature_block(lines: list[str]) -> bool:
+    """Short lines (name, title, company, phone) and no sentences."""
+    return all(
+        len(line.strip()) <= SIGNATURE_MAX_LINE_CHARS and not SENTENCE_PATTERN.search(line.strip())
+        for line in lines
+    )
+
+
+def clean_body(body: str) -> str:
+    return strip_signature(strip_quoted_reply(normalise_body(body or "")))
+
+
+def _paragraph_key(paragraph: str) -> str:
+    return " ".join(paragraph.lower().split())
+
+
+def deduplicate_threads(emails: list[dict]) -> int:
+    """
+    Removes paragraphs a message repeats from an earlier message of the same thread (unmarked
+    quotes, forwarded copies, repeated disclaimers). Bodies are edited in place; returns the
+    number of paragraphs removed.
+    """
+    removed = 0
+    seen_by_thread: dict[str, set[str]] = {}
+    # Results are newest first; the oldest copy of a paragraph is the original.
+    for email in reversed(emails):
+        seen = seen_by_thread.setdefault(email.get("threadId") or email["id"], set())
+        kept = []
+        for paragraph in re.split(r"\n\s*\n", email.get("body") or ""):
+            key = _paragraph_key(paragraph)
+            if not key:
+                continue
+            if key in seen and len(key) > 20:
+                removed += 1
+                continue
+            seen.add(key)
+            kept.append(paragraph.strip())
+        email["body"] = "\n\n".join(kept)
+    return removed
+
+
+def _display_name(address: str | None) -> str:
+    name, email_address = parseaddr(address or "")
+    return name or email_address or "unknown sender"
+
+
+def thread_transcript(messages: list[dict]) -> tuple[str, int]:
+    """
+    Collapses a conversation (`gmail_search.parse_thread` messages, oldest first) into one body:
+    each message cleaned, paragraphs it repeats from earlier messages dropped, under a
+    `[date] sender:` line. Newest message first, so truncation cuts the oldest. Returns the
+    transcript and the number of repeated paragraphs removed.
+    """
+    cleaned = [dict(message, body=clean_body(message.get("body") or "")) for message in messages]
+    removed = deduplicate_threads(list(reversed(cleaned)))
+    # The record lists the participants' addresses; names are enough here.
+    parts = [
+        f"[{message.get('date') or 'undated'}] {_display_name(message.get('from'))}:\n"
+        f"{message['body'] or message.get('snippet') or ''}".strip()
+        for message in reversed(cleaned)
+    ]
+    return "\n\n".join(parts), removed
+
+
+# ──────── Token budgets ─────────────────────────────────────────────────────────
+def allocate_budget(sizes: list[int], budget: int) -> list[int]:
+    """
+    Splits a token budget across bodies water-filling style: short bodies keep everything, the
+    remainder is shared evenly by the longer ones.
+    """
+    allocation = [0] * len(sizes)
+    remaining = max(budget, 0)
+    pending = sorted(range(len(sizes)), key=lambda index: sizes[index])
+    while pending:
+        share = remaining // len(pending)
+        index = pending[0]
+        if sizes[index] <= share:
+            allocation[index] = sizes[index]
+            remaining -= sizes[index]
+            pending.pop(0)
+        else:
+            for index in pending:
+                allocation[index] = share
+            break
+    return allocation
+
+
+@dataclass
+class CompactionStats:
+    original_tokens: int = 0
+    compacted_tokens: int = 0
+    emails: int = 0
+    truncated_emails: int = 0
+    dropped_emails: int = 0
+    duplicate_paragraphs: int = 0
+    exact_token_counts: bool = True
+
+    def as_dict(self) -> dict:
+        saved = self.original_tokens - self.compacted_tokens
+        return {
+            "original_tokens": self.original_tokens,
+            "compacted_tokens": self.compacted_tokens,
+            "saved_pct": round(100 * saved / self.original_tokens, 1) if self.original_tokens else 0.0,
+            "emails": self.emails,
+            "truncated_emails": self.truncated_emails,
+            "dropped_emails": self.dropped_emails,
+            "duplicate_paragraphs": self.duplicate_paragraphs,
+            "exact_token_counts": self.exact_token_counts,
+        }
+
+
+def _compact_fields(email: dict, body: str) -> dict:
+    """Drops empty fields, the `sender` alias of `from`, and the snippet when the body is present."""
+    record = {
+        key: value for key, value in email.items()
+        if value not in (None, "") and key not in ("sender", "body", "messages")
+    }
+    if email.get("sender") and email.get("sender") != email.get("from"):
+        record["sender"] = email["sender"]
+    if body:
+        record.pop("snippet", None)
+        record["body"] = body
+    return record
+
+
+def compact_emails(
+    emails: list[dict],
+    max_tokens: int | None = None,
+    max_tokens_per_email: int | None = None,
+) -> tuple[list[dict], CompactionStats]:
+    """
+    Shrinks tool results before they reach the model: HTML to text, quoted replies and signatures
+    removed, paragraphs repeated within a thread dropped (thread records from `parse_thread` become
+    one transcript, see `thread_transcript`), then each body cut to
+    `max_tokens_per_email` and all bodies together to what `max_tokens` leaves after the headers.
+    When even the headers do not fit, the lowest ranked emails are dropped.
+
+    Token counts cover the JSON the tool returns, which is what the model actually sees.
+    """
+    counter = get_token_counter()
+    max_tokens = max_tokens or settings.EMAIL_MAX_TOKENS_PER_RESPONSE
+    max_tokens_per_email = max_tokens_per_email or settings.EMAIL_MAX_TOKENS_PER_EMAIL
+    stats = CompactionStats(emails=len(emails), exact_token_counts=counter.is_exact)
+    stats.original_tokens = counter.count(json.dumps(emails, ensure_ascii=False))
+
+    cleaned = []
+    for email in emails:
+        if email.get("messages") is not None:
+            body, removed = thread_transcript(email["messages"])
+            stats.duplicate_paragraphs += removed
+        else:
+            body = clean_body(email.get("body", ""))
+        cleaned.append(dict(email, body=body))
+    stats.duplicate_paragraphs += deduplicate_threads(cleaned)
+    compacted = [_compact_fields(email, email["body"]) for email in cleaned]
+
+    # Per-email overhead (headers, ids, JSON punctuation); keep the best ranked emails that fit
+    # with at least MIN_BODY_TOKENS of body each.
+    overheads = [counter.count(json.dumps(_compact_fields(email, ""), ensure_ascii=False)) + 2 for email in cleaned]
+    kept, used = 0, 2
+    for overhead in overheads:
+        if kept and used + overhead + MIN_BODY_TOKENS * (kept + 1) > max_tokens:
+            break
+        used += overhead
+        kept += 1
+    stats.dropped_emails = len(compacted) - kept
+    compacted = compacted[:kept]
+
+    sizes = [min(counter.count(email.get("body", "")), max_tokens_per_email) for email in compacted]
+    for email, allowance in zip(compacted, allocate_budget(sizes, max_tokens - used)):
+        if email.get("body") and counter.count(email["body"]) > allowance:
+            email["body"] = counter.truncate(email["body"], allowance)
+            stats.truncated_emails += 1
+            if not email["body"]:
+                del email["body"]
+
+    stats.compacted_tokens = counter.count(json.dumps(compacted, ensure_ascii=False))
+    return compacted, stats
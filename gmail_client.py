@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import urljoin
+
+import google_auth_httplib2
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+from gmail_quota import backoff_seconds, is_rate_limited, quota_limiter, quota_user, request_cost, retry_after_seconds
+from logger.app_logger import log_message
+from settings import settings
+from tracing import span
+
+
+@lru_cache(maxsize=1)
+def get_gmail_discovery_document() -> dict:
+    """
+    Loads and parses the Gmail v1 discovery document bundled with googleapiclient once per process.
+    """
+    document = get_static_doc("gmail", "v1")
+    if document is None:
+        raise RuntimeError("Static discovery document for gmail v1 is not available.")
+    return json.loads(document)
+
+
+def get_token_fingerprint(access_token: str | None) -> str:
+    """
+    Short, non-reversible identifier of an access token, safe to use in cache keys and logs.
+    """
+    return hashlib.sha256((access_token or "").encode()).hexdigest()[:16]
+
+
+def build_credentials(session_data: dict) -> Credentials:
+    """
+    Credentials for the session's current access token.
+
+    No `expiry`: google-auth counts a token as expired `REFRESH_THRESHOLD` early and would try to
+    refresh it itself, without the client secret. `token_manager` keeps the token fresh instead.
+    """
+    return Credentials(
+        token=session_data.get("access_token"),
+        id_token=session_data.get("id_token"),
+        refresh_token=session_data.get("refresh_token"),
+        scopes=session_data.get("scope"),
+    )
+
+
+class GmailClient:
+    """
+    A Gmail API resource bound to one session's credentials and a few persistent HTTP connections.
+
+    httplib2 connections are not thread safe, so every request made through this client
+    must go through `execute`, which checks a transport out of the client's own small pool
+    (at most `GMAIL_CLIENT_CONNECTIONS`) for the duration of the request. Async callers use
+    `aexecute`, which also spends the user's Gmail quota and retries rate-limited requests.
+    """
+
+    def __init__(self, session_id: str, credentials: Credentials, fingerprint: str, user: str | None = None):
+        self.session_id = session_id
+        self.credentials = credentials
+        self.fingerprint = fingerprint
+        self.user = user or quota_user(session_id, {})
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+        self.max_connections = max(1, settings.GMAIL_CLIENT_CONNECTIONS)
+        self._transports: queue.LifoQueue = queue.LifoQueue()
+        self._all_transports: list[google_auth_httplib2.AuthorizedHttp] = []
+        self._transports_lock = threading.Lock()
+
+        transport = self._new_transport()
+        client_options = {"api_endpoint": settings.GMAIL_API_ENDPOINT} if settings.GMAIL_API_ENDPOINT else None
+        self.service = build_from_document(
+            get_gmail_discovery_document(),
+            http=transport,
+            client_options=client_options,
+        )
+        self._transports.put(transport)
+
+    def _new_transport(self) -> google_auth_httplib2.AuthorizedHttp:
+        transport = google_auth_httplib2.AuthorizedHttp(
+            self.credentials,
+            http=httplib2.Http(timeout=settings.GMAIL_HTTP_TIMEOUT_SECONDS),
+        )
+        self._all_transports.append(transport)
+        return transport
+
+    def _checkout(self) -> google_auth_httplib2.AuthorizedHttp:
+        try:
+            return self._transports.get_nowait()
+        except queue.Empty:
+            pass
+        with self._transports_lock:
+            if len(self._all_transports) < self.max_connections:
+                return self._new_transport()
+        return self._transports.get()
+
+    def execute(self, request):
+        """
+        Executes a googleapiclient request (or batch) over one of this client's persistent connections.
+        """
+        method = getattr(request, "methodId", None) or "batch"
+        with span(f"gmail {method.removeprefix('gmail.')}", "gmail"):
+            transport = self._checkout()
+            try:
+                self.last_used_at = time.monotonic()
+                return request.execute(http=transport)
+            finally:
+                self._transports.put(transport)
+
+    async def aexecute(self, request):
+        """
+        `execute` on a worker thread once the request's quota units are reserved for this user
+        (`gmail_quota.quota_limiter`). Rate-limited responses are retried up to `GMAIL_MAX_RETRIES`
+        times with jittered exponential backoff, waiting at least the response's Retry-After.
+        """
+        units = request_cost(request)
+        for attempt in range(settings.GMAIL_MAX_RETRIES + 1):
+            await quota_limiter.acquire(self.user, units)
+            try:
+                return await asyncio.to_thread(self.execute, request)
+            except HttpError as e:
+                if not is_rate_limited(e) or attempt == settings.GMAIL_MAX_RETRIES:
+                    raise
+                delay = backoff_seconds(attempt, retry_after_seconds(e))
+                log_message(
+                    f"[{self.session_id}]: Gmail rate limited ({e.resp.status}), retry {attempt + 1} in {delay:.2f}s",
+                    level="warning",
+                )
+                await quota_limiter.penalise(self.user, delay)
+                await asyncio.sleep(delay)
+
+    def new_batch(self, callback=None) -> BatchHttpRequest:
+        if settings.GMAIL_API_ENDPOINT:
+            # The discovery document's batch URI always points at Google, follow the endpoint override.
+            return BatchHttpRequest(callback=callback, batch_uri=urljoin(settings.GMAIL_API_ENDPOINT, "batch"))
+        return self.service.new_batch_http_request(callback=callback)
+
+    def is_stale(self, ttl_seconds: int) -> bool:
+        if time.monotonic() - self.created_at > ttl_seconds:
+            return True
+        # The transport refreshed the token in place, the cached session data no longer matches.
+        return get_token_fingerprint(self.credentials.token) != self.fingerprint
+
+    def close(self):
+        for transport in self._all_transports:
+            try:
+                transport.close()
+            except Exception:
+                pass
+
+
+class GmailClientPool:
+    """
+    Per-session pool of Gmail clients with LRU eviction and a TTL.
+
+    Entries are keyed by (session_id, token fingerprint) so a new token for the same session
+    never reuses a client built for the old one.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clients: OrderedDict[tuple[str, str], GmailClient] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id: str, session_data: dict) -> GmailClient:
+        fingerprint = get_token_fingerprint(session_data.get("access_token"))
+        key = (session_id, fingerprint)
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None and not client.is_stale(self.ttl_seconds):
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return client
+            self.misses += 1
+            self._drop_session(session_id)
+
+        client = GmailClient(session_id, build_credentials(session_data), fingerprint,
+                             quota_user(session_id, session_data))
+        log_message(f"[{session_id}]: Built Gmail client for token {fingerprint}", level="debug")
+
+        with self._lock:
+            self._clients[key] = client
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                _, evicted = self._clients.popitem(last=False)
+                self.evictions += 1
+                evicted.close()
+        return client
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._drop_session(session_id)
+
+    def clear(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._clients),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _drop_session(self, session_id: str):
+        for key in [key for key in self._clients if key[0] == session_id]:
+            self._clients.pop(key).close()
+            self.evictions += 1
+
+
+gmail_client_pool = GmailClientPool(
+    max_size=settings.GMAIL_CLIENT_POOL_SIZE,
+    ttl_seconds=settings.GMAIL_CLIENT_TTL_SECONDS,
+)
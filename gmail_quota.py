@@ -0,0 +1,278 @@
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+from googleapiclient.errors import HttpError
+
+import cache
+from logger.app_logger import log_message
+from settings import settings
+
+QUOTA_KEY_PREFIX = f"{cache.GLOBAL_USER_DATA_CACHE_PREFIX}_gmail_quota"
+
+# Quota units Gmail charges per method (https://developers.google.com/gmail/api/reference/quota).
+QUOTA_UNITS = {
+    "gmail.users.getProfile": 1,
+    "gmail.users.labels.list": 1,
+    "gmail.users.labels.get": 1,
+    "gmail.users.history.list": 2,
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.attachments.get": 5,
+    "gmail.users.threads.list": 10,
+    "gmail.users.threads.get": 10,
+}
+DEFAULT_QUOTA_UNITS = 5
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+# Atomically refills the user's bucket from the Redis clock, then reserves `units` or reports how
+# long to wait. A reservation may take the bucket below zero (one batch can cost more than a
+# second's worth); later callers wait out the debt. `hold` > 0 empties the bucket for that long.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local units = tonumber(ARGV[3])
+local hold = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local last = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+local wait = 0
+if hold > 0 then
+  tokens = math.min(tokens, -hold * rate)
+elseif tokens >= math.min(units, burst) then
+  tokens = tokens - units
+else
+  wait = (math.min(units, burst) - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return tostring(wait)
+"""
+
+
+class GmailQuotaTimeout(RuntimeError):
+    """The user's quota would not allow the request within `GMAIL_QUOTA_MAX_WAIT_SECONDS`."""
+
+
+def request_cost(request) -> int:
+    """Quota units of a googleapiclient request; a batch costs the sum of its parts."""
+    parts = getattr(request, "_requests", None)
+    if parts is not None:
+        return sum(request_cost(part) for part in parts.values())
+    return QUOTA_UNITS.get(getattr(request, "methodId", None), DEFAULT_QUOTA_UNITS)
+
+
+def quota_user(session_id: str, session_data: dict) -> str:
+    """
+    Key of the Gmail user a session acts for. Quota is per Gmail account, and every browser tab
+    has its own session, so the account's `sub` from the ID token is used when there is one.
+    """
+    subject = None
+    id_token = session_data.get("id_token")
+    if id_token:
+        try:
+            payload = id_token.split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            subject = claims.get("sub") or claims.get("email")
+        except (IndexError, ValueError):
+            pass
+    return hashlib.sha256((subject or f"session:{session_id}").encode()).hexdigest()[:16]
+
+
+# ──────── Retry policy ──────────────────────────────────────────────────────────
+def is_rate_limited(error: HttpError) -> bool:
+    status = getattr(error.resp, "status", None)
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    try:
+        details = json.loads(error.content).get("error", {}).get("errors", [])
+    except (ValueError, AttributeError):
+        return False
+    return any(isinstance(detail, dict) and detail.get("reason") in RATE_LIMIT_REASONS for detail in details)
+
+
+def retry_after_seconds(error: HttpError) -> float | None:
+    """The response's Retry-After, in seconds or as an HTTP date."""
+    value = error.resp.get("retry-after") if hasattr(error.resp, "get") else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_seconds(attempt: int, retry_after: float | None = None) -> float:
+    """Exponential backoff with jitter (half fixed, half random), never shorter than Retry-After."""
+    ceiling = min(settings.GMAIL_BACKOFF_MAX_SECONDS, settings.GMAIL_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    return max(random.uniform(ceiling / 2, ceiling), retry_after or 0.0)
+
+
+# ──────── Limiter ───────────────────────────────────────────────────────────────
+@dataclass
+class _Waiter:
+    units: int
+    future: asyncio.Future
+    deadline: float
+
+
+class QuotaLimiter:
+    """
+    Per-user token bucket of Gmail quota units, kept in Redis so every MCP worker draws from the
+    same budget (a bucket in this process is used while Redis is unreachable).
+
+    Requests queue per user in arrival order. One drainer task per user reserves units for as many
+    queued requests as a full bucket covers in a single Redis round trip, releases them together,
+    and otherwise sleeps until the bucket has refilled (plus a little jitter, so workers do not
+    retry in lockstep). A rate-limit response from Gmail empties the shared bucket for the
+    Retry-After period via `penalise`.
+    """
+
+    def __init__(self, units_per_second: float, burst_units: int, max_wait_seconds: float, enabled: bool = True):
+        self.units_per_second = units_per_second
+        self.burst_units = burst_units
+        self.max_wait_seconds = max_wait_seconds
+        self.enabled = enabled
+        self._queues: dict[str, deque[_Waiter]] = {}
+        self._drainers: dict[str, asyncio.Task] = {}
+        self._script = None
+        self._script_client = None
+        self._local_buckets: dict[str, tuple[float, float]] = {}
+        self._redis_failing = False
+        self.requests = 0
+        self.reservations = 0
+        self.throttled_seconds = 0.0
+        self.timeouts = 0
+        self.penalties = 0
+
+    async def acquire(self, user: str, units: int):
+        """Waits until `units` of the user's quota are reserved; raises `GmailQuotaTimeout` past the max wait."""
+        if not self.enabled or units <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(units, loop.create_future(), loop.time() + self.max_wait_seconds)
+        self._queues.setdefault(user, deque()).append(waiter)
+        self.requests += 1
+        drainer = self._drainers.get(user)
+        if drainer is None or drainer.done() or drainer.get_loop() is not loop:
+            self._drainers[user] = loop.create_task(self._drain(user))
+        await waiter.future
+
+    async def penalise(self, user: str, seconds: float):
+        """Gmail rejected a request for this user: nobody spends their quota for `seconds`."""
+        if self.enabled and seconds > 0:
+            self.penalties += 1
+            await self._reserve(user, 0, hold_seconds=seconds)
+
+    async def _drain(self, user: str):
+        pending = self._queues[user]
+        loop = asyncio.get_running_loop()
+        try:
+            while pending:
+                group: list[_Waiter] = []
+                units = 0
+                while pending and (not group or units + pending[0].units <= self.burst_units):
+                    waiter = pending.popleft()
+                    if not waiter.future.done():  # cancelled callers give up their place
+                        group.append(waiter)
+                        units += waiter.units
+                if not group:
+                    continue
+
+                wait = await self._reserve(user, units)
+                self.reservations += 1
+                if wait <= 0:
+                    for waiter in group:
+                        if not waiter.future.done():
+                            waiter.future.set_result(None)
+                    continue
+
+                now = loop.time()
+                for waiter in group:
+                    if now + wait > waiter.deadline and not waiter.future.done():
+                        self.timeouts += 1
+                        waiter.future.set_exception(GmailQuotaTimeout(
+                            f"Gmail quota for this user is exhausted for the next {wait:.1f}s"
+                        ))
+                pending.extendleft(reversed(group))
+                wait *= random.uniform(1.0, 1.1)
+                self.throttled_seconds += wait
+                await asyncio.sleep(wait)
+        except BaseException as e:
+            for waiter in pending:
+                if not waiter.future.done():
+                    waiter.future.set_exception(e if isinstance(e, Exception) else asyncio.CancelledError())
+            pending.clear()
+            raise
+        finally:
+            if self._drainers.get(user) is asyncio.current_task():
+                del self._drainers[user]
+                if not pending:
+                    self._queues.pop(user, None)
+
+    async def _reserve(self, user: str, units: int, hold_seconds: float = 0.0) -> float:
+        """Seconds to wait before `units` can be reserved (0 when they were)."""
+        client = cache.async_redis_client
+        if client is not None:
+            try:
+                if self._script_client is not client:
+                    self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+                    self._script_client = client
+                wait = await self._script(
+                    keys=[f"{QUOTA_KEY_PREFIX}_{user}"],
+                    args=[self.units_per_second, self.burst_units, units, hold_seconds, 3600],
+                )
+                self._redis_failing = False
+                return float(wait)
+            except Exception as e:
+                if not self._redis_failing:
+                    log_message(f"Gmail quota bucket unavailable in Redis, limiting per process: {e}", level="warning")
+                self._redis_failing = True
+        return self._reserve_locally(user, units, hold_seconds)
+
+    def _reserve_locally(self, user: str, units: int, hold_seconds: float) -> float:
+        now = time.monotonic()
+        tokens, last = self._local_buckets.get(user, (float(self.burst_units), now))
+        tokens = min(self.burst_units, tokens + max(0.0, now - last) * self.units_per_second)
+        wait = 0.0
+        if hold_seconds > 0:
+            tokens = min(tokens, -hold_seconds * self.units_per_second)
+        elif tokens >= min(units, self.burst_units):
+            tokens -= units
+        else:
+            wait = (min(units, self.burst_units) - tokens) / self.units_per_second
+        self._local_buckets[user] = (tokens, now)
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "reservations": self.reservations,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "timeouts": self.timeouts,
+            "penalties": self.penalties,
+            "queued": sum(len(pending) for pending in self._queues.values()),
+        }
+
+
+quota_limiter = QuotaLimiter(
+    units_per_second=settings.GMAIL_QUOTA_UNITS_PER_SECOND,
+    burst_units=settings.GMAIL_QUOTA_BURST_UNITS,
+    max_wait_seconds=settings.GMAIL_QUOTA_MAX_WAIT_SECONDS,
+    enabled=settings.GMAIL_QUOTA_ENABLED,
+)
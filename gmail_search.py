@@ -0,0 +1,285 @@
+import asyncio
+import base64
+import email
+from email.message import Message
+from html.parser import HTMLParser
+from typing import Literal
+
+from googleapiclient.errors import HttpError
+
+from gmail_client import GmailClient
+from gmail_quota import backoff_seconds, is_rate_limited, quota_limiter, retry_after_seconds
+from logger.app_logger import log_message
+from settings import settings
+from tracing import span
+
+MessageFormat = Literal["full", "metadata", "raw"]
+SearchResource = Literal["messages", "threads"]
+
+METADATA_HEADERS = ["From", "To", "Cc", "Subject", "Date"]
+LIST_PAGE_SIZE = 500  # Gmail's maximum page size for messages.list / threads.list
+
+BLOCK_TAGS = {"p", "div", "br", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6", "table", "blockquote"}
+
+
+class _HTMLTextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style", "head"):
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style", "head"):
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    extractor = _HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    lines = (" ".join(line.split()) for line in "".join(extractor.parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _decode_body_data(data: str) -> str:
+    raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+
+def _find_payload_body(payload: dict) -> str:
+    """
+    Walks a `format=full` payload and returns its text/plain body, falling back to text/html.
+    """
+    html_body = None
+    stack = [payload]
+    while stack:
+        part = stack.pop(0)
+        if part.get("filename"):
+            continue  # attachment
+        mime_type = part.get("mimeType", "")
+        data = part.get("body", {}).get("data")
+        if data and mime_type == "text/plain":
+            return _decode_body_data(data)
+        if data and mime_type == "text/html" and html_body is None:
+            html_body = _decode_body_data(data)
+        stack.extend(part.get("parts", []))
+    return html_to_text(html_body) if html_body else ""
+
+
+def _find_raw_body(email_msg: Message) -> str:
+    html_body = None
+    for part in email_msg.walk() if email_msg.is_multipart() else [email_msg]:
+        if "attachment" in str(part.get("Content-Disposition")):
+            continue
+        payload = part.get_payload(decode=True)
+        if payload is None:
+            continue
+        try:
+            text = payload.decode("utf-8")
+        except UnicodeDecodeError:
+            text = payload.decode("latin-1")
+        if part.get_content_type() == "text/plain":
+            return text
+        if part.get_content_type() == "text/html" and html_body is None:
+            html_body = text
+    return html_to_text(html_body) if html_body else ""
+
+
+def parse_message(resource: dict, message_format: MessageFormat = "full") -> dict:
+    """
+    Converts a Gmail message resource into the email dict returned by `get_top_mails_for_query`.
+    """
+    if message_format == "raw":
+        email_msg = email.message_from_bytes(base64.urlsafe_b64decode(resource["raw"]))
+        headers = {key.lower(): value for key, value in email_msg.items()}
+        body = _find_raw_body(email_msg)
+    else:
+        payload = resource.get("payload", {})
+        headers = {header["name"].lower(): header["value"] for header in payload.get("headers", [])}
+        body = _find_payload_body(payload) if message_format == "full" else ""
+
+    return {
+        "id": resource["id"],
+        "threadId": resource.get("threadId"),
+        "snippet": resource.get("snippet", ""),
+        "body": body,
+        "subject": headers.get("subject"),
+        "sender": headers.get("from"),
+        "from": headers.get("from"),
+        "date": headers.get("date"),
+        "to": headers.get("to"),
+        "cc": headers.get("cc"),
+    }
+
+
+def parse_thread(resource: dict, message_format: MessageFormat = "full") -> dict:
+    """
+    Converts a Gmail thread resource into one record per conversation: the headers of its
+    latest message, who took part, and every message (oldest first) under `messages`.
+    `email_compactor.compact_emails` collapses the messages into a single transcript body.
+    """
+    messages = [parse_message(message, message_format) for message in resource.get("messages", [])]
+    first, last = (messages[0], messages[-1]) if messages else ({}, {})
+    return {
+        "id": resource["id"],
+        "threadId": resource["id"],
+        "snippet": last.get("snippet", ""),
+        "body": "",
+        "subject": first.get("subject"),
+        "sender": last.get("from"),
+        "from": last.get("from"),
+        "date": last.get("date"),
+        "to": last.get("to"),
+        "cc": last.get("cc"),
+        "first_date": first.get("date"),
+        "participants": list(dict.fromkeys(message["from"] for message in messages if message.get("from"))),
+        "message_count": len(messages),
+        "messages": messages,
+    }
+
+
+async def list_message_refs(
+    client: GmailClient, query: str, max_results: int, resource: SearchResource = "messages"
+) -> list[dict]:
+    """
+    Lists refs matching a Gmail query (`{"id", "threadId"}` for messages, `{"id", "snippet"}` for
+    threads), following pagination up to `max_results`.
+    """
+    collection = client.service.users().threads() if resource == "threads" else client.service.users().messages()
+    refs: list[dict] = []
+    page_token = None
+    while len(refs) < max_results:
+        request = collection.list(
+            userId="me",
+            q=query,
+            maxResults=min(LIST_PAGE_SIZE, max_results - len(refs)),
+            pageToken=page_token,
+        )
+        response = await client.aexecute(request)
+        refs.extend(response.get(resource, []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+    return refs[:max_results]
+
+
+def _get_request(client: GmailClient, resource_id: str, message_format: MessageFormat, resource: SearchResource):
+    collection = client.service.users().threads() if resource == "threads" else client.service.users().messages()
+    if message_format == "metadata":
+        return collection.get(userId="me", id=resource_id, format="metadata", metadataHeaders=METADATA_HEADERS)
+    if resource == "threads" and message_format == "raw":
+        message_format = "full"  # threads.get has no raw format
+    return collection.get(userId="me", id=resource_id, format=message_format)
+
+
+async def _execute_batch(
+    client: GmailClient, message_ids: list[str], message_format: MessageFormat, resource: SearchResource = "messages"
+):
+    responses: dict[str, dict] = {}
+    errors: dict[str, HttpError] = {}
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            responses[request_id] = response
+
+    with span("gmail batch", "gmail", items=len(message_ids), resource=resource, format=message_format) as batch_span:
+        batch = client.new_batch(callback=collect)
+        for message_id in message_ids:
+            batch.add(_get_request(client, message_id, message_format, resource), request_id=message_id)
+        await client.aexecute(batch)
+        batch_span.set(errors=len(errors))
+    return responses, errors
+
+
+async def fetch_messages(
+    client: GmailClient,
+    message_ids: list[str],
+    message_format: MessageFormat = "full",
+    resource: SearchResource = "messages",
+) -> list[dict]:
+    """
+    Hydrates message (or, with `resource="threads"`, thread) resources through Gmail batch requests.
+
+    Ids are split into batches of `GMAIL_BATCH_SIZE` which run concurrently on the client's
+    connections. Messages deleted in the meantime (404) are skipped. Parts Gmail rate limited are
+    retried after a backoff, up to `GMAIL_MAX_RETRIES` times; other failed parts are retried once
+    in a follow-up batch. Results keep the order of `message_ids`.
+    """
+    batch_size = max(1, settings.GMAIL_BATCH_SIZE)
+    resources: dict[str, dict] = {}
+    pending = list(dict.fromkeys(message_ids))
+    other_retries = 0
+
+    for attempt in range(settings.GMAIL_MAX_RETRIES + 1):
+        chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        results = await asyncio.gather(*(_execute_batch(client, chunk, message_format, resource) for chunk in chunks))
+        failed: dict[str, HttpError] = {}
+        for responses, errors in results:
+            resources.update(responses)
+            failed.update({key: error for key, error in errors.items() if error.resp.status != 404})
+        if not failed:
+            break
+        rate_limited = [error for error in failed.values() if is_rate_limited(error)]
+        if not rate_limited:
+            other_retries += 1
+        if attempt == settings.GMAIL_MAX_RETRIES or other_retries > 1:
+            raise next(iter(failed.values()))
+        log_message(f"[{client.session_id}]: Retrying {len(failed)} failed {resource} fetches", level="warning")
+        if rate_limited:
+            delay = backoff_seconds(attempt, max((retry_after_seconds(error) or 0.0) for error in rate_limited))
+            await quota_limiter.penalise(client.user, delay)
+            await asyncio.sleep(delay)
+        pending = list(failed)
+
+    return [resources[message_id] for message_id in message_ids if message_id in resources]
+
+
+async def search_messages(
+    client: GmailClient,
+    query: str,
+    max_results: int = 10,
+    message_format: MessageFormat = "full",
+) -> list[dict]:
+    """
+    Native replacement for LangChain's GmailSearch: one list call plus batched hydration
+    instead of one sequential `messages.get` round trip per result.
+    """
+    refs = await list_message_refs(client, query, max_results)
+    if not refs:
+        return []
+    resources = await fetch_messages(client, [ref["id"] for ref in refs], message_format)
+    return [parse_message(resource, message_format) for resource in resources]
+
+
+async def search_threads(
+    client: GmailClient,
+    query: str,
+    max_results: int = 10,
+    message_format: MessageFormat = "full",
+) -> list[dict]:
+    """
+    The `max_results` conversations matching a query, most recent first, each hydrated whole by
+    `threads.get` in the same batches as messages (see `parse_thread`).
+    """
+    refs = await list_message_refs(client, query, max_results, resource="threads")
+    if not refs:
+        return []
+    resources = await fetch_messages(client, [ref["id"] for ref in refs], message_format, resource="threads")
+    return [parse_thread(resource, "full" if message_format == "raw" else message_format) for resource in resources]
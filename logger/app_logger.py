@@ -1,30 +1,26 @@
+import atexit
 import json
-import sys
-import inspect
+import logging
 import os
+import queue
+import re
+import sys
+import threading
 import time
-from datetime import datetime
+import traceback
+from datetime import datetime, timezone
+from functools import lru_cache
 
 from loguru import logger
 from tqdm import tqdm
-import html
-import logging
-import re
-import traceback
 
 from settings import settings
 
 logger_format = "<green>{time}</green> | <level>{level: <8}</level> | {extra[logger_context]} | <level>{message}</level>"
 logger.remove()
 
-log_level="INFO"
-# Get current epoch time
-current_epoch_time = datetime.now().timestamp() * 1000
+log_level = settings.LOG_LEVEL.upper()
 log_file_name = settings.APP_NAME
-logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True, format=logger_format, backtrace=True, diagnose=True,
-               enqueue=True, level=log_level)
-logger.add(log_file_name, format=logger_format, rotation="10 MB", backtrace=True, diagnose=True, enqueue=True,
-               level=log_level)
 custom_logger = None
 html_tags_regex = re.compile(r'(<[^>]*>)')
 
@@ -34,6 +30,42 @@ def cleanhtml(raw_html):
   return cleantext
 
 
+# Every accepted spelling of a level, resolved once: name -> (loguru level, number).
+LEVELS = {
+    "debug": ("DEBUG", logging.DEBUG),
+    logging.DEBUG: ("DEBUG", logging.DEBUG),
+
+    "info": ("INFO", logging.INFO),
+    logging.INFO: ("INFO", logging.INFO),
+
+    "warn": ("WARNING", logging.WARNING),
+    "warning": ("WARNING", logging.WARNING),
+    logging.WARNING: ("WARNING", logging.WARNING),
+
+    "error": ("ERROR", logging.ERROR),
+    logging.ERROR: ("ERROR", logging.ERROR),
+
+    "critical": ("CRITICAL", logging.CRITICAL),
+    logging.CRITICAL: ("CRITICAL", logging.CRITICAL),
+
+    "fatal": ("CRITICAL", logging.CRITICAL),
+    logging.FATAL: ("CRITICAL", logging.CRITICAL),
+}
+LEVELS.update({name.upper(): value for name, value in list(LEVELS.items()) if isinstance(name, str)})
+min_level_no = LEVELS[log_level][1]
+
+
+def set_log_level(level):
+    """Changes the level below which `log_message` returns before doing any work."""
+    global log_level, min_level_no
+    log_level, min_level_no = LEVELS[level]
+
+
+def is_enabled_for(level) -> bool:
+    resolved = LEVELS.get(level)
+    return resolved is None or resolved[1] >= min_level_no
+
+
 # redirect all logging to loguru
 class InterceptHandler(logging.Handler):
     def emit(self, record):
@@ -49,16 +81,14 @@ class InterceptHandler(logging.Handler):
             frame = frame.f_back
             depth += 1
 
-        # from pdb import set_trace; set_trace()
         custom_logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
-        # log_message(record.getMessage(), level=level)
 
 
 # Define a function that adds contextual information to the logger
 def add_logger_context(log_level="INFO", **kwargs):
     global custom_logger
 
-    custom_logger = logger.bind(logger_context=kwargs).opt(colors=True)
+    custom_logger = logger.bind(logger_context=kwargs).patch(_use_event_time).opt(colors=True)
     handler = InterceptHandler()
     logging.basicConfig(handlers=[handler], level=log_level)
 
@@ -90,75 +120,174 @@ def format_to_str(data):
         return str(data)
 
 
-def log_message(message, *args, **kwargs):
-    # message = repr(html.escape(message, quote=True))[1:-1]
-    global custom_logger
-    if not custom_logger:
-        custom_logger = logger.bind(logger_context=kwargs).opt(colors=True)
-    message = repr(message)[1:-1]
-
-    level = kwargs.pop("level", "info")
-    if isinstance(level, str):
-        level = level.lower()
+@lru_cache(maxsize=1024)
+def relative_path(path: str) -> str:
+    return os.path.relpath(path, start=os.getcwd())
 
-    # if logging._nameToLevel.get(level, -1) <= logging.root.level:
-    #     return
 
-    # Get the frame of the caller
-    frame = inspect.currentframe().f_back
+def _use_event_time(record):
+    # Records reach the sinks from the writer thread; keep the time the caller logged them.
+    event_time = record["extra"].pop("event_time", None)
+    if event_time is not None:
+        record["time"] = record["time"].fromtimestamp(event_time, tz=record["time"].tzinfo)
 
-    # Get the caller's filename relative to the project root
-    filename = os.path.relpath(inspect.getfile(frame.f_code), start=os.getcwd())
 
-    # Get the caller's function name and line number
-    func_name = frame.f_code.co_name
-    line_no = frame.f_lineno
+# ──────── Sinks ─────────────────────────────────────────────────────────────────
+class JsonLineSink:
+    """Appends one JSON object per record to `path`, rotating to `path.1` past `max_bytes`."""
 
-    # message can contain HTML tags. do NOT escape it by using html.escape
-    # loguru expects all html tags to be prepended with a '\' in order to be escaped
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = open(path, "a", encoding="utf-8")
 
-    message = cleanhtml(message)
+    def write(self, record: dict):
+        self._file.write(json.dumps(record, default=str, ensure_ascii=False) + "\n")
 
-    message = re.sub(html_tags_regex, r'\\\1', message)
-    func_name = re.sub(html_tags_regex, r'\\\1', func_name)
-    args = re.sub(html_tags_regex, r'\\\1', ' '.join(map(format_to_str, args)))
+    def flush(self):
+        self._file.flush()
+        if self._file.tell() > self.max_bytes:
+            self._file.close()
+            os.replace(self.path, f"{self.path}.1")
+            self._file = open(self.path, "a", encoding="utf-8")
 
-    # Format the log message with the filename, function name, and line number
-    message = f"{colorize_filename(filename)}::<b><e>{func_name}</e></b> (<y>{line_no}</y>) - {message} {args}"
+    def close(self):
+        self._file.close()
 
-    # Use the logger to log the message
 
-    level_mapping = {
-        "debug": custom_logger.debug,
-        logging.DEBUG: custom_logger.debug,
+json_sink: JsonLineSink | None = None
 
-        "info": custom_logger.info,
-        logging.INFO: custom_logger.info,
 
-        "warn": custom_logger.warning,
-        "warning": custom_logger.warning,
-        logging.WARNING: custom_logger.warning,
+def configure_sinks(console: bool = True, log_file: str | None = log_file_name, json_path: str | None = None):
+    """
+    (Re)creates the output sinks. Text goes to loguru (console through tqdm, rotating file);
+    `json_path` adds structured JSON lines. Sinks are written from the log writer thread only.
+    """
+    global json_sink
+    flush_logs()
+    logger.remove()
+    if console:
+        logger.add(lambda msg: tqdm.write(msg, end=""), colorize=True, format=logger_format, backtrace=True,
+                   diagnose=True, level=log_level)
+    if log_file:
+        logger.add(log_file, format=logger_format, rotation="10 MB", backtrace=True, diagnose=True, level=log_level)
+    if json_sink is not None:
+        json_sink.close()
+    json_sink = JsonLineSink(json_path) if json_path else None
 
-        "error": custom_logger.error,
-        logging.ERROR: custom_logger.error,
 
-        "critical": custom_logger.critical,
-        logging.CRITICAL: custom_logger.critical,
+# ──────── Queue-backed writer ───────────────────────────────────────────────────
+# Callers only check the level, capture their frame's code object and line and enqueue; paths,
+# escaping, formatting and I/O happen on the writer thread.
+_log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+_FLUSH = object()
+dropped_records = 0
 
-        "fatal": custom_logger.critical,
-        logging.FATAL: custom_logger.critical,
-    }
 
+def _write_record(item):
+    global custom_logger
+    event_time, level_name, message, args, code, line_no, thread_name, fields = item
+    filename = relative_path(code.co_filename)
+    message = repr(str(message))[1:-1]
+
+    if json_sink is not None:
+        json_sink.write({
+            "time": datetime.fromtimestamp(event_time, timezone.utc).isoformat(),
+            "level": level_name,
+            "message": f"{message} {args}" if args else message,
+            "file": filename,
+            "function": code.co_name,
+            "line": line_no,
+            "thread": thread_name,
+            **({"fields": fields} if fields else {}),
+        })
+
+    if custom_logger is None:
+        custom_logger = logger.bind(logger_context={}).patch(_use_event_time).opt(colors=True)
+    # message can contain HTML tags. do NOT escape it by using html.escape
+    # loguru expects all html tags to be prepended with a '\' in order to be escaped
+    message = html_tags_regex.sub(r'\\\1', cleanhtml(message))
+    func_name = html_tags_regex.sub(r'\\\1', code.co_name)
+    args = html_tags_regex.sub(r'\\\1', args)
+    custom_logger.bind(event_time=event_time).log(
+        level_name,
+        f"{colorize_filename(filename)}::<b><e>{func_name}</e></b> (<y>{line_no}</y>) - {message} {args}",
+    )
+
+
+def _writer():
+    global dropped_records
+    while True:
+        item = _log_queue.get()
+        try:
+            if item is _FLUSH:
+                if json_sink is not None:
+                    json_sink.flush()
+                continue
+            _write_record(item)
+            if _log_queue.empty() and json_sink is not None:
+                json_sink.flush()
+            if dropped_records:
+                dropped, dropped_records = dropped_records, 0
+                custom_logger.warning(f"Log queue full, dropped {dropped} records")
+        except Exception:
+            traceback.print_exc()
+        finally:
+            _log_queue.task_done()
+
+
+_writer_thread = threading.Thread(target=_writer, name="log-writer", daemon=True)
+_writer_thread.start()
+
+
+def flush_logs(timeout: float = 5.0):
+    """Blocks until every record logged so far has been written (or `timeout` passes)."""
     try:
-        level_mapping[level](message, **kwargs)
-    except Exception:
-        # TODO: pls fix
-        traceback.print_exc()
-        print(message, flush=True)
+        _log_queue.put(_FLUSH, timeout=timeout)
+    except queue.Full:
         return
+    deadline = time.monotonic() + timeout
+    while _log_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+atexit.register(flush_logs)
+configure_sinks(json_path=settings.LOG_JSON_PATH)
+
+
+def log_message(message, *args, level="info", **kwargs):
+    """
+    Logs `message` from the caller's file, function and line. Returns immediately when `level`
+    is disabled; otherwise the record is queued for the writer thread and never blocks: when the
+    queue is full the record is dropped and counted. Keyword arguments are structured fields
+    (the JSON sink's `fields`).
+    """
+    resolved = LEVELS.get(level.lower() if isinstance(level, str) else level)
+    if resolved is None:
+        resolved = LEVELS["info"]
+    if resolved[1] < min_level_no:
+        return
+
+    frame = sys._getframe(1)
+    try:
+        _log_queue.put_nowait((
+            time.time(),
+            resolved[0],
+            message,
+            " ".join(map(format_to_str, args)) if args else "",
+            frame.f_code,
+            frame.f_lineno,
+            threading.current_thread().name,
+            kwargs,
+        ))
+    except queue.Full:
+        global dropped_records
+        dropped_records += 1
 
 
 if __name__ == "__main__":
+    set_log_level("DEBUG")
+    configure_sinks(log_file=None)
     add_logger_context(logger_context="test")
     log_message("test message")
     log_message("test message", level="debug")
@@ -174,21 +303,5 @@ if __name__ == "__main__":
     log_message("test message", level=logging.CRITICAL)
     log_message("test message", level=logging.FATAL)
 
-    log_message("test message", level="debug", extra={"logger_context": "test"})
-    log_message("test message", level="warning", extra={"logger_context": "test"})
-    log_message("test message", level="error", extra={"logger_context": "test"})
-    log_message("test message", level="critical", extra={"logger_context": "test"})
-    log_message("test message", level="fatal", extra={"logger_context": "test"})
-
-    log_message("test message", level=logging.DEBUG, extra={"logger_context": "test"})
-    log_message("test message", level=logging.INFO, extra={"logger_context": "test"})
-    log_message("test message", level=logging.WARNING, extra={"logger_context": "test"})
-    log_message("test message", level=logging.ERROR, extra={"logger_context": "test"})
-    log_message("test message", level=logging.CRITICAL, extra={"logger_context": "test"})
-    log_message("test message", level=logging.FATAL, extra={"logger_context": "test"})
-
-    log_message("test message", level="debug", extra={"logger_context": "test"}, a=1, b=2)
-    log_message("test message", level="warning", extra={"logger_context": "test"}, a=1, b=2)
-    log_message("test message", level="error", extra={"logger_context": "test"}, a=1, b=2)
-    log_message("test message", level="critical", extra={"logger_context": "test"}, a=1, b=2)
-    log_message("test message", level="fatal", extra={"logger_context": "test"}, a=1, b=2)
+    log_message("test <b>message</b> with", "args", {"a": 1}, level="info", request_id="abc")
+    flush_logs()
@@ -0,0 +1,763 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from googleapiclient.errors import HttpError
+
+import cache
+from email_compactor import clean_body
+from gmail_client import GmailClient
+from gmail_search import LIST_PAGE_SIZE, MessageFormat, fetch_messages, parse_message
+from logger.app_logger import log_message
+from settings import settings
+
+HISTORY_TYPES = ["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"]
+SYNC_CHUNK_SIZE = 200  # messages hydrated and written per step of the bulk sync
+SQL_BATCH_SIZE = 500  # ids per "IN (...)" lookup
+
+SYSTEM_LABELS = {
+    "inbox": "INBOX", "sent": "SENT", "spam": "SPAM", "trash": "TRASH", "draft": "DRAFT", "drafts": "DRAFT",
+    "starred": "STARRED", "important": "IMPORTANT", "unread": "UNREAD", "chat": "CHAT",
+}
+CATEGORY_LABELS = {
+    "primary": "CATEGORY_PERSONAL", "social": "CATEGORY_SOCIAL", "promotions": "CATEGORY_PROMOTIONS",
+    "updates": "CATEGORY_UPDATES", "forums": "CATEGORY_FORUMS",
+}
+RELATIVE_UNITS = {"d": 86400, "m": 30 * 86400, "y": 365 * 86400}
+
+QUERY_TOKEN_REGEX = re.compile(r'(-?)([A-Za-z_]+):("[^"]*"|\S+)|"([^"]*)"|(\S+)')
+
+# Bumped when the schema changes; an index file of another version is rebuilt from scratch.
+SCHEMA_VERSION = 2
+
+# Message text (snippet, body, chunks) is stored Fernet-encrypted. The full-text index is contentless
+# (it keeps terms, not the text), so rows are added to and removed from it explicitly.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    internal_date INTEGER,
+    history_id INTEGER,
+    sender TEXT,
+    recipients TEXT,
+    cc TEXT,
+    subject TEXT,
+    date TEXT,
+    snippet BLOB,
+    body BLOB
+);
+CREATE INDEX IF NOT EXISTS messages_internal_date ON messages (internal_date DESC);
+CREATE TABLE IF NOT EXISTS message_labels (
+    message_id TEXT NOT NULL,
+    label_id TEXT NOT NULL,
+    PRIMARY KEY (message_id, label_id)
+);
+CREATE INDEX IF NOT EXISTS message_labels_label ON message_labels (label_id);
+CREATE TABLE IF NOT EXISTS labels (id TEXT PRIMARY KEY, name TEXT);
+CREATE TABLE IF NOT EXISTS message_chunks (
+    message_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    text BLOB NOT NULL,
+    model TEXT,
+    embedding BLOB,
+    PRIMARY KEY (message_id, chunk)
+);
+CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, sender, recipients, body, snippet, content=''
+);
+"""
+DROP_SCHEMA = """
+DROP TRIGGER IF EXISTS messages_ai;
+DROP TRIGGER IF EXISTS messages_ad;
+DROP TRIGGER IF EXISTS messages_au;
+DROP TABLE IF EXISTS messages_fts;
+DROP TABLE IF EXISTS messages;
+DROP TABLE IF EXISTS message_labels;
+DROP TABLE IF EXISTS labels;
+DROP TABLE IF EXISTS message_chunks;
+DROP TABLE IF EXISTS sync_state;
+"""
+
+
+class UnsupportedQuery(ValueError):
+    """Raised when a Gmail query uses an operator the local index cannot answer faithfully."""
+
+
+@dataclass
+class CompiledQuery:
+    conditions: list[str] = field(default_factory=list)
+    params: list = field(default_factory=list)
+    fts_terms: list[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        """The query's free text, without its operators."""
+        return " ".join(term[1:-1].replace('""', '"') for term in self.fts_terms)
+
+
+def _like(value: str) -> str:
+    escaped = value.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _fts_phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _parse_date_ms(value: str) -> int:
+    if value.isdigit():
+        return int(value) * 1000  # Gmail accepts epoch seconds
+    for date_format in ("%Y/%m/%d", "%Y-%m-%d", "%m/%d/%Y"):
+        try:
+            parsed = datetime.strptime(value, date_format).replace(tzinfo=timezone.utc)
+            return int(parsed.timestamp() * 1000)
+        except ValueError:
+            continue
+    raise UnsupportedQuery(f"Unsupported date: {value}")
+
+
+def _parse_relative_ms(value: str) -> int:
+    match = re.fullmatch(r"(\d+)([dmy])", value.lower())
+    if not match:
+        raise UnsupportedQuery(f"Unsupported relative date: {value}")
+    return int(match.group(1)) * RELATIVE_UNITS[match.group(2)] * 1000
+
+
+def _label_condition(negate: bool = False) -> str:
+    return f"{'NOT ' if negate else ''}EXISTS (SELECT 1 FROM message_labels ml WHERE ml.message_id = m.id AND ml.label_id = ?)"
+
+
+def compile_gmail_query(query: str, now: float | None = None) -> CompiledQuery:
+    """
+    Translates a Gmail search query into SQL conditions over the local index.
+
+    Supports from:, to:, cc:, subject:, label:, in:, is:, category:, after:, before:,
+    newer_than:, older_than:, free text and "quoted phrases", all implicitly AND-ed.
+    Anything else (OR, grouping, negation, has:, size operators, ...) raises `UnsupportedQuery`.
+    """
+    now_ms = int((now if now is not None else time.time()) * 1000)
+    compiled = CompiledQuery()
+
+    for match in QUERY_TOKEN_REGEX.finditer(query or ""):
+        negation, operator, value, phrase, word = match.groups()
+        if operator is not None:
+            if negation:
+                raise UnsupportedQuery(f"Negated operator: {match.group(0)}")
+            operator = operator.lower()
+            value = value.strip('"')
+            lowered = value.lower()
+
+            if operator == "from":
+                compiled.conditions.append("lower(m.sender) LIKE ? ESCAPE '\\'")
+                compiled.params.append(_like(value))
+            elif operator == "to":
+                compiled.conditions.append("(lower(m.recipients) LIKE ? ESCAPE '\\' OR lower(m.cc) LIKE ? ESCAPE '\\')")
+                compiled.params.extend([_like(value), _like(value)])
+            elif operator == "cc":
+                compiled.conditions.append("lower(m.cc) LIKE ? ESCAPE '\\'")
+                compiled.params.append(_like(value))
+            elif operator == "subject":
+                compiled.conditions.append("lower(m.subject) LIKE ? ESCAPE '\\'")
+                compiled.params.append(_like(value))
+            elif operator == "label":
+                compiled.conditions.append(
+                    "EXISTS (SELECT 1 FROM message_labels ml JOIN labels l ON l.id = ml.label_id "
+                    "WHERE ml.message_id = m.id AND (lower(l.id) = ? OR "
+                    "replace(replace(lower(l.name), ' ', '-'), '/', '-') = ?))"
+                )
+                normalised = lowered.replace(" ", "-").replace("/", "-")
+                compiled.params.extend([SYSTEM_LABELS.get(lowered, lowered).lower(), normalised])
+            elif operator in ("in", "is"):
+                if lowered in ("anywhere", "all", "spam", "trash"):
+                    # The sync, like messages.list, skips spam and trash.
+                    raise UnsupportedQuery(f"Index does not cover {operator}:{value}")
+                elif lowered == "read":
+                    compiled.conditions.append(_label_condition(negate=True))
+                    compiled.params.append("UNREAD")
+                elif lowered in SYSTEM_LABELS:
+                    compiled.conditions.append(_label_condition())
+                    compiled.params.append(SYSTEM_LABELS[lowered])
+                else:
+                    raise UnsupportedQuery(f"Unsupported {operator}: value {value}")
+            elif operator == "category":
+                if lowered not in CATEGORY_LABELS:
+                    raise UnsupportedQuery(f"Unsupported category: {value}")
+                compiled.conditions.append(_label_condition())
+                compiled.params.append(CATEGORY_LABELS[lowered])
+            elif operator == "after":
+                compiled.conditions.append("m.internal_date >= ?")
+                compiled.params.append(_parse_date_ms(value))
+            elif operator == "before":
+                compiled.conditions.append("m.internal_date < ?")
+                compiled.params.append(_parse_date_ms(value))
+            elif operator == "newer_than":
+                compiled.conditions.append("m.internal_date >= ?")
+                compiled.params.append(now_ms - _parse_relative_ms(value))
+            elif operator == "older_than":
+                compiled.conditions.append("m.internal_date < ?")
+                compiled.params.append(now_ms - _parse_relative_ms(value))
+            else:
+                raise UnsupportedQuery(f"Unsupported operator: {operator}:")
+        elif phrase is not None:
+            if phrase.strip():
+                compiled.fts_terms.append(_fts_phrase(phrase))
+        else:
+            if word == "AND":
+                continue
+            if word == "OR" or word.startswith(("-", "(", "{")) or word.endswith((")", "}")) or word.startswith("+"):
+                raise UnsupportedQuery(f"Unsupported query syntax: {word}")
+            compiled.fts_terms.append(_fts_phrase(word))
+
+    # Messages moved to spam or trash after the sync stay indexed, Gmail hides them by default.
+    compiled.conditions.append(
+        "NOT EXISTS (SELECT 1 FROM message_labels ml WHERE ml.message_id = m.id AND ml.label_id IN ('SPAM', 'TRASH'))"
+    )
+    return compiled
+
+
+def _encrypt(text: str) -> bytes:
+    return cache.fernet.encrypt(text.encode())
+
+
+def _decrypt(token: bytes) -> str:
+    return cache.fernet.decrypt(token).decode()
+
+
+def _message_row(resource: dict) -> tuple:
+    parsed = parse_message(resource, "full")
+    return (
+        parsed["id"],
+        parsed["threadId"],
+        int(resource.get("internalDate", 0)),
+        int(resource.get("historyId", 0)),
+        parsed["from"] or "",
+        parsed["to"] or "",
+        parsed["cc"] or "",
+        parsed["subject"] or "",
+        parsed["date"] or "",
+        parsed["snippet"],
+        parsed["body"],
+    )
+
+
+def chunk_message(subject: str, sender: str, body: str, snippet: str = "") -> list[str]:
+    """
+    Splits a message into overlapping windows of `SEMANTIC_CHUNK_WORDS` words for embedding.
+    Quoted history and signatures are dropped (the quoted message has chunks of its own) and
+    every chunk starts with the subject and sender.
+    """
+    header = f"{subject}\n{sender}\n"
+    words = clean_body(body).split() or (snippet or "").split()
+    size = max(1, settings.SEMANTIC_CHUNK_WORDS)
+    step = max(1, size - settings.SEMANTIC_CHUNK_OVERLAP_WORDS)
+    return [header + " ".join(words[start:start + size]) for start in range(0, max(1, len(words) - size + step), step)]
+
+
+def _row_to_email(row: sqlite3.Row, message_format: MessageFormat) -> dict:
+    return {
+        "id": row["id"],
+        "threadId": row["thread_id"],
+        "snippet": _decrypt(row["snippet"]),
+        "body": _decrypt(row["body"]) if message_format == "full" else "",
+        "subject": row["subject"] or None,
+        "sender": row["sender"] or None,
+        "from": row["sender"] or None,
+        "date": row["date"] or None,
+        "to": row["recipients"] or None,
+        "cc": row["cc"] or None,
+    }
+
+
+class MailboxIndex:
+    """
+    On-disk SQLite/FTS5 index of one Gmail user's most recent messages.
+
+    Filled by `bulk_sync` (newest `MAILBOX_INDEX_MAX_MESSAGES` messages) and kept current with
+    Gmail's history API (`incremental_sync`). All methods are blocking, async callers go through
+    `asyncio.to_thread`. Message text is encrypted with `cache.fernet`; headers stay in clear for
+    the from:/to:/subject: operators. Workers on the same host share the file: SQLite waits
+    `MAILBOX_INDEX_BUSY_TIMEOUT_MS` for another worker's write, and syncs are claimed in Redis
+    under `key`.
+
+    Messages are also split into chunks (`chunk_message`) whose embeddings are filled in by
+    `semantic_search.embed_pending`; `version` changes with every write, so readers can cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.key = f"{socket.gethostname()}_{os.path.splitext(os.path.basename(path))[0]}"
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.sync_lock = asyncio.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock:
+            self._connection.execute(f"PRAGMA busy_timeout = {int(settings.MAILBOX_INDEX_BUSY_TIMEOUT_MS)}")
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            if self._connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                # Older versions kept message text in clear: dropped, the file rewritten, and synced again.
+                self._connection.executescript(f"{DROP_SCHEMA}{SCHEMA}PRAGMA user_version = {SCHEMA_VERSION};")
+                self._connection.execute("VACUUM")
+                self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    @property
+    def version(self) -> tuple[int, int]:
+        """Changes with every write, by this process or (`data_version`) another worker."""
+        with self._lock:
+            return self._writes, self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    # ──────── Sync state ─────────────────────────────────────────────────────────
+    def get_state(self, key: str, default=None):
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_state(self, **values):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in values.items()],
+            )
+
+    def is_ready(self) -> bool:
+        return bool(self.get_state("history_id"))
+
+    def is_fresh(self) -> bool:
+        last_sync_at = self.get_state("last_sync_at", 0)
+        return time.time() - last_sync_at <= settings.MAILBOX_INDEX_MAX_STALENESS_SECONDS
+
+    # ──────── Writes ──────────────────────────────────────────────────────────────
+    def upsert_messages(self, resources: list[dict]):
+        # Parsing, chunking and encryption happen before taking the lock, readers only wait for the writes.
+        messages = list({row[0]: row for row in map(_message_row, resources)}.values())
+        rows = [row[:9] + (_encrypt(row[9]), _encrypt(row[10])) for row in messages]
+        chunks = [
+            (row[0], number, _encrypt(text))
+            for row in messages
+            for number, text in enumerate(chunk_message(row[7], row[4], row[10], row[9]))
+        ]
+        with self._lock, self._connection:
+            self._unindex_text([row[0] for row in messages])
+            self._connection.executemany(
+                "INSERT INTO messages (id, thread_id, internal_date, history_id, sender, recipients, cc, subject, date, snippet, body) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET thread_id = excluded.thread_id, internal_date = excluded.internal_date, "
+                "history_id = excluded.history_id, sender = excluded.sender, recipients = excluded.recipients, "
+                "cc = excluded.cc, subject = excluded.subject, date = excluded.date, snippet = excluded.snippet, "
+                "body = excluded.body",
+                rows,
+            )
+            self._connection.executemany(
+                "INSERT INTO messages_fts (rowid, subject, sender, recipients, body, snippet) "
+                "SELECT rowid, ?, ?, ?, ?, ? FROM messages WHERE id = ?",
+                [(row[7], row[4], row[5], row[10], row[9], row[0]) for row in messages],
+            )
+            for resource in resources:
+                self._replace_labels(resource["id"], resource.get("labelIds", []))
+            self._connection.executemany("DELETE FROM message_chunks WHERE message_id = ?", [(row[0],) for row in rows])
+            self._connection.executemany("INSERT INTO message_chunks (message_id, chunk, text) VALUES (?, ?, ?)", chunks)
+            self._writes += 1
+
+    def _unindex_text(self, message_ids: list[str]):
+        """Removes messages from the contentless full-text index, which needs the text it indexed."""
+        rows = []
+        for offset in range(0, len(message_ids), SQL_BATCH_SIZE):
+            batch = message_ids[offset:offset + SQL_BATCH_SIZE]
+            rows += self._connection.execute(
+                f"SELECT rowid, subject, sender, recipients, body, snippet FROM messages "
+                f"WHERE id IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall()
+        self._connection.executemany(
+            "INSERT INTO messages_fts (messages_fts, rowid, subject, sender, recipients, body, snippet) "
+            "VALUES ('delete', ?, ?, ?, ?, ?, ?)",
+            [(row[0], row[1], row[2], row[3], _decrypt(row[4]), _decrypt(row[5])) for row in rows],
+        )
+
+    def set_message_labels(self, message_id: str, label_ids: list[str]):
+        with self._lock, self._connection:
+            self._replace_labels(message_id, label_ids)
+            self._writes += 1
+
+    def _replace_labels(self, message_id: str, label_ids: list[str]):
+        self._connection.execute("DELETE FROM message_labels WHERE message_id = ?", (message_id,))
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO message_labels (message_id, label_id) VALUES (?, ?)",
+            [(message_id, label_id) for label_id in label_ids],
+        )
+
+    def delete_messages(self, message_ids: list[str]):
+        with self._lock, self._connection:
+            self._unindex_text(message_ids)
+            self._connection.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in message_ids])
+            self._connection.executemany("DELETE FROM message_labels WHERE message_id = ?", [(i,) for i in message_ids])
+            self._connection.executemany("DELETE FROM message_chunks WHERE message_id = ?", [(i,) for i in message_ids])
+            self._writes += 1
+
+    def replace_labels_catalog(self, labels: list[dict]):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM labels")
+            self._connection.executemany(
+                "INSERT INTO labels (id, name) VALUES (?, ?)",
+                [(label["id"], label.get("name", label["id"])) for label in labels],
+            )
+
+    def message_ids(self) -> set[str]:
+        with self._lock:
+            return {row["id"] for row in self._connection.execute("SELECT id FROM messages")}
+
+    # ──────── Reads ───────────────────────────────────────────────────────────────
+    def search(self, query: str, max_results: int, message_format: MessageFormat = "full") -> list[dict]:
+        compiled = compile_gmail_query(query)
+        conditions = list(compiled.conditions)
+        params = list(compiled.params)
+        if compiled.fts_terms:
+            conditions.append("m.rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            params.append(" AND ".join(compiled.fts_terms))
+
+        sql = "SELECT m.* FROM messages m"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY m.internal_date DESC LIMIT ?"
+        params.append(max_results)
+
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [_row_to_email(row, message_format) for row in rows]
+
+    def get_messages(self, message_ids: list[str], message_format: MessageFormat = "full") -> list[dict]:
+        """Indexed messages by id, in the order given."""
+        if not message_ids:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT * FROM messages WHERE id IN ({', '.join('?' * len(message_ids))})", message_ids
+            ).fetchall()
+        by_id = {row["id"]: row for row in rows}
+        return [_row_to_email(by_id[message_id], message_format) for message_id in message_ids if message_id in by_id]
+
+    def matching_ids(self, compiled: CompiledQuery) -> set[str]:
+        """Ids of the messages that pass the query's operators (its free text is not applied)."""
+        sql = "SELECT m.id FROM messages m"
+        if compiled.conditions:
+            sql += " WHERE " + " AND ".join(compiled.conditions)
+        with self._lock:
+            return {row["id"] for row in self._connection.execute(sql, compiled.params)}
+
+    def keyword_ranking(self, terms: list[str], max_results: int) -> list[str]:
+        """Message ids matching any of `terms`, best BM25 score first (subject weighted highest)."""
+        if not terms:
+            return []
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT m.id FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+                "WHERE messages_fts MATCH ? ORDER BY bm25(messages_fts, 4.0, 2.0, 1.0, 1.0, 0.5) LIMIT ?",
+                (" OR ".join(terms), max_results),
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    # ──────── Chunk embeddings ────────────────────────────────────────────────────
+    def pending_chunks(self, model: str, limit: int) -> list[tuple[str, int, str]]:
+        """Chunks without an embedding from `model`: `(message id, chunk number, text)`."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT message_id, chunk, text FROM message_chunks WHERE model IS NOT ? LIMIT ?", (model, limit)
+            ).fetchall()
+        return [(row["message_id"], row["chunk"], _decrypt(row["text"])) for row in rows]
+
+    def count_pending_chunks(self, model: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT count(*) FROM message_chunks WHERE model IS NOT ?", (model,)
+            ).fetchone()[0]
+
+    def store_embeddings(self, model: str, embeddings: list[tuple[str, int, bytes]]):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE message_chunks SET model = ?, embedding = ? WHERE message_id = ? AND chunk = ?",
+                [(model, embedding, message_id, chunk) for message_id, chunk, embedding in embeddings],
+            )
+            self._writes += 1
+
+    def chunk_embeddings(self, model: str) -> list[tuple[str, bytes]]:
+        """`(message id, embedding)` of every chunk embedded with `model`."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT message_id, embedding FROM message_chunks WHERE model = ?", (model,)
+            ).fetchall()
+        return [(row["message_id"], row["embedding"]) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+# ──────── Sync against Gmail ─────────────────────────────────────────────────────
+async def bulk_sync(index: MailboxIndex, client: GmailClient):
+    """
+    Indexes the newest `MAILBOX_INDEX_MAX_MESSAGES` messages and records the history id to resume from.
+    """
+    started = time.perf_counter()
+    # Take the history id first: anything that changes while we list is replayed by the next incremental sync.
+    profile = await client.aexecute(client.service.users().getProfile(userId="me"))
+    await _sync_labels(index, client)
+
+    max_messages = settings.MAILBOX_INDEX_MAX_MESSAGES
+    seen: set[str] = set()
+    page_token = None
+    complete = False
+    while len(seen) < max_messages:
+        request = client.service.users().messages().list(
+            userId="me", maxResults=min(LIST_PAGE_SIZE, max_messages - len(seen)), pageToken=page_token
+        )
+        response = await client.aexecute(request)
+        ids = [ref["id"] for ref in response.get("messages", [])]
+        for offset in range(0, len(ids), SYNC_CHUNK_SIZE):
+            resources = await fetch_messages(client, ids[offset:offset + SYNC_CHUNK_SIZE], "full")
+            await asyncio.to_thread(index.upsert_messages, resources)
+        seen.update(ids)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            complete = True
+            break
+
+    stale_ids = await asyncio.to_thread(index.message_ids) - seen
+    if stale_ids:
+        await asyncio.to_thread(index.delete_messages, list(stale_ids))
+
+    await asyncio.to_thread(
+        index.set_state,
+        history_id=profile["historyId"],
+        last_sync_at=time.time(),
+        complete=complete,
+        email_address=profile.get("emailAddress"),
+    )
+    log_message(
+        f"[{client.session_id}]: Indexed {len(seen)} messages (complete={complete}) "
+        f"in {time.perf_counter() - started:.2f}s",
+        level="info",
+    )
+
+
+async def incremental_sync(index: MailboxIndex, client: GmailClient):
+    """
+    Applies Gmail history records since the stored history id. Falls back to a bulk sync
+    when Gmail no longer has history that far back (404).
+    """
+    start_history_id = await asyncio.to_thread(index.get_state, "history_id")
+    added: set[str] = set()
+    deleted: set[str] = set()
+    label_changes: dict[str, list[str]] = {}
+    page_token = None
+    latest_history_id = start_history_id
+
+    try:
+        while True:
+            request = client.service.users().history().list(
+                userId="me", startHistoryId=start_history_id, historyTypes=HISTORY_TYPES, pageToken=page_token
+            )
+            response = await client.aexecute(request)
+            latest_history_id = response.get("historyId", latest_history_id)
+            for record in response.get("history", []):
+                for item in record.get("messagesAdded", []):
+                    added.add(item["message"]["id"])
+                    deleted.discard(item["message"]["id"])
+                for item in record.get("messagesDeleted", []):
+                    deleted.add(item["message"]["id"])
+                    added.discard(item["message"]["id"])
+                for item in record.get("labelsAdded", []) + record.get("labelsRemoved", []):
+                    label_changes[item["message"]["id"]] = item["message"].get("labelIds", [])
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+    except HttpError as e:
+        if e.resp.status == 404:
+            log_message(f"[{client.session_id}]: History {start_history_id} expired, re-syncing index", level="warning")
+            await bulk_sync(index, client)
+            return
+        raise
+
+    if added:
+        resources = await fetch_messages(client, list(added), "full")
+        await asyncio.to_thread(index.upsert_messages, resources)
+    if deleted:
+        await asyncio.to_thread(index.delete_messages, list(deleted))
+    for message_id, label_ids in label_changes.items():
+        if message_id not in added and message_id not in deleted:
+            await asyncio.to_thread(index.set_message_labels, message_id, label_ids)
+    if label_changes:
+        await _sync_labels(index, client)
+
+    await asyncio.to_thread(index.set_state, history_id=latest_history_id, last_sync_at=time.time())
+    if added or deleted or label_changes:
+        log_message(
+            f"[{client.session_id}]: Index sync applied {len(added)} added, {len(deleted)} deleted, "
+            f"{len(label_changes)} relabelled messages",
+            level="debug",
+        )
+
+
+async def _sync_labels(index: MailboxIndex, client: GmailClient):
+    response = await client.aexecute(client.service.users().labels().list(userId="me"))
+    await asyncio.to_thread(index.replace_labels_catalog, response.get("labels", []))
+
+
+# ──────── Index registry ─────────────────────────────────────────────────────────
+_indexes: dict[str, MailboxIndex] = {}
+_session_users: OrderedDict[str, tuple[float, str]] = OrderedDict()  # session id -> (last used, email address)
+_background_syncs: dict[str, asyncio.Task] = {}
+
+
+def _prune_session_users(now: float):
+    """Forgets sessions unused for `MAILBOX_INDEX_SESSION_IDLE_SECONDS` (logged out or expired)."""
+    while _session_users:
+        session_id, (last_used, _) = next(iter(_session_users.items()))
+        if now - last_used <= settings.MAILBOX_INDEX_SESSION_IDLE_SECONDS:
+            break
+        del _session_users[session_id]
+
+
+async def get_mailbox_index(client: GmailClient) -> MailboxIndex:
+    """
+    Returns the index of the Gmail user behind `client`, keyed by the account's email address.
+    """
+    now = time.monotonic()
+    _prune_session_users(now)
+    entry = _session_users.get(client.session_id)
+    if entry is None:
+        profile = await client.aexecute(client.service.users().getProfile(userId="me"))
+        email_address = profile["emailAddress"]
+    else:
+        email_address = entry[1]
+    _session_users[client.session_id] = (now, email_address)
+    _session_users.move_to_end(client.session_id)
+
+    index = _indexes.get(email_address)
+    if index is None:
+        os.makedirs(settings.MAILBOX_INDEX_DIR, exist_ok=True)
+        file_name = hashlib.sha256(email_address.lower().encode()).hexdigest()[:24] + ".sqlite3"
+        opened = await asyncio.to_thread(MailboxIndex, os.path.join(settings.MAILBOX_INDEX_DIR, file_name))
+        index = _indexes.setdefault(email_address, opened)
+        if index is not opened:
+            opened.close()
+    return index
+
+
+@asynccontextmanager
+async def _claim_sync(index: MailboxIndex):
+    """Claims syncing `index` across workers; yields False when another worker is syncing it."""
+    token = await cache.aacquire_index_sync_lock(index.key, settings.MAILBOX_INDEX_SYNC_LOCK_SECONDS)
+    try:
+        yield token is not None
+    finally:
+        if token is not None:
+            await cache.arelease_index_sync_lock(index.key, token)
+
+
+async def _wait_until_fresh(index: MailboxIndex, wait_seconds: float, poll_seconds: float = 0.1):
+    deadline = time.monotonic() + wait_seconds
+    while time.monotonic() < deadline and not await asyncio.to_thread(index.is_fresh):
+        await asyncio.sleep(poll_seconds)
+
+
+def schedule_bulk_sync(index: MailboxIndex, client: GmailClient) -> asyncio.Task:
+    """
+    Starts building the index in the background (once); returns the task building it. Nothing is
+    built while another worker is building the same index.
+    """
+    task = _background_syncs.get(index.path)
+    if task is not None and not task.done():
+        return task
+
+    async def run():
+        async with index.sync_lock:
+            try:
+                if await asyncio.to_thread(index.is_ready):
+                    return
+                async with _claim_sync(index) as claimed:
+                    if claimed:
+                        await bulk_sync(index, client)
+                    else:
+                        log_message(f"[{client.session_id}]: Another worker is building the mailbox index", level="debug")
+            except Exception:
+                log_message(f"[{client.session_id}]: Mailbox index bulk sync failed: {traceback.format_exc()}", level="error")
+
+    task = _background_syncs[index.path] = asyncio.create_task(run())
+    return task
+
+
+async def current_mailbox_index(client: GmailClient) -> MailboxIndex | None:
+    """
+    The session's index, brought up to date with the history API when it is stale. None (and a
+    bulk sync is scheduled) while the index is still being built. When another worker is syncing
+    it, waits up to `MAILBOX_INDEX_SYNC_WAIT_SECONDS` for that sync instead.
+    """
+    index = await get_mailbox_index(client)
+    if not await asyncio.to_thread(index.is_ready):
+        schedule_bulk_sync(index, client)
+        return None
+
+    if not await asyncio.to_thread(index.is_fresh):
+        async with index.sync_lock:
+            if not await asyncio.to_thread(index.is_fresh):
+                async with _claim_sync(index) as claimed:
+                    if claimed:
+                        await incremental_sync(index, client)
+                    else:
+                        await _wait_until_fresh(index, settings.MAILBOX_INDEX_SYNC_WAIT_SECONDS)
+    return index
+
+
+async def search_mailbox_index(
+    client: GmailClient,
+    query: str,
+    max_results: int,
+    message_format: MessageFormat = "full",
+) -> list[dict] | None:
+    """
+    Answers a Gmail query from the local index.
+
+    Returns None when the caller has to go to the live API instead: the index is still being
+    built, cannot be brought up to date, the query uses an unsupported operator, or the index
+    only covers part of the mailbox and holds fewer matches than requested.
+    """
+    if not settings.MAILBOX_INDEX_ENABLED or message_format == "raw":
+        return None
+
+    try:
+        compile_gmail_query(query)
+    except UnsupportedQuery as e:
+        log_message(f"[{client.session_id}]: Index cannot answer query ({e}), using Gmail", level="debug")
+        return None
+
+    try:
+        index = await current_mailbox_index(client)
+        if index is None:
+            return None
+
+        started = time.perf_counter()
+        results = await asyncio.to_thread(index.search, query, max_results, message_format)
+        if len(results) < max_results and not await asyncio.to_thread(index.get_state, "complete", False):
+            # Older messages outside the indexed window might match too.
+            return None
+
+        log_message(
+            f"[{client.session_id}]: Served {len(results)} emails from the local index "
+            f"in {(time.perf_counter() - started) * 1000:.1f}ms",
+            level="debug",
+        )
+        return results
+    except Exception:
+        log_message(f"[{client.session_id}]: Mailbox index unavailable: {traceback.format_exc()}", level="warning")
+        return None
@@ -1,11 +1,22 @@
+import html
 import json
-import asyncio
+import re
+import time
+from typing import Iterator
+
+import altair as alt
 import streamlit as st
 from config import *
-from agent import get_emails_using_mcp
-from cache import save_encrypted_cache
+from agent import answer_query, stream_emails_using_mcp, warm_up_session
+from cache import get_digest_results, save_encrypted_cache, schedule_digest
+from gmail_quota import quota_user
+from runtime import get_runtime
+from settings import settings
+from tracing import get_trace, new_trace_id
 from uuid import uuid4
 
+MARKDOWN_SPECIAL_CHARACTERS = re.compile(r"[\\`*_{}\[\]()#+\-.!|~>]")
+
 # ──────── App Configuration ───────────────────────────────────────────────────
 st.set_page_config(
     page_title="Google OAuth Email Summariser",
@@ -18,23 +29,121 @@ def authenticate(oauth, code):
     token = oauth.fetch_token(code)
     oauth.save_token(token)
     st.session_state["session_id"] = str(uuid4())  # Generate a unique session ID
-    save_encrypted_cache(st.session_state["session_id"], token, expire_in=3600)  # Save token in cache
+    # The session outlives the access token; the MCP server refreshes it (token_manager.py).
+    save_encrypted_cache(st.session_state["session_id"], token, expire_in=settings.SESSION_TTL_SECONDS)
+    if settings.WARMUP_ENABLED:
+        # Fire and forget: index, connections and recent summaries are prepared while the user types.
+        get_runtime().submit(warm_up_session(st.session_state["session_id"]))
+    if settings.DIGEST_ENABLED:
+        # Run by digest_worker.py in the background; shown above the chat once it is done. One per
+        # Gmail user: a new login moves it to the new session rather than adding another.
+        schedule_digest(st.session_state["session_id"], settings.DIGEST_DEFAULT_NAME,
+                        settings.DIGEST_DEFAULT_QUERY, settings.DIGEST_DEFAULT_INTERVAL_SECONDS,
+                        user=quota_user(st.session_state["session_id"], token))
     st.experimental_set_query_params()  # clear code from URL
     st.sidebar.success("✅ Authentication successful!")
     return token
 
 # ──────── Caching for Summarisation ────────────────────────────────────────────
 @st.cache_data(show_spinner=False)
-def fetch_and_summarize(access_token: str, query: str) -> list[str]:
-    response = asyncio.run(get_emails_using_mcp(access_token, query))
+def fetch_and_summarize(access_token: str, query: str, _trace_id: str | None = None) -> list[str]:
+    # Runs on the shared runtime loop, reusing its MCP session and model connection pool.
+    # The trace id is not part of the cache key (leading underscore); cached answers have no trace.
+    return get_runtime().run(answer_query(access_token, query, trace_id=_trace_id))
+
+
+def stream_and_summarize(access_token: str, query: str, trace_id: str | None = None) -> Iterator[dict]:
+    """
+    Drives `stream_emails_using_mcp` on the shared runtime loop from Streamlit's script thread.
+    """
+    yield from get_runtime().iterate(stream_emails_using_mcp(access_token, query, trace_id=trace_id))
+
+
+def escape_markdown(text: str) -> str:
+    """`text` rendered literally by `st.markdown`: HTML escaped, markdown syntax backslash-escaped."""
+    return MARKDOWN_SPECIAL_CHARACTERS.sub(r"\\\g<0>", html.escape(str(text), quote=False))
+
+
+def render_streamed_summaries(access_token: str, query: str, trace_id: str | None = None) -> list[str]:
+    """
+    Shows retrieved email headers and model output as they arrive, returns the final summaries.
+    """
     summaries: list[str] = []
-    for msg in response:
-        if msg.source == "critic_agent" and msg.type == "ToolCallSummaryMessage":
-            args = json.loads(msg.tool_calls[0].arguments)
-            if resp := args.get("response"):
-                summaries.append(resp)
+    with st.chat_message("assistant"):
+        status = st.status("Searching your mailbox…", expanded=False)
+        draft = st.empty()
+        streamed_text = ""
+        for event in stream_and_summarize(access_token, query, trace_id):
+            if event["type"] == "emails":
+                status.update(label=f"Found {len(event['emails'])} emails for `{event['query']}`")
+                with status:
+                    for email in event["emails"]:
+                        # Headers are written by the sender: shown as plain text, never as markdown or HTML.
+                        st.markdown(f"**{escape_markdown(email.get('subject') or '(no subject)')}** — "
+                                    f"{escape_markdown(email.get('from') or '')}")
+                        st.caption(escape_markdown(email.get('date') or ''))
+            elif event["type"] == "token":
+                streamed_text += event["content"]
+                draft.markdown(streamed_text + "▌")
+            elif event["type"] == "summary":
+                streamed_text = ""
+                draft.markdown(event["content"])
+            elif event["type"] == "done":
+                summaries = event["summaries"]
+        status.update(label="Done", state="complete")
     return summaries
 
+# ──────── Digests ───────────────────────────────────────────────────────────────
+def render_digests(session_id: str):
+    """
+    The session's digests the background worker has finished, newest first: one Redis read, no
+    model or Gmail call.
+    """
+    digests = sorted(get_digest_results(session_id).values(), key=lambda digest: digest["finished_at"], reverse=True)
+    for digest in digests:
+        finished = time.strftime("%d %b %H:%M", time.localtime(digest["finished_at"]))
+        with st.expander(f"📬 {digest['name']} ({finished})"):
+            if digest.get("error"):
+                st.warning(f"This digest could not be prepared: {digest['error']}")
+            for summary in digest["summaries"]:
+                st.markdown(summary)
+
+# ──────── Latency Waterfall ─────────────────────────────────────────────────────
+def render_latency_waterfall(trace_id: str):
+    """
+    One bar per span of the query's trace (agent turns, model calls, tool calls, and the MCP
+    server's cache lookups and Gmail requests), positioned on a shared timeline.
+    """
+    spans = get_trace(trace_id)
+    if not spans:
+        return
+    origin = min(item.start_ns for item in spans)
+    depths: dict[str, int] = {}
+    rows = []
+    for index, item in enumerate(spans):
+        depth = depths.get(item.parent_id, -1) + 1
+        depths[item.span_id] = depth
+        rows.append({
+            "span": f"{index + 1:>2}. {'  ' * depth}{item.name}",
+            "start_ms": round((item.start_ns - origin) / 1e6, 2),
+            "end_ms": round(((item.end_ns or item.start_ns) - origin) / 1e6, 2),
+            "duration_ms": round(item.duration_ms, 1),
+            "category": item.category,
+            "service": item.service,
+            "details": json.dumps(item.attributes, default=str)[:200],
+            "error": item.error or "",
+        })
+    total_ms = max(row["end_ms"] for row in rows)
+    chart = alt.Chart(alt.Data(values=rows)).mark_bar().encode(
+        x=alt.X("start_ms:Q", title="ms since the query started"),
+        x2="end_ms:Q",
+        y=alt.Y("span:N", sort=None, title=None, axis=alt.Axis(labelLimit=400)),
+        color=alt.Color("category:N", title=None),
+        tooltip=["span:N", "duration_ms:Q", "category:N", "service:N", "details:N", "error:N"],
+    ).properties(height=max(120, 22 * len(rows)))
+    with st.expander(f"⏱️ Latency breakdown of the last answer ({total_ms:.0f} ms, {len(rows)} spans)"):
+        st.altair_chart(chart, use_container_width=True)
+
 # ──────── Main Application ─────────────────────────────────────────────────────
 def main():
     # Sidebar: Authentication & Controls
@@ -69,6 +178,15 @@ def main():
             st.session_state.history = []
             st.rerun()
 
+        if settings.DIGEST_ENABLED and st.session_state.get("session_id"):
+            st.header("📬 Digests")
+            saved_query = st.text_input("Query to summarise every day")
+            if st.button("Save digest") and saved_query:
+                schedule_digest(st.session_state["session_id"], saved_query, saved_query,
+                                settings.DIGEST_DEFAULT_INTERVAL_SECONDS,
+                                user=quota_user(st.session_state["session_id"], token))
+                st.success("Saved, the first digest is being prepared.")
+
     # Ensure chat history exists
     if "history" not in st.session_state:
         st.session_state.history = []  # list of (role, content)
@@ -77,27 +195,38 @@ def main():
     st.header("✉️ Gmail Search & Summarisation")
     st.markdown("---")
 
+    if settings.DIGEST_ENABLED and st.session_state.get("session_id"):
+        render_digests(st.session_state["session_id"])
+
     chat_area = st.container()
     with chat_area:
         for role, content in st.session_state.history:
             with st.chat_message(role):
                 st.markdown(content)
+        if st.session_state.get("last_trace_id"):
+            render_latency_waterfall(st.session_state["last_trace_id"])
 
     # Input area: default chat_input
     prompt = st.chat_input("Type your Gmail query here and press Enter…")
     if prompt:
         # append user message
         st.session_state.history.append(("user", prompt))
-        with st.spinner("Fetching & summarising emails…"):
-            try:
-                summaries = fetch_and_summarize(st.session_state["session_id"], prompt)
-                if summaries:
-                    for summary in summaries:
-                        st.session_state.history.append(("assistant", summary))
-                else:
-                    st.session_state.history.append(("assistant", "*No summaries found for this query.*"))
-            except Exception as e:
-                st.session_state.history.append(("assistant", f"Error: {e}"))
+        with st.chat_message("user"):
+            st.markdown(prompt)
+        trace_id = st.session_state["last_trace_id"] = new_trace_id()
+        try:
+            if settings.STREAM_SUMMARIES:
+                summaries = render_streamed_summaries(st.session_state["session_id"], prompt, trace_id)
+            else:
+                with st.spinner("Fetching & summarising emails…"):
+                    summaries = fetch_and_summarize(st.session_state["session_id"], prompt, trace_id)
+            if summaries:
+                for summary in summaries:
+                    st.session_state.history.append(("assistant", summary))
+            else:
+                st.session_state.history.append(("assistant", "*No summaries found for this query.*"))
+        except Exception as e:
+            st.session_state.history.append(("assistant", f"Error: {e}"))
         st.rerun()
 
 if __name__ == "__main__":
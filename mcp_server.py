@@ -1,77 +1,447 @@
+import argparse
+import asyncio
+import os
 import traceback
+from contextlib import asynccontextmanager
 
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from langchain_google_community.gmail.search import GmailSearch, Resource
+import uvicorn
+from googleapiclient.errors import HttpError
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount
 
-from logger.app_logger import log_message
+from logger.app_logger import flush_logs, log_message
 
 from fastmcp import FastMCP
 
-from cache import get_session_details_from_cache
-
-from langchain_community.tools.gmail.search import GmailSearch
+import cache
+from email_compactor import compact_emails
+from gmail_client import gmail_client_pool
+from gmail_quota import quota_limiter
+from gmail_search import MessageFormat, SearchResource, search_messages, search_threads
+from mailbox_index import UnsupportedQuery, current_mailbox_index, search_mailbox_index
+from multi_search import fan_out_search
+from search_coalescer import search_coalescer
+from semantic_search import RetrievalMode, ensure_embedded, get_embedder, semantic_search
+from settings import settings
+from token_manager import token_manager
+from tracing import configure_tracing, continue_trace, span, trace_store
+from warmup import warm_up_index
 
 mcp = FastMCP("Demo 🚀")
+configure_tracing(f"{settings.TRACE_SERVICE_NAME}-mcp")
 
 
 @mcp.tool
-async def get_top_mails_for_query(session_id: str, query: str, top_n_mails: int = 10) -> dict:
+async def get_top_mails_for_query(
+    session_id: str,
+    query: str,
+    top_n_mails: int = 10,
+    message_format: MessageFormat = "full",
+    max_tokens: int | None = None,
+    resource: SearchResource = "messages",
+    traceparent: str | None = None,
+) -> dict:
     """Gets the top N emails for a given query using the Gmail API.
 
     :param session_id: User Session identifier.
     :param query: Refined search query to find emails.
     :param top_n_mails: Number of top emails to retrieve.
+    :param message_format: "full" for bodies, "metadata" for headers and snippet only (much cheaper), or "raw".
+    :param max_tokens: Token budget for the returned emails; bodies are cleaned and truncated to fit.
+    :param resource: "messages", or "threads" for conversations: top_n_mails threads, each returned as one
+        record with its participants and a transcript of its messages with quoted text collapsed.
+    :param traceparent: W3C trace context of the calling query, set by the client (not the model).
 
     """
+    with continue_trace(traceparent, "mcp get_top_mails_for_query", query=query, top_n_mails=top_n_mails,
+                        resource=resource) as root:
+        # Identical concurrent (or very recent) searches share one Gmail round trip.
+        response = await search_coalescer.run(
+            (session_id, query, top_n_mails, message_format, max_tokens, resource),
+            lambda: _get_top_mails_for_query(session_id, query, top_n_mails, message_format, max_tokens, resource),
+        )
+        root.set(success=response["success"], count=response.get("count", 0))
+    if traceparent and root.trace_id:
+        # The caller's waterfall shows the server side too; the client strips these before the model.
+        response["trace_spans"] = [item.as_dict() for item in trace_store.pop(root.trace_id)]
+    return response
+
+
+async def _get_top_mails_for_query(
+    session_id: str,
+    query: str,
+    top_n_mails: int,
+    message_format: MessageFormat,
+    max_tokens: int | None,
+    resource: SearchResource = "messages",
+) -> dict:
     try:
 
-        session_data = get_session_details_from_cache(session_id)
+        session_data = await token_manager.get_session(session_id)
 
         if not session_data:
             log_message(f"[{session_id}]: No session data found for session_id: {session_id}", level="warning")
             raise ValueError(f"No session data found for session_id: {session_id}")
 
-        access_token = session_data.get("access_token")
-        refresh_token = session_data.get("refresh_token")
-        scopes = session_data.get("scope")
-        id_token = session_data.get("id_token")
+        # Reuse the session's Gmail API client (and its open connection) across tool calls.
+        gmail_client = gmail_client_pool.get(session_id, session_data)
 
-        credentials = Credentials(token=access_token, id_token=id_token, refresh_token=refresh_token, scopes=scopes)
-        # Build the Gmail API client.
-        api_resource = build("gmail", "v1", credentials=credentials)
+        if resource == "threads":
+            # One threads.list, then whole conversations hydrated in batches of threads.get.
+            results = await search_threads(gmail_client, query, top_n_mails, message_format)
+            return _email_response(session_id, query, results, max_tokens)
 
-        # Initialise the GmailSearch tool.
-        gmail_search = GmailSearch(api_resource=api_resource)
+        # Answer from the local mailbox index when it is current and understands the query,
+        # otherwise one list call, then batched hydration of the matching messages.
+        with span("mailbox index search", "cache") as index_span:
+            results = await search_mailbox_index(gmail_client, query, top_n_mails, message_format)
+            index_span.set(hit=results is not None)
+        if results is None:
+            results = await search_messages(gmail_client, query, top_n_mails, message_format)
+        return _email_response(session_id, query, results, max_tokens)
 
-        # Build the search input as a dict that matches the schema.
-        search_input = {
-            "query": query,
-            "resource": Resource.MESSAGES,  # or Resource.THREADS
-            "max_results": top_n_mails
+    except Exception as e:
+        if isinstance(e, HttpError) and e.resp.status == 401:
+            # The token was rejected, do not hand the same client out again.
+            gmail_client_pool.invalidate(session_id)
+        log_message(f"[{session_id}]: Error retrieving emails: {traceback.format_exc()}", level="error")
+        return {
+            "success": False,
+            "error": str(e)
         }
 
-        results = await gmail_search.ainvoke(search_input)
-        if not results:
-            log_message(f"[{session_id}]: No emails found for query: {query}", level="info")
-            return {
-                "success": True,
-                "count": 0,
-                "emails": []
-            }
+
+@mcp.tool
+async def get_top_mails_for_queries(
+    session_id: str,
+    queries: list[str],
+    top_n_mails: int = 10,
+    message_format: MessageFormat = "full",
+    max_tokens: int | None = None,
+    resource: SearchResource = "messages",
+    traceparent: str | None = None,
+) -> dict:
+    """Runs several candidate Gmail queries at once and returns their emails merged, without duplicates.
+
+    Use it instead of consecutive get_top_mails_for_query calls when unsure how to phrase a search:
+    try the formulations together in one call. Emails found by more queries come first and list the
+    queries that found them in `matched_queries`; `queries` reports the hits of each query and how many
+    emails only it found (`unique`).
+
+    :param session_id: User Session identifier.
+    :param queries: Candidate Gmail search queries; only the first MULTI_QUERY_MAX_QUERIES are run.
+    :param top_n_mails: Number of top emails to retrieve per query.
+    :param message_format: "full" for bodies, "metadata" for headers and snippet only (much cheaper), or "raw".
+    :param max_tokens: Token budget for all returned emails; bodies are cleaned and truncated to fit.
+    :param resource: "messages", or "threads" for one record per conversation (see get_top_mails_for_query).
+    :param traceparent: W3C trace context of the calling query, set by the client (not the model).
+
+    """
+    with continue_trace(traceparent, "mcp get_top_mails_for_queries", queries=len(queries),
+                        top_n_mails=top_n_mails, resource=resource) as root:
+        response = await search_coalescer.run(
+            ("multi", session_id, queries, top_n_mails, message_format, max_tokens, resource),
+            lambda: _get_top_mails_for_queries(session_id, queries, top_n_mails, message_format, max_tokens, resource),
+        )
+        root.set(success=response["success"], count=response.get("count", 0))
+    if traceparent and root.trace_id:
+        response["trace_spans"] = [item.as_dict() for item in trace_store.pop(root.trace_id)]
+    return response
+
+
+async def _get_top_mails_for_queries(
+    session_id: str,
+    queries: list[str],
+    top_n_mails: int,
+    message_format: MessageFormat,
+    max_tokens: int | None,
+    resource: SearchResource = "messages",
+) -> dict:
+    try:
+        session_data = await token_manager.get_session(session_id)
+        if not session_data:
+            log_message(f"[{session_id}]: No session data found for session_id: {session_id}", level="warning")
+            raise ValueError(f"No session data found for session_id: {session_id}")
+        # One session lookup and Gmail client for every query.
+        gmail_client = gmail_client_pool.get(session_id, session_data)
+
+        queries = list(dict.fromkeys(query.strip() for query in queries if query and query.strip()))
+        run, skipped = queries[:settings.MULTI_QUERY_MAX_QUERIES], queries[settings.MULTI_QUERY_MAX_QUERIES:]
+        with span("fan-out search", "gmail", queries=len(run)) as fan_out_span:
+            results, query_stats = await fan_out_search(gmail_client, run, top_n_mails, message_format, resource)
+            fan_out_span.set(merged=len(results), hits=sum(stat["hits"] for stat in query_stats))
+        response = _email_response(session_id, " | ".join(run), results, max_tokens)
+        response["queries"] = query_stats
+        if skipped:
+            response["skipped_queries"] = skipped
+        return response
+
+    except Exception as e:
+        if isinstance(e, HttpError) and e.resp.status == 401:
+            gmail_client_pool.invalidate(session_id)
+        log_message(f"[{session_id}]: Error retrieving emails for several queries: {traceback.format_exc()}",
+                    level="error")
         return {
-            "success": True,
-            "count": len(results),
-            "emails": results
+            "success": False,
+            "error": str(e)
+        }
+
+
+@mcp.tool
+async def semantic_search_mails(
+    session_id: str,
+    query: str,
+    top_n_mails: int = 10,
+    mode: RetrievalMode = "hybrid",
+    message_format: MessageFormat = "full",
+    max_tokens: int | None = None,
+    traceparent: str | None = None,
+) -> dict:
+    """Finds the emails most relevant to a natural-language description, by meaning as well as keywords.
+
+    Prefer this over get_top_mails_for_query when the request describes what the emails are about
+    rather than exact words. Gmail operators (from:, after:, label:, ...) in the query still filter.
+
+    :param session_id: User Session identifier.
+    :param query: Description of the emails to find, optionally with Gmail operators.
+    :param top_n_mails: Number of emails to retrieve, most relevant first.
+    :param mode: "hybrid" (keywords and meaning), "vector" (meaning only) or "keyword" (BM25 only).
+    :param message_format: "full" for bodies, "metadata" for headers and snippet only (much cheaper), or "raw".
+    :param max_tokens: Token budget for the returned emails; bodies are cleaned and truncated to fit.
+    :param traceparent: W3C trace context of the calling query, set by the client (not the model).
+
+    """
+    with continue_trace(traceparent, "mcp semantic_search_mails", query=query, top_n_mails=top_n_mails,
+                        mode=mode) as root:
+        response = await search_coalescer.run(
+            ("semantic", session_id, query, top_n_mails, mode, message_format, max_tokens),
+            lambda: _semantic_search_mails(session_id, query, top_n_mails, mode, message_format, max_tokens),
+        )
+        root.set(success=response["success"], count=response.get("count", 0))
+    if traceparent and root.trace_id:
+        response["trace_spans"] = [item.as_dict() for item in trace_store.pop(root.trace_id)]
+    return response
+
+
+async def _semantic_search_mails(
+    session_id: str,
+    query: str,
+    top_n_mails: int,
+    mode: RetrievalMode,
+    message_format: MessageFormat,
+    max_tokens: int | None,
+) -> dict:
+    try:
+        session_data = await token_manager.get_session(session_id)
+        if not session_data:
+            log_message(f"[{session_id}]: No session data found for session_id: {session_id}", level="warning")
+            raise ValueError(f"No session data found for session_id: {session_id}")
+        gmail_client = gmail_client_pool.get(session_id, session_data)
+
+        results = None
+        retrieval = "gmail"
+        pending_chunks = 0
+        if settings.SEMANTIC_SEARCH_ENABLED and settings.MAILBOX_INDEX_ENABLED and message_format != "raw":
+            with span("mailbox index sync", "cache") as index_span:
+                index = await current_mailbox_index(gmail_client)
+                index_span.set(ready=index is not None)
+            if index is not None:
+                embedder = get_embedder()
+                if mode != "keyword":
+                    try:
+                        pending_chunks = await ensure_embedded(index, embedder, session_id)
+                    except Exception as e:
+                        log_message(f"[{session_id}]: Could not embed new mail: {e}", level="warning")
+                try:
+                    results = await semantic_search(index, query, top_n_mails, mode, message_format, embedder)
+                    retrieval = mode
+                except UnsupportedQuery as e:
+                    log_message(f"[{session_id}]: Index cannot answer query ({e}), using Gmail", level="debug")
+
+        if results is None:
+            # The index is still being built (or cannot apply the query): Gmail's own search.
+            results = await search_messages(gmail_client, query, top_n_mails, message_format)
+        response = _email_response(session_id, query, results, max_tokens)
+        response["retrieval"] = retrieval
+        if pending_chunks:
+            response["pending_chunks"] = pending_chunks
+        return response
+
+    except Exception as e:
+        if isinstance(e, HttpError) and e.resp.status == 401:
+            gmail_client_pool.invalidate(session_id)
+        log_message(f"[{session_id}]: Error in semantic email search: {traceback.format_exc()}", level="error")
+        return {
+            "success": False,
+            "error": str(e)
         }
 
+
+@mcp.tool
+async def warm_up_session(
+    session_id: str,
+    top_n_mails: int = 20,
+    max_tokens: int | None = None,
+    traceparent: str | None = None,
+) -> dict:
+    """Prepares a newly signed-in session. Called by the app after login, not by the agent.
+
+    Builds the session's Gmail client, starts building its mailbox index in the background and
+    returns its most recent inbox emails (same shape as get_top_mails_for_query) for pre-summarisation.
+    Runs once per Gmail user per WARMUP_COOLDOWN_SECONDS; later calls return `skipped`.
+
+    :param session_id: User Session identifier.
+    :param top_n_mails: Number of recent inbox emails to return.
+    :param max_tokens: Token budget for the returned emails.
+    :param traceparent: W3C trace context of the caller.
+
+    """
+    with continue_trace(traceparent, "mcp warm_up_session", top_n_mails=top_n_mails) as root:
+        response = await _warm_up_session(session_id, top_n_mails, max_tokens)
+        root.set(success=response["success"], skipped=response.get("skipped", False), count=response.get("count", 0))
+    if traceparent and root.trace_id:
+        response["trace_spans"] = [item.as_dict() for item in trace_store.pop(root.trace_id)]
+    return response
+
+
+async def _warm_up_session(session_id: str, top_n_mails: int, max_tokens: int | None) -> dict:
+    try:
+        session_data = await token_manager.get_session(session_id)
+        if not session_data:
+            raise ValueError(f"No session data found for session_id: {session_id}")
+        with span("build gmail client", "gmail"):
+            gmail_client = gmail_client_pool.get(session_id, session_data)
+        if not await cache.aclaim_warm_up(gmail_client.user, settings.WARMUP_COOLDOWN_SECONDS):
+            return {"success": True, "skipped": True, "count": 0, "emails": []}
+
+        with span("warm up mailbox index", "cache") as index_span:
+            index_state = await warm_up_index(gmail_client)
+            index_span.set(state=index_state)
+        response = await _get_top_mails_for_query(session_id, "in:inbox", top_n_mails, "full", max_tokens)
+        response["index"] = index_state
+        log_message(f"[{session_id}]: Warmed up session (index {index_state}, {response.get('count', 0)} recent emails)",
+                    level="info")
+        return response
+
     except Exception as e:
-        log_message(f"[{session_id}]: Error retrieving emails: {traceback.format_exc()}", level="error")
+        log_message(f"[{session_id}]: Session warm-up failed: {traceback.format_exc()}", level="warning")
         return {
             "success": False,
             "error": str(e)
         }
 
 
+def _email_response(session_id: str, query: str, results: list[dict], max_tokens: int | None) -> dict:
+    if not results:
+        log_message(f"[{session_id}]: No emails found for query: {query}", level="info")
+        return {
+            "success": True,
+            "count": 0,
+            "emails": []
+        }
+    response = {
+        "success": True,
+        "count": len(results),
+        "emails": results
+    }
+    if settings.EMAIL_COMPACTION_ENABLED:
+        # Strip HTML, quoted replies, signatures and repeated thread content, then fit the budget.
+        with span("compact emails", "internal", emails=len(results)) as compact_span:
+            response["emails"], stats = compact_emails(results, max_tokens)
+            compact_span.set(original_tokens=stats.original_tokens, compacted_tokens=stats.compacted_tokens)
+        response["token_stats"] = stats.as_dict()
+        log_message(
+            f"[{session_id}]: Compacted {stats.original_tokens} -> {stats.compacted_tokens} tokens "
+            f"for {len(results)} emails",
+            level="info",
+        )
+    return response
+
+
+# ──────── Health & lifecycle ────────────────────────────────────────────────────
+# Each uvicorn worker is its own process: it imports this module and builds its own Gmail client
+# pool, Redis pools and session LRU. Nothing but Redis is shared between workers.
+worker_state = {"ready": False, "transport": None}
+
+
+@mcp.custom_route("/healthz", methods=["GET"])
+async def healthz(request: Request) -> JSONResponse:
+    """Liveness: the worker's event loop is answering."""
+    return JSONResponse({"status": "ok", "pid": os.getpid()})
+
+
+@mcp.custom_route("/readyz", methods=["GET"])
+async def readyz(request: Request) -> JSONResponse:
+    """Readiness: the worker has started, is not shutting down, and Redis answers."""
+    status = {"pid": os.getpid(), "transport": worker_state["transport"]}
+    if not worker_state["ready"]:
+        return JSONResponse(status | {"status": "starting or stopping"}, status_code=503)
+    try:
+        await asyncio.wait_for(cache.async_redis_client.ping(), timeout=2)
+    except Exception as e:
+        return JSONResponse(status | {"status": "redis unavailable", "error": str(e)}, status_code=503)
+    return JSONResponse(status | {
+        "status": "ready",
+        "gmail_clients": gmail_client_pool.stats(),
+        "session_cache": cache.session_cache.stats(),
+        "gmail_quota": quota_limiter.stats(),
+        "search_coalescing": search_coalescer.stats(),
+    })
+
+
+def create_app(transport: str | None = None) -> Starlette:
+    """
+    ASGI app serving the MCP endpoint (`/mcp` for streamable HTTP, `/sse` for SSE) plus
+    `/healthz` and `/readyz`. Streamable HTTP runs stateless, so consecutive requests of one
+    client can land on different workers.
+    """
+    transport = transport or settings.MCP_TRANSPORT
+    if transport == "sse":
+        mcp_app = mcp.http_app(transport="sse")
+    else:
+        mcp_app = mcp.http_app(transport="http", stateless_http=True)
+
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        async with mcp_app.lifespan(mcp_app):
+            worker_state.update(ready=True, transport=transport)
+            log_message(f"MCP worker {os.getpid()} ready ({transport})", level="info")
+            try:
+                yield
+            finally:
+                # Uvicorn has stopped accepting requests and drained the in-flight ones.
+                worker_state["ready"] = False
+                gmail_client_pool.clear()
+                await token_manager.aclose()
+                await cache.aclose()
+                log_message(f"MCP worker {os.getpid()} stopped", level="info")
+                flush_logs()
+
+    return Starlette(routes=[Mount("/", app=mcp_app)], lifespan=lifespan)
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
-    mcp.run(transport="sse")
+    parser = argparse.ArgumentParser(description="Serve the Gmail MCP tools.")
+    parser.add_argument("--transport", choices=["sse", "http"], default=settings.MCP_TRANSPORT)
+    parser.add_argument("--host", default=settings.MCP_HOST)
+    parser.add_argument("--port", type=int, default=settings.MCP_PORT)
+    parser.add_argument("--workers", type=int, default=settings.MCP_WORKERS)
+    args = parser.parse_args()
+    if args.transport == "sse" and args.workers > 1:
+        parser.error("SSE sessions live in the process that opened them; use --transport http for several workers")
+
+    # Workers are fresh processes that read the transport from the environment.
+    os.environ["MCP_TRANSPORT"] = args.transport
+    uvicorn.run(
+        "mcp_server:app" if args.workers > 1 else create_app(args.transport),
+        host=args.host,
+        port=args.port,
+        workers=args.workers if args.workers > 1 else None,
+        timeout_graceful_shutdown=settings.MCP_SHUTDOWN_TIMEOUT_SECONDS,
+        log_level="warning",
+    )
@@ -0,0 +1,664 @@
+import asyncio
+import hashlib
+import json
+import time
+import traceback
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncGenerator, Literal, Mapping, Optional, Sequence, Union
+
+from autogen_core import CancellationToken
+from autogen_core.models import AssistantMessage, ChatCompletionClient, CreateResult, LLMMessage, ModelInfo, RequestUsage
+from autogen_core.tools import Tool, ToolSchema
+from pydantic import BaseModel, ValidationError
+
+import cache
+from logger.app_logger import log_message
+from settings import settings
+from tracing import Span, span, start_span
+
+LLM_CACHE_PREFIX = f"{cache.GLOBAL_USER_DATA_CACHE_PREFIX}_llm"
+LLM_CACHE_VERSION = 1  # Bump to invalidate every cached response after a prompt/serialisation change
+CACHEABLE_FINISH_REASONS = {"stop", "function_calls"}
+
+
+class DelegatingChatCompletionClient(ChatCompletionClient):
+    """
+    Forwards every `ChatCompletionClient` call to a wrapped client.
+
+    Subclasses override `create` / `create_stream` to add behaviour around the model call while
+    usage accounting, token counting and model info keep coming from the real client.
+    """
+
+    def __init__(self, client: ChatCompletionClient):
+        self._client = client
+
+    @property
+    def inner(self) -> ChatCompletionClient:
+        return self._client
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        return await self._client.create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        return self._client.create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self._client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self._client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self._client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self):  # type: ignore[override]
+        return self._client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self._client.model_info
+
+
+class CachedChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    Content-addressed response cache in front of a chat completion client.
+
+    The key is a sha256 over the model name, the full message history (system prompt included),
+    the tool schemas, the output mode and any extra create args, so a cached turn is only
+    reused when the conversation up to that point is identical. Tool results are part of the
+    history, which ties every later turn to the mailbox state the tools returned.
+
+    Responses are stored Fernet-encrypted in Redis with a TTL. Entries larger than
+    `max_entry_bytes` are not stored, and a sorted set of last-access times keeps the number of
+    entries under `max_entries` by evicting the least recently used ones. Redis errors are
+    logged and treated as misses; the cache never fails a model call.
+    """
+
+    def __init__(
+        self,
+        client: ChatCompletionClient,
+        model: str,
+        redis_client=None,
+        ttl_seconds: int | None = None,
+        max_entry_bytes: int | None = None,
+        max_entries: int | None = None,
+    ):
+        super().__init__(client)
+        self.model = model
+        self.redis_client = redis_client if redis_client is not None else cache.redis_client
+        self.ttl_seconds = ttl_seconds or settings.LLM_CACHE_TTL_SECONDS
+        self.max_entry_bytes = max_entry_bytes or settings.LLM_CACHE_MAX_ENTRY_BYTES
+        self.max_entries = max_entries or settings.LLM_CACHE_MAX_ENTRIES
+        self.index_key = f"{LLM_CACHE_PREFIX}_index"
+        self.stats_key = f"{LLM_CACHE_PREFIX}_stats"
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.errors = 0
+
+    # ──────── Keys ────────────────────────────────────────────────────────────────
+    def cache_key(
+        self,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[Tool | ToolSchema],
+        tool_choice: Tool | str,
+        json_output: Optional[bool | type[BaseModel]],
+        extra_create_args: Mapping[str, Any],
+    ) -> str:
+        if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+            json_output_data = json_output.model_json_schema()
+        else:
+            json_output_data = json_output
+        payload = {
+            "version": LLM_CACHE_VERSION,
+            "model": self.model,
+            "messages": [message.model_dump(mode="json") for message in messages],
+            "tools": [tool.schema if isinstance(tool, Tool) else tool for tool in tools],
+            "tool_choice": tool_choice.name if isinstance(tool_choice, Tool) else tool_choice,
+            "json_output": json_output_data,
+            "extra_create_args": dict(extra_create_args),
+        }
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+        return f"{LLM_CACHE_PREFIX}_{digest}"
+
+    # ──────── Redis storage ───────────────────────────────────────────────────────
+    def _load(self, key: str) -> CreateResult | None:
+        encrypted = self.redis_client.get(key)
+        if encrypted is None:
+            self.redis_client.zrem(self.index_key, key)
+            return None
+        try:
+            result = CreateResult.model_validate_json(cache.fernet.decrypt(encrypted))
+        except (ValidationError, ValueError):
+            log_message(f"Discarding unreadable LLM cache entry {key}", level="warning")
+            self.redis_client.delete(key)
+            return None
+        self.redis_client.zadd(self.index_key, {key: time.time()})
+        return result
+
+    def _store(self, key: str, result: CreateResult) -> bool:
+        payload = result.model_dump_json().encode()
+        if len(payload) > self.max_entry_bytes:
+            return False
+        with self.redis_client.pipeline() as pipe:
+            pipe.set(key, cache.fernet.encrypt(payload), ex=self.ttl_seconds)
+            pipe.zadd(self.index_key, {key: time.time()})
+            pipe.zcard(self.index_key)
+            entries = pipe.execute()[-1]
+        if entries > self.max_entries:
+            evicted = [member for member, _ in self.redis_client.zpopmin(self.index_key, entries - self.max_entries)]
+            if evicted:
+                self.redis_client.delete(*evicted)
+        return True
+
+    async def _lookup(self, key: str) -> CreateResult | None:
+        if self.redis_client is None:
+            return None
+        with span("cache llm", "cache") as lookup_span:
+            try:
+                result = await asyncio.to_thread(self._load, key)
+            except Exception:
+                self.errors += 1
+                log_message(f"LLM cache lookup failed: {traceback.format_exc()}", level="warning")
+                return None
+            lookup_span.set(hit=result is not None)
+        await self._record("hits" if result is not None else "misses")
+        if result is not None:
+            log_message(f"LLM cache hit {key[-12:]} ({self.hit_rate:.0%} hit rate)", level="info")
+            result.cached = True
+        return result
+
+    async def _save(self, key: str, result: CreateResult):
+        if self.redis_client is None or result.finish_reason not in CACHEABLE_FINISH_REASONS:
+            return
+        try:
+            stored = await asyncio.to_thread(self._store, key, result)
+        except Exception:
+            self.errors += 1
+            log_message(f"LLM cache write failed: {traceback.format_exc()}", level="warning")
+            return
+        if not stored:
+            await self._record("skipped")
+
+    async def _record(self, counter: str):
+        setattr(self, counter, getattr(self, counter) + 1)
+        try:
+            await asyncio.to_thread(self.redis_client.hincrby, self.stats_key, counter, 1)
+        except Exception:
+            self.errors += 1
+
+    # ──────── Metrics ─────────────────────────────────────────────────────────────
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters for this process, plus the totals across processes kept in Redis.
+        """
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped_oversized": self.skipped,
+            "errors": self.errors,
+            "hit_rate": round(self.hit_rate, 3),
+        }
+        if self.redis_client is not None:
+            try:
+                stats["global"] = {name: int(value) for name, value in self.redis_client.hgetall(self.stats_key).items()}
+                stats["entries"] = self.redis_client.zcard(self.index_key)
+            except Exception:
+                log_message(f"Could not read LLM cache stats: {traceback.format_exc()}", level="warning")
+        return stats
+
+    # ──────── ChatCompletionClient ────────────────────────────────────────────────
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        key = self.cache_key(messages, tools, tool_choice, json_output, extra_create_args)
+        if (cached := await self._lookup(key)) is not None:
+            return cached
+
+        result = await super().create(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        )
+        await self._save(key, result)
+        return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        key = self.cache_key(messages, tools, tool_choice, json_output, extra_create_args)
+        if (cached := await self._lookup(key)) is not None:
+            # Replayed as a single chunk so streaming UIs still render the text.
+            if isinstance(cached.content, str) and cached.content:
+                yield cached.content
+            yield cached
+            return
+
+        async for item in super().create_stream(
+            messages,
+            tools=tools,
+            tool_choice=tool_choice,
+            json_output=json_output,
+            extra_create_args=extra_create_args,
+            cancellation_token=cancellation_token,
+        ):
+            if isinstance(item, CreateResult):
+                await self._save(key, item)
+            yield item
+
+
+def _usage_attributes(result: CreateResult) -> dict:
+    return {
+        "prompt_tokens": result.usage.prompt_tokens,
+        "completion_tokens": result.usage.completion_tokens,
+        "finish_reason": result.finish_reason,
+        "cached": bool(result.cached),
+    }
+
+
+class TracedChatCompletionClient(DelegatingChatCompletionClient):
+    """
+    Records every model call as a `model` span of the active trace, with token usage and whether
+    the response came from the cache. Wrap it outermost so cache lookups appear inside the call.
+    """
+
+    def __init__(self, client: ChatCompletionClient, model: str):
+        super().__init__(client)
+        self.model = model
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        with span(f"model {self.model}", "model", model=self.model, messages=len(messages), tools=len(tools)) as model_span:
+            result = await super().create(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            )
+            model_span.set(**_usage_attributes(result))
+            return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        # Not activated: a generator can be resumed from a different context than it started in.
+        model_span = start_span(
+            f"model {self.model}", "model", model=self.model, messages=len(messages), tools=len(tools), streamed=True
+        )
+        first_chunk = True
+        try:
+            async for item in super().create_stream(
+                messages,
+                tools=tools,
+                tool_choice=tool_choice,
+                json_output=json_output,
+                extra_create_args=extra_create_args,
+                cancellation_token=cancellation_token,
+            ):
+                if first_chunk and isinstance(model_span, Span):
+                    first_chunk = False
+                    model_span.set(first_chunk_ms=round(model_span.duration_ms, 1))
+                if isinstance(item, CreateResult):
+                    model_span.set(**_usage_attributes(item))
+                yield item
+        except BaseException as e:
+            model_span.end(error=e)
+            raise
+        finally:
+            model_span.end()
+
+
+# ──────── Routing ───────────────────────────────────────────────────────────────
+CHARS_PER_TOKEN = 4  # Prompt size estimate for routing; exact counts are not worth a tokenizer pass
+FALLBACK_FINISH_REASONS = {"length", "content_filter"}  # Truncated or refused: ask the fallback model
+
+
+@dataclass
+class RouteRule:
+    """
+    Sends the calls it matches to `model`. A rule matches a call from one of `roles` (any role when
+    None), on a turn between `min_turn` and `max_turn` (the caller's earlier model turns in the
+    conversation, 0 for its first) with a prompt of `min_prompt_tokens` to `max_prompt_tokens`.
+    A call that fails, or is cut short, is retried once on `fallback` (the default model if unset).
+    """
+
+    model: str
+    roles: list[str] | None = None
+    min_turn: int = 0
+    max_turn: int | None = None
+    min_prompt_tokens: int = 0
+    max_prompt_tokens: int | None = None
+    fallback: str | None = None
+
+    def matches(self, role: str | None, turn: int, prompt_tokens: int) -> bool:
+        return (
+            (self.roles is None or role in self.roles)
+            and self.min_turn <= turn and (self.max_turn is None or turn <= self.max_turn)
+            and self.min_prompt_tokens <= prompt_tokens
+            and (self.max_prompt_tokens is None or prompt_tokens <= self.max_prompt_tokens)
+        )
+
+
+@dataclass
+class RouteStats:
+    calls: int = 0
+    failures: int = 0
+    fallbacks: int = 0  # Calls answered by the fallback model after this route failed
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latencies_ms: deque = field(default_factory=lambda: deque(maxlen=1000))
+
+
+class RoutingChatCompletionClient(ChatCompletionClient):
+    """
+    Picks the model for every call by its caller's role and turn and the size of the prompt.
+
+    `clients` maps model names to their clients (each with its own cache and tracing wrappers).
+    Callers take a view bound to their role with `for_role` (or `with_role`): the retriever and
+    critic agents by name, the fast path and the summariser's map, reduce and final calls. The
+    first matching rule wins; calls no rule matches go to `default_model`. A routed call that
+    raises or finishes with a `FALLBACK_FINISH_REASONS` reason is retried once on the rule's
+    fallback; streamed calls only before their first chunk.
+
+    Latency, tokens and spend (`prices`: USD per million prompt and completion tokens) are kept
+    per route, `role -> model`, for `stats()`.
+    """
+
+    def __init__(
+        self,
+        clients: Mapping[str, ChatCompletionClient],
+        rules: Sequence[RouteRule],
+        default_model: str,
+        prices: Mapping[str, Sequence[float]] | None = None,
+    ):
+        if default_model not in clients:
+            raise ValueError(f"No client for the default model {default_model}")
+        unknown = {name for rule in rules for name in (rule.model, rule.fallback) if name and name not in clients}
+        if unknown:
+            raise ValueError(f"No client for routed models {sorted(unknown)}")
+        self.clients = dict(clients)
+        self.rules = list(rules)
+        self.default_model = default_model
+        self.prices = dict(prices or {})
+        self.routes: dict[tuple[str, str], RouteStats] = {}
+
+    def for_role(self, role: str) -> ChatCompletionClient:
+        return _RoleBoundClient(self, role)
+
+    # ──────── Route selection ─────────────────────────────────────────────────────
+    def route(self, role: str | None, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema] = ()) -> tuple[str, str | None]:
+        """`(model, fallback model)` for a call."""
+        turn = sum(isinstance(message, AssistantMessage) for message in messages)
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        prompt_chars += sum(len(json.dumps(tool.schema if isinstance(tool, Tool) else tool, default=str)) for tool in tools)
+        for rule in self.rules:
+            if rule.matches(role, turn, prompt_chars // CHARS_PER_TOKEN):
+                fallback = rule.fallback or self.default_model
+                return rule.model, fallback if fallback != rule.model else None
+        return self.default_model, None
+
+    def routing_key(self, role: str) -> str:
+        """
+        Names the models `role`'s calls can go to, for caches of their answers: changes with the
+        default model and with every rule that can match the role.
+        """
+        rules = [asdict(rule) for rule in self.rules if rule.roles is None or role in rule.roles]
+        payload = json.dumps([self.default_model, rules], sort_keys=True)
+        return f"routed-{hashlib.sha256(payload.encode()).hexdigest()[:16]}"
+
+    def _stats(self, role: str | None, model: str) -> RouteStats:
+        return self.routes.setdefault((role or "default", model), RouteStats())
+
+    def _record(self, role: str | None, model: str, started: float, result: CreateResult):
+        stats = self._stats(role, model)
+        stats.calls += 1
+        stats.latencies_ms.append((time.perf_counter() - started) * 1000)
+        stats.prompt_tokens += result.usage.prompt_tokens
+        stats.completion_tokens += result.usage.completion_tokens
+
+    def _failed(self, role: str | None, model: str, fallback: str | None, reason: str):
+        stats = self._stats(role, model)
+        stats.calls += 1
+        stats.failures += 1
+        if fallback is not None:
+            stats.fallbacks += 1
+        log_message(
+            f"Model call for {role or 'default'} on {model} failed ({reason})"
+            + (f", retrying on {fallback}" if fallback else ""),
+            level="warning",
+        )
+
+    # ──────── ChatCompletionClient ────────────────────────────────────────────────
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+        role: str | None = None,
+    ) -> CreateResult:
+        model, fallback = self.route(role, messages, tools)
+        while True:
+            started = time.perf_counter()
+            try:
+                result = await self.clients[model].create(
+                    messages,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    json_output=json_output,
+                    extra_create_args=extra_create_args,
+                    cancellation_token=cancellation_token,
+                )
+            except Exception as e:
+                if fallback is None or (cancellation_token is not None and cancellation_token.is_cancelled()):
+                    self._failed(role, model, None, f"{type(e).__name__}: {e}")
+                    raise
+                self._failed(role, model, fallback, f"{type(e).__name__}: {e}")
+                model, fallback = fallback, None
+                continue
+            if result.finish_reason in FALLBACK_FINISH_REASONS and fallback is not None:
+                self._failed(role, model, fallback, f"finish reason {result.finish_reason}")
+                model, fallback = fallback, None
+                continue
+            self._record(role, model, started, result)
+            return result
+
+    async def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+        role: str | None = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+        model, fallback = self.route(role, messages, tools)
+        while True:
+            started = time.perf_counter()
+            streamed = False
+            try:
+                async for item in self.clients[model].create_stream(
+                    messages,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    json_output=json_output,
+                    extra_create_args=extra_create_args,
+                    cancellation_token=cancellation_token,
+                ):
+                    if isinstance(item, CreateResult):
+                        self._record(role, model, started, item)
+                    streamed = True
+                    yield item
+                return
+            except Exception as e:
+                if streamed or fallback is None:
+                    self._failed(role, model, None, f"{type(e).__name__}: {e}")
+                    raise
+                self._failed(role, model, fallback, f"{type(e).__name__}: {e}")
+                model, fallback = fallback, None
+
+    async def close(self) -> None:
+        for client in self.clients.values():
+            await client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        usages = [client.actual_usage() for client in self.clients.values()]
+        return RequestUsage(prompt_tokens=sum(u.prompt_tokens for u in usages),
+                            completion_tokens=sum(u.completion_tokens for u in usages))
+
+    def total_usage(self) -> RequestUsage:
+        usages = [client.total_usage() for client in self.clients.values()]
+        return RequestUsage(prompt_tokens=sum(u.prompt_tokens for u in usages),
+                            completion_tokens=sum(u.completion_tokens for u in usages))
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.clients[self.default_model].count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.clients[self.default_model].remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self):  # type: ignore[override]
+        return self.clients[self.default_model].capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self.clients[self.default_model].model_info
+
+    # ──────── Metrics ─────────────────────────────────────────────────────────────
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def stats(self) -> dict:
+        """Calls, failures, latency percentiles, tokens and spend per `role -> model` route."""
+        routes = {}
+        for (role, model), route in sorted(self.routes.items()):
+            latencies = sorted(route.latencies_ms)
+            routes[f"{role} -> {model}"] = {
+                "calls": route.calls,
+                "failures": route.failures,
+                "fallbacks": route.fallbacks,
+                "p50_ms": round(latencies[len(latencies) // 2], 1) if latencies else 0.0,
+                "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1) if latencies else 0.0,
+                "prompt_tokens": route.prompt_tokens,
+                "completion_tokens": route.completion_tokens,
+                "cost_usd": round(self.cost(model, route.prompt_tokens, route.completion_tokens), 6),
+            }
+        return {
+            "routes": routes,
+            "calls": sum(route["calls"] for route in routes.values()),
+            "failures": sum(route["failures"] for route in routes.values()),
+            "cost_usd": round(sum(route["cost_usd"] for route in routes.values()), 6),
+        }
+
+
+class _RoleBoundClient(DelegatingChatCompletionClient):
+    """A `RoutingChatCompletionClient` as seen by one caller: every call is routed for `role`."""
+
+    def __init__(self, router: RoutingChatCompletionClient, role: str):
+        super().__init__(router)
+        self.role = role
+
+    async def create(self, messages: Sequence[LLMMessage], **kwargs) -> CreateResult:
+        return await self._client.create(messages, role=self.role, **kwargs)
+
+    def create_stream(self, messages: Sequence[LLMMessage], **kwargs) -> AsyncGenerator[Union[str, CreateResult], None]:
+        return self._client.create_stream(messages, role=self.role, **kwargs)
+
+    async def close(self) -> None:
+        pass  # The router is shared; its owner closes it
+
+
+def with_role(client: ChatCompletionClient, role: str) -> ChatCompletionClient:
+    """`client` bound to a caller's role when it routes per role, `client` itself otherwise."""
+    return client.for_role(role) if isinstance(client, RoutingChatCompletionClient) else client
+
+
+def routing_key(client: ChatCompletionClient, role: str) -> str | None:
+    """`RoutingChatCompletionClient.routing_key` of `role` when `client` routes per role, None otherwise."""
+    return client.routing_key(role) if isinstance(client, RoutingChatCompletionClient) else None
@@ -0,0 +1,93 @@
+import asyncio
+
+from gmail_client import GmailClient
+from gmail_search import MessageFormat, SearchResource, fetch_messages, list_message_refs, parse_message, parse_thread
+from logger.app_logger import log_message
+from mailbox_index import search_mailbox_index
+from semantic_search import fuse_rankings
+from settings import settings
+from tracing import span
+
+
+async def _rank(
+    client: GmailClient, query: str, max_results: int, message_format: MessageFormat, resource: SearchResource
+) -> tuple[list[str], dict[str, dict]]:
+    """Ids matching one query, best first, and the records the local index already hydrated."""
+    with span("fan-out query", "gmail", query=query) as query_span:
+        if resource == "messages":
+            results = await search_mailbox_index(client, query, max_results, message_format)
+            if results is not None:
+                query_span.set(index=True, hits=len(results))
+                return [result["id"] for result in results], {result["id"]: result for result in results}
+        refs = await list_message_refs(client, query, max_results, resource)
+        query_span.set(index=False, hits=len(refs))
+        return [ref["id"] for ref in refs], {}
+
+
+async def fan_out_search(
+    client: GmailClient,
+    queries: list[str],
+    max_results: int = 10,
+    message_format: MessageFormat = "full",
+    resource: SearchResource = "messages",
+) -> tuple[list[dict], list[dict]]:
+    """
+    Runs several formulations of one search at once and merges their results.
+
+    Every query is listed concurrently (from the local index when it can answer it), then the
+    union of the ids is hydrated once, in shared batches, so an email several queries found is
+    fetched a single time. Results are ranked by reciprocal rank fusion (`SEMANTIC_RRF_K`): emails
+    found by more queries, and ranked higher by them, come first; each carries the queries that
+    found it in `matched_queries`.
+
+    Returns `(records, per-query stats)`; a query that failed is reported in its stats, and the
+    error is raised only when every query failed.
+    """
+    queries = list(dict.fromkeys(query.strip() for query in queries if query and query.strip()))
+    outcomes = await asyncio.gather(
+        *(_rank(client, query, max_results, message_format, resource) for query in queries),
+        return_exceptions=True,
+    )
+    rankings: dict[str, list[str]] = {}
+    records: dict[str, dict] = {}
+    stats: list[dict] = []
+    errors: list[Exception] = []
+    for query, outcome in zip(queries, outcomes):
+        if isinstance(outcome, BaseException):
+            if not isinstance(outcome, Exception):
+                raise outcome
+            log_message(f"[{client.session_id}]: Fan-out query {query!r} failed: {outcome}", level="warning")
+            errors.append(outcome)
+            stats.append({"query": query, "hits": 0, "error": str(outcome)})
+            continue
+        ids, hydrated = outcome
+        rankings[query] = ids
+        records.update(hydrated)
+        stats.append({"query": query, "hits": len(ids)})
+    if errors and not rankings:
+        raise errors[0]
+
+    fused = fuse_rankings(rankings, settings.SEMANTIC_RRF_K)
+    missing = [message_id for message_id, _, _ in fused if message_id not in records]
+    if missing:
+        resources = await fetch_messages(client, missing, message_format, resource)
+        if resource == "threads":
+            parsed = [parse_thread(item, "full" if message_format == "raw" else message_format) for item in resources]
+        else:
+            parsed = [parse_message(item, message_format) for item in resources]
+        records.update({record["id"]: record for record in parsed})
+
+    found_by: dict[str, int] = {}
+    for ids in rankings.values():
+        for message_id in ids:
+            found_by[message_id] = found_by.get(message_id, 0) + 1
+    for stat in stats:
+        # Emails no other query found: what this formulation added.
+        stat["unique"] = sum(found_by[message_id] == 1 for message_id in rankings.get(stat["query"], []))
+
+    merged = [
+        {**records[message_id], "matched_queries": matched}
+        for message_id, _, matched in fused
+        if message_id in records  # deleted since it was listed
+    ]
+    return merged, stats
@@ -0,0 +1,240 @@
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from settings import settings
+
+# Words that carry no search meaning in a mailbox request ("show me my unread emails ...").
+FILLER_WORDS = {
+    "a", "about", "all", "an", "and", "any", "are", "can", "could", "did", "do", "email", "emails",
+    "find", "for", "from", "get", "give", "got", "have", "i", "in", "inbox", "is", "list", "look",
+    "mail", "mails", "me", "message", "messages", "my", "of", "on", "please", "pull", "received",
+    "regarding", "search", "see", "show", "summarise", "summarize", "summary", "tell", "that",
+    "the", "there", "to", "up", "what", "which", "with", "you", "latest", "recent", "new", "any",
+    "what's", "whats", "there's", "i've", "i'm", "anything", "everything", "some", "got", "has", "been",
+}
+
+# Requests that need judgement, comparison or several searches go to the agent team.
+COMPLEX_PATTERN = re.compile(
+    r"\b(why|how come|compare|comparison|versus|vs\.?|difference|should|either|or|not|except|without|"
+    r"unless|reply|respond|draft|write|follow[- ]?up on|action items?|decide|recommend)\b",
+    re.IGNORECASE,
+)
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "twenty": 20, "fifty": 50,
+}
+MONTHS = {
+    name: index
+    for index, names in enumerate(
+        [("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+         ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"),
+         ("november", "nov"), ("december", "dec")],
+        start=1,
+    )
+    for name in names
+}
+CATEGORIES = {"promotion": "promotions", "promotions": "promotions", "social": "social", "updates": "updates", "forums": "forums"}
+RELATIVE_UNITS = {"hour": "d", "hours": "d", "day": "d", "days": "d", "week": "d", "weeks": "d", "month": "m", "months": "m", "year": "y", "years": "y"}
+TIME_WORDS = {"today", "yesterday", "week", "month", "year", "last", "past", "this", "since"}
+# "due by friday", "emails from tomorrow": deadlines and times, never senders.
+DEADLINE_WORDS = {
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "weekend", "tomorrow",
+    "tonight", "morning", "afternoon", "evening", "noon", "midnight", "eod", "eow", "now", "then", "later",
+}
+
+MAX_RESULTS = 500  # Gmail's page size; larger requests are capped
+
+NUMBER = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+ADDRESS = r"([\w.+-]+@[\w.-]+\.\w+|[a-z][\w.'-]*)"
+
+
+@dataclass
+class QueryPlan:
+    """
+    Gmail search derived from a natural language request.
+
+    ``confidence`` estimates how completely the rules explained the request; below
+    `QUERY_PLANNER_MIN_CONFIDENCE` the request is handed to the agent team instead.
+    """
+    prompt: str
+    gmail_query: str
+    confidence: float
+    max_results: int = 10
+    matched_rules: list[str] = field(default_factory=list)
+    free_text: list[str] = field(default_factory=list)
+    resource: str = "messages"  # "threads" for conversation requests
+
+    @property
+    def is_confident(self) -> bool:
+        return bool(self.gmail_query) and self.confidence >= settings.QUERY_PLANNER_MIN_CONFIDENCE
+
+
+def _number(token: str) -> int:
+    return int(token) if token.isdigit() else NUMBER_WORDS[token.lower()]
+
+
+def _gmail_date(value: datetime) -> str:
+    return value.strftime("%Y/%m/%d")
+
+
+class _Planner:
+    def __init__(self, prompt: str, now: datetime):
+        self.prompt = prompt
+        self.now = now
+        self.text = " " + re.sub(r"\s+", " ", prompt.strip().rstrip("?.!")) + " "
+        self.terms: list[str] = []
+        self.rules: list[str] = []
+        self.max_results = 10
+        self.resource = "messages"
+
+    def consume(self, rule: str, pattern: str, handler) -> None:
+        """Applies ``handler`` to every match of ``pattern`` and blanks the matched text."""
+        def replace(match: re.Match) -> str:
+            terms = handler(match)
+            if terms is None:
+                return match.group(0)
+            self.terms.extend(terms)
+            self.rules.append(rule)
+            return " "
+        self.text = re.sub(pattern, replace, self.text, flags=re.IGNORECASE)
+
+    def plan(self) -> QueryPlan:
+        self.consume("quoted_phrase", r'"([^"]+)"', lambda m: [f'"{m.group(1)}"'])
+        self.consume("count", rf"\b(?:last|latest|top|first|recent|newest)\s+{NUMBER}\b(?=\s+(?:\w+\s+)?(?:e?mails?|messages?)\b)",
+                     lambda m: self._set_count(m.group(1)))
+        self.consume("count", rf"\b{NUMBER}\s+(?:most\s+recent\s+|latest\s+|recent\s+|newest\s+)?(?:e?mails?|messages?)\b",
+                     lambda m: self._set_count(m.group(1)))
+        self.consume("attachment", r"\b(?:with|having|that have|has)\s+(?:an?\s+)?(?:attachments?|attached files?)\b|\battachments?\b",
+                     lambda m: ["has:attachment"])
+        self.consume("pdf", r"\bpdfs?\b", lambda m: ["filename:pdf"])
+        self.consume("unread", r"\bunread\b|\bhaven'?t (?:read|opened)\b|\bnot (?:yet )?read\b", lambda m: ["is:unread"])
+        self.consume("starred", r"\bstarred\b", lambda m: ["is:starred"])
+        self.consume("important", r"\b(?:important|priority)\b", lambda m: ["is:important"])
+        self.consume("category", r"\b(promotions?|social|updates|forums)\b(?:\s+(?:tab|category))?",
+                     lambda m: [f"category:{CATEGORIES[m.group(1).lower()]}"])
+        self.consume("sent", r"\b(?:i|i've|i have)\s+sent\b|\bsent (?:mail|folder|items)\b|\bmy sent\b", lambda m: ["in:sent"])
+        self.consume("label", r"\b(?:label(?:l?ed)?|tagged)\s+([\w-]+)\b|\bin (?:my |the )?([\w-]+) (?:label|folder)\b",
+                     lambda m: [f"label:{(m.group(1) or m.group(2)).lower()}"])
+        self.consume("subject", r"\b(?:with (?:the )?subject|subject(?: line)?|titled|entitled)\s*:?\s*([^,;]+?)(?=\s+(?:from|to|since|after|before|in|last|this|today|yesterday)\b|\s*$)",
+                     lambda m: [f'subject:"{m.group(1).strip()}"' if " " in m.group(1).strip() else f"subject:{m.group(1).strip()}"])
+        self.consume("recipient", rf"\b(?:sent|addressed|e?mails?|messages?|wrote)\s+to\s+{ADDRESS}",
+                     lambda m: self._address("to", m.group(1)))
+        self.consume("conversation", rf"\b(?:conversations?|threads?|discussions?|exchanges?|chats?)\s+(?:with|between me and)\s+{ADDRESS}",
+                     lambda m: self._conversation(m.group(1)))
+        self.consume("threads", r"\b(?:conversations?|e?mail threads?|threads?|discussions?)\b",
+                     lambda m: self._conversation(None))
+        self.consume("sender", rf"\b(?:from|sent by)\s+{ADDRESS}(?:\s+and\s+{ADDRESS})?",
+                     lambda m: self._senders(m.group(1), m.group(2)))
+        self.consume("sender", r"\b([a-z][\w'-]*)'s\s+(?:e?mails?|messages?)\b", lambda m: self._address("from", m.group(1)))
+        self._dates()
+
+        words = re.findall(r"[\w@.'+-]+", self.text.lower())
+        keywords = [word.strip(".'") for word in words if word.strip(".'") and word not in FILLER_WORDS and word not in TIME_WORDS]
+        self.terms.extend(keywords)
+        if keywords:
+            self.rules.append("keywords")
+        elif self.rules == ["count"]:
+            self.terms.append("in:inbox")  # "my latest 5 emails"
+
+        return QueryPlan(
+            prompt=self.prompt,
+            gmail_query=" ".join(dict.fromkeys(self.terms)),
+            confidence=self._confidence(keywords),
+            max_results=self.max_results,
+            matched_rules=self.rules,
+            free_text=keywords,
+            resource=self.resource,
+        )
+
+    def _set_count(self, token: str):
+        self.max_results = max(1, min(_number(token), MAX_RESULTS))
+        return []
+
+    def _conversation(self, person: str | None):
+        """Conversations are fetched as whole threads; "with amit" means either direction."""
+        self.resource = "threads"
+        if person is None:
+            return []
+        terms = self._address("from", person)
+        if terms is None:
+            return None
+        person = terms[0].removeprefix("from:")
+        return [f"{{from:{person} to:{person}}}"]
+
+    def _senders(self, first: str, second: str | None):
+        """"from alice and bob" wants the emails of both senders, i.e. either one."""
+        terms = self._address("from", first)
+        if terms is None or second is None:
+            return terms
+        other = self._address("from", second)
+        if other is None:
+            return None
+        return [f"from:({terms[0].removeprefix('from:')} OR {other[0].removeprefix('from:')})"]
+
+    def _address(self, operator: str, value: str):
+        value = value.strip(".'").lower()
+        if (value in FILLER_WORDS or value in TIME_WORDS or value in MONTHS or value in DEADLINE_WORDS
+                or value in {"me", "us", "them", "him", "her"}):
+            return None
+        return [f"{operator}:{value}"]
+
+    def _dates(self):
+        today = self.now.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.consume("today", r"\b(?:from |received )?today\b", lambda m: ["newer_than:1d"])
+        self.consume("yesterday", r"\b(?:from |received )?yesterday\b",
+                     lambda m: [f"after:{_gmail_date(today - timedelta(days=1))}", f"before:{_gmail_date(today)}"])
+        self.consume("relative_date", rf"\b(?:in |from |over |during |within )?(?:the )?(?:last|past)\s+{NUMBER}\s+(hours?|days?|weeks?|months?|years?)\b",
+                     lambda m: [self._newer_than(_number(m.group(1)), m.group(2).lower())])
+        self.consume("relative_date", r"\b(?:in |from |over |during |within )?(?:the )?(?:last|past|this)\s+(hour|day|week|month|year)\b",
+                     lambda m: [self._newer_than(1, m.group(1).lower())])
+        self.consume("month", r"\b(?:in |from |during )?(" + "|".join(MONTHS) + r")\b(?:\s+(\d{4}))?",
+                     lambda m: self._month(m.group(1).lower(), m.group(2)))
+        self.consume("since", r"\bsince\s+(\d{4})[-/](\d{1,2})[-/](\d{1,2})\b",
+                     lambda m: [f"after:{int(m.group(1)):04d}/{int(m.group(2)):02d}/{int(m.group(3)):02d}"])
+
+    def _newer_than(self, amount: int, unit: str) -> str:
+        suffix = RELATIVE_UNITS[unit]
+        if unit.startswith("week"):
+            amount *= 7
+        elif unit.startswith("hour"):
+            if amount % 24:
+                # newer_than only takes whole days; after: also takes a timestamp in seconds.
+                return f"after:{int((self.now - timedelta(hours=amount)).timestamp())}"
+            amount //= 24
+        return f"newer_than:{amount}{suffix}"
+
+    def _month(self, name: str, year: str | None):
+        if name == "may" and not year:
+            return None  # "may" is far more often the verb
+        month = MONTHS[name]
+        start_year = int(year) if year else self.now.year - (month > self.now.month)
+        start = datetime(start_year, month, 1)
+        end = datetime(start_year + month // 12, month % 12 + 1, 1)
+        return [f"after:{_gmail_date(start)}", f"before:{_gmail_date(end)}"]
+
+    def _confidence(self, keywords: list[str]) -> float:
+        if COMPLEX_PATTERN.search(self.prompt):
+            return 0.2
+        # Asking for threads changes what is fetched, not which emails match.
+        structured = [rule for rule in self.rules if rule not in ("keywords", "threads")]
+        if not structured and not keywords:
+            return 0.0
+        # Structured operators are reliable; every leftover word is a guess at intent. Keywords
+        # alone ("boss", "2024") are below QUERY_PLANNER_MIN_CONFIDENCE: the team plans them.
+        if structured:
+            confidence = 0.95 - 0.1 * len(keywords)
+        else:
+            confidence = 0.6 - 0.1 * max(0, len(keywords) - 1)
+        return round(max(confidence, 0.0), 2)
+
+
+def plan_query(prompt: str, now: datetime | None = None) -> QueryPlan:
+    """
+    Translates common mailbox requests into Gmail search syntax without a model call.
+
+    >>> plan_query("unread emails from alice last week").gmail_query
+    'is:unread from:alice newer_than:7d'
+    """
+    return _Planner(prompt, now or datetime.now()).plan()
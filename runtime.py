@@ -0,0 +1,299 @@
+import asyncio
+import atexit
+import concurrent.futures
+import threading
+import time
+import traceback
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, TypeVar
+
+from autogen_core import CancellationToken
+from autogen_core.models import ChatCompletionClient
+from autogen_core.tools import BaseTool
+from autogen_core.utils import schema_to_pydantic_model
+from pydantic import BaseModel
+
+from logger.app_logger import log_message
+from model_clients import CachedChatCompletionClient, RouteRule, RoutingChatCompletionClient, TracedChatCompletionClient
+from settings import settings
+from tracing import TRACEPARENT_ARGUMENT, current_traceparent, record_remote_spans, span
+
+T = TypeVar("T")
+
+
+class TracedTool(BaseTool[BaseModel, Any]):
+    """
+    MCP tool adapter that records each call as a `tool` span and passes the active trace to the
+    server through the tool's `traceparent` argument. The argument is removed from the schema the
+    model sees; the spans the server sends back (`trace_spans`) join the local trace and are
+    stripped from the result before it reaches the model.
+    """
+
+    def __init__(self, tool: BaseTool):
+        parameters = tool.schema.get("parameters", {})
+        properties = {key: value for key, value in parameters.get("properties", {}).items() if key != TRACEPARENT_ARGUMENT}
+        args_type = schema_to_pydantic_model({
+            "type": "object",
+            "title": f"{tool.name}_args",
+            "properties": properties,
+            "required": [key for key in parameters.get("required", []) if key in properties],
+        })
+        super().__init__(args_type, tool.return_type(), tool.name, tool.description)
+        self.inner = tool
+        self.accepts_traceparent = TRACEPARENT_ARGUMENT in parameters.get("properties", {})
+
+    async def run(self, args: BaseModel, cancellation_token: CancellationToken) -> Any:
+        arguments = args.model_dump(exclude_unset=True)
+        attributes = {key: value for key, value in arguments.items() if key != "session_id"}
+        with span(f"tool {self.name}", "tool", **attributes):
+            if self.accepts_traceparent and (traceparent := current_traceparent()):
+                arguments[TRACEPARENT_ARGUMENT] = traceparent
+            result = await self.inner.run_json(arguments, cancellation_token)
+        return self._strip_remote_spans(result)
+
+    @staticmethod
+    def _strip_remote_spans(result: Any) -> Any:
+        if not isinstance(result, list):
+            return result
+        stripped = []
+        for item in result:
+            text = getattr(item, "text", None)
+            if getattr(item, "type", None) == "text" and text and "trace_spans" in text:
+                try:
+                    payload = json.loads(text)
+                except ValueError:
+                    payload = None
+                if isinstance(payload, dict) and "trace_spans" in payload:
+                    record_remote_spans(payload.pop("trace_spans") or [])
+                    item = item.model_copy(update={"text": json.dumps(payload)})
+            stripped.append(item)
+        return stripped
+
+    def return_value_as_string(self, value: Any) -> str:
+        return self.inner.return_value_as_string(value)
+
+
+class AgentRuntime:
+    """
+    Long-lived background event loop shared by every Streamlit session in the process.
+
+    The loop owns the MCP SSE session (and the tool adapters bound to it) and the OpenAI model
+    client with its HTTP connection pool, so neither is rebuilt per query. Streamlit script
+    threads hand work to the loop through `submit` / `run` / `iterate`.
+
+    A supervisor task keeps the MCP session open: if the server goes away the session is torn
+    down and re-established with exponential backoff, and `get_tools` waits for it to come back.
+
+    With `MODEL_ROUTING_ENABLED` the model client is a router over one client per model named in
+    `MODEL_ROUTING_RULES`, each with its own cache and tracing. `model_factory` builds the client
+    for a model name instead of the OpenAI client (the offline benchmarks pass replayed and
+    simulated models); its clients are wrapped by the LLM cache and tracing like the OpenAI ones.
+    """
+
+    def __init__(self, model_factory: Callable[[str], ChatCompletionClient] | None = None):
+        self.model_client: ChatCompletionClient | None = None
+        self._model_factory = model_factory
+        self.tools: list = []
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_task: asyncio.Task | None = None
+        self._connected: asyncio.Event | None = None
+        self._reconnect: asyncio.Event | None = None
+        self._stop: asyncio.Event | None = None
+        self._last_health_check = 0.0
+
+    # ──────── Lifecycle ──────────────────────────────────────────────────────────
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.is_running:
+                return
+            self._loop = asyncio.new_event_loop()
+            loop_ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run_loop, args=(loop_ready,), name="agent-runtime", daemon=True
+            )
+            self._thread.start()
+            loop_ready.wait()
+            asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+            log_message("Agent runtime started", level="info")
+
+    def _run_loop(self, loop_ready: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(loop_ready.set)
+        self._loop.run_forever()
+
+    async def _setup(self):
+        self._connected = asyncio.Event()
+        self._reconnect = asyncio.Event()
+        self._stop = asyncio.Event()
+        if settings.MODEL_ROUTING_ENABLED:
+            rules = [RouteRule(**rule) for rule in settings.MODEL_ROUTING_RULES]
+            models = {settings.OPENAI_MODEL} | {rule.model for rule in rules} | {rule.fallback for rule in rules if rule.fallback}
+            self.model_client = RoutingChatCompletionClient(
+                {model: self._model_client(model) for model in sorted(models)},
+                rules,
+                default_model=settings.OPENAI_MODEL,
+                prices=settings.MODEL_PRICES,
+            )
+        else:
+            self.model_client = self._model_client(settings.OPENAI_MODEL)
+        self._session_task = asyncio.create_task(self._maintain_mcp_session())
+
+    def _model_client(self, model: str) -> ChatCompletionClient:
+        if self._model_factory is not None:
+            client = self._model_factory(model)
+        else:
+            # The OpenAI SDK and the MCP client are the slowest imports of the app; they load here,
+            # on the runtime's own thread, the first time a session needs the runtime.
+            from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+            client = OpenAIChatCompletionClient(model=model, api_key=settings.OPENAI_API_KEY)
+        if settings.LLM_CACHE_ENABLED:
+            client = CachedChatCompletionClient(client, model=model)
+        if settings.TRACING_ENABLED:
+            client = TracedChatCompletionClient(client, model=model)
+        return client
+
+    def shutdown(self, timeout: float = 10):
+        with self._lock:
+            if not self.is_running:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._teardown(), self._loop).result(timeout)
+            except Exception:
+                log_message(f"Error tearing down agent runtime: {traceback.format_exc()}", level="warning")
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            self._loop.close()
+            self._thread = None
+            log_message("Agent runtime stopped", level="info")
+
+    async def _teardown(self):
+        self._stop.set()
+        if self._session_task is not None:
+            await self._session_task
+        if self.model_client is not None:
+            await self.model_client.close()
+
+    # ──────── MCP session ────────────────────────────────────────────────────────
+    @staticmethod
+    def _server_params():
+        from autogen_ext.tools.mcp import SseServerParams, StreamableHttpServerParams
+
+        if settings.MCP_TRANSPORT == "sse":
+            return SseServerParams(
+                url=settings.MCP_SERVER_URL,
+                headers={"Content-Type": "application/json"},
+                timeout=30
+            )
+        # Stateless streamable HTTP: every call is one request, any server worker can answer it.
+        return StreamableHttpServerParams(url=settings.MCP_SERVER_URL, timeout=30)
+
+    async def _maintain_mcp_session(self):
+        from autogen_ext.tools.mcp import create_mcp_server_session, mcp_server_tools
+
+        server_params = self._server_params()
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                async with create_mcp_server_session(server_params) as session:
+                    await session.initialize()
+                    # Discovered once per session and reused by every query until it reconnects.
+                    self.tools = [
+                        TracedTool(tool) for tool in await mcp_server_tools(server_params, session=session)
+                    ]
+                    self._session = session
+                    self._last_health_check = time.monotonic()
+                    self._connected.set()
+                    backoff = 1.0
+                    log_message(f"Connected to MCP server at {settings.MCP_SERVER_URL} ({len(self.tools)} tools)", level="info")
+
+                    waiters = [asyncio.create_task(self._reconnect.wait()), asyncio.create_task(self._stop.wait())]
+                    try:
+                        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        for waiter in waiters:
+                            waiter.cancel()
+            except Exception:
+                log_message(f"MCP session error: {traceback.format_exc()}", level="warning")
+            finally:
+                self._connected.clear()
+                self._session = None
+                self._reconnect.clear()
+
+            if not self._stop.is_set():
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=backoff)
+                except asyncio.TimeoutError:
+                    pass
+                backoff = min(backoff * 2, 30.0)
+
+    def reconnect(self):
+        """Drops the current MCP session, the supervisor opens a new one."""
+        if self.is_running:
+            self._loop.call_soon_threadsafe(self._reconnect.set)
+
+    async def get_tools(self, timeout: float = 30) -> list:
+        """
+        Returns the MCP tool adapters bound to the shared session, (re)connecting if needed.
+
+        Must be awaited on the runtime loop.
+        """
+        session = self._session
+        if session is not None and time.monotonic() - self._last_health_check > settings.MCP_HEALTH_CHECK_INTERVAL_SECONDS:
+            try:
+                await asyncio.wait_for(session.send_ping(), timeout=5)
+                self._last_health_check = time.monotonic()
+            except Exception:
+                log_message("MCP server did not answer the ping, reconnecting", level="warning")
+                self._connected.clear()
+                self._reconnect.set()
+
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"MCP server at {settings.MCP_SERVER_URL} is not reachable")
+        return self.tools
+
+    # ──────── Thread-safe submission ────────────────────────────────────────────
+    def submit(self, coro: Awaitable[T]) -> concurrent.futures.Future:
+        """Schedules a coroutine on the runtime loop from any thread."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro: Awaitable[T], timeout: float | None = None) -> T:
+        """Runs a coroutine on the runtime loop and blocks the calling thread for its result."""
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, events: AsyncIterator[T]) -> Iterator[T]:
+        """Consumes an async generator that runs on the runtime loop from a synchronous thread."""
+        try:
+            while True:
+                try:
+                    yield self.run(events.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            if hasattr(events, "aclose"):
+                self.run(events.aclose())
+
+
+_runtime: AgentRuntime | None = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime() -> AgentRuntime:
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = AgentRuntime()
+            atexit.register(_runtime.shutdown)
+    _runtime.start()
+    return _runtime
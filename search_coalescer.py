@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import time
+import traceback
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import cache
+from logger.app_logger import log_message
+from settings import settings
+from tracing import span
+
+
+def search_key(*parts) -> str:
+    """Identifies one search; the arguments never appear in Redis keys."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+
+
+class SearchCoalescer:
+    """
+    Single-flight for identical searches (same session, query and result options).
+
+    In this process, concurrent identical calls await one task. Across workers, the task first
+    looks for a result another worker stored in Redis, then claims the search with a Redis lock;
+    when another worker holds it, the task polls for that worker's result instead of calling
+    Gmail (and runs the search itself if the other worker fails or takes longer than
+    `wait_seconds`). Successful results are kept for `result_ttl_seconds`, in process and in
+    Redis (encrypted), so rapid re-queries from the agent are answered without Gmail.
+    """
+
+    def __init__(
+        self,
+        result_ttl_seconds: int,
+        lock_ttl_seconds: int,
+        wait_seconds: float,
+        poll_seconds: float = 0.05,
+        max_local_results: int = 256,
+        enabled: bool = True,
+    ):
+        self.result_ttl_seconds = result_ttl_seconds
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_seconds = poll_seconds
+        self.max_local_results = max_local_results
+        self.enabled = enabled
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._results: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.calls = 0
+        self.searches = 0
+        self.joined_in_flight = 0
+        self.joined_other_worker = 0
+        self.local_hits = 0
+        self.redis_hits = 0
+
+    async def run(self, parts: tuple, search: Callable[[], Awaitable[dict]]) -> dict:
+        """The result of `search()` for `parts`, shared with identical concurrent and recent calls."""
+        if not self.enabled:
+            return await search()
+        self.calls += 1
+        key = search_key(*parts)
+
+        if (result := self._recent(key)) is not None:
+            self.local_hits += 1
+            with span("coalesced search", "cache", source="local"):
+                return dict(result)
+
+        task = self._inflight.get(key)
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            self.joined_in_flight += 1
+            with span("coalesced search", "cache", source="in_flight"):
+                return dict(await asyncio.shield(task))
+
+        task = asyncio.ensure_future(self._lead(key, search))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._inflight.pop(key, None) if self._inflight.get(key) is done else None)
+        # Shielded: a caller that gives up does not cancel the search for the others.
+        return dict(await asyncio.shield(task))
+
+    async def _lead(self, key: str, search: Callable[[], Awaitable[dict]]) -> dict:
+        token = None
+        try:
+            result, _ = await cache.aget_search_result(key)
+            if result is not None:
+                self.redis_hits += 1
+                self._remember(key, result)
+                return result
+            token = await cache.aacquire_search_lock(key, self.lock_ttl_seconds)
+            if token is None:
+                with span("coalesced search", "cache", source="other_worker") as wait_span:
+                    result = await self._await_other_worker(key)
+                    wait_span.set(found=result is not None)
+                if result is not None:
+                    self.joined_other_worker += 1
+                    self._remember(key, result)
+                    return result
+        except Exception:
+            log_message(f"Search coalescing through Redis failed, searching locally: {traceback.format_exc()}",
+                        level="warning")
+
+        try:
+            self.searches += 1
+            result = await search()
+            if result.get("success"):
+                self._remember(key, result)
+                try:
+                    await cache.asave_search_result(key, result, self.result_ttl_seconds)
+                except Exception as e:
+                    log_message(f"Could not share search result: {e}", level="warning")
+            return result
+        finally:
+            if token is not None:
+                try:
+                    await cache.arelease_search_lock(key, token)
+                except Exception as e:
+                    log_message(f"Could not release search lock: {e}", level="warning")
+
+    async def _await_other_worker(self, key: str) -> dict | None:
+        deadline = time.monotonic() + self.wait_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_seconds)
+            result, locked = await cache.aget_search_result(key)
+            if result is not None:
+                return result
+            if not locked:
+                return None  # the other worker finished without a shareable result
+        return None
+
+    def _recent(self, key: str) -> dict | None:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.result_ttl_seconds:
+            del self._results[key]
+            return None
+        return entry[1]
+
+    def _remember(self, key: str, result: dict):
+        self._results[key] = (time.monotonic(), result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_local_results:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
+
+    def stats(self) -> dict:
+        deduplicated = self.joined_in_flight + self.joined_other_worker + self.local_hits + self.redis_hits
+        return {
+            "calls": self.calls,
+            "searches": self.searches,
+            "deduplicated": deduplicated,
+            "joined_in_flight": self.joined_in_flight,
+            "joined_other_worker": self.joined_other_worker,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+        }
+
+
+search_coalescer = SearchCoalescer(
+    result_ttl_seconds=settings.SEARCH_RESULT_TTL_SECONDS,
+    lock_ttl_seconds=settings.SEARCH_LOCK_TTL_SECONDS,
+    wait_seconds=settings.SEARCH_COALESCE_WAIT_SECONDS,
+    enabled=settings.SEARCH_COALESCING_ENABLED,
+)
@@ -0,0 +1,265 @@
+import asyncio
+import re
+import time
+import traceback
+import zlib
+from typing import Literal
+
+import numpy as np
+
+from gmail_search import MessageFormat
+from logger.app_logger import log_message
+from mailbox_index import MailboxIndex, compile_gmail_query
+from settings import settings
+from tracing import span
+
+RetrievalMode = Literal["hybrid", "vector", "keyword"]
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+SUFFIXES = ("ing", "ed", "es", "s")
+CANDIDATES_PER_RESULT = 5  # Each ranking contributes this many candidates per requested result to the fusion
+MIN_CANDIDATES = 50
+
+
+# ──────── Embedders ─────────────────────────────────────────────────────────────
+class HashingEmbedder:
+    """
+    Offline embedder: words (with plural and tense endings stripped) and word pairs hashed into
+    `dimensions` buckets, sublinear term frequency, L2 normalised. It only matches vocabulary, not
+    meaning; it is what the benchmarks use and a fallback for deployments without an embeddings API.
+    """
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+
+    @staticmethod
+    def _features(text: str) -> list[str]:
+        words = []
+        for word in TOKEN_PATTERN.findall(text.lower()):
+            for suffix in SUFFIXES:
+                if len(word) > len(suffix) + 3 and word.endswith(suffix):
+                    word = word[:-len(suffix)]
+                    break
+            words.append(word)
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def embed_sync(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: dict[int, int] = {}
+            for feature in self._features(text):
+                bucket = zlib.crc32(feature.encode()) % self.dimensions
+                counts[bucket] = counts.get(bucket, 0) + 1
+            for bucket, count in counts.items():
+                vectors[row, bucket] = 1.0 + np.log(count)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        return self.embed_sync(texts)
+
+
+class OpenAIEmbedder:
+    """OpenAI embeddings (`EMBEDDING_MODEL`, shortened to `EMBEDDING_DIMENSIONS`), requested in batches."""
+
+    def __init__(self, model: str, dimensions: int, batch_size: int):
+        from openai import AsyncOpenAI
+
+        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.model_name = model
+        self.model = f"{model}-{dimensions}"
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = await self.client.embeddings.create(
+                model=self.model_name, input=texts[start:start + self.batch_size], dimensions=self.dimensions,
+            )
+            vectors.extend(item.embedding for item in response.data)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimensions)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        if settings.EMBEDDING_PROVIDER == "hashing":
+            _embedder = HashingEmbedder(settings.EMBEDDING_DIMENSIONS)
+        else:
+            _embedder = OpenAIEmbedder(
+                settings.EMBEDDING_MODEL, settings.EMBEDDING_DIMENSIONS, settings.EMBEDDING_BATCH_SIZE
+            )
+    return _embedder
+
+
+# ──────── Incremental embedding ─────────────────────────────────────────────────
+_background_embeddings: dict[str, asyncio.Task] = {}
+
+
+async def embed_pending(index: MailboxIndex, embedder) -> int:
+    """Embeds every chunk of the index that has no vector from `embedder` yet; returns how many."""
+    embedded = 0
+    while True:
+        pending = await asyncio.to_thread(index.pending_chunks, embedder.model, settings.EMBEDDING_BATCH_SIZE)
+        if not pending:
+            return embedded
+        vectors = await embedder.embed([text for _, _, text in pending])
+        await asyncio.to_thread(
+            index.store_embeddings,
+            embedder.model,
+            [(message_id, chunk, vector.tobytes()) for (message_id, chunk, _), vector in zip(pending, vectors)],
+        )
+        embedded += len(pending)
+
+
+async def ensure_embedded(index: MailboxIndex, embedder, session_id: str) -> int:
+    """
+    Brings the index's vectors up to date. A few pending chunks (new mail since the last search)
+    are embedded before answering; a backlog (the first bulk sync) is embedded in the background
+    and the search uses the vectors that exist so far. Returns the number of chunks still pending.
+    """
+    pending = await asyncio.to_thread(index.count_pending_chunks, embedder.model)
+    if pending == 0:
+        return 0
+    task = _background_embeddings.get(index.path)
+    if task is not None and not task.done():
+        return pending
+    if pending <= settings.SEMANTIC_INLINE_EMBED_LIMIT:
+        with span("embed new chunks", "llm", chunks=pending):
+            await embed_pending(index, embedder)
+        return 0
+
+    async def run():
+        started = time.perf_counter()
+        try:
+            embedded = await embed_pending(index, embedder)
+            log_message(
+                f"[{session_id}]: Embedded {embedded} mailbox chunks in {time.perf_counter() - started:.1f}s",
+                level="info",
+            )
+        except Exception:
+            log_message(f"[{session_id}]: Embedding the mailbox index failed: {traceback.format_exc()}", level="error")
+
+    _background_embeddings[index.path] = asyncio.create_task(run())
+    return pending
+
+
+# ──────── Vector search ─────────────────────────────────────────────────────────
+class _ChunkMatrix:
+    def __init__(self, version: tuple[int, int], message_ids: np.ndarray, vectors: np.ndarray):
+        self.version = version
+        self.message_ids = message_ids
+        self.vectors = vectors
+
+
+_matrices: dict[tuple[str, str], _ChunkMatrix] = {}
+
+
+def _chunk_matrix(index: MailboxIndex, model: str, dimensions: int) -> _ChunkMatrix:
+    """All chunk vectors of the index as one matrix, reloaded from SQLite only after a write."""
+    matrix = _matrices.get((index.path, model))
+    version = index.version
+    if matrix is None or matrix.version != version:
+        rows = index.chunk_embeddings(model)
+        vectors = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.float32).reshape(len(rows), dimensions)
+        matrix = _matrices[(index.path, model)] = _ChunkMatrix(
+            version, np.array([message_id for message_id, _ in rows], dtype=object), vectors
+        )
+    return matrix
+
+
+def vector_ranking(
+    index: MailboxIndex, model: str, query_vector: np.ndarray, max_results: int, allowed: set[str] | None = None
+) -> list[tuple[str, float]]:
+    """Messages by the cosine similarity of their best chunk to the query, best first."""
+    matrix = _chunk_matrix(index, model, query_vector.shape[0])
+    if not len(matrix.message_ids):
+        return []
+    scores = matrix.vectors @ query_vector
+    ranking: list[tuple[str, float]] = []
+    seen = set()
+    for position in np.argsort(-scores):
+        if scores[position] <= 0:
+            break  # nothing in common with the query
+        message_id = matrix.message_ids[position]
+        if message_id in seen or (allowed is not None and message_id not in allowed):
+            continue
+        seen.add(message_id)
+        ranking.append((message_id, float(scores[position])))
+        if len(ranking) >= max_results:
+            break
+    return ranking
+
+
+def fuse_rankings(rankings: dict[str, list[str]], k: int) -> list[tuple[str, float, list[str]]]:
+    """Reciprocal rank fusion: `(message id, score, rankings it appears in)`, best first."""
+    fused: dict[str, list] = {}
+    for name, ranking in rankings.items():
+        for rank, message_id in enumerate(ranking, start=1):
+            entry = fused.setdefault(message_id, [0.0, []])
+            entry[0] += 1.0 / (k + rank)
+            entry[1].append(name)
+    return sorted(((message_id, score, sources) for message_id, (score, sources) in fused.items()),
+                  key=lambda item: item[1], reverse=True)
+
+
+async def semantic_search(
+    index: MailboxIndex,
+    query: str,
+    max_results: int,
+    mode: RetrievalMode = "hybrid",
+    message_format: MessageFormat = "full",
+    embedder=None,
+) -> list[dict]:
+    """
+    Ranks the indexed messages by relevance to a natural-language query. Gmail operators in the
+    query (`from:`, `after:`, `label:` ...) filter the candidates; the free text is matched by
+    BM25 over the FTS index (any term, not all of them), by vector similarity, or both fused
+    with reciprocal rank fusion. Raises `UnsupportedQuery` for operators the index cannot apply.
+    """
+    compiled = compile_gmail_query(query)
+    text = compiled.text
+    if not text:
+        # Operators only: nothing to rank by, newest first like Gmail.
+        return await asyncio.to_thread(index.search, query, max_results, message_format)
+
+    candidates = max(MIN_CANDIDATES, CANDIDATES_PER_RESULT * max_results)
+    rankings: dict[str, list[str]] = {}
+    vector_scores: dict[str, float] = {}
+    allowed = await asyncio.to_thread(index.matching_ids, compiled)
+
+    if mode != "keyword":
+        embedder = embedder or get_embedder()
+        try:
+            with span("embed query", "llm"):
+                query_vector = (await embedder.embed([text]))[0]
+            with span("vector search", "internal") as vector_span:
+                ranked = await asyncio.to_thread(vector_ranking, index, embedder.model, query_vector, candidates, allowed)
+                vector_span.set(candidates=len(ranked))
+            rankings["vector"] = [message_id for message_id, _ in ranked]
+            vector_scores = dict(ranked)
+        except Exception as e:
+            log_message(f"Vector search unavailable, ranking by keywords: {e}", level="warning")
+            mode = "keyword"
+
+    if mode != "vector":
+        with span("keyword search", "internal") as keyword_span:
+            ranked = await asyncio.to_thread(index.keyword_ranking, compiled.fts_terms, candidates * 2)
+            rankings["keyword"] = [message_id for message_id in ranked if message_id in allowed][:candidates]
+            keyword_span.set(candidates=len(rankings["keyword"]))
+
+    fused = fuse_rankings(rankings, settings.SEMANTIC_RRF_K)[:max_results]
+    emails = await asyncio.to_thread(index.get_messages, [message_id for message_id, _, _ in fused], message_format)
+    details = {message_id: (score, sources) for message_id, score, sources in fused}
+    for email in emails:
+        score, sources = details[email["id"]]
+        email["score"] = round(vector_scores[email["id"]], 4) if mode == "vector" else round(score, 5)
+        email["matched_by"] = sources
+    return emails
@@ -1,5 +1,3 @@
-from pprint import pprint
-
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv, find_dotenv
 
@@ -9,11 +7,156 @@ class Settings(BaseSettings):
     COOKIE_NAME: str
     COOKIE_SECRET: str
     OPENAI_API_KEY: str
+    OPENAI_MODEL: str = "gpt-4o"
     GOOGLE_CLIENT_ID: str
     GOOGLE_CLIENT_SECRET: str
     MCP_SERVER_URL: str
     FERNET_KEY: str
+    LOG_LEVEL: str = "INFO"  # log_message returns before any formatting below this level
+    LOG_JSON_PATH: str | None = None  # Structured JSON lines, written by the log writer thread
+    LOG_QUEUE_SIZE: int = 10000  # Records waiting for the writer; more are dropped, never blocking
     REDIS_HOST: str = "redis://localhost:6379"
+    REDIS_MAX_CONNECTIONS: int = 50  # Per pool; the sync and async clients each have one
+    REDIS_POOL_TIMEOUT_SECONDS: int = 20  # Wait for a free pooled connection before failing
+    SESSION_CACHE_SIZE: int = 1024  # Decrypted sessions kept in process (see cache.SessionCache)
+    SESSION_CACHE_TTL_SECONDS: int = 30
+    # MCP server deployment (see mcp_server.py): "sse" serves one process; "http" is stateless
+    # streamable HTTP, which any of MCP_WORKERS uvicorn workers can answer
+    MCP_TRANSPORT: str = "sse"
+    MCP_HOST: str = "127.0.0.1"
+    MCP_PORT: int = 8000
+    MCP_WORKERS: int = 1
+    MCP_SHUTDOWN_TIMEOUT_SECONDS: int = 30  # In-flight tool calls get this long to finish on SIGTERM
+    STREAM_SUMMARIES: bool = True  # Render agent progress incrementally in the chat
+    MCP_HEALTH_CHECK_INTERVAL_SECONDS: int = 15  # Ping the shared MCP session when idle longer than this
+
+    # OAuth sessions and token refresh ahead of expiry (see token_manager.py)
+    SESSION_TTL_SECONDS: int = 7 * 24 * 3600  # Lifetime of a login's session entry in Redis
+    OAUTH_TOKEN_URL: str = "https://oauth2.googleapis.com/token"
+    TOKEN_REFRESH_ENABLED: bool = True
+    TOKEN_REFRESH_AHEAD_SECONDS: int = 600  # Refresh in the background this long before the token expires
+    TOKEN_REFRESH_IDLE_SECONDS: int = 1800  # Stop refreshing sessions without tool calls for this long
+    TOKEN_REFRESH_LOCK_SECONDS: int = 30  # A worker's claim on a refresh expires after this
+    TOKEN_REFRESH_WAIT_SECONDS: float = 10  # An expired token waits this long for another worker's refresh
+    TOKEN_REFRESH_TIMEOUT_SECONDS: float = 10
+
+    # Gmail API client pool (see gmail_client.py)
+    GMAIL_API_ENDPOINT: str | None = None  # Override for local Gmail stubs, e.g. http://127.0.0.1:8765/
+    GMAIL_CLIENT_POOL_SIZE: int = 256
+    GMAIL_CLIENT_TTL_SECONDS: int = 900
+    GMAIL_CLIENT_CONNECTIONS: int = 4  # Persistent HTTP connections per pooled client
+    GMAIL_BATCH_SIZE: int = 50  # Gmail recommends at most 50 requests per batch
+
+    # Per-user Gmail quota and retries (see gmail_quota.py); Gmail allows 15,000 units per user per minute
+    GMAIL_QUOTA_ENABLED: bool = True
+    GMAIL_QUOTA_UNITS_PER_SECOND: float = 250
+    GMAIL_QUOTA_BURST_UNITS: int = 250
+    GMAIL_QUOTA_MAX_WAIT_SECONDS: float = 30  # Fail a call rather than queue it longer than this
+    GMAIL_MAX_RETRIES: int = 4  # Retries of rate-limited (429 / 403 rateLimitExceeded) requests
+    GMAIL_BACKOFF_BASE_SECONDS: float = 0.5
+    GMAIL_BACKOFF_MAX_SECONDS: float = 32
+
+    # Single-flight for identical searches (see search_coalescer.py)
+    SEARCH_COALESCING_ENABLED: bool = True
+    SEARCH_RESULT_TTL_SECONDS: int = 10  # Identical searches within this window reuse the result
+    SEARCH_LOCK_TTL_SECONDS: int = 30  # A worker's claim on a search expires after this
+    SEARCH_COALESCE_WAIT_SECONDS: float = 15  # Wait this long for another worker before searching
+
+    # Several candidate queries in one tool call (see multi_search.py)
+    MULTI_QUERY_MAX_QUERIES: int = 5
+
+    # Local mailbox index (see mailbox_index.py)
+    MAILBOX_INDEX_ENABLED: bool = True
+    MAILBOX_INDEX_DIR: str = ".mailbox_index"
+    MAILBOX_INDEX_MAX_MESSAGES: int = 2000  # Depth of the initial bulk sync
+    MAILBOX_INDEX_MAX_STALENESS_SECONDS: int = 30  # Older than this, sync history before answering
+    MAILBOX_INDEX_SYNC_LOCK_SECONDS: int = 600  # A worker's claim on syncing an index expires after this
+    MAILBOX_INDEX_SYNC_WAIT_SECONDS: float = 5  # Wait this long for another worker's history sync
+    MAILBOX_INDEX_BUSY_TIMEOUT_MS: int = 5000  # SQLite waits this long for another worker's write
+    MAILBOX_INDEX_SESSION_IDLE_SECONDS: int = 1800  # Forget a session's Gmail address after this long unused
+    GMAIL_HTTP_TIMEOUT_SECONDS: int = 30
+
+    # Semantic retrieval over the mailbox index (see semantic_search.py)
+    SEMANTIC_SEARCH_ENABLED: bool = True
+    EMBEDDING_PROVIDER: str = "openai"  # "openai", or "hashing" for offline lexical vectors
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    EMBEDDING_DIMENSIONS: int = 512
+    EMBEDDING_BATCH_SIZE: int = 256  # Chunks per embeddings request
+    SEMANTIC_CHUNK_WORDS: int = 200
+    SEMANTIC_CHUNK_OVERLAP_WORDS: int = 40
+    SEMANTIC_INLINE_EMBED_LIMIT: int = 256  # More pending chunks than this are embedded in the background
+    SEMANTIC_RRF_K: int = 60  # Reciprocal rank fusion constant for hybrid ranking
+
+    # Background warm-up after login (see warmup.py and agent.warm_up_session)
+    WARMUP_ENABLED: bool = True
+    WARMUP_SUMMARY_MESSAGES: int = 20  # Most recent inbox emails fetched and pre-summarised
+    WARMUP_COOLDOWN_SECONDS: int = 900  # One warm-up per Gmail user in this window
+
+    # Tool result compaction (see email_compactor.py)
+    EMAIL_COMPACTION_ENABLED: bool = True
+    EMAIL_TOKENIZER_MODEL: str = "gpt-4o"
+    EMAIL_MAX_TOKENS_PER_EMAIL: int = 800
+    EMAIL_MAX_TOKENS_PER_RESPONSE: int = 6000  # Default for the search tool's max_tokens
+
+    # Query planner fast path (see query_planner.py)
+    QUERY_PLANNER_ENABLED: bool = True
+    QUERY_PLANNER_MIN_CONFIDENCE: float = 0.7  # Below this the agent team plans the search
+
+    # Summarisation mode (see summariser.py): "team", "map_reduce", or "auto" to use
+    # map-reduce when a request asks for more than SUMMARY_MAP_REDUCE_MIN_EMAILS emails
+    SUMMARY_MODE: str = "auto"
+    SUMMARY_MAP_REDUCE_MIN_EMAILS: int = 20
+    SUMMARY_MAP_REDUCE_MAX_EMAILS: int = 200  # Emails fetched when the request gives no count
+    SUMMARY_BATCH_SIZE: int = 20
+    SUMMARY_BATCH_MAX_TOKENS: int = 8000
+    SUMMARY_MAX_CONCURRENCY: int = 10
+    SUMMARY_REDUCE_FAN_IN: int = 10  # Partials merged per reduce call
+    SUMMARY_CACHE_ENABLED: bool = True  # Reuse per-message summaries across queries
+    SUMMARY_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+
+    # Background digests (see digest_worker.py): every login schedules DIGEST_DEFAULT_QUERY
+    DIGEST_ENABLED: bool = True
+    DIGEST_DEFAULT_NAME: str = "Daily summary of unread"
+    DIGEST_DEFAULT_QUERY: str = "summarise my unread emails from the last day"
+    DIGEST_DEFAULT_INTERVAL_SECONDS: int = 24 * 3600
+    DIGEST_WORKER_CONCURRENCY: int = 20  # Digests in flight per worker process
+    DIGEST_USER_CONCURRENCY: int = 2  # Digests in flight per Gmail user per worker
+    DIGEST_USER_JOBS_PER_HOUR: int = 30  # Per Gmail user across workers; more wait for the next hour
+    DIGEST_USER_BUSY_DEFER_SECONDS: float = 5  # A job whose user is at DIGEST_USER_CONCURRENCY waits this long
+    DIGEST_LEASE_SECONDS: int = 300  # A claimed job goes back to the queue when its worker stops renewing it
+    DIGEST_POLL_SECONDS: float = 1.0  # Queue poll interval of an idle worker
+    DIGEST_MAX_ATTEMPTS: int = 3
+    DIGEST_RETRY_SECONDS: float = 60  # Doubled on every further attempt
+    DIGEST_RESULT_TTL_SECONDS: int = 7 * 24 * 3600
+    DIGEST_SHUTDOWN_TIMEOUT_SECONDS: int = 30  # Running digests get this long to finish on SIGTERM
+
+    # LLM response cache (see model_clients.py)
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_TTL_SECONDS: int = 3600
+    LLM_CACHE_MAX_ENTRY_BYTES: int = 256 * 1024
+    LLM_CACHE_MAX_ENTRIES: int = 10000  # Least recently used entries are evicted beyond this
+
+    # Model routing per agent role and turn (see model_clients.py). Rules are tried in order, the
+    # first match picks the model; unmatched calls use OPENAI_MODEL. Roles: email_retriever,
+    # critic_agent, fast_path, summary_map, summary_reduce and summary_final
+    MODEL_ROUTING_ENABLED: bool = False
+    MODEL_ROUTING_RULES: list[dict] = [
+        # The retriever's first turn only chooses a search; per-message summaries are short and many
+        {"model": "gpt-4o-mini", "roles": ["email_retriever"], "max_turn": 0},
+        {"model": "gpt-4o-mini", "roles": ["summary_map"], "max_prompt_tokens": 8000},
+    ]
+    MODEL_PRICES: dict[str, list[float]] = {  # USD per million prompt and completion tokens
+        "gpt-4o": [2.5, 10.0],
+        "gpt-4o-mini": [0.15, 0.6],
+    }
+
+    # Request tracing (see tracing.py)
+    TRACING_ENABLED: bool = True
+    TRACE_SERVICE_NAME: str = "gmail-insighter"
+    TRACE_EXPORTER: str = "none"  # "none", "file" (JSON lines at TRACE_FILE_PATH) or "otlp"
+    TRACE_FILE_PATH: str = "traces.jsonl"
+    TRACE_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"  # OTLP/HTTP JSON collector
+    TRACE_STORE_SIZE: int = 200  # Recent traces kept in process for the latency waterfall
 
     class Config:
         _env_file = None
@@ -23,5 +166,3 @@ load_dotenv(find_dotenv())
 
 settings = Settings(_env_file=find_dotenv())
 
-pprint(settings.model_dump())
-
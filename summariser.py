@@ -0,0 +1,224 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+
+from autogen_core.models import ChatCompletionClient, SystemMessage, UserMessage
+
+from cache import get_cached_summaries, save_cached_summaries
+from config import FINAL_SUMMARY_PROMPT, MAP_SUMMARY_PROMPT, MAP_SUMMARY_PROMPT_VERSION, REDUCE_SUMMARY_PROMPT
+from email_compactor import get_token_counter
+from logger.app_logger import log_message
+from model_clients import routing_key, with_role
+from settings import settings
+from tracing import span
+
+FALLBACK_SUMMARY_CHARS = 200  # Used when the model did not summarise an email
+
+
+@dataclass
+class SummaryStats:
+    emails: int = 0
+    cached_summaries: int = 0
+    map_calls: int = 0
+    map_failures: int = 0
+    reduce_calls: int = 0
+    reduce_levels: int = 0
+    map_seconds: float = 0.0
+    reduce_seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "emails": self.emails,
+            "cached_summaries": self.cached_summaries,
+            "cache_hit_rate": round(self.cached_summaries / self.emails, 3) if self.emails else 0.0,
+            "map_calls": self.map_calls,
+            "map_failures": self.map_failures,
+            "reduce_calls": self.reduce_calls,
+            "reduce_levels": self.reduce_levels,
+            "map_seconds": round(self.map_seconds, 2),
+            "reduce_seconds": round(self.reduce_seconds, 2),
+        }
+
+
+def batch_emails(emails: list[dict], batch_size: int, max_batch_tokens: int) -> list[list[dict]]:
+    """
+    Packs emails into map batches of at most `batch_size` emails and `max_batch_tokens` tokens.
+    Threads are placed whole into the first batch with room (first fit, in result order); a thread
+    larger than a batch is split across new ones.
+    """
+    counter = get_token_counter()
+    threads: dict[str, list[dict]] = {}
+    for email in emails:
+        threads.setdefault(email.get("threadId") or email["id"], []).append(email)
+
+    batches: list[list[dict]] = []
+    batch_tokens: list[int] = []
+    for thread in threads.values():
+        tokens = [counter.count(email.get("body") or email.get("snippet") or "") for email in thread]
+        for index, batch in enumerate(batches):
+            if len(batch) + len(thread) <= batch_size and batch_tokens[index] + sum(tokens) <= max_batch_tokens:
+                batch.extend(thread)
+                batch_tokens[index] += sum(tokens)
+                break
+        else:
+            for email, email_tokens in zip(thread, tokens):
+                full = batches and (len(batches[-1]) >= batch_size or batch_tokens[-1] + email_tokens > max_batch_tokens)
+                if email is thread[0] or full:
+                    batches.append([])
+                    batch_tokens.append(0)
+                batches[-1].append(email)
+                batch_tokens[-1] += email_tokens
+    return batches
+
+
+def _email_line(email: dict, summary: str) -> str:
+    return f"- [{email.get('date') or 'undated'}] {email.get('from') or 'unknown sender'} | {email.get('subject') or '(no subject)'}: {summary}"
+
+
+class MapReduceSummariser:
+    """
+    Summarises large result sets in parallel.
+
+    Map: batches of emails (threads kept together) are summarised concurrently, at most
+    `max_concurrency` model calls at a time, into one short summary per message.
+    Reduce: the per-message notes are merged `fan_in` partials at a time, level by level, until a
+    single call can write the answer. Wall time grows with the number of levels
+    (logarithmic in the result size), not with the number of emails.
+
+    Per-message summaries do not depend on the request and are cached in Redis by message id,
+    model (with routing, the rules of the map calls) and prompt version (`cache.get_cached_summaries`);
+    only uncached emails are mapped.
+    """
+
+    def __init__(
+        self,
+        model_client: ChatCompletionClient,
+        batch_size: int | None = None,
+        max_batch_tokens: int | None = None,
+        max_concurrency: int | None = None,
+        fan_in: int | None = None,
+        model: str | None = None,
+        use_cache: bool | None = None,
+    ):
+        self.model_client = model_client
+        # Cached summaries are keyed by the model that wrote them: with routing, the map calls' routes.
+        self.model = model or routing_key(model_client, "summary_map") or settings.OPENAI_MODEL
+        self.use_cache = settings.SUMMARY_CACHE_ENABLED if use_cache is None else use_cache
+        self.batch_size = batch_size or settings.SUMMARY_BATCH_SIZE
+        self.max_batch_tokens = max_batch_tokens or settings.SUMMARY_BATCH_MAX_TOKENS
+        self.fan_in = max(2, fan_in or settings.SUMMARY_REDUCE_FAN_IN)
+        self._semaphore = asyncio.Semaphore(max_concurrency or settings.SUMMARY_MAX_CONCURRENCY)
+        self.stats = SummaryStats()
+
+    async def _complete(self, role: str, system_prompt: str, content: str, json_output: bool = False) -> str:
+        async with self._semaphore:
+            result = await with_role(self.model_client, role).create(
+                [SystemMessage(content=system_prompt), UserMessage(content=content, source="user")],
+                json_output=json_output,
+            )
+        return result.content if isinstance(result.content, str) else ""
+
+    # ──────── Map ─────────────────────────────────────────────────────────────────
+    async def summarise_batch(self, batch: list[dict]) -> dict[str, str]:
+        """One model call: `{message id: summary}` for a batch of emails."""
+        documents = [
+            {key: email.get(key) for key in ("id", "threadId", "from", "date", "subject")}
+            | {"body": email.get("body") or email.get("snippet") or ""}
+            for email in batch
+        ]
+        self.stats.map_calls += 1
+        content = await self._complete(
+            "summary_map",
+            MAP_SUMMARY_PROMPT,
+            f"Emails:\n{json.dumps(documents, ensure_ascii=False)}",
+            json_output=True,
+        )
+        summaries = json.loads(content).get("summaries", [])
+        return {item["id"]: item["summary"] for item in summaries if item.get("id") and item.get("summary")}
+
+    async def map_batches(self, batches: list[list[dict]]) -> dict[str, str]:
+        """Model summaries for the batches; a batch that fails contributes none."""
+        results = await asyncio.gather(*(self.summarise_batch(batch) for batch in batches), return_exceptions=True)
+        summaries: dict[str, str] = {}
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                self.stats.map_failures += 1
+                log_message(f"Summary batch of {len(batch)} emails failed: {result!r}", level="warning")
+                continue
+            summaries.update({email["id"]: result[email["id"]] for email in batch if email["id"] in result})
+        return summaries
+
+    async def summarise_messages(self, emails: list[dict]) -> dict[str, str]:
+        """
+        `{message id: summary}` for every email: cached summaries first, the rest mapped in batches.
+        Emails the model did not summarise fall back to their snippet and are not cached.
+        """
+        cached: dict[str, str] = {}
+        if self.use_cache:
+            with span("cache summaries", "cache", emails=len(emails)) as lookup_span:
+                cached = await asyncio.to_thread(get_cached_summaries, emails, self.model, MAP_SUMMARY_PROMPT_VERSION)
+                lookup_span.set(hits=len(cached))
+        self.stats.cached_summaries += len(cached)
+
+        uncached = [email for email in emails if email["id"] not in cached]
+        fresh = await self.map_batches(batch_emails(uncached, self.batch_size, self.max_batch_tokens)) if uncached else {}
+        if self.use_cache and fresh:
+            await asyncio.to_thread(
+                save_cached_summaries, uncached, fresh, self.model, MAP_SUMMARY_PROMPT_VERSION,
+                settings.SUMMARY_CACHE_TTL_SECONDS,
+            )
+
+        return {
+            email["id"]: cached.get(email["id"]) or fresh.get(email["id"])
+            or (email.get("snippet") or email.get("body") or "")[:FALLBACK_SUMMARY_CHARS]
+            for email in emails
+        }
+
+    # ──────── Reduce ──────────────────────────────────────────────────────────────
+    async def reduce(self, request: str, partials: list[str]) -> str:
+        """Merges partial notes `fan_in` at a time until one final call can answer the request."""
+        while len(partials) > self.fan_in:
+            self.stats.reduce_levels += 1
+            groups = [partials[index:index + self.fan_in] for index in range(0, len(partials), self.fan_in)]
+            self.stats.reduce_calls += len(groups)
+            partials = list(await asyncio.gather(*(
+                self._complete("summary_reduce", REDUCE_SUMMARY_PROMPT, f"Request: {request}\n\nNotes:\n" + "\n\n".join(group))
+                for group in groups
+            )))
+        self.stats.reduce_levels += 1
+        self.stats.reduce_calls += 1
+        return await self._complete("summary_final", FINAL_SUMMARY_PROMPT, f"Request: {request}\n\nNotes:\n" + "\n\n".join(partials))
+
+    async def summarise(self, request: str, emails: list[dict]) -> str:
+        self.stats.emails += len(emails)
+        started = time.perf_counter()
+        with span("summary map", "summary", emails=len(emails)):
+            summaries = await self.summarise_messages(emails)
+        self.stats.map_seconds += time.perf_counter() - started
+
+        # Leaves of the reduce tree: the notes of each batch (threads together), in result order.
+        leaves = [
+            "\n".join(_email_line(email, summaries[email["id"]]) for email in batch)
+            for batch in batch_emails(emails, self.batch_size, self.max_batch_tokens)
+        ]
+        started = time.perf_counter()
+        try:
+            with span("summary reduce", "summary", partials=len(leaves)):
+                return await self.reduce(request, leaves)
+        finally:
+            self.stats.reduce_seconds += time.perf_counter() - started
+
+
+async def summarise_emails(model_client: ChatCompletionClient, request: str, emails: list[dict]) -> str:
+    """Map-reduce summary of `emails` for the user's request."""
+    summariser = MapReduceSummariser(model_client)
+    try:
+        return await summariser.summarise(request, emails)
+    finally:
+        stats = summariser.stats
+        log_message(
+            f"Map-reduce summary of {stats.emails} emails, summary cache hits "
+            f"{stats.cached_summaries}/{stats.emails} ({stats.as_dict()['cache_hit_rate']:.0%}): {stats.as_dict()}",
+            level="info",
+        )
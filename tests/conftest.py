@@ -0,0 +1,4 @@
+from benchmarks.environment import configure_offline_environment
+
+# settings.py needs its required values before any application module is imported.
+configure_offline_environment(LOG_LEVEL="ERROR")
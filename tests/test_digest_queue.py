@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    return cache.redis_client
+
+
+async def claim() -> dict:
+    await cache.apromote_digest_jobs()
+    return await cache.aclaim_digest_job(60)
+
+
+def stored(redis, job: dict) -> dict:
+    return json.loads(redis.hget(cache.DIGEST_JOBS_KEY, job["id"]))
+
+
+def test_finishing_a_run_keeps_changes_saved_while_it_ran(redis):
+    async def scenario():
+        cache.schedule_digest("session-1", "daily", "unread emails", 86400, user="user-1")
+        job = await claim()
+        # The user logs in again while the digest runs.
+        cache.schedule_digest("session-2", "daily", "unread emails from alice", 86400, user="user-1")
+        assert await cache.afinish_digest_job({**job, "attempts": 0}, 86400)
+        return job
+
+    job = asyncio.run(scenario())
+    saved = stored(redis, job)
+    assert (saved["session_id"], saved["query"]) == ("session-2", "unread emails from alice")
+    assert redis.zscore(cache.DIGEST_SCHEDULED_KEY, job["id"]) == pytest.approx(saved["run_at"])
+
+
+def test_finishing_a_run_reschedules_the_stored_job(redis):
+    async def scenario():
+        cache.schedule_digest("session-1", "daily", "unread emails", 86400, user="user-1")
+        job = await claim()
+        assert await cache.afinish_digest_job({**job, "attempts": 2}, 30)
+        return job
+
+    job = asyncio.run(scenario())
+    saved = stored(redis, job)
+    assert saved["attempts"] == 2
+    assert saved["query"] == "unread emails"
+    assert redis.zscore(cache.DIGEST_SCHEDULED_KEY, job["id"]) == pytest.approx(saved["run_at"])
+
+
+def test_one_job_per_user_and_name(redis):
+    for session_id in ("session-1", "session-2", "session-3"):
+        cache.schedule_digest(session_id, "daily", "unread emails", 86400, user="user-1")
+    cache.schedule_digest("session-4", "daily", "unread emails", 86400, user="user-2")
+    assert redis.hlen(cache.DIGEST_JOBS_KEY) == 2
+    assert redis.zcard(cache.DIGEST_SCHEDULED_KEY) == 2
@@ -0,0 +1,36 @@
+from email_compactor import clean_body, strip_signature
+
+
+def test_keeps_content_starting_with_thanks():
+    body = "Hi,\nThanks for the update.\nPlease pay the invoice by Friday."
+    assert strip_signature(body) == body
+
+
+def test_keeps_content_starting_with_best():
+    body = "Hi team,\nBest option is plan B.\nIt is cheaper and ships sooner."
+    assert strip_signature(body) == body
+
+
+def test_strips_sign_off_line():
+    body = "Hi,\nThe release is on Monday.\n\nBest regards,\nAlice\nAcme Corp"
+    assert strip_signature(body) == "Hi,\nThe release is on Monday."
+
+
+def test_strips_delimited_signature():
+    body = "The numbers are attached.\n-- \nAlice Smith\nHead of Finance"
+    assert clean_body(body) == "The numbers are attached."
+
+
+def test_keeps_content_after_an_early_delimiter():
+    body = "Agenda\n--\n" + "\n".join(f"Item {index}" for index in range(1, 15))
+    assert strip_signature(body) == body
+
+
+def test_keeps_request_after_a_sign_off_line():
+    body = "Hi Bob,\nThanks!\nCan you send the signed contract by Friday?\nThe client is waiting."
+    assert clean_body(body) == body
+
+
+def test_strips_sign_off_followed_by_contact_details():
+    body = "See the draft attached.\n\nThanks!\nBob Jones\nSales Director, Acme Inc.\n+1 555 0100"
+    assert clean_body(body) == "See the draft attached."
@@ -0,0 +1,24 @@
+import time
+
+from gmail_client import GmailClientPool, build_credentials
+
+
+def session(expires_in: float) -> dict:
+    return {"access_token": "token", "refresh_token": "refresh", "scope": [], "expires_at": time.time() + expires_in}
+
+
+def test_token_close_to_expiry_is_still_valid():
+    # Within google-auth's refresh threshold, which would raise RefreshError on every call.
+    credentials = build_credentials(session(60))
+    assert credentials.valid
+    assert not credentials.expired
+
+
+def test_pool_reuses_client_for_token_close_to_expiry():
+    pool = GmailClientPool(max_size=4, ttl_seconds=300)
+    try:
+        client = pool.get("session", session(60))
+        assert pool.get("session", session(60)) is client
+        assert pool.stats()["hits"] == 1
+    finally:
+        pool.clear()
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import fakeredis
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import cache
+from gmail_quota import QUOTA_KEY_PREFIX, GmailQuotaTimeout, QuotaLimiter, backoff_seconds, retry_after_seconds
+
+RATE = 10.0
+BURST = 20
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    return cache.redis_client
+
+
+@pytest.fixture
+def limiter(redis):
+    return QuotaLimiter(units_per_second=RATE, burst_units=BURST, max_wait_seconds=0.5)
+
+
+def idle(redis, user: str, seconds: float):
+    """Moves the bucket's last refill back, as if nobody had spent quota for `seconds`."""
+    key = f"{QUOTA_KEY_PREFIX}_{user}"
+    redis.hset(key, "ts", str(float(redis.hget(key, "ts")) - seconds))
+
+
+def rate_limited(headers: dict) -> HttpError:
+    return HttpError(httplib2.Response({"status": 429, **headers}), b"{}")
+
+
+def test_burst_is_spent_then_callers_wait(limiter):
+    async def scenario():
+        assert await limiter._reserve("alice", BURST) == 0
+        return await limiter._reserve("alice", 5)
+
+    assert asyncio.run(scenario()) == pytest.approx(5 / RATE, abs=0.05)
+
+
+def test_bucket_refills_at_the_rate_up_to_the_burst(limiter, redis):
+    async def scenario():
+        await limiter._reserve("alice", BURST)
+        idle(redis, "alice", 1.0)
+        refilled = await limiter._reserve("alice", int(RATE))
+        after_refill = await limiter._reserve("alice", 1)
+        idle(redis, "alice", 3600.0)
+        full = await limiter._reserve("alice", BURST)
+        beyond_burst = await limiter._reserve("alice", 1)
+        return refilled, after_refill, full, beyond_burst
+
+    refilled, after_refill, full, beyond_burst = asyncio.run(scenario())
+    assert refilled == 0 and after_refill > 0
+    # An hour idle still only buys one burst.
+    assert full == 0 and beyond_burst > 0
+
+
+def test_each_user_has_their_own_bucket(limiter):
+    async def scenario():
+        await limiter._reserve("alice", BURST)
+        return await limiter._reserve("alice", 1), await limiter._reserve("bob", BURST)
+
+    alice, bob = asyncio.run(scenario())
+    assert alice > 0
+    assert bob == 0
+
+
+def test_workers_share_the_bucket_in_redis(limiter):
+    other_worker = QuotaLimiter(units_per_second=RATE, burst_units=BURST, max_wait_seconds=0.5)
+
+    async def scenario():
+        await limiter._reserve("alice", BURST)
+        return await other_worker._reserve("alice", 1)
+
+    assert asyncio.run(scenario()) > 0
+
+
+def test_acquire_times_out_past_the_max_wait(limiter):
+    async def scenario():
+        await limiter.acquire("alice", BURST)
+        with pytest.raises(GmailQuotaTimeout):
+            await limiter.acquire("alice", BURST)
+
+    asyncio.run(scenario())
+    assert limiter.stats()["timeouts"] == 1
+
+
+def test_penalty_empties_the_bucket_for_retry_after(limiter):
+    async def scenario():
+        await limiter.penalise("alice", retry_after_seconds(rate_limited({"retry-after": "3"})))
+        return await limiter._reserve("alice", 1), await limiter._reserve("bob", 1)
+
+    alice, bob = asyncio.run(scenario())
+    assert alice == pytest.approx(3 + 1 / RATE, abs=0.05)
+    assert bob == 0
+
+
+def test_retry_after_in_seconds_or_as_a_date():
+    assert retry_after_seconds(rate_limited({"retry-after": "7"})) == 7
+    assert retry_after_seconds(rate_limited({"retry-after": formatdate(time.time() + 30, usegmt=True)})) == pytest.approx(30, abs=2)
+    assert retry_after_seconds(rate_limited({"retry-after": "soon"})) is None
+    assert retry_after_seconds(rate_limited({})) is None
+
+
+def test_backoff_is_never_shorter_than_retry_after():
+    assert backoff_seconds(0, retry_after=45) == 45
+    assert backoff_seconds(0) > 0
@@ -0,0 +1,47 @@
+import sqlite3
+
+import pytest
+
+from benchmarks.synthetic_mailbox import SyntheticMessage
+from mailbox_index import MailboxIndex
+
+
+def message(message_id: str, body: str) -> dict:
+    return SyntheticMessage(
+        id=message_id, thread_id=message_id, history_id=1, internal_date=1_700_000_000_000,
+        sender="Alice <alice@example.com>", to="me@example.com", cc="", subject="Quarterly report",
+        body_text=body, body_html=None, label_ids=["INBOX"],
+    ).to_resource()
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MailboxIndex(str(tmp_path / "index.sqlite3"))
+    yield index
+    index.close()
+
+
+def test_message_text_is_encrypted_at_rest(index):
+    index.upsert_messages([message("m1", "The confidential merger closes on Friday.")])
+
+    raw = sqlite3.connect(index.path)
+    try:
+        for (value,) in raw.execute("SELECT body FROM messages UNION ALL SELECT snippet FROM messages "
+                                    "UNION ALL SELECT text FROM message_chunks"):
+            assert b"merger" not in value
+    finally:
+        raw.close()
+    assert [email["body"].strip() for email in index.search("merger", 10)] == ["The confidential merger closes on Friday."]
+    assert "merger" in index.pending_chunks("model", 10)[0][2]
+
+
+def test_updates_and_deletes_leave_the_text_index_consistent(index):
+    index.upsert_messages([message("m1", "Budget draft attached.")])
+    index.upsert_messages([message("m1", "Final budget attached."), message("m2", "Lunch on Friday?")])
+    assert index.search("draft", 10) == []
+    assert [email["id"] for email in index.search("final", 10)] == ["m1"]
+
+    index.delete_messages(["m1"])
+    assert index.search("budget", 10) == []
+    assert index.keyword_ranking(['"lunch"', '"budget"'], 10) == ["m2"]
+    index._connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('integrity-check')")
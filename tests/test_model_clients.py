@@ -0,0 +1,159 @@
+import asyncio
+
+import fakeredis
+import pytest
+from autogen_core.models import AssistantMessage, CreateResult, RequestUsage, SystemMessage, UserMessage
+from pydantic import BaseModel
+
+from benchmarks.simulated_model import SimulatedChatCompletionClient
+from model_clients import CachedChatCompletionClient, DelegatingChatCompletionClient, RouteRule, RoutingChatCompletionClient
+
+MESSAGES = [SystemMessage(content="You summarise emails."), UserMessage(content="Summarise my unread emails.", source="user")]
+SEARCH_TOOL = {"name": "search", "description": "Searches Gmail.", "parameters": {"type": "object", "properties": {}}}
+
+
+class StubModel(DelegatingChatCompletionClient):
+    """Answers every call with `finish_reason`, or raises `error`."""
+
+    def __init__(self, finish_reason: str = "stop", error: Exception | None = None):
+        super().__init__(SimulatedChatCompletionClient(time_scale=0))
+        self.finish_reason = finish_reason
+        self.error = error
+        self.calls = 0
+
+    async def create(self, messages, **kwargs) -> CreateResult:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return CreateResult(finish_reason=self.finish_reason, content="Two unread emails from Alice.",
+                            usage=RequestUsage(prompt_tokens=10, completion_tokens=8), cached=False)
+
+
+class Summary(BaseModel):
+    text: str
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def cached(model: StubModel, redis) -> CachedChatCompletionClient:
+    return CachedChatCompletionClient(model, "gpt-test", redis_client=redis, ttl_seconds=60,
+                                      max_entry_bytes=10_000, max_entries=10)
+
+
+def test_hit_does_not_call_the_model(redis):
+    model = StubModel()
+    client = cached(model, redis)
+
+    async def scenario():
+        return await client.create(MESSAGES), await client.create(MESSAGES)
+
+    first, second = asyncio.run(scenario())
+    assert model.calls == 1
+    assert second.content == first.content and second.cached
+    assert (client.hits, client.misses) == (1, 1)
+
+
+def test_key_covers_messages_tools_and_output_mode(redis):
+    client = cached(StubModel(), redis)
+
+    def key(messages=MESSAGES, tools=(), json_output=None):
+        return client.cache_key(messages, tools, "auto", json_output, {})
+
+    keys = [
+        key(),
+        key(messages=MESSAGES[:1] + [UserMessage(content="Summarise my starred emails.", source="user")]),
+        key(messages=MESSAGES[1:]),  # no system prompt
+        key(tools=[SEARCH_TOOL]),
+        key(json_output=True),
+        key(json_output=Summary),
+    ]
+    assert len(set(keys)) == len(keys)
+    assert key(messages=list(MESSAGES), tools=[SEARCH_TOOL]) == key(tools=[SEARCH_TOOL])
+
+
+@pytest.mark.parametrize("finish_reason", ["length", "content_filter", "unknown"])
+def test_incomplete_responses_are_not_cached(redis, finish_reason):
+    model = StubModel(finish_reason=finish_reason)
+    client = cached(model, redis)
+
+    async def scenario():
+        await client.create(MESSAGES)
+        await client.create(MESSAGES)
+
+    asyncio.run(scenario())
+    assert model.calls == 2
+    assert client.stats()["entries"] == 0
+
+
+def test_failed_call_is_not_cached(redis):
+    model = StubModel(error=RuntimeError("model unavailable"))
+    client = cached(model, redis)
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await client.create(MESSAGES)
+
+    asyncio.run(scenario())
+    assert model.calls == 2
+    assert client.stats()["entries"] == 0
+
+
+def router(rules: list[RouteRule], **clients) -> RoutingChatCompletionClient:
+    models = {"large": StubModel(), "small": StubModel(), **clients}
+    return RoutingChatCompletionClient(models, rules, "large")
+
+
+def test_routes_by_role():
+    client = router([RouteRule(model="small", roles=["summary_map"])])
+    assert client.route("summary_map", MESSAGES) == ("small", "large")
+    assert client.route("critic", MESSAGES) == ("large", None)
+    assert client.route(None, MESSAGES) == ("large", None)
+
+
+def test_routes_by_turn():
+    client = router([RouteRule(model="small", roles=["retriever"], max_turn=0)])
+    later_turn = MESSAGES + [AssistantMessage(content="Searching.", source="retriever"),
+                             UserMessage(content="Only from Alice.", source="user")]
+    assert client.route("retriever", MESSAGES)[0] == "small"
+    assert client.route("retriever", later_turn)[0] == "large"
+
+
+def test_routes_by_prompt_size():
+    client = router([RouteRule(model="small", max_prompt_tokens=100)])
+    long_prompt = [UserMessage(content="email body " * 100, source="user")]
+    assert client.route("summary_map", MESSAGES)[0] == "small"
+    assert client.route("summary_map", long_prompt)[0] == "large"
+    assert client.route("summary_map", MESSAGES, tools=[{**SEARCH_TOOL, "description": "x" * 1000}])[0] == "large"
+
+
+def test_first_matching_rule_wins():
+    client = router([RouteRule(model="small", roles=["critic"]), RouteRule(model="large", roles=["critic"])])
+    assert client.route("critic", MESSAGES)[0] == "small"
+
+
+def test_failing_routed_model_falls_back_to_the_default():
+    failing = StubModel(error=RuntimeError("model unavailable"))
+    client = router([RouteRule(model="small", roles=["summary_map"])], small=failing)
+
+    result = asyncio.run(client.for_role("summary_map").create(MESSAGES))
+    assert result.content == "Two unread emails from Alice."
+    assert failing.calls == 1 and client.clients["large"].calls == 1
+    routes = client.stats()["routes"]
+    assert routes["summary_map -> small"]["fallbacks"] == 1
+    assert routes["summary_map -> large"]["calls"] == 1
+
+
+def test_truncated_answer_falls_back_to_the_default():
+    client = router([RouteRule(model="small")], small=StubModel(finish_reason="length"))
+    assert asyncio.run(client.for_role("critic").create(MESSAGES)).finish_reason == "stop"
+
+
+def test_default_model_failure_is_raised():
+    client = router([], large=StubModel(error=RuntimeError("model unavailable")))
+    with pytest.raises(RuntimeError):
+        asyncio.run(client.for_role("critic").create(MESSAGES))
+    assert client.stats()["failures"] == 1
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from query_planner import plan_query
+
+NOW = datetime(2026, 1, 15, 10, 0, 0)
+
+
+@pytest.mark.parametrize("prompt", ["boss", "2024", "@gmail.com", "emails about invoices"])
+def test_keywords_alone_go_to_the_team(prompt):
+    plan = plan_query(prompt, NOW)
+    assert plan.gmail_query
+    assert plan.matched_rules == ["keywords"]
+    assert not plan.is_confident
+
+
+def test_structured_request_takes_the_fast_path():
+    plan = plan_query("unread emails from alice last week", NOW)
+    assert plan.gmail_query == "is:unread from:alice newer_than:7d"
+    assert plan.is_confident
+
+
+def test_hours_are_not_widened_to_a_day():
+    plan = plan_query("emails from the last 3 hours", NOW)
+    assert plan.gmail_query == f"after:{int((NOW - timedelta(hours=3)).timestamp())}"
+    assert plan.is_confident
+
+
+def test_whole_days_of_hours_use_newer_than():
+    assert plan_query("unread messages from the last 24 hours", NOW).gmail_query == "is:unread newer_than:1d"
+
+
+@pytest.mark.parametrize("prompt", ["invoices due by friday", "emails by noon", "emails from tomorrow"])
+def test_deadlines_are_not_senders(prompt):
+    plan = plan_query(prompt, NOW)
+    assert "from:" not in plan.gmail_query
+    assert not plan.is_confident
+
+
+def test_two_senders_match_either():
+    plan = plan_query("emails from alice and bob", NOW)
+    assert plan.gmail_query == "from:(alice OR bob)"
+    assert plan.is_confident
+
+
+def test_last_hour_is_a_one_hour_window():
+    assert plan_query("emails from the last hour", NOW).gmail_query == f"after:{int((NOW - timedelta(hours=1)).timestamp())}"
+
+
+def test_leftover_keywords_lower_a_structured_plan():
+    assert plan_query("emails from alice", NOW).confidence == 0.95
+    assert plan_query("emails from alice about the budget", NOW).confidence < 0.95
@@ -0,0 +1,92 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import cache
+from search_coalescer import SearchCoalescer, search_key
+
+PARTS = ("session-1", "from:alice", 10)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    return cache.redis_client
+
+
+def worker(**overrides) -> SearchCoalescer:
+    return SearchCoalescer(**{"result_ttl_seconds": 60, "lock_ttl_seconds": 5, "wait_seconds": 5, "poll_seconds": 0.01,
+                              **overrides})
+
+
+class FakeGmail:
+    def __init__(self, seconds: float = 0.05):
+        self.seconds = seconds
+        self.calls = 0
+
+    async def search(self) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.seconds)
+        return {"success": True, "emails": [{"id": "m1"}]}
+
+
+def test_concurrent_identical_searches_call_gmail_once(redis):
+    gmail = FakeGmail()
+    coalescer = worker()
+
+    async def scenario():
+        return await asyncio.gather(*(coalescer.run(PARTS, gmail.search) for _ in range(10)))
+
+    results = asyncio.run(scenario())
+    assert gmail.calls == 1
+    assert all(result == results[0] for result in results)
+    assert coalescer.stats()["joined_in_flight"] == 9
+
+
+def test_other_worker_waits_for_the_lock_holder(redis):
+    gmail = FakeGmail(seconds=0.2)
+    first, second = worker(), worker()
+
+    async def scenario():
+        leader = asyncio.create_task(first.run(PARTS, gmail.search))
+        await asyncio.sleep(0.05)  # the first worker holds the lock
+        return await asyncio.gather(leader, second.run(PARTS, gmail.search))
+
+    led, joined = asyncio.run(scenario())
+    assert gmail.calls == 1
+    assert joined == led
+    assert second.stats()["joined_other_worker"] == 1
+    assert not redis.exists(f"{cache.SEARCH_LOCK_PREFIX}_{search_key(*PARTS)}")
+
+
+def test_lock_of_a_dead_worker_expires(redis):
+    gmail = FakeGmail(seconds=0)
+    coalescer = worker()
+
+    async def scenario():
+        # A worker claimed the search and died: its lock is never released.
+        assert await cache.aacquire_search_lock(search_key(*PARTS), 1)
+        return await coalescer.run(PARTS, gmail.search)
+
+    assert asyncio.run(scenario())["success"]
+    assert gmail.calls == 1
+    assert coalescer.stats()["joined_other_worker"] == 0
+
+
+def test_unsuccessful_results_are_not_shared(redis):
+    calls = 0
+
+    async def failing_search() -> dict:
+        nonlocal calls
+        calls += 1
+        return {"success": False, "error": "backend error"}
+
+    async def scenario():
+        await worker().run(PARTS, failing_search)
+        await worker().run(PARTS, failing_search)
+
+    asyncio.run(scenario())
+    assert calls == 2
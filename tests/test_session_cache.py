@@ -0,0 +1,85 @@
+import asyncio
+import json
+import time
+
+import fakeredis
+import pytest
+
+import cache
+
+SESSION = "session-1"
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "session_cache", cache.SessionCache(max_size=8, ttl_seconds=60))
+    monkeypatch.setattr(cache, "_invalidation_listener", None)
+    # What another worker writes through its own connection.
+    return fakeredis.FakeRedis(server=server, decode_responses=True)
+
+
+async def until(condition, seconds: float = 2.0):
+    deadline = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def listening_client(session: dict) -> dict:
+    """Loads the session into this process's LRU, with the invalidation listener subscribed."""
+    cache.save_encrypted_cache(SESSION, session)
+    loaded = await cache.aget_session_details_from_cache(SESSION)
+    subscribers = 0
+    while not subscribers:
+        await asyncio.sleep(0.01)
+        [(_, subscribers)] = await cache.async_redis_client.pubsub_numsub(cache.SESSION_INVALIDATION_CHANNEL)
+    return loaded
+
+
+def test_another_workers_write_evicts_the_local_copy(redis):
+    async def scenario():
+        try:
+            assert await listening_client({"access_token": "old"}) == {"access_token": "old"}
+            # Another worker refreshes the token.
+            redis.set(cache._session_key(SESSION), cache.fernet.encrypt(json.dumps({"access_token": "new"}).encode()))
+            redis.publish(cache.SESSION_INVALIDATION_CHANNEL, SESSION)
+            await until(lambda: SESSION not in cache.session_cache._entries)
+            return await cache.aget_session_details_from_cache(SESSION)
+        finally:
+            cache._invalidation_listener.cancel()
+
+    assert asyncio.run(scenario()) == {"access_token": "new"}
+
+
+def test_invalidation_alone_evicts_the_local_copy(redis):
+    async def scenario():
+        try:
+            await listening_client({"access_token": "old"})
+            redis.publish(cache.SESSION_INVALIDATION_CHANNEL, SESSION)
+            await until(lambda: SESSION not in cache.session_cache._entries)
+        finally:
+            cache._invalidation_listener.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_entries_expire_after_the_ttl():
+    sessions = cache.SessionCache(max_size=8, ttl_seconds=0.05)
+    sessions.set(SESSION, {"access_token": "token"})
+    assert sessions.get(SESSION) == {"access_token": "token"}
+    time.sleep(0.06)
+    assert sessions.get(SESSION) is None
+    assert sessions.stats() == {"size": 0, "hits": 1, "misses": 1}
+
+
+def test_least_recently_used_entry_is_evicted():
+    sessions = cache.SessionCache(max_size=2, ttl_seconds=60)
+    sessions.set("a", {})
+    sessions.set("b", {})
+    sessions.get("a")
+    sessions.set("c", {})
+    assert sessions.get("b") is None
+    assert sessions.get("a") == {} and sessions.get("c") == {}
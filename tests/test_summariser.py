@@ -0,0 +1,25 @@
+from benchmarks.simulated_model import SimulatedChatCompletionClient
+from model_clients import RouteRule, RoutingChatCompletionClient
+from settings import settings
+from summariser import MapReduceSummariser
+
+MODELS = {"large": SimulatedChatCompletionClient(), "small": SimulatedChatCompletionClient()}
+
+
+def cache_model(rules: list[RouteRule]) -> str:
+    return MapReduceSummariser(RoutingChatCompletionClient(MODELS, rules, "large"), use_cache=True).model
+
+
+def test_summary_cache_key_follows_the_map_route():
+    unrouted = cache_model([])
+    routed = cache_model([RouteRule(model="small", roles=["summary_map"], max_prompt_tokens=3000)])
+    assert unrouted != routed != settings.OPENAI_MODEL
+    assert cache_model([RouteRule(model="small", roles=["summary_map"], max_prompt_tokens=2000)]) != routed
+
+
+def test_summary_cache_key_ignores_other_roles():
+    assert cache_model([RouteRule(model="small", roles=["retriever"])]) == cache_model([])
+
+
+def test_summary_cache_key_without_routing():
+    assert MapReduceSummariser(MODELS["large"]).model == settings.OPENAI_MODEL
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import fakeredis
+import httpx
+import pytest
+
+import cache
+from token_manager import TokenManager, TokenRefreshError
+
+SESSION = "session-1"
+TOKEN_URL = "https://oauth2.example.com/token"
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "async_redis_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(cache, "session_cache", cache.SessionCache(max_size=8, ttl_seconds=60))
+    return cache.redis_client
+
+
+@pytest.fixture
+def expires_at(redis) -> float:
+    expires_at = time.time() + 60
+    cache.save_encrypted_cache(SESSION, {"access_token": "old", "refresh_token": "refresh", "expires_at": expires_at},
+                               expire_in=3600)
+    return expires_at
+
+
+class TokenEndpoint:
+    """Stub of Google's token endpoint; `respond` may be replaced to misbehave."""
+
+    def __init__(self, seconds: float = 0.05):
+        self.seconds = seconds
+        self.requests = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.seconds)
+        return self.respond(request)
+
+    def respond(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"access_token": f"new-{self.requests}", "expires_in": 3600})
+
+
+def worker(endpoint: TokenEndpoint, **overrides) -> TokenManager:
+    manager = TokenManager(**{"refresh_ahead_seconds": 300, "idle_seconds": 600, "lock_ttl_seconds": 5,
+                              "wait_seconds": 2, "token_url": TOKEN_URL, "poll_seconds": 0.01, **overrides})
+    manager._http = httpx.AsyncClient(transport=httpx.MockTransport(endpoint))
+    return manager
+
+
+def test_concurrent_refreshes_ask_the_endpoint_once(expires_at):
+    endpoint = TokenEndpoint()
+    first, second = worker(endpoint), worker(endpoint)
+
+    async def scenario():
+        return await asyncio.gather(*(manager.refresh(SESSION, expires_at) for manager in [first] * 5 + [second] * 5))
+
+    results = asyncio.run(scenario())
+    assert endpoint.requests == 1
+    assert {result["access_token"] for result in results} == {"new-1"}
+    assert second.stats()["joined_other_worker"] == 1
+    assert asyncio.run(cache.aload_session(SESSION))["refresh_token"] == "refresh"
+
+
+def test_lock_loser_waits_for_the_other_workers_write(expires_at):
+    endpoint = TokenEndpoint()
+    manager = worker(endpoint)
+
+    async def scenario():
+        lock = await cache.aacquire_refresh_lock(SESSION, 5)  # another worker is refreshing
+        waiting = asyncio.create_task(manager.refresh(SESSION, expires_at))
+        await asyncio.sleep(0.05)
+        refreshed = {**await cache.aload_session(SESSION), "access_token": "other", "expires_at": time.time() + 3600}
+        assert await cache.asave_refreshed_session(SESSION, refreshed, lock)
+        return await waiting
+
+    assert asyncio.run(scenario())["access_token"] == "other"
+    assert endpoint.requests == 0
+
+
+def test_refresh_is_not_saved_once_the_lock_is_lost(expires_at, redis):
+    endpoint = TokenEndpoint()
+    manager = worker(endpoint)
+    original = endpoint.respond
+
+    def respond_after_lock_expiry(request):
+        # The request outlived the lock and another worker claimed the refresh.
+        redis.set(f"{cache.REFRESH_LOCK_PREFIX}_{SESSION}", "other-worker")
+        return original(request)
+
+    endpoint.respond = respond_after_lock_expiry
+    assert asyncio.run(manager.refresh(SESSION, expires_at)) is None
+    assert asyncio.run(cache.aload_session(SESSION))["access_token"] == "old"
+    assert redis.get(f"{cache.REFRESH_LOCK_PREFIX}_{SESSION}") == "other-worker"
+
+
+def test_save_is_refused_without_the_lock(expires_at):
+    async def scenario():
+        lock = await cache.aacquire_refresh_lock(SESSION, 5)
+        await cache.arelease_refresh_lock(SESSION, lock)
+        return await cache.asave_refreshed_session(SESSION, {"access_token": "late"}, lock)
+
+    assert not asyncio.run(scenario())
+    assert asyncio.run(cache.aload_session(SESSION))["access_token"] == "old"
+
+
+def test_revoked_refresh_token_fails_the_refresh(expires_at, redis):
+    endpoint = TokenEndpoint(seconds=0)
+    endpoint.respond = lambda request: httpx.Response(400, json={"error": "invalid_grant"})
+    manager = worker(endpoint)
+
+    with pytest.raises(TokenRefreshError, match="400"):
+        asyncio.run(manager._request_token("revoked"))
+    assert asyncio.run(manager.refresh(SESSION, expires_at)) is None
+    assert manager.stats()["failures"] == 1
+    assert asyncio.run(cache.aload_session(SESSION))["access_token"] == "old"
+    assert not redis.exists(f"{cache.REFRESH_LOCK_PREFIX}_{SESSION}")
@@ -0,0 +1,237 @@
+import asyncio
+import random
+import time
+import traceback
+
+import httpx
+from google.auth._helpers import REFRESH_THRESHOLD
+
+import cache
+from cache import aget_session_details_from_cache
+from logger.app_logger import log_message
+from settings import settings
+from tracing import span
+
+# A token this close to expiry is not handed to a Gmail call: past google-auth's own threshold,
+# plus slack for the call itself.
+EXPIRY_MARGIN_SECONDS = REFRESH_THRESHOLD.total_seconds() + 30
+RETRY_SECONDS = 15  # Failed background refreshes are retried this often until the token expires
+
+
+class TokenRefreshError(Exception):
+    """The token endpoint rejected the refresh (e.g. the refresh token was revoked)."""
+
+
+class TokenManager:
+    """
+    Keeps sessions' OAuth access tokens valid without tool calls waiting for Google.
+
+    Every session a tool call reads (`get_session`) gets a timer in this process that refreshes
+    its token `refresh_ahead_seconds` before `expires_at`, in the background, for as long as the
+    session keeps making calls (`idle_seconds`). Refreshes are single-flight: in process, callers
+    share one task; across workers, a Redis lock elects one worker and the others wait for its
+    write. The new token replaces the session entry atomically (`cache.asave_refreshed_session`),
+    keeping the entry's TTL, and the invalidation drops every worker's cached copy (and so its
+    Gmail client, which is keyed by token).
+
+    Only a token that has already expired, because the session was idle through its refresh,
+    is refreshed inline.
+    """
+
+    def __init__(
+        self,
+        refresh_ahead_seconds: int,
+        idle_seconds: int,
+        lock_ttl_seconds: int,
+        wait_seconds: float,
+        token_url: str,
+        timeout_seconds: float = 10,
+        poll_seconds: float = 0.1,
+        expiry_margin_seconds: float = EXPIRY_MARGIN_SECONDS,
+        enabled: bool = True,
+    ):
+        self.refresh_ahead_seconds = refresh_ahead_seconds
+        self.idle_seconds = idle_seconds
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.wait_seconds = wait_seconds
+        self.token_url = token_url
+        self.timeout_seconds = timeout_seconds
+        self.poll_seconds = poll_seconds
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self.enabled = enabled
+        self._timers: dict[str, tuple[float, asyncio.Task]] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._last_used: dict[str, float] = {}
+        self._http: httpx.AsyncClient | None = None
+        self.background_refreshes = 0
+        self.inline_refreshes = 0
+        self.joined_other_worker = 0
+        self.token_requests = 0
+        self.failures = 0
+
+    async def get_session(self, session_id: str) -> dict:
+        """
+        Session details for a tool call, like `cache.aget_session_details_from_cache`, with a
+        token that is valid for at least `expiry_margin_seconds`; schedules its next refresh.
+        """
+        session_data = await aget_session_details_from_cache(session_id)
+        if not self.enabled or not session_data.get("refresh_token") or not session_data.get("expires_at"):
+            return session_data
+        self._last_used[session_id] = time.monotonic()
+        expires_at = float(session_data["expires_at"])
+
+        if expires_at - time.time() <= self.expiry_margin_seconds:
+            self.inline_refreshes += 1
+            with span("refresh token", "auth", inline=True) as refresh_span:
+                refreshed = await self.refresh(session_id, expires_at)
+                refresh_span.set(refreshed=refreshed is not None)
+            if refreshed is None:
+                return session_data  # Gmail answers 401 and the caller reports it
+            session_data = refreshed
+            expires_at = float(session_data["expires_at"])
+        self._schedule(session_id, expires_at)
+        return session_data
+
+    async def refresh(self, session_id: str, expires_at: float) -> dict | None:
+        """
+        The session's details with a token newer than the one expiring at `expires_at`, refreshed by
+        this process or another worker; None if the refresh failed or the session is gone.
+        """
+        task = self._inflight.get(session_id)
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._refresh(session_id, expires_at))
+            self._inflight[session_id] = task
+            task.add_done_callback(
+                lambda done: self._inflight.pop(session_id, None) if self._inflight.get(session_id) is done else None
+            )
+        # Shielded: a tool call that gives up does not cancel the refresh for the others.
+        return await asyncio.shield(task)
+
+    async def _refresh(self, session_id: str, expires_at: float) -> dict | None:
+        try:
+            lock = await cache.aacquire_refresh_lock(session_id, self.lock_ttl_seconds)
+            if lock is None:
+                self.joined_other_worker += 1
+                return await self._await_other_worker(session_id, expires_at)
+            try:
+                # Another worker may have refreshed since this process read the session.
+                current = await cache.aload_session(session_id)
+                if not current:
+                    return None
+                if float(current.get("expires_at") or 0) > expires_at:
+                    return current
+                refreshed = {**current, **await self._request_token(current["refresh_token"])}
+                if not await cache.asave_refreshed_session(session_id, refreshed, lock):
+                    log_message(f"[{session_id}]: Refreshed token not saved (lock lost or session ended)",
+                                level="warning")
+                    return None
+                log_message(f"[{session_id}]: Refreshed access token", level="debug")
+                return refreshed
+            finally:
+                await cache.arelease_refresh_lock(session_id, lock)
+        except Exception:
+            self.failures += 1
+            log_message(f"[{session_id}]: Token refresh failed: {traceback.format_exc()}", level="warning")
+            return None
+
+    async def _request_token(self, refresh_token: str) -> dict:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=self.timeout_seconds)
+        self.token_requests += 1
+        response = await self._http.post(self.token_url, data={
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": settings.GOOGLE_CLIENT_ID,
+            "client_secret": settings.GOOGLE_CLIENT_SECRET,
+        })
+        if response.status_code >= 400:
+            raise TokenRefreshError(f"Token endpoint answered {response.status_code}: {response.text[:200]}")
+        token = response.json()
+        updated = {
+            "access_token": token["access_token"],
+            "expires_in": token.get("expires_in", 3600),
+            "expires_at": time.time() + float(token.get("expires_in", 3600)),
+        }
+        # Google rotates refresh tokens rarely and only sometimes returns a new id token.
+        for key in ("refresh_token", "id_token", "token_type"):
+            if token.get(key):
+                updated[key] = token[key]
+        if isinstance(token.get("scope"), str):
+            updated["scope"] = token["scope"].split()
+        return updated
+
+    async def _await_other_worker(self, session_id: str, expires_at: float) -> dict | None:
+        deadline = time.monotonic() + self.wait_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_seconds)
+            current = await cache.aload_session(session_id)
+            if not current:
+                return None
+            if float(current.get("expires_at") or 0) > expires_at:
+                return current
+        return None
+
+    # ──────── Background refresh ────────────────────────────────────────────────
+    def _schedule(self, session_id: str, expires_at: float):
+        timer = self._timers.get(session_id)
+        if timer is not None and timer[0] == expires_at and not timer[1].done():
+            return
+        if timer is not None:
+            timer[1].cancel()
+        self._timers[session_id] = (expires_at, asyncio.ensure_future(self._refresh_later(session_id, expires_at)))
+
+    async def _refresh_later(self, session_id: str, expires_at: float):
+        # Jittered, so the workers that track a session rarely contend for its lock.
+        delay = expires_at - self.refresh_ahead_seconds - time.time()
+        await asyncio.sleep(max(0.0, delay - random.uniform(0, self.refresh_ahead_seconds / 10)))
+        refreshed = None
+        while time.time() < expires_at:
+            if time.monotonic() - self._last_used.get(session_id, 0) > self.idle_seconds:
+                # Idle: stop refreshing; the next call after expiry refreshes inline.
+                self._forget(session_id, expires_at)
+                self._last_used.pop(session_id, None)
+                return
+            refreshed = await self.refresh(session_id, expires_at)
+            if refreshed is not None and float(refreshed["expires_at"]) > expires_at:
+                self.background_refreshes += 1
+                break
+            await asyncio.sleep(min(RETRY_SECONDS, max(0.0, expires_at - time.time())))
+        self._forget(session_id, expires_at)
+        if refreshed is not None:
+            self._schedule(session_id, float(refreshed["expires_at"]))
+
+    def _forget(self, session_id: str, expires_at: float):
+        timer = self._timers.get(session_id)
+        if timer is not None and timer[0] == expires_at:
+            del self._timers[session_id]
+
+    async def aclose(self):
+        """Cancels the refresh timers and closes the HTTP client (worker shutdown)."""
+        for _, task in self._timers.values():
+            task.cancel()
+        self._timers.clear()
+        self._last_used.clear()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def stats(self) -> dict:
+        return {
+            "tracked_sessions": len(self._timers),
+            "background_refreshes": self.background_refreshes,
+            "inline_refreshes": self.inline_refreshes,
+            "joined_other_worker": self.joined_other_worker,
+            "token_requests": self.token_requests,
+            "failures": self.failures,
+        }
+
+
+token_manager = TokenManager(
+    refresh_ahead_seconds=settings.TOKEN_REFRESH_AHEAD_SECONDS,
+    idle_seconds=settings.TOKEN_REFRESH_IDLE_SECONDS,
+    lock_ttl_seconds=settings.TOKEN_REFRESH_LOCK_SECONDS,
+    wait_seconds=settings.TOKEN_REFRESH_WAIT_SECONDS,
+    token_url=settings.OAUTH_TOKEN_URL,
+    timeout_seconds=settings.TOKEN_REFRESH_TIMEOUT_SECONDS,
+    enabled=settings.TOKEN_REFRESH_ENABLED,
+)
@@ -0,0 +1,312 @@
+import json
+import queue
+import re
+import secrets
+import threading
+import time
+import traceback
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from logger.app_logger import log_message
+from settings import settings
+
+# W3C trace context, passed to the MCP tool as its `traceparent` argument.
+TRACEPARENT_ARGUMENT = "traceparent"
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# Categories drive the waterfall colours; the OTLP span kind is derived from them.
+OTLP_KINDS = {"mcp": 2, "tool": 3, "model": 3, "gmail": 3, "cache": 3}  # 1 internal, 2 server, 3 client
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    end_ns: int | None = None
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+    service: str = ""
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException | str | None = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = error if isinstance(error, str) else f"{type(error).__name__}: {error}"
+        _finish(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "category": self.category,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+            "service": self.service,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Span":
+        return cls(**{key: value for key, value in data.items() if key != "duration_ms"})
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off or no trace is active."""
+
+    trace_id = None
+    span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+service_name = settings.TRACE_SERVICE_NAME
+
+
+def configure_tracing(service: str):
+    """Names the process in exported spans (the UI and the MCP server export separately)."""
+    global service_name
+    service_name = service
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def current_traceparent() -> str | None:
+    parent = _current_span.get()
+    return f"00-{parent.trace_id}-{parent.span_id}-01" if parent is not None else None
+
+
+# ──────── Spans ─────────────────────────────────────────────────────────────────
+def start_span(name: str, category: str = "internal", **attributes) -> Span | _NoopSpan:
+    """
+    Opens a child of the active span without making it active; the caller must `end()` it.
+    For async generators, which may resume in another context than the one they started in.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, category, parent.trace_id, secrets.token_hex(8), parent.span_id, time.time_ns(),
+                attributes=attributes, service=service_name)
+
+
+@contextmanager
+def _activate(active: Span) -> Iterator[Span]:
+    token = _current_span.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.end(error=e)
+        raise
+    finally:
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Closed from another context (an abandoned generator being finalised).
+            pass
+        active.end()
+
+
+@contextmanager
+def span(name: str, category: str = "internal", **attributes) -> Iterator[Span | _NoopSpan]:
+    """Records the block as a child of the active span; a no-op outside a trace."""
+    child = start_span(name, category, **attributes)
+    if child is NOOP_SPAN:
+        yield child
+        return
+    with _activate(child) as active:
+        yield active
+
+
+@contextmanager
+def start_trace(
+    name: str,
+    trace_id: str | None = None,
+    category: str = "query",
+    parent_id: str | None = None,
+    **attributes,
+) -> Iterator[Span | _NoopSpan]:
+    """Opens the root span of a trace (a new trace unless `trace_id` is given)."""
+    if not settings.TRACING_ENABLED:
+        yield NOOP_SPAN
+        return
+    root = Span(name, category, trace_id or new_trace_id(), secrets.token_hex(8), parent_id, time.time_ns(),
+                attributes=attributes, service=service_name)
+    with _activate(root) as active:
+        yield active
+
+
+def continue_trace(traceparent: str | None, name: str, category: str = "mcp", **attributes):
+    """`start_trace` under a caller's W3C `traceparent`, or a new trace when it is missing or invalid."""
+    match = TRACEPARENT_PATTERN.match(traceparent or "")
+    if match is None:
+        return start_trace(name, category=category, **attributes)
+    return start_trace(name, trace_id=match.group(1), category=category, parent_id=match.group(2), **attributes)
+
+
+# ──────── Recent traces ─────────────────────────────────────────────────────────
+class TraceStore:
+    """Finished spans of the most recent traces in this process, for the latency waterfall."""
+
+    def __init__(self, max_traces: int):
+        self.max_traces = max_traces
+        self._traces: OrderedDict[str, list[Span]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, finished: Span):
+        with self._lock:
+            self._traces.setdefault(finished.trace_id, []).append(finished)
+            self._traces.move_to_end(finished.trace_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def get(self, trace_id: str) -> list[Span]:
+        with self._lock:
+            return sorted(self._traces.get(trace_id, []), key=lambda item: item.start_ns)
+
+    def pop(self, trace_id: str) -> list[Span]:
+        with self._lock:
+            return sorted(self._traces.pop(trace_id, []), key=lambda item: item.start_ns)
+
+
+trace_store = TraceStore(settings.TRACE_STORE_SIZE)
+
+
+def get_trace(trace_id: str) -> list[Span]:
+    return trace_store.get(trace_id)
+
+
+def record_remote_spans(spans: list[dict]):
+    """Adds spans another process recorded (the MCP server's) to the local waterfall, not re-exported."""
+    for data in spans:
+        try:
+            trace_store.add(Span.from_dict(data))
+        except TypeError:
+            continue
+
+
+# ──────── Export ────────────────────────────────────────────────────────────────
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": value if isinstance(value, str) else json.dumps(value, default=str)}
+
+
+def to_otlp(spans: list[Span]) -> dict:
+    """OTLP/HTTP JSON payload (`/v1/traces`) for finished spans, grouped by service."""
+    services: dict[str, list[dict]] = {}
+    for item in spans:
+        attributes = {"category": item.category, **item.attributes}
+        services.setdefault(item.service, []).append({
+            "traceId": item.trace_id,
+            "spanId": item.span_id,
+            **({"parentSpanId": item.parent_id} if item.parent_id else {}),
+            "name": item.name,
+            "kind": OTLP_KINDS.get(item.category, 1),
+            "startTimeUnixNano": str(item.start_ns),
+            "endTimeUnixNano": str(item.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+            "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+        })
+    return {"resourceSpans": [
+        {
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+            "scopeSpans": [{"scope": {"name": "gmail-insighter"}, "spans": service_spans}],
+        }
+        for service, service_spans in services.items()
+    ]}
+
+
+class SpanExporter:
+    """
+    Ships finished spans from a background thread, in batches of up to `batch_size` or every
+    `flush_seconds`: JSON lines appended to `TRACE_FILE_PATH` ("file") or POSTed to an
+    OTLP/HTTP collector at `TRACE_OTLP_ENDPOINT` ("otlp"). Spans are dropped when the queue is full.
+    """
+
+    def __init__(self, exporter: str, batch_size: int = 256, flush_seconds: float = 1.0):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, finished: Span):
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception:
+                log_message(f"Exporting {len(batch)} spans failed: {traceback.format_exc()}", level="warning")
+
+    def export(self, spans: list[Span]):
+        if self.exporter == "file":
+            with open(settings.TRACE_FILE_PATH, "a", encoding="utf-8") as file:
+                file.writelines(json.dumps(item.as_dict(), default=str) + "\n" for item in spans)
+        elif self.exporter == "otlp":
+            request = urllib.request.Request(
+                settings.TRACE_OTLP_ENDPOINT,
+                data=json.dumps(to_otlp(spans), default=str).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(request, timeout=5) as response:
+                response.read()
+
+
+span_exporter = SpanExporter(settings.TRACE_EXPORTER) if settings.TRACE_EXPORTER != "none" else None
+
+
+def _finish(finished: Span):
+    trace_store.add(finished)
+    if span_exporter is not None:
+        span_exporter.submit(finished)
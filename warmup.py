@@ -0,0 +1,38 @@
+import asyncio
+import traceback
+
+from gmail_client import GmailClient
+from logger.app_logger import log_message
+from mailbox_index import get_mailbox_index, schedule_bulk_sync
+from semantic_search import ensure_embedded, get_embedder
+from settings import settings
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def warm_up_index(client: GmailClient) -> str:
+    """
+    Starts building the user's mailbox index (labels and the newest messages, through the quota
+    limiter like every other Gmail call) and then embeds its chunks, both in the background.
+    Returns the index state: "ready", "building" or "disabled".
+    """
+    if not settings.MAILBOX_INDEX_ENABLED:
+        return "disabled"
+    index = await get_mailbox_index(client)
+    sync = None if await asyncio.to_thread(index.is_ready) else schedule_bulk_sync(index, client)
+
+    if settings.SEMANTIC_SEARCH_ENABLED:
+        async def embed():
+            try:
+                if sync is not None:
+                    await sync
+                if await asyncio.to_thread(index.is_ready):
+                    await ensure_embedded(index, get_embedder(), client.session_id)
+            except Exception:
+                log_message(f"[{client.session_id}]: Warming up embeddings failed: {traceback.format_exc()}",
+                            level="warning")
+
+        task = asyncio.create_task(embed())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    return "building" if sync is not None else "ready"